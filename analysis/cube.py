@@ -0,0 +1,204 @@
+"""Pre-aggregate student outcomes by every combination of the reporting dimensions.
+
+Reports break outcomes (graduation, persistence, core progress, 4th-term completion) down by cohort, category and
+demographic attributes, in many different combinations.  An OutcomeCube groups contacts_df once by all of the
+dimensions in CUBE_DIMENSIONS_LIST and keeps, for each combination of values that occurs (a cell), the number of
+students and, for each outcome in CUBE_MEASURES_LIST, the number of students with a known value and the sum of the
+values.  Since counts and sums add up, any breakdown by fewer dimensions, restricted to any values, is a sum over
+cells, and no row-level data is needed to answer it:
+    cube = OutcomeCube(contacts_df)
+    cube.rollup(by=["cohort_year", "category"])
+    cube.rollup(by=["race"], where={"category": "Metro", "cohort_year": [2012, 2013]})
+
+Outcomes are converted into numbers with outcome_to_numeric() of analysis/resampling.py, so the mean of result is
+the graduation rate.  Missing dimension values are kept, under MISSING_LABEL.
+
+When contacts_df is recomputed (e.g., after a new term or cohort is ingested), refresh() rebuilds only the cells of
+the cohort years whose students changed.  To find them, the cube keeps a fingerprint per cohort year: the sum of
+hashes of the cohort's rows.  When the students whose records changed are known (see utilities/change_capture.py),
+refresh_students() rebuilds the cells of their cohort years.
+
+Classes exported by this module include:
+    OutcomeCube: counts and sums of outcomes per combination of dimension values
+
+"""
+
+import numpy as np
+import pandas as pd
+from analysis.resampling import outcome_to_numeric
+
+CUBE_DIMENSIONS_LIST = ["cohort_year", "cohort_name", "category", "race", "gender", "pell_eligible",
+                        "household_income"]
+CUBE_MEASURES_LIST = ["result", "third_persistence", "fifth_persistence", "seventh_persistence", "core_progress",
+                      "fourth_completion"]
+MISSING_LABEL = "(missing)"
+STUDENTS_COLUMN = "students"
+
+
+class OutcomeCube:
+    """This class holds the cells of the cube and answers roll-ups and slices from them.
+
+    The cells DataFrame has one row per combination of dimension values, with the columns listed in dimensions,
+    the number of students, and, for each measure, <measure>_count and <measure>_sum.
+
+    """
+
+    def __init__(self, contacts_df, dimensions=CUBE_DIMENSIONS_LIST, measures=CUBE_MEASURES_LIST,
+                 refresh_key="cohort_year"):
+        """Instantiate an OutcomeCube object from the rows of contacts_df.
+
+        Args:
+            contacts_df (DataFrame): Student attributes and outcomes, as returned by preprocessing().
+            dimensions (list): Columns by which to aggregate.  Columns absent from contacts_df are left out.
+            measures (list): Outcome columns to count and sum.  Columns absent from contacts_df are left out,
+                e.g., core_progress and fourth_completion when preprocessing() covered all students.
+            refresh_key (str): Dimension by which refresh() finds the cells to rebuild.
+
+        """
+
+        self.dimensions = [x for x in dimensions if x in contacts_df.columns]
+        self.measures = [x for x in measures if x in contacts_df.columns]
+        if refresh_key not in self.dimensions:
+            raise ValueError("The refresh key " + refresh_key + " must be one of the dimensions of the cube.")
+        self.refresh_key = refresh_key
+        prepared_df = self._prepare(contacts_df)
+        self.cells = self._aggregate(prepared_df)
+        self.fingerprints = self._fingerprint(prepared_df)
+
+    def _prepare(self, contacts_df):
+        """Select the dimension and measure columns, label missing dimension values, and convert the measures.
+
+        Args:
+            contacts_df (DataFrame): Student attributes and outcomes.
+
+        Returns:
+            A DataFrame with the dimension columns (as objects) and the measures (as floats, NaN if missing).
+
+        """
+
+        prepared_df = pd.DataFrame(index=np.arange(len(contacts_df)))
+        for each_dimension in self.dimensions:
+            values = contacts_df[each_dimension].values
+            if values.dtype.kind == 'f' and np.all(np.mod(values[~np.isnan(values)], 1) == 0):
+                values = [x if np.isnan(x) else int(x) for x in values]
+            prepared_df[each_dimension] = pd.Series(values, dtype=object).where(pd.notnull(values), MISSING_LABEL)\
+                .values
+        for each_measure in self.measures:
+            prepared_df[each_measure] = outcome_to_numeric(contacts_df[each_measure]).values
+        return prepared_df
+
+    def _aggregate(self, prepared_df):
+        """Group prepared rows by all dimensions into cells.
+
+        Args:
+            prepared_df (DataFrame): Rows returned by _prepare().
+
+        Returns:
+            The cells DataFrame (see the class docstring).
+
+        """
+
+        aggregated_df = prepared_df[self.dimensions].copy()
+        aggregated_df[STUDENTS_COLUMN] = 1
+        for each_measure in self.measures:
+            values = prepared_df[each_measure].values
+            aggregated_df[each_measure + "_count"] = (~np.isnan(values)).astype('int64')
+            aggregated_df[each_measure + "_sum"] = np.nan_to_num(values)
+        return aggregated_df.groupby(self.dimensions, sort=True).sum().reset_index()
+
+    def _fingerprint(self, prepared_df):
+        """Compute a fingerprint of the rows of each value of the refresh key.
+
+        Args:
+            prepared_df (DataFrame): Rows returned by _prepare().
+
+        Returns:
+            A Series mapping each value of the refresh key to the wrapping sum of the hashes of its rows.
+
+        """
+
+        row_hashes = pd.util.hash_pandas_object(prepared_df, index=False).values
+        codes, keys = pd.factorize(prepared_df[self.refresh_key])
+        sums = np.zeros(len(keys), dtype='uint64')
+        np.add.at(sums, codes, row_hashes)
+        return pd.Series(sums, index=keys)
+
+    def refresh(self, contacts_df, keys=None):
+        """Rebuild the cells of the refresh-key values (by default, cohort years) whose rows changed.
+
+        Args:
+            contacts_df (DataFrame): The recomputed student attributes and outcomes.
+            keys (iterable): If given, the refresh-key values to rebuild; otherwise those whose fingerprint
+                changed, including new values and values no longer present.
+
+        Returns:
+            The sorted list of refresh-key values whose cells were rebuilt.
+
+        """
+
+        prepared_df = self._prepare(contacts_df)
+        new_fingerprints = self._fingerprint(prepared_df)
+        if keys is None:
+            old_fingerprints_dict = self.fingerprints.to_dict()
+            new_fingerprints_dict = new_fingerprints.to_dict()
+            keys = [x for x in set(old_fingerprints_dict) | set(new_fingerprints_dict)
+                    if old_fingerprints_dict.get(x) != new_fingerprints_dict.get(x)]
+        keys = sorted(keys)
+        kept_cells_df = self.cells[~self.cells[self.refresh_key].isin(keys)]
+        rebuilt_cells_df = self._aggregate(prepared_df[prepared_df[self.refresh_key].isin(keys)])
+        self.cells = pd.concat([kept_cells_df, rebuilt_cells_df], ignore_index=True)\
+            .sort_values(self.dimensions).reset_index(drop=True)
+        self.fingerprints = pd.concat([self.fingerprints[~self.fingerprints.index.isin(keys)],
+                                       new_fingerprints[new_fingerprints.index.isin(keys)]])
+        return keys
+
+    def refresh_students(self, contacts_df, previous_contacts_df, student_ids):
+        """Rebuild the cells of the refresh-key values of some students, before and after their rows changed.
+
+        The cells to rebuild are those of the students' refresh-key values in either DataFrame, so that a student
+        who moved to another cohort year is removed from the old cells.  See utilities/change_capture.py for
+        finding the students whose records changed.
+
+        Args:
+            contacts_df (DataFrame): The recomputed student attributes and outcomes.
+            previous_contacts_df (DataFrame): The student attributes and outcomes from which the cube was built.
+            student_ids (iterable): Ids of the students whose rows changed.
+
+        Returns:
+            The sorted list of refresh-key values whose cells were rebuilt.
+
+        """
+
+        student_ids = set(student_ids)
+        keys = set()
+        for each_df in (previous_contacts_df, contacts_df):
+            changed_df = each_df[each_df["student_id"].isin(student_ids)]
+            keys.update(self._prepare(changed_df)[self.refresh_key].values)
+        return self.refresh(contacts_df, keys=keys)
+
+    def rollup(self, by=(), where=None):
+        """Aggregate the cells by some dimensions, over the cells matching some dimension values.
+
+        Args:
+            by (iterable): Dimensions to keep; the others are summed over.  With none, the result has a single row.
+            where (dict): Mapping of dimensions to a value, or a list of values, that the cells must have.
+
+        Returns:
+            A DataFrame indexed by the by dimensions, with the number of students and, for each measure,
+            <measure>_count, <measure>_sum and <measure>_mean (the rate, for yes/no outcomes).
+
+        """
+
+        selected_df = self.cells
+        for each_dimension, values in (where or {}).items():
+            values = list(values) if isinstance(values, (list, tuple, set)) else [values]
+            selected_df = selected_df[selected_df[each_dimension].isin(values)]
+        value_columns = [STUDENTS_COLUMN] + [x + y for x in self.measures for y in ("_count", "_sum")]
+        if len(by):
+            rolled_df = selected_df.groupby(list(by), sort=True)[value_columns].sum()
+        else:
+            rolled_df = selected_df[value_columns].sum().to_frame().T
+        for each_measure in self.measures:
+            counts = rolled_df[each_measure + "_count"].astype(float)
+            rolled_df[each_measure + "_mean"] = rolled_df[each_measure + "_sum"] / counts.where(counts > 0)
+        return rolled_df
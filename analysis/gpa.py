@@ -0,0 +1,185 @@
+"""Load term and cumulative GPA/units from Rstcmp2 query exports, or derive them from letter grades.
+
+The SFSU CS Rstcmp2 query reports, for each student and term, the term GPA, the units taken, the cumulative
+GPA and the units earned.  Its csv exports are stored in RSTCMP2_QUERY_DIR (see configuration.py), one file
+per term, and are named like the query_data files: a term abbreviation such as "F2012" starts the file name.
+
+When no Rstcmp2 export covers a term, a GPA can still be derived from the letter grades of the enrollment
+data, using GRADE_POINT_DICT.  Since the query_data files carry no units, each course is weighted by
+DEFAULT_COURSE_UNITS, so the derived GPA is an approximation of the official one.
+
+Both sources produce the same long-format GPA DataFrame, with one row per student and semester number and the
+columns listed in GPA_FRAME_COLUMNS.  It can be joined to the enrollment DataFrame of utilities/enrollment.py,
+or copied into the CourseGroup objects of a student_record_dict.
+
+Functions exported by this module include:
+    read_rstcmp2_queries(): read all Rstcmp2 exports into a GPA DataFrame
+    derive_term_gpa(): compute a GPA DataFrame from the grades in the enrollment data
+    build_term_gpa_df(): combine the two sources, preferring Rstcmp2 values
+    attach_term_gpa(): join a GPA DataFrame to the enrollment data
+    apply_term_gpa_to_records(): copy GPA values into CourseGroup objects
+
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from configuration import RSTCMP2_QUERY_DIR
+from utilities.file_constants import RSTCMP2_COLUMNS_DICT
+from utilities.helpers import parse_term_from_filename, convert_semester_name_to_semester_number
+from utilities.other_constants import GRADE_POINT_DICT
+
+GPA_FRAME_COLUMNS = ["student_id", "semester_number", "term_gpa", "term_units", "cumulative_gpa", "cumulative_units"]
+DEFAULT_COURSE_UNITS = 3
+RSTCMP2_NUMERIC_COLUMNS = ["grade_points", "current_units", "units_passed", "current_gpa", "cum_gpa",
+                           "campus_ue", "transfer_ue"]
+
+
+def read_rstcmp2_queries(query_dir=RSTCMP2_QUERY_DIR):
+    """Read every Rstcmp2 export in a directory and return per-term and cumulative GPA and units.
+
+    Each file is read in one call to pandas and converted with vectorized operations.  The term GPA and units
+    come from the "Current GPA" and "Current Total Units Taken" columns; the cumulative GPA from "Cumulative GPA";
+    and the cumulative units from the sum of "Campus UE" and "Transfer UE", missing only when both are.
+
+    Args:
+        query_dir (str): Directory containing the Rstcmp2 csv exports.
+
+    Returns:
+        A DataFrame with the columns listed in GPA_FRAME_COLUMNS.  A student appearing more than once in a
+        term's file keeps the last row.
+
+    """
+
+    frames = []
+    for each_file in sorted([x for x in os.listdir(query_dir) if x.endswith(".csv") and x[0] != '~']):
+        df = pd.read_csv(os.path.join(query_dir, each_file),
+                         usecols=RSTCMP2_COLUMNS_DICT.keys(),
+                         dtype=str)
+        df.rename(columns=RSTCMP2_COLUMNS_DICT, inplace=True)
+        df["semester_number"] = convert_semester_name_to_semester_number(parse_term_from_filename(each_file))
+        frames.append(df)
+    if len(frames) == 0:
+        return pd.DataFrame(columns=GPA_FRAME_COLUMNS)
+    rstcmp2_df = pd.concat(frames, ignore_index=True)
+    rstcmp2_df["student_id"] = rstcmp2_df["student_id"].str.strip()
+    for each_column in RSTCMP2_NUMERIC_COLUMNS:
+        rstcmp2_df[each_column] = pd.to_numeric(rstcmp2_df[each_column].str.replace(",", ""), errors="coerce")
+    rstcmp2_df.drop_duplicates(subset=["student_id", "semester_number"], keep="last", inplace=True)
+    gpa_df = pd.DataFrame({"student_id": rstcmp2_df["student_id"].values,
+                           "semester_number": rstcmp2_df["semester_number"].values.astype('int32'),
+                           "term_gpa": rstcmp2_df["current_gpa"].values,
+                           "term_units": rstcmp2_df["current_units"].values,
+                           "cumulative_gpa": rstcmp2_df["cum_gpa"].values,
+                           "cumulative_units": rstcmp2_df["campus_ue"].add(rstcmp2_df["transfer_ue"],
+                                                                            fill_value=0).values},
+                          columns=GPA_FRAME_COLUMNS)
+    return gpa_df.sort_values(["student_id", "semester_number"]).reset_index(drop=True)
+
+
+def derive_term_gpa(enrollment_df, units_column=None):
+    """Derive per-term and cumulative GPA and units from the letter grades in the enrollment data.
+
+    Only grades with a grade-point value in GRADE_POINT_DICT count toward GPA and units; CR, W, I and similar
+    grades are left out, as they are in the official GPA.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        units_column (str): Column of enrollment_df holding each course's units.  If None, every course
+            counts for DEFAULT_COURSE_UNITS units.
+
+    Returns:
+        A DataFrame with the columns listed in GPA_FRAME_COLUMNS, with one row per student and semester in
+        which the student received at least one grade counting toward GPA.
+
+    """
+
+    grade_points = enrollment_df["grade_letter"].map(GRADE_POINT_DICT).astype('float64')
+    counts_toward_gpa = grade_points.notnull()
+    if units_column is None:
+        units = pd.Series(float(DEFAULT_COURSE_UNITS), index=enrollment_df.index)
+    else:
+        units = enrollment_df[units_column].astype('float64')
+    weighted_df = pd.DataFrame({"student_id": enrollment_df["student_id"].values[counts_toward_gpa.values],
+                                "semester_number": enrollment_df["semester_number"].values[counts_toward_gpa.values],
+                                "quality_points": (grade_points * units)[counts_toward_gpa].values,
+                                "term_units": units[counts_toward_gpa].values})
+    gpa_df = weighted_df.groupby(["student_id", "semester_number"], sort=True).sum().reset_index()
+    cumulative_df = gpa_df.groupby("student_id")[["quality_points", "term_units"]].cumsum()
+    gpa_df["term_gpa"] = gpa_df["quality_points"] / gpa_df["term_units"]
+    gpa_df["cumulative_units"] = cumulative_df["term_units"]
+    gpa_df["cumulative_gpa"] = cumulative_df["quality_points"] / cumulative_df["term_units"]
+    gpa_df["semester_number"] = gpa_df["semester_number"].astype('int32')
+    return gpa_df[GPA_FRAME_COLUMNS]
+
+
+def build_term_gpa_df(enrollment_df, rstcmp2_gpa_df=None, units_column=None):
+    """Combine Rstcmp2 GPA values with GPA values derived from letter grades.
+
+    For each student and semester, values reported by Rstcmp2 are kept; derived values fill in the rest.  The
+    gpa_source of a row is "rstcmp2" when its term GPA was reported by Rstcmp2.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        rstcmp2_gpa_df (DataFrame): Output of read_rstcmp2_queries(), or None to use derived values only.
+        units_column (str): Passed to derive_term_gpa().
+
+    Returns:
+        A DataFrame with the columns listed in GPA_FRAME_COLUMNS plus a gpa_source column ("rstcmp2" or "derived").
+
+    """
+
+    derived_df = derive_term_gpa(enrollment_df, units_column=units_column)\
+        .set_index(["student_id", "semester_number"])
+    derived_df["gpa_source"] = "derived"
+    if rstcmp2_gpa_df is None or len(rstcmp2_gpa_df) == 0:
+        return derived_df.reset_index()[GPA_FRAME_COLUMNS + ["gpa_source"]]
+    reported_df = rstcmp2_gpa_df.set_index(["student_id", "semester_number"])[GPA_FRAME_COLUMNS[2:]]
+    combined_df = reported_df.combine_first(derived_df[GPA_FRAME_COLUMNS[2:]])
+    is_reported = reported_df["term_gpa"].reindex(combined_df.index).notnull().values
+    combined_df["gpa_source"] = np.where(is_reported, "rstcmp2", "derived")
+    combined_df = combined_df.reset_index()
+    combined_df["semester_number"] = combined_df["semester_number"].astype('int32')
+    return combined_df[GPA_FRAME_COLUMNS + ["gpa_source"]]
+
+
+def attach_term_gpa(enrollment_df, gpa_df):
+    """Join per-term GPA and units to every row of the enrollment data.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        gpa_df (DataFrame): A GPA DataFrame, as returned by the other functions of this module.
+
+    Returns:
+        A copy of enrollment_df with the GPA and units columns added (NaN where gpa_df has no value).
+
+    """
+
+    return enrollment_df.merge(gpa_df, how="left", on=["student_id", "semester_number"])
+
+
+def apply_term_gpa_to_records(student_record_dict, gpa_df):
+    """Fill in the term_gpa, term_units, cumulative_gpa and cumulative_units fields of CourseGroup objects.
+
+    Args:
+        student_record_dict (dict): Mapping of student id's to dictionaries of semester number->CourseGroup
+            pairs, as returned by preprocessing().
+        gpa_df (DataFrame): A GPA DataFrame, as returned by the other functions of this module.
+
+    Returns:
+        The number of CourseGroup objects that were updated.
+
+    """
+
+    updated = 0
+    for row in gpa_df[GPA_FRAME_COLUMNS].itertuples(index=False):
+        try:
+            this_CourseGroup = student_record_dict[row[0]][row[1]]
+        except KeyError:
+            continue
+        this_CourseGroup.term_gpa = None if np.isnan(row[2]) else row[2]
+        this_CourseGroup.term_units = None if np.isnan(row[3]) else row[3]
+        this_CourseGroup.cumulative_gpa = None if np.isnan(row[4]) else row[4]
+        this_CourseGroup.cumulative_units = None if np.isnan(row[5]) else row[5]
+        updated += 1
+    return updated
@@ -0,0 +1,200 @@
+"""Compute grade distributions and D/F/W rates for every course and semester at once.
+
+The grade distribution of a course in a semester is the number of students who received each letter grade in
+VALID_GRADES.  From it, grade_distributions() derives:
+    - mean_grade_points: the mean of the grade points (see GRADE_POINT_DICT) of the grades that carry points;
+    - pass_rate: the share of grades in PASSING_GRADES;
+    - dfw_rate: the share of grades in DFW_GRADES (the D and F grades, NC, and the withdrawals W and WU);
+    - incomplete_rate: the share of grades in INCOMPLETE_GRADES.
+All courses, semesters and student categories (Metro, Comp and Other) are computed in one grouped pass over the
+long-format enrollment DataFrame of utilities/enrollment.py.  course_trends() then fits, for every course, a
+straight line through its semester-by-semester rates, to show which courses are getting harder or easier.
+
+Because the enrollment data only changes when terms are added, a GradeDistributionCache keeps the results
+keyed by the set of semesters present in the enrollment data, in memory and optionally on disk, so dashboards can
+show them without recomputing.
+
+Functions and classes exported by this module include:
+    grade_distributions(): grade counts and rates per course, semester and category
+    course_trends(): per-course trends of the rates across semesters
+    GradeDistributionCache: cache of grade_distributions() results keyed by the ingested term set
+
+"""
+
+import hashlib
+import os
+import pandas as pd
+from configuration import CACHE_DIR
+from utilities.other_constants import VALID_GRADES, PASSING_GRADES, INCOMPLETE_GRADES
+
+DFW_GRADES = {'D+', 'D', 'D-', 'F', 'NC', 'W', 'WU'}
+GRADE_RATE_SETS_DICT = {
+    "pass_rate": PASSING_GRADES,
+    "dfw_rate": DFW_GRADES,
+    "incomplete_rate": INCOMPLETE_GRADES
+}
+DEFAULT_DISTRIBUTION_GROUPS = ("course", "semester_number", "category")
+UNKNOWN_CATEGORY = "Other"
+
+
+def _attach_category(enrollment_df, contacts_df):
+    """Return a copy of enrollment_df with each student's category, or UNKNOWN_CATEGORY if unknown."""
+
+    categorized_df = enrollment_df.copy()
+    if contacts_df is None:
+        categorized_df["category"] = UNKNOWN_CATEGORY
+    else:
+        category_series = contacts_df.drop_duplicates("student_id").set_index("student_id")["category"]
+        categorized_df["category"] = categorized_df["student_id"].map(category_series).fillna(UNKNOWN_CATEGORY)
+    return categorized_df
+
+
+def grade_distributions(enrollment_df, contacts_df=None, by=DEFAULT_DISTRIBUTION_GROUPS):
+    """Count the letter grades, and compute the grade rates, of every group of enrollments.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        contacts_df (DataFrame): Student attributes with student_id and category columns; if None, or for
+            students it does not contain, the category is UNKNOWN_CATEGORY.
+        by (iterable): Columns by which to group; "category" and any enrollment column may be used, e.g.,
+            ("course", "semester_number") to combine the categories.
+
+    Returns:
+        A DataFrame with the by columns, a column per letter grade in VALID_GRADES holding its count, and the
+        enrollments, graded (grades with points), mean_grade_points, pass_rate, dfw_rate and incomplete_rate
+        columns.
+
+    """
+
+    by = list(by)
+    categorized_df = _attach_category(enrollment_df, contacts_df) if "category" in by else enrollment_df
+    counts_df = categorized_df.groupby(by + ["grade_letter"]).size().unstack("grade_letter", fill_value=0)\
+        .reindex(columns=VALID_GRADES, fill_value=0)
+    counts_df.columns.name = None
+    points = categorized_df.groupby(by)["grade"].agg(["count", "mean"])
+    distributions_df = counts_df
+    distributions_df["enrollments"] = counts_df[VALID_GRADES].sum(axis=1)
+    distributions_df["graded"] = points["count"]
+    distributions_df["mean_grade_points"] = points["mean"]
+    for rate_column, grades_set in sorted(GRADE_RATE_SETS_DICT.items()):
+        distributions_df[rate_column] = counts_df[[x for x in VALID_GRADES if x in grades_set]].sum(axis=1) \
+            / distributions_df["enrollments"].astype(float)
+    return distributions_df.reset_index()
+
+
+def course_trends(distributions_df, rate_columns=("dfw_rate", "pass_rate", "mean_grade_points"),
+                  by=("course",), min_semesters=2):
+    """Fit a least-squares line through each course's rates across semesters.
+
+    Args:
+        distributions_df (DataFrame): Output of grade_distributions(), with a semester_number column.  If it is
+            also split by category, add "category" to by.
+        rate_columns (iterable): Columns whose trends to compute.
+        by (iterable): Columns identifying a course (and, optionally, a category).
+        min_semesters (int): Courses offered in fewer semesters get NaN slopes.
+
+    Returns:
+        A DataFrame indexed by the by columns, with the number of semesters, the first and last semester numbers,
+        the total enrollments, and for each rate column, its enrollment-weighted mean and its slope per year
+        (four semester numbers).
+
+    """
+
+    by = list(by)
+    moments_df = distributions_df[by].copy()
+    x = distributions_df["semester_number"].astype(float)
+    for each_rate in rate_columns:
+        # Semesters where a rate is undefined (e.g., no grade points) are left out of its fit
+        known = distributions_df[each_rate].notnull()
+        y = distributions_df[each_rate].fillna(0)
+        moments_df[each_rate + "_n"] = known.astype(int)
+        moments_df[each_rate + "_x"] = x.where(known, 0)
+        moments_df[each_rate + "_xx"] = (x ** 2).where(known, 0)
+        moments_df[each_rate + "_y"] = y
+        moments_df[each_rate + "_xy"] = x * y
+        moments_df[each_rate + "_enrollments"] = distributions_df["enrollments"].where(known, 0)
+        moments_df[each_rate + "_weighted"] = y * distributions_df["enrollments"]
+    grouped = distributions_df.groupby(by)
+    sums_df = moments_df.groupby(by).sum()
+    trends_df = pd.DataFrame({"semesters": grouped.size(),
+                              "first_semester": grouped["semester_number"].min(),
+                              "last_semester": grouped["semester_number"].max(),
+                              "enrollments": grouped["enrollments"].sum()},
+                             columns=["semesters", "first_semester", "last_semester", "enrollments"])
+    for each_rate in rate_columns:
+        n = sums_df[each_rate + "_n"].astype(float)
+        x_variance = sums_df[each_rate + "_xx"] - sums_df[each_rate + "_x"] ** 2 / n
+        covariance = sums_df[each_rate + "_xy"] - sums_df[each_rate + "_x"] * sums_df[each_rate + "_y"] / n
+        enough = (n >= min_semesters) & (x_variance > 1e-9)
+        trends_df[each_rate + "_mean"] = sums_df[each_rate + "_weighted"] \
+            / sums_df[each_rate + "_enrollments"].where(sums_df[each_rate + "_enrollments"] > 0)
+        trends_df[each_rate + "_slope_per_year"] = (4 * covariance / x_variance).where(enough)
+    return trends_df
+
+
+class GradeDistributionCache:
+    """This class caches grade_distributions() results, keyed by the set of semesters in the enrollment data.
+
+    A result is reused whenever the enrollment data covers the same semesters, with the same numbers of rows and
+    students (which tells the Metro-only, Metro and Comparison, and all-student data sets apart), and the same
+    grouping is asked for.  Call clear() after re-ingesting the data of a semester that was already present.
+
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, use_disk=True):
+        """Instantiate a GradeDistributionCache object.
+
+        Args:
+            cache_dir (str): Directory in which to keep the results on disk.
+            use_disk (bool): If false, results are only kept in memory.
+
+        """
+
+        self.cache_dir = cache_dir
+        self.use_disk = use_disk
+        self.results_dict = dict()
+
+    def _key(self, enrollment_df, contacts_df, by):
+        """Create the cache key of a request from its term set and grouping."""
+
+        term_set = sorted(int(x) for x in enrollment_df["semester_number"].unique())
+        description = repr((term_set, len(enrollment_df), enrollment_df["student_id"].nunique(), list(by),
+                            None if contacts_df is None else len(contacts_df)))
+        return hashlib.md5(description.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, "grade_distributions_" + key + ".pkl")
+
+    def grade_distributions(self, enrollment_df, contacts_df=None, by=DEFAULT_DISTRIBUTION_GROUPS):
+        """Return grade_distributions() for the arguments, from the cache if possible.
+
+        Args:
+            enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+            contacts_df (DataFrame): Student attributes with student_id and category columns.
+            by (iterable): Columns by which to group.
+
+        Returns:
+            The grade_distributions() DataFrame.
+
+        """
+
+        key = self._key(enrollment_df, contacts_df, by)
+        if key not in self.results_dict and self.use_disk and os.path.exists(self._path(key)):
+            self.results_dict[key] = pd.read_pickle(self._path(key))
+        if key not in self.results_dict:
+            self.results_dict[key] = grade_distributions(enrollment_df, contacts_df, by)
+            if self.use_disk:
+                if not os.path.isdir(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                self.results_dict[key].to_pickle(self._path(key) + ".tmp")
+                os.rename(self._path(key) + ".tmp", self._path(key))
+        return self.results_dict[key]
+
+    def clear(self):
+        """Forget every cached result, in memory and on disk."""
+
+        self.results_dict = dict()
+        if self.use_disk and os.path.isdir(self.cache_dir):
+            for each_file in os.listdir(self.cache_dir):
+                if each_file.startswith("grade_distributions_"):
+                    os.remove(os.path.join(self.cache_dir, each_file))
@@ -0,0 +1,414 @@
+"""Build matched samples of Metro and Comparison (or other campus) students.
+
+Metro students differ from the students they are compared with in demographics and academic preparation,
+so outcome comparisons are more credible on matched samples.  This module offers two matching methods over
+the attributes in contacts_df, as returned by preprocessing() in processing.py:
+    1. Coarsened exact matching: numeric attributes (such as test scores) are cut into bins, and each treated
+        student is matched to all control students in the same stratum of binned and categorical attributes.
+    2. Nearest-neighbor propensity matching: a logistic regression estimates each student's propensity to be
+        treated, and each treated student is matched to the control student(s) with the nearest logit propensity,
+        optionally within exact strata (cohort year by default) and within a caliper.  Neighbors are found with
+        a KD-tree, so pools of tens of thousands of control students are searched in well under a second.
+
+Both methods return a matched-pairs (or strata) DataFrame and a weights DataFrame with one row per matched
+student.  The weights make the matched control students represent the treated students, and can be passed to
+standardized_mean_differences() to check balance, or to any weighted outcome comparison.
+
+Functions exported by this module include:
+    coarsened_exact_match(): stratify on coarsened attributes and weight the matched strata
+    estimate_propensity(): fit a logistic regression of treatment on student attributes
+    nearest_neighbor_match(): match on the logit propensity with a KD-tree
+    standardized_mean_differences(): compare attribute balance before and after weighting
+
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+MATCHING_CATEGORICAL_COLUMNS = ["race", "gender", "pell_eligible", "first_gen", "household_income"]
+MATCHING_NUMERIC_COLUMNS = ["SAT_Math", "SAT_Verbal", "ACT_Math", "ACT_English", "ELM", "EPT"]
+MATCHING_EXACT_COLUMNS = ["cohort_year"]
+DEFAULT_NUMERIC_BINS = 4
+MISSING_LABEL = "Missing"
+
+
+def _select_groups(contacts_df, treated_category, control_categories):
+    """Keep the treated and control students of contacts_df and flag the treated ones.
+
+    Args:
+        contacts_df (DataFrame): Student attributes, including student_id and category columns.
+        treated_category (str): Category of the treated students (e.g., "Metro").
+        control_categories (iterable): Categories of the control students (e.g., ["Comp"] or ["Comp", "Other"]).
+
+    Returns:
+        A tuple of (DataFrame of the selected students with a fresh index, boolean array of treatment flags).
+
+    """
+
+    selected_df = contacts_df[contacts_df["category"].isin([treated_category] + list(control_categories))]
+    selected_df = selected_df.drop_duplicates(subset="student_id").reset_index(drop=True)
+    return selected_df, (selected_df["category"] == treated_category).values
+
+
+def _categorical_codes(selected_df, columns):
+    """Encode categorical columns as strings, with missing values as their own category.
+
+    Args:
+        selected_df (DataFrame): Student attributes.
+        columns (list): Names of the categorical columns.
+
+    Returns:
+        A DataFrame of string-valued columns.
+
+    """
+
+    return pd.DataFrame({each_column: selected_df[each_column].astype(object).where(
+        selected_df[each_column].notnull(), MISSING_LABEL).astype(str)
+        for each_column in columns}, columns=columns)
+
+
+def _numeric_values(selected_df, columns):
+    """Convert numeric attribute columns (which may hold strings) to floating-point values.
+
+    Args:
+        selected_df (DataFrame): Student attributes.
+        columns (list): Names of the numeric columns.
+
+    Returns:
+        A DataFrame of float columns, with NaN for missing or unparseable values.
+
+    """
+
+    return pd.DataFrame({each_column: pd.to_numeric(selected_df[each_column], errors="coerce")
+                         for each_column in columns}, columns=columns)
+
+
+def _stratum_labels(keys_df):
+    """Combine several key columns into a single integer stratum label per row.
+
+    Args:
+        keys_df (DataFrame): Columns whose combined values define the strata.
+
+    Returns:
+        An integer array of stratum labels (all zeros if keys_df has no columns).
+
+    """
+
+    if keys_df.shape[1] == 0:
+        return np.zeros(len(keys_df), dtype=np.int64)
+    return keys_df.astype(str).groupby(list(keys_df.columns), sort=False).ngroup().values
+
+
+def coarsened_exact_match(contacts_df, treated_category="Metro", control_categories=("Comp",),
+                          categorical_columns=MATCHING_CATEGORICAL_COLUMNS + MATCHING_EXACT_COLUMNS,
+                          numeric_columns=MATCHING_NUMERIC_COLUMNS, bins=DEFAULT_NUMERIC_BINS):
+    """Match treated and control students exactly on categorical attributes and binned numeric attributes.
+
+    Numeric attributes are cut into quantile bins (computed over treated and control students together), with
+    missing values as a bin of their own.  Strata that lack either treated or control students are dropped.
+    Treated students get a weight of 1; control students in a stratum s get the weight
+    (treated in s / controls in s) * (matched controls / matched treated), the usual coarsened exact matching weight.
+
+    Args:
+        contacts_df (DataFrame): Student attributes, including student_id and category columns.
+        treated_category (str): Category of the treated students.
+        control_categories (iterable): Categories of the control students.
+        categorical_columns (list): Attributes to match on exactly.
+        numeric_columns (list): Attributes to coarsen into bins and then match on exactly.
+        bins (int or dict): Number of quantile bins for every numeric attribute, or a dictionary mapping
+            attribute names to a number of bins or to a list of bin edges.
+
+    Returns:
+        A DataFrame with one row per matched student: student_id, category, treated, stratum and weight.
+
+    """
+
+    selected_df, treated = _select_groups(contacts_df, treated_category, control_categories)
+    keys_df = _categorical_codes(selected_df, categorical_columns)
+    numeric_df = _numeric_values(selected_df, numeric_columns)
+    for each_column in numeric_columns:
+        column_bins = bins.get(each_column, DEFAULT_NUMERIC_BINS) if isinstance(bins, dict) else bins
+        if isinstance(column_bins, int):
+            binned = pd.qcut(numeric_df[each_column], column_bins, labels=False, duplicates="drop")
+        else:
+            binned = pd.cut(numeric_df[each_column], column_bins, labels=False, include_lowest=True)
+        keys_df[each_column] = binned.astype(object).where(binned.notnull(), MISSING_LABEL).astype(str)
+    strata = _stratum_labels(keys_df)
+
+    treated_counts = np.bincount(strata, weights=treated, minlength=strata.max() + 1 if len(strata) else 0)
+    control_counts = np.bincount(strata, weights=~treated, minlength=len(treated_counts))
+    matched = (treated_counts[strata] > 0) & (control_counts[strata] > 0)
+    matched_treated = treated[matched].sum()
+    matched_controls = (~treated[matched]).sum()
+    weights = np.where(treated, 1.0,
+                       treated_counts[strata] / np.maximum(control_counts[strata], 1)
+                       * float(matched_controls) / max(matched_treated, 1))
+    return pd.DataFrame({"student_id": selected_df["student_id"].values[matched],
+                         "category": selected_df["category"].values[matched],
+                         "treated": treated[matched],
+                         "stratum": strata[matched],
+                         "weight": weights[matched]},
+                        columns=["student_id", "category", "treated", "stratum", "weight"])
+
+
+def _design_matrix(selected_df, categorical_columns, numeric_columns):
+    """Build a standardized design matrix for the propensity model.
+
+    Categorical attributes are one-hot encoded (dropping the first level).  Missing numeric values are replaced
+    by the column median and flagged by an indicator column, so students with missing test scores stay in
+    the model.
+
+    Args:
+        selected_df (DataFrame): Student attributes.
+        categorical_columns (list): Names of the categorical columns.
+        numeric_columns (list): Names of the numeric columns.
+
+    Returns:
+        A two-dimensional float array, with an intercept in the first column.
+
+    """
+
+    blocks = [np.ones((len(selected_df), 1))]
+    if categorical_columns:
+        blocks.append(pd.get_dummies(_categorical_codes(selected_df, categorical_columns),
+                                     drop_first=True).values.astype(float))
+    numeric_df = _numeric_values(selected_df, numeric_columns)
+    for each_column in numeric_columns:
+        values = numeric_df[each_column].values
+        missing = np.isnan(values)
+        if missing.all():
+            continue
+        values = np.where(missing, np.nanmedian(values), values)
+        spread = values.std()
+        blocks.append(((values - values.mean()) / (spread if spread > 0 else 1.0))[:, None])
+        if missing.any():
+            blocks.append(missing[:, None].astype(float))
+    return np.hstack(blocks)
+
+
+def estimate_propensity(contacts_df, treated_category="Metro", control_categories=("Comp",),
+                        categorical_columns=MATCHING_CATEGORICAL_COLUMNS, numeric_columns=MATCHING_NUMERIC_COLUMNS,
+                        ridge=1e-3, max_iterations=50, tolerance=1e-8):
+    """Fit a logistic regression of treatment on student attributes and return each student's propensity.
+
+    The model is fit by Newton-Raphson iterations, with a small ridge penalty that keeps the fit stable when
+    some attribute levels occur only among treated or only among control students.
+
+    Args:
+        contacts_df (DataFrame): Student attributes, including student_id and category columns.
+        treated_category (str): Category of the treated students.
+        control_categories (iterable): Categories of the control students.
+        categorical_columns (list): Categorical attributes in the model.
+        numeric_columns (list): Numeric attributes in the model.
+        ridge (float): Ridge penalty applied to every coefficient except the intercept.
+        max_iterations (int): Maximum number of Newton-Raphson iterations.
+        tolerance (float): Convergence threshold on the largest coefficient change.
+
+    Returns:
+        A DataFrame with student_id, category, treated, propensity and logit columns.
+
+    """
+
+    selected_df, treated = _select_groups(contacts_df, treated_category, control_categories)
+    design = _design_matrix(selected_df, categorical_columns, numeric_columns)
+    penalty = np.full(design.shape[1], ridge)
+    penalty[0] = 0.0
+    coefficients = np.zeros(design.shape[1])
+    outcome = treated.astype(float)
+    for iteration in range(max_iterations):
+        probabilities = 1.0 / (1.0 + np.exp(-design.dot(coefficients)))
+        gradient = design.T.dot(outcome - probabilities) - penalty * coefficients
+        hessian = (design * (probabilities * (1.0 - probabilities))[:, None]).T.dot(design) + np.diag(penalty)
+        step = np.linalg.solve(hessian, gradient)
+        coefficients += step
+        if np.abs(step).max() < tolerance:
+            break
+    logits = design.dot(coefficients)
+    return pd.DataFrame({"student_id": selected_df["student_id"].values,
+                         "category": selected_df["category"].values,
+                         "treated": treated,
+                         "propensity": 1.0 / (1.0 + np.exp(-logits)),
+                         "logit": logits},
+                        columns=["student_id", "category", "treated", "propensity", "logit"])
+
+
+def nearest_neighbor_match(contacts_df, treated_category="Metro", control_categories=("Comp",),
+                           categorical_columns=MATCHING_CATEGORICAL_COLUMNS, numeric_columns=MATCHING_NUMERIC_COLUMNS,
+                           exact_columns=MATCHING_EXACT_COLUMNS, n_neighbors=1, caliper=0.2, replace=True,
+                           propensity_df=None):
+    """Match each treated student to the nearest control student(s) on the logit of the propensity score.
+
+    Within each stratum of exact_columns, a KD-tree is built over the logit propensities of the control students
+    and queried for all treated students at once.  Pairs farther apart than the caliper are discarded.
+
+    Args:
+        contacts_df (DataFrame): Student attributes, including student_id and category columns.
+        treated_category (str): Category of the treated students.
+        control_categories (iterable): Categories of the control students.
+        categorical_columns (list): Categorical attributes in the propensity model.
+        numeric_columns (list): Numeric attributes in the propensity model.
+        exact_columns (list): Attributes on which treated and control students must agree exactly.
+        n_neighbors (int): Number of control students to match to each treated student.
+        caliper (float): Maximum distance between matched logits, in standard deviations of the logit.
+            None disables the caliper.
+        replace (bool): If true, a control student may be matched to several treated students.  If false,
+            treated students are matched greedily, closest pairs first, and each control student is used once.
+        propensity_df (DataFrame): Output of estimate_propensity(), if it has already been computed.
+
+    Returns:
+        A tuple of (pairs_df, weights_df):
+            pairs_df has one row per matched pair: treated_id, control_id, distance (in logit units).
+            weights_df has one row per matched student: student_id, category, treated and weight.  Each
+                treated student has weight 1; each control student has the sum, over the treated students it
+                is matched to, of 1 / (number of controls matched to that treated student).
+
+    """
+
+    if propensity_df is None:
+        propensity_df = estimate_propensity(contacts_df, treated_category, control_categories,
+                                            categorical_columns, numeric_columns)
+    selected_df, treated = _select_groups(contacts_df, treated_category, control_categories)
+    propensity_df = propensity_df.set_index("student_id").reindex(selected_df["student_id"].values)
+    logits = propensity_df["logit"].values
+    max_distance = np.inf if caliper is None else caliper * logits.std()
+    strata = _stratum_labels(_categorical_codes(selected_df, list(exact_columns)))
+    student_ids = selected_df["student_id"].values
+
+    treated_positions, control_positions, distances = [], [], []
+    for each_stratum in np.unique(strata):
+        in_stratum = strata == each_stratum
+        stratum_treated = np.flatnonzero(in_stratum & treated)
+        stratum_controls = np.flatnonzero(in_stratum & ~treated)
+        if len(stratum_treated) == 0 or len(stratum_controls) == 0:
+            continue
+        tree = cKDTree(logits[stratum_controls][:, None])
+        if replace:
+            k = min(n_neighbors, len(stratum_controls))
+            found_distances, found_positions = tree.query(logits[stratum_treated][:, None], k=k,
+                                                          distance_upper_bound=max_distance)
+            found_distances = found_distances.reshape(len(stratum_treated), k)
+            found_positions = found_positions.reshape(len(stratum_treated), k)
+            valid = np.isfinite(found_distances)
+            treated_positions.append(np.repeat(stratum_treated, k)[valid.ravel()])
+            control_positions.append(stratum_controls[found_positions[valid]])
+            distances.append(found_distances[valid])
+        else:
+            pairs = _greedy_match(tree, logits[stratum_treated], n_neighbors, max_distance)
+            treated_positions.append(stratum_treated[pairs[0]])
+            control_positions.append(stratum_controls[pairs[1]])
+            distances.append(pairs[2])
+
+    treated_positions = np.concatenate(treated_positions) if treated_positions else np.array([], dtype=np.int64)
+    control_positions = np.concatenate(control_positions) if control_positions else np.array([], dtype=np.int64)
+    distances = np.concatenate(distances) if distances else np.array([])
+    pairs_df = pd.DataFrame({"treated_id": student_ids[treated_positions],
+                             "control_id": student_ids[control_positions],
+                             "distance": distances},
+                            columns=["treated_id", "control_id", "distance"])
+
+    # Each treated student's unit weight is shared equally among its matched control students
+    matches_per_treated = np.bincount(treated_positions, minlength=len(selected_df))
+    weights = np.zeros(len(selected_df))
+    weights[np.unique(treated_positions)] = 1.0
+    np.add.at(weights, control_positions, 1.0 / matches_per_treated[treated_positions])
+    matched = weights > 0
+    weights_df = pd.DataFrame({"student_id": student_ids[matched],
+                               "category": selected_df["category"].values[matched],
+                               "treated": treated[matched],
+                               "weight": weights[matched]},
+                              columns=["student_id", "category", "treated", "weight"])
+    return pairs_df, weights_df
+
+
+def _greedy_match(tree, treated_logits, n_neighbors, max_distance):
+    """Match treated students to control students without replacement, closest candidate pairs first.
+
+    Candidate pairs come from KD-tree queries of increasing size; when a treated student's candidates have all
+    been taken, the query for that student is widened until it finds free control students or runs out.
+
+    Args:
+        tree (cKDTree): Tree built over the control students' logits.
+        treated_logits (ndarray): Logits of the treated students.
+        n_neighbors (int): Number of control students to match to each treated student.
+        max_distance (float): Caliper, in logit units.
+
+    Returns:
+        A tuple of arrays (treated positions, control positions, distances), with positions relative to the
+        arguments.
+
+    """
+
+    n_controls = tree.n
+    used = np.zeros(n_controls, dtype=bool)
+    matched_counts = np.zeros(len(treated_logits), dtype=np.int64)
+    treated_positions, control_positions, distances = [], [], []
+    k = min(n_controls, 4 * n_neighbors)
+    pending = np.arange(len(treated_logits))
+    while len(pending) and k > 0:
+        found_distances, found_positions = tree.query(treated_logits[pending][:, None], k=k,
+                                                      distance_upper_bound=max_distance)
+        found_distances = found_distances.reshape(len(pending), k)
+        found_positions = found_positions.reshape(len(pending), k)
+        exhausted = np.zeros(len(pending), dtype=bool)
+        for row in np.argsort(found_distances[:, 0], kind="mergesort"):
+            each_treated = pending[row]
+            for each_distance, each_control in zip(found_distances[row], found_positions[row]):
+                if matched_counts[each_treated] == n_neighbors:
+                    break
+                if not np.isfinite(each_distance):
+                    exhausted[row] = True
+                    break
+                if not used[each_control]:
+                    used[each_control] = True
+                    matched_counts[each_treated] += 1
+                    treated_positions.append(each_treated)
+                    control_positions.append(each_control)
+                    distances.append(each_distance)
+        pending = pending[(matched_counts[pending] < n_neighbors) & ~exhausted]
+        if k == n_controls or used.all():
+            break
+        k = min(n_controls, 2 * k)
+    return (np.array(treated_positions, dtype=np.int64), np.array(control_positions, dtype=np.int64),
+            np.array(distances))
+
+
+def standardized_mean_differences(contacts_df, weights_df, numeric_columns=MATCHING_NUMERIC_COLUMNS,
+                                  categorical_columns=MATCHING_CATEGORICAL_COLUMNS):
+    """Compute the standardized mean difference of each attribute between treated and control students.
+
+    Args:
+        contacts_df (DataFrame): Student attributes, including student_id.
+        weights_df (DataFrame): Weights returned by one of the matching functions.
+        numeric_columns (list): Numeric attributes to compare.
+        categorical_columns (list): Categorical attributes to compare, one indicator per level.
+
+    Returns:
+        A DataFrame indexed by attribute (or attribute=level) with treated_mean, control_mean and smd columns,
+        where the control mean uses the matching weights.
+
+    """
+
+    merged_df = weights_df.merge(contacts_df.drop_duplicates(subset="student_id"), on="student_id",
+                                 suffixes=("", "_contact"))
+    features_df = _numeric_values(merged_df, numeric_columns)
+    if categorical_columns:
+        dummies_df = pd.get_dummies(_categorical_codes(merged_df, categorical_columns), prefix_sep="=")
+        features_df = pd.concat([features_df, dummies_df.astype(float)], axis=1)
+    treated = merged_df["treated"].values.astype(bool)
+    weights = merged_df["weight"].values
+    rows = []
+    for each_feature in features_df.columns:
+        values = features_df[each_feature].values
+        present = ~np.isnan(values)
+        treated_values = values[treated & present]
+        control_values = values[~treated & present]
+        control_weights = weights[~treated & present]
+        if len(treated_values) == 0 or control_weights.sum() == 0:
+            continue
+        treated_mean = treated_values.mean()
+        control_mean = np.average(control_values, weights=control_weights)
+        pooled_sd = np.sqrt((treated_values.var() + control_values.var()) / 2.0)
+        rows.append((each_feature, treated_mean, control_mean,
+                     (treated_mean - control_mean) / pooled_sd if pooled_sd > 1e-8 else 0.0))
+    return pd.DataFrame(rows, columns=["attribute", "treated_mean", "control_mean", "smd"]).set_index("attribute")
@@ -0,0 +1,314 @@
+"""Compute term-based persistence and completion metrics for all students at once.
+
+Persistence and completion are measured against a student's "regular" terms: by default the fall and
+spring semesters, counted from the fall semester of the student's cohort year.  With the default seasons,
+the first regular term of a 2012 cohort student is Fall 2012, the third is Fall 2013, and so on.
+
+Three metrics are defined for the n-th regular term:
+    persistence: the student is enrolled in one or more courses in the n-th term.
+    terms enrolled: the number of the first n terms in which the student is enrolled.
+    completion: the student completes a course (receives a grade not in INCOMPLETE_GRADES) in the n-th
+        term, and is enrolled in at least n-1 of the first n terms.  For n=4, this is the fourth_completion
+        field computed by preprocessing() in processing.py.
+
+All metrics are derived from two boolean matrices of shape (number of students, number of terms), built
+from the long-format enrollment DataFrame of utilities/enrollment.py.  Every metric for every n is then a
+column slice or cumulative sum of those matrices, so complete 1..n curves for every cohort cost about as
+much as a single metric.
+
+Functions exported by this module include:
+    build_term_matrices(): build the enrolled/completed matrices for a population of students
+    compute_term_metrics(): per-student persistence, completion and terms-enrolled columns
+    compute_metric_curves(): per-cohort (or other grouping) rates for terms 1..n
+    compare_with_ir_persistence(): check computed persistence against the IR persistence fields
+    convert_to_flags(): convert yes/no style columns (1/0, Y/N, True/False) into booleans
+
+"""
+
+import numpy as np
+import pandas as pd
+from utilities.semesters import SEMESTER_CALENDAR
+from utilities.other_constants import SEASON_MODULO, INCOMPLETE_GRADES, FIRST_SEMESTER_YEAR
+
+DEFAULT_SEASONS = ("Fall", "Spring")
+IR_PERSISTENCE_TERMS_DICT = {
+    "third_persistence": 3,
+    "fifth_persistence": 5,
+    "seventh_persistence": 7
+}
+TRUE_FLAG_VALUES_SET = {"1", "1.0", "y", "yes", "t", "true"}
+FALSE_FLAG_VALUES_SET = {"0", "0.0", "n", "no", "f", "false"}
+
+
+def _regular_term_lookup(seasons, last_semester_number):
+    """Build lookups between semester numbers and the ordinal positions of regular terms.
+
+    Args:
+        seasons (iterable): Names of the seasons (see SEASON_MODULO) that count as regular terms.
+        last_semester_number (int): The largest semester number that must be covered by the lookups.
+
+    Returns:
+        A tuple consisting of:
+            (1) a boolean array indicating, for each semester number, whether it is a regular term, and
+            (2) an array holding, for each semester number, the number of regular terms up to and including it.
+
+    """
+
+    season_residues = [SEASON_MODULO[each_season] for each_season in seasons]
+    is_regular = np.in1d(np.arange(last_semester_number + 1) % 4, season_residues)
+    is_regular[0] = False
+    return is_regular, np.cumsum(is_regular)
+
+
+def _check_start_terms(start_terms, cohort_years):
+    """Make sure that every start semester is semester 1 or later, so that it can index the regular-term lookups.
+
+    Args:
+        start_terms (ndarray): Semester numbers of the students' first terms; NaN for unknown ones.
+        cohort_years (ndarray): The cohort years from which start_terms were computed, in the same order.
+
+    Raises:
+        ValueError: if a cohort starts before FIRST_SEMESTER_YEAR, the first year of the semester numbering.
+
+    """
+
+    with np.errstate(invalid="ignore"):
+        too_early = np.asarray(start_terms) < 1
+    if too_early.any():
+        raise ValueError(str(too_early.sum()) + " students have a cohort year before " + str(FIRST_SEMESTER_YEAR) +
+                         ", the first year of the semester numbering, such as " +
+                         repr(np.asarray(cohort_years)[too_early][0]) + ".")
+
+
+def build_term_matrices(enrollment_df, contacts_df, max_terms=12, seasons=DEFAULT_SEASONS):
+    """Build boolean enrolled/completed matrices over the first max_terms regular terms of each student.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        contacts_df (DataFrame): Student attributes; must contain student_id and cohort_year columns.
+            Students without a cohort year are left out.
+        max_terms (int): Number of regular terms to cover.
+        seasons (iterable): Seasons that count as regular terms; must include Fall, since students start
+            in the fall semester of their cohort year.
+
+    Returns:
+        A tuple consisting of:
+            (1) students_df, a DataFrame with one row per student (student_id, cohort_year, start_term), whose
+                row positions correspond to the rows of the matrices,
+            (2) enrolled, a boolean matrix whose [i, j] entry is true if student i is enrolled in regular term j+1,
+            (3) completed, a boolean matrix whose [i, j] entry is true if student i completes a course in
+                regular term j+1, and
+            (4) term_semesters, an integer matrix holding the semester number of each student's regular terms.
+
+    Raises:
+        ValueError: if seasons does not include Fall, or a cohort year is before FIRST_SEMESTER_YEAR.
+
+    """
+
+    if "Fall" not in seasons:
+        raise ValueError("build_term_matrices() requires the Fall season, in which every cohort starts")
+    students_df = contacts_df.loc[contacts_df["cohort_year"].notnull(), ["student_id", "cohort_year"]]
+    students_df = students_df.drop_duplicates(subset="student_id").reset_index(drop=True)
+    students_df["start_term"] = SEMESTER_CALENDAR.cohort_start_numbers(students_df["cohort_year"]).astype('int32')
+    _check_start_terms(students_df["start_term"].values, students_df["cohort_year"].values)
+
+    # Each cohort needs room for max_terms regular terms, even when fewer seasons count as regular
+    last_semester_number = int(max(enrollment_df["semester_number"].max() if len(enrollment_df) else 0,
+                                   students_df["start_term"].max() if len(students_df) else 0)) + 4 * max_terms
+    is_regular, regular_counts = _regular_term_lookup(seasons, last_semester_number)
+    regular_semesters = np.flatnonzero(is_regular)
+    start_terms = students_df["start_term"].values
+    term_semesters = regular_semesters[regular_counts[start_terms - 1][:, None] + np.arange(max_terms)[None, :]]
+
+    # Locate every enrollment row in the matrices: row from the student, column from the regular-term ordinal
+    student_positions = pd.Series(np.arange(len(students_df)), index=students_df["student_id"].values)
+    row_positions = enrollment_df["student_id"].map(student_positions).values
+    semesters = enrollment_df["semester_number"].values
+    in_population = ~np.isnan(row_positions)
+    row_positions = np.where(in_population, row_positions, 0).astype(np.int64)
+    term_positions = regular_counts[semesters] - regular_counts[start_terms[row_positions] - 1] - 1
+    keep = in_population & is_regular[semesters] & (term_positions >= 0) & (term_positions < max_terms)
+    row_positions = row_positions[keep]
+    term_positions = term_positions[keep]
+    is_complete = ~enrollment_df["grade_letter"].isin(INCOMPLETE_GRADES).values[keep]
+
+    enrolled = np.zeros((len(students_df), max_terms), dtype=bool)
+    completed = np.zeros((len(students_df), max_terms), dtype=bool)
+    enrolled[row_positions, term_positions] = True
+    completed[row_positions[is_complete], term_positions[is_complete]] = True
+    return students_df, enrolled, completed, term_semesters
+
+
+def _derive_metrics(enrolled, completed):
+    """Derive the terms-enrolled and completion matrices from the enrolled and completed matrices.
+
+    Args:
+        enrolled (ndarray): Boolean enrolled matrix from build_term_matrices().
+        completed (ndarray): Boolean completed matrix from build_term_matrices().
+
+    Returns:
+        A tuple of (terms_enrolled, completion) matrices with the same shape as the arguments.
+
+    """
+
+    terms_enrolled = np.cumsum(enrolled, axis=1)
+    required_terms = np.arange(enrolled.shape[1])[None, :]  # n-1 of the first n terms
+    completion = completed & (terms_enrolled >= required_terms)
+    return terms_enrolled, completion
+
+
+def compute_term_metrics(enrollment_df, contacts_df, terms=(3, 4, 5, 7), seasons=DEFAULT_SEASONS):
+    """Compute per-student persistence, completion and terms-enrolled metrics for the requested terms.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        contacts_df (DataFrame): Student attributes; must contain student_id and cohort_year columns.
+        terms (iterable): The regular-term numbers n (1 is the first term) for which to compute metrics.
+        seasons (iterable): Seasons that count as regular terms.
+
+    Returns:
+        A DataFrame with student_id and cohort_year columns, plus persistence_<n>, completion_<n> and
+        terms_enrolled_<n> columns for each requested n.
+
+    """
+
+    terms = sorted(set(terms))
+    students_df, enrolled, completed, term_semesters = build_term_matrices(enrollment_df, contacts_df,
+                                                                           max_terms=terms[-1],
+                                                                           seasons=seasons)
+    terms_enrolled, completion = _derive_metrics(enrolled, completed)
+    metrics_df = students_df[["student_id", "cohort_year"]].copy()
+    for n in terms:
+        metrics_df["persistence_" + str(n)] = enrolled[:, n - 1]
+        metrics_df["completion_" + str(n)] = completion[:, n - 1]
+        metrics_df["terms_enrolled_" + str(n)] = terms_enrolled[:, n - 1].astype('int8')
+    return metrics_df
+
+
+def enrolled_k_of_n(enrollment_df, contacts_df, k, n, seasons=DEFAULT_SEASONS):
+    """Determine which students are enrolled in at least k of their first n regular terms.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        contacts_df (DataFrame): Student attributes; must contain student_id and cohort_year columns.
+        k (int): Minimum number of terms enrolled.
+        n (int): Number of regular terms to consider.
+        seasons (iterable): Seasons that count as regular terms.
+
+    Returns:
+        A boolean Series indexed by student id.
+
+    """
+
+    students_df, enrolled, completed, term_semesters = build_term_matrices(enrollment_df, contacts_df,
+                                                                           max_terms=n, seasons=seasons)
+    return pd.Series(enrolled.sum(axis=1) >= k, index=students_df["student_id"].values)
+
+
+def compute_metric_curves(enrollment_df, contacts_df, max_terms=12, by=("cohort_year",),
+                          seasons=DEFAULT_SEASONS, last_semester_number=None):
+    """Compute persistence and completion rates for regular terms 1..max_terms, per group of students.
+
+    A term that lies after the last semester in the enrollment data has not been observed yet for that
+    student, so the student is left out of the rates for that term rather than being counted as not enrolled.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        contacts_df (DataFrame): Student attributes; must contain student_id, cohort_year and the by columns.
+        max_terms (int): Number of regular terms for which to compute the curves.
+        by (iterable): Columns of contacts_df by which to group the students.
+        seasons (iterable): Seasons that count as regular terms.
+        last_semester_number (int): Last observed semester; defaults to the last semester in enrollment_df.
+
+    Returns:
+        A long-format DataFrame with the by columns, a term column (1..max_terms), and the columns
+        students (number of students observed in that term), persistence_rate, completion_rate
+        and mean_terms_enrolled.
+
+    """
+
+    by = list(by)
+    students_df, enrolled, completed, term_semesters = build_term_matrices(enrollment_df, contacts_df,
+                                                                           max_terms=max_terms,
+                                                                           seasons=seasons)
+    terms_enrolled, completion = _derive_metrics(enrolled, completed)
+    if last_semester_number is None:
+        last_semester_number = enrollment_df["semester_number"].max()
+    observed = term_semesters <= last_semester_number
+    group_keys = contacts_df.drop_duplicates(subset="student_id").set_index("student_id")[by]\
+        .reindex(students_df["student_id"].values).reset_index(drop=True)
+    term_columns = list(range(1, max_terms + 1))
+
+    def grouped_sums(matrix):
+        masked = pd.DataFrame(np.where(observed, matrix, 0), columns=term_columns)
+        return pd.concat([group_keys, masked], axis=1).groupby(by).sum()
+
+    observed_counts = grouped_sums(observed)
+    rates_dict = {"persistence_rate": grouped_sums(enrolled) / observed_counts,
+                  "completion_rate": grouped_sums(completion) / observed_counts,
+                  "mean_terms_enrolled": grouped_sums(terms_enrolled) / observed_counts}
+    curves_df = pd.DataFrame({"students": observed_counts.stack()})
+    for each_name in ["persistence_rate", "completion_rate", "mean_terms_enrolled"]:
+        curves_df[each_name] = rates_dict[each_name].stack()
+    curves_df.index.names = by + ["term"]
+    curves_df = curves_df.reset_index()
+    return curves_df[curves_df["students"] > 0].reset_index(drop=True)
+
+
+def convert_to_flags(series):
+    """Convert a column of yes/no style values (1/0, Y/N, True/False) into booleans, with NaN for anything else.
+
+    Args:
+        series (Series): The values to convert.
+
+    Returns:
+        A Series of True, False and NaN values.
+
+    """
+
+    as_text = series.astype(str).str.strip().str.lower()
+    flags = pd.Series(np.nan, index=series.index, dtype=object)
+    flags[as_text.isin(TRUE_FLAG_VALUES_SET)] = True
+    flags[as_text.isin(FALSE_FLAG_VALUES_SET)] = False
+    return flags
+
+
+def compare_with_ir_persistence(term_metrics_df, contacts_df, last_semester_number=None):
+    """Check computed persistence against the third/fifth/seventh persistence fields from Salesforce and IR.
+
+    Args:
+        term_metrics_df (DataFrame): Output of compute_term_metrics(), with persistence_3, persistence_5 and
+            persistence_7 columns.
+        contacts_df (DataFrame): Student attributes containing the third_persistence, fifth_persistence and
+            seventh_persistence columns.
+        last_semester_number (int): If given, students whose persistence term comes after this semester
+            are not compared.
+
+    Returns:
+        A DataFrame with one row per persistence field, holding the number of students compared, the number
+        of agreements, the disagreements in each direction, and the agreement rate.
+
+    """
+
+    reference_df = contacts_df.drop_duplicates(subset="student_id").set_index("student_id")
+    comparison_rows = []
+    for field, n in sorted(IR_PERSISTENCE_TERMS_DICT.items(), key=lambda x: x[1]):
+        computed = term_metrics_df.set_index("student_id")["persistence_" + str(n)]
+        reported = convert_to_flags(reference_df[field]).reindex(computed.index)
+        comparable = reported.notnull().values
+        if last_semester_number is not None:
+            start_terms = SEMESTER_CALENDAR.cohort_start_numbers(term_metrics_df["cohort_year"].values)
+            comparable &= start_terms + 2 * (n - 1) <= last_semester_number
+        computed_values = computed.values[comparable].astype(bool)
+        reported_values = reported.values[comparable].astype(bool)
+        agree = int((computed_values == reported_values).sum())
+        comparison_rows.append({"field": field,
+                                "term": n,
+                                "compared": len(computed_values),
+                                "agree": agree,
+                                "reported_only": int((reported_values & ~computed_values).sum()),
+                                "computed_only": int((computed_values & ~reported_values).sum()),
+                                "agreement_rate": float(agree) / len(computed_values)
+                                if len(computed_values) else np.nan})
+    return pd.DataFrame(comparison_rows, columns=["field", "term", "compared", "agree", "reported_only",
+                                                  "computed_only", "agreement_rate"])
@@ -0,0 +1,386 @@
+"""Find students by the courses they took, when they took them, and the grades they received.
+
+Questions such as "students who took MATH110 before MATH226 within two terms", "students who withdrew from a
+math course in their first year" or "students who never took their pathway's capstone" are answered by
+combining predicates:
+    query = before(took("MATH110"), took("MATH226"), within=2)
+    query = grade_in(MATH_COURSES_SET, {"W", "WU"}, terms=(1, 4))
+    query = ~took_assigned({x.student_id: x.Pathway.cap for x in metro_df.itertuples()})
+    index = EnrollmentIndex(enrollment_df, contacts_df)
+    student_ids = index.query(query & passed("ENG114"))
+
+An EnrollmentIndex holds, for every course, a posting list of (student, term, grade) entries, sorted by student
+and term.  Predicates are evaluated on the postings of the courses they name, never on the student records: a
+took() predicate marks the students appearing in its postings, and a before() predicate merges two sets of
+postings with one sorted search.  Each predicate yields a boolean mask over all students, so &, | and ~ are
+element-wise operations on arrays.
+
+Terms are counted either in semester numbers (see SEMESTERS_TO_NUMBERS_DICT in utilities/other_constants.py),
+in which case Fall to Spring is two terms apart, or, if the index is built with seasons, in regular terms only, in
+which case Fall to Spring is one term apart and courses taken in other seasons are left out of the index.
+Relative terms, as used by the terms arguments, count from 1 at the student's start term: the fall semester of
+their cohort year if contacts_df is given, and their first enrolled term otherwise.
+
+Functions and classes exported by this module include:
+    EnrollmentIndex: posting lists of the courses in a long-format enrollment DataFrame
+    took(): students who took one of some courses, optionally with some grades and within some terms
+    passed(): students who passed one of some courses (see PASSING_GRADES)
+    grade_in(): students who received one of some grades in one of some courses
+    before(), after(): students who took one course before or after another, optionally within k terms
+    took_assigned(): students who took one of the courses assigned to them individually
+
+"""
+
+import numpy as np
+import pandas as pd
+from analysis.metrics import _regular_term_lookup, _check_start_terms
+from utilities.semesters import SEMESTER_CALENDAR
+from utilities.other_constants import PASSING_GRADES
+
+TERM_KEY_MULTIPLIER = 1 << 20   # larger than any term number; combines (student, term) into one sortable key
+
+
+def _as_name_list(names):
+    """Return a list of names, given a single name or an iterable of names."""
+
+    return [names] if isinstance(names, basestring) else list(names)
+
+
+class EnrollmentIndex:
+    """This class holds the per-course posting lists used to evaluate predicates.
+
+    The postings of all courses are stored in three parallel arrays (student code, term, grade code), sorted by
+    course, student and term, so the postings of one course are a contiguous slice.  Student codes are positions
+    in the sorted student_ids array.
+
+    """
+
+    def __init__(self, enrollment_df, contacts_df=None, seasons=None):
+        """Instantiate an EnrollmentIndex object.
+
+        Args:
+            enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+            contacts_df (DataFrame): Student attributes with student_id and cohort_year columns.  If given, its
+                students are included even if they have no enrollment rows, and relative terms count from the
+                fall semester of each student's cohort year.
+            seasons (iterable): If given, the seasons (see SEASON_MODULO) that count as terms; rows in other
+                seasons are left out and terms are counted in regular terms.
+
+        """
+
+        student_ids = enrollment_df["student_id"].unique()
+        cohort_years = None
+        if contacts_df is not None:
+            student_ids = np.union1d(student_ids, contacts_df["student_id"].values)
+            cohort_years = contacts_df.drop_duplicates("student_id").set_index("student_id")["cohort_year"]
+        self.student_ids = np.sort(np.asarray(student_ids, dtype=object))
+        self.seasons = seasons
+        semester_numbers = enrollment_df["semester_number"].values.astype('int64')
+        last_semester_number = int(semester_numbers.max()) if len(semester_numbers) else 1
+        student_codes = np.searchsorted(self.student_ids, enrollment_df["student_id"].values)
+
+        # Start semester of each student: from the cohort year, else from the first enrolled semester
+        start_semesters = np.full(len(self.student_ids), np.iinfo('int64').max, dtype='int64')
+        np.minimum.at(start_semesters, student_codes, semester_numbers)
+        if cohort_years is not None:
+            cohort_start = pd.to_numeric(cohort_years.reindex(self.student_ids), errors="coerce").values
+            known = ~np.isnan(cohort_start)
+            start_semesters[known] = SEMESTER_CALENDAR.cohort_start_numbers(cohort_start[known])
+            _check_start_terms(start_semesters[known], cohort_start[known])
+            last_semester_number = max(last_semester_number, int(start_semesters[known].max()) if known.any() else 1)
+
+        if seasons is None:
+            keep = np.ones(len(semester_numbers), dtype=bool)
+            terms = semester_numbers
+            start_terms = start_semesters
+        else:
+            is_regular, regular_ordinal = _regular_term_lookup(seasons, last_semester_number)
+            keep = is_regular[semester_numbers]
+            terms = regular_ordinal[semester_numbers]
+            unknown_start = start_semesters > last_semester_number
+            known_start_semesters = np.where(unknown_start, 0, start_semesters)
+            # a start semester outside the seasons counts from the next regular term
+            start_terms = regular_ordinal[known_start_semesters] + ~is_regular[known_start_semesters]
+            start_terms[unknown_start] = np.iinfo('int64').max
+        self.start_terms = start_terms
+
+        courses = enrollment_df["course"].values[keep]
+        self.course_names = np.unique(courses)
+        course_codes = np.searchsorted(self.course_names, courses)
+        self.grade_letters = np.unique(enrollment_df["grade_letter"].values)
+        grade_codes = np.searchsorted(self.grade_letters, enrollment_df["grade_letter"].values[keep])
+        student_codes, terms = student_codes[keep], terms[keep]
+
+        order = np.lexsort((terms, student_codes, course_codes))
+        self.course_codes = course_codes[order].astype('int32')
+        self.student_codes = student_codes[order].astype('int32')
+        self.terms = terms[order].astype('int32')
+        self.grade_codes = grade_codes[order].astype('int16')
+        self.course_offsets = np.searchsorted(self.course_codes, np.arange(len(self.course_names) + 1))
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    def postings(self, courses, grades=None, terms=None):
+        """Return the postings of some courses, restricted to some grades and relative terms.
+
+        Args:
+            courses (str or iterable): Course name(s), without spaces (e.g., "MATH110").
+            grades (iterable): If given, only postings with these letter grades are returned.
+            terms (tuple): If given, (first, last) relative terms, inclusive, to which the postings are restricted.
+
+        Returns:
+            A tuple of (student codes, terms, grade codes, course codes) arrays, sorted by student and term.
+
+        """
+
+        course_codes = np.searchsorted(self.course_names, _as_name_list(courses))
+        slices = [slice(self.course_offsets[x], self.course_offsets[x + 1])
+                  for x, name in zip(course_codes, _as_name_list(courses))
+                  if x < len(self.course_names) and self.course_names[x] == name]
+        if len(slices) == 1:
+            selected = np.arange(slices[0].start, slices[0].stop)
+        else:
+            selected = np.concatenate([np.arange(x.start, x.stop) for x in slices] or [np.array([], dtype=int)])
+        if grades is not None:
+            allowed_grades = np.in1d(self.grade_letters, list(grades))
+            selected = selected[allowed_grades[self.grade_codes[selected]]]
+        if terms is not None:
+            relative_terms = self.terms[selected] - self.start_terms[self.student_codes[selected]] + 1
+            selected = selected[(relative_terms >= terms[0]) & (relative_terms <= terms[1])]
+        if len(slices) > 1:
+            selected = selected[np.lexsort((self.terms[selected], self.student_codes[selected]))]
+        return (self.student_codes[selected], self.terms[selected], self.grade_codes[selected],
+                self.course_codes[selected])
+
+    def evaluate(self, predicate):
+        """Evaluate a predicate over all students.
+
+        Args:
+            predicate (Predicate): The predicate to evaluate.
+
+        Returns:
+            A boolean array, aligned with student_ids, that is True for the students satisfying the predicate.
+
+        """
+
+        return predicate.evaluate(self)
+
+    def query(self, predicate):
+        """Return the id's of the students satisfying a predicate.
+
+        Args:
+            predicate (Predicate): The predicate to evaluate.
+
+        Returns:
+            A sorted list of student id's.
+
+        """
+
+        return list(self.student_ids[predicate.evaluate(self)])
+
+    def count(self, predicate):
+        """Return the number of students satisfying a predicate."""
+
+        return int(np.count_nonzero(predicate.evaluate(self)))
+
+
+class Predicate:
+    """This class is the base of all predicates; it combines predicates with &, | and ~."""
+
+    def evaluate(self, index):
+        """Return a boolean array, aligned with index.student_ids, of the students satisfying the predicate."""
+
+        raise NotImplementedError
+
+    def __and__(self, other):
+        return _Combined(np.logical_and, self, other)
+
+    def __or__(self, other):
+        return _Combined(np.logical_or, self, other)
+
+    def __invert__(self):
+        return _Negated(self)
+
+
+class _Combined(Predicate):
+    """Predicate combining two predicates with an element-wise logical operation."""
+
+    def __init__(self, operation, left, right):
+        self.operation = operation
+        self.left = left
+        self.right = right
+
+    def evaluate(self, index):
+        return self.operation(self.left.evaluate(index), self.right.evaluate(index))
+
+
+class _Negated(Predicate):
+    """Predicate satisfied by the students who do not satisfy another predicate."""
+
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def evaluate(self, index):
+        return ~self.predicate.evaluate(index)
+
+
+class Took(Predicate):
+    """Predicate satisfied by students with at least one posting of some courses, grades and relative terms."""
+
+    def __init__(self, courses, grades=None, terms=None):
+        """Instantiate a Took predicate; see took() for the arguments."""
+
+        self.courses = _as_name_list(courses)
+        self.grades = None if grades is None else set(grades)
+        self.terms = terms
+
+    def events(self, index):
+        """Return the (student codes, terms) of the matching postings, sorted by student and term."""
+
+        student_codes, terms, grade_codes, course_codes = index.postings(self.courses, self.grades, self.terms)
+        return student_codes, terms
+
+    def evaluate(self, index):
+        mask = np.zeros(len(index), dtype=bool)
+        mask[self.events(index)[0]] = True
+        return mask
+
+
+class Sequence(Predicate):
+    """Predicate satisfied by students with a posting of one Took predicate followed by a posting of another."""
+
+    def __init__(self, first, second, within=None, min_gap=1):
+        """Instantiate a Sequence predicate; see before() for the arguments."""
+
+        self.first = first
+        self.second = second
+        self.within = within
+        self.min_gap = min_gap
+
+    def evaluate(self, index):
+        first_students, first_terms = self.first.events(index)
+        second_students, second_terms = self.second.events(index)
+        first_keys = first_students.astype('int64') * TERM_KEY_MULTIPLIER + first_terms
+        second_keys = second_students.astype('int64') * TERM_KEY_MULTIPLIER + second_terms
+        # For each posting of the second course, find the latest posting of the first course that is at least
+        #     min_gap terms earlier; it is the one closest in time, so it decides the within condition
+        latest = np.searchsorted(first_keys, second_keys - self.min_gap, side="right") - 1
+        found = latest >= 0
+        latest = np.where(found, latest, 0)
+        found &= len(first_keys) > 0
+        if len(first_keys):
+            found &= first_students[latest] == second_students
+            if self.within is not None:
+                found &= second_terms - first_terms[latest] <= self.within
+        mask = np.zeros(len(index), dtype=bool)
+        mask[second_students[found]] = True
+        return mask
+
+
+class TookAssigned(Predicate):
+    """Predicate satisfied by students who took one of the courses assigned to them individually."""
+
+    def __init__(self, student_courses_dict, grades=None, terms=None):
+        """Instantiate a TookAssigned predicate; see took_assigned() for the arguments."""
+
+        self.student_courses_dict = student_courses_dict
+        self.grades = grades
+        self.terms = terms
+
+    def evaluate(self, index):
+        pairs = [(student_id, each_course) for student_id, courses in self.student_courses_dict.items()
+                 if courses is not None for each_course in _as_name_list(courses)]
+        mask = np.zeros(len(index), dtype=bool)
+        if not pairs:
+            return mask
+        pairs_df = pd.DataFrame(pairs, columns=["student_id", "course"])
+        student_codes = np.searchsorted(index.student_ids, pairs_df["student_id"].values)
+        course_codes = np.searchsorted(index.course_names, pairs_df["course"].values)
+        known = (student_codes < len(index.student_ids)) & (course_codes < len(index.course_names))
+        known[known] &= (index.student_ids[student_codes[known]] == pairs_df["student_id"].values[known]) \
+            & (index.course_names[course_codes[known]] == pairs_df["course"].values[known])
+        assigned_keys = student_codes[known].astype('int64') * len(index.course_names) + course_codes[known]
+        posting_students, posting_terms, posting_grades, posting_courses = \
+            index.postings(pairs_df["course"].unique(), self.grades, self.terms)
+        posting_keys = posting_students.astype('int64') * len(index.course_names) + posting_courses
+        mask[posting_students[np.in1d(posting_keys, assigned_keys)]] = True
+        return mask
+
+
+def took(courses, grades=None, terms=None):
+    """Create a predicate for students who took one of some courses.
+
+    Args:
+        courses (str or iterable): Course name(s), without spaces (e.g., "MATH110" or MATH_COURSES_SET).
+        grades (iterable): If given, only enrollments with these letter grades count.
+        terms (tuple): If given, (first, last) relative terms, inclusive; e.g., (1, 4) is the first year when
+            terms are semester numbers, and (1, 2) when terms are Fall and Spring only.
+
+    Returns:
+        A Took predicate, which can also be used as either argument of before() and after().
+
+    """
+
+    return Took(courses, grades, terms)
+
+
+def passed(courses, terms=None):
+    """Create a predicate for students who passed (see PASSING_GRADES) one of some courses."""
+
+    return Took(courses, PASSING_GRADES, terms)
+
+
+def grade_in(courses, grades, terms=None):
+    """Create a predicate for students who received one of some letter grades in one of some courses."""
+
+    return Took(courses, grades, terms)
+
+
+def before(first, second, within=None):
+    """Create a predicate for students who took a course in a term before the term of another course.
+
+    Args:
+        first (Took): Predicate for the earlier course(s), e.g., took("MATH110").
+        second (Took): Predicate for the later course(s), e.g., passed("MATH226").
+        within (int): If given, the later course is at most this many terms after the earlier one.
+
+    Returns:
+        A Sequence predicate.
+
+    """
+
+    return Sequence(first, second, within)
+
+
+def after(first, second, within=None):
+    """Create a predicate for students who took a course in a term after the term of another course.
+
+    Args:
+        first (Took): Predicate for the later course(s).
+        second (Took): Predicate for the earlier course(s).
+        within (int): If given, the later course is at most this many terms after the earlier one.
+
+    Returns:
+        A Sequence predicate.
+
+    """
+
+    return Sequence(second, first, within)
+
+
+def took_assigned(student_courses_dict, grades=None, terms=None):
+    """Create a predicate for students who took one of the courses assigned to them individually.
+
+    Args:
+        student_courses_dict (dict): Mapping of student id's to course names, or to iterables of course names,
+            e.g., each Metro student's capstone courses (Pathway.cap).
+        grades (iterable): If given, only enrollments with these letter grades count.
+        terms (tuple): If given, (first, last) relative terms, inclusive.
+
+    Returns:
+        A TookAssigned predicate.
+
+    """
+
+    return TookAssigned(student_courses_dict, grades, terms)
@@ -0,0 +1,326 @@
+"""Follow every student's path through remedial and college-level Math, and compare it with Math placement.
+
+A Math trajectory is read from a student's enrollments in the remedial Math courses of MATH_REMEDIATION_COURSES_SET
+and the college-level Math courses of MATH_COURSES_SET (see utilities/other_constants.py; these are the courses
+that Course flags with is_remediation_math_course and is_math_course).  Time is counted in regular terms from the
+start of the student's cohort, as in analysis/metrics.py: term 1 is the Fall of the cohort year, and a summer or
+winter semester counts as the regular term before it.
+
+build_math_trajectories() computes, for every student at once, with one sort and a few bincounts over the Math
+rows of the enrollment DataFrame:
+    remediation: attempts and withdrawals in remedial courses, and the terms of the first attempt and first pass;
+    college-level Math: the first attempt (course, semester, term, and whether it was passed), the attempts and
+        withdrawals (W or WU grades), and the first pass, whose term is the number of terms to completion.  When
+        a student takes several college-level courses in the semester of the first attempt, the first attempt is
+        one that was not passed, if any, so it counts as passed only if all of them were; ties are then broken
+        by course name;
+    terms from remediation: from the first remedial attempt to the first college-level pass;
+    timing: for students whose cohort has a Pathway, the term of its first recommended Math course
+        (Pathway.first_math_course and first_math_semester), the delay of the first attempt past it, and whether
+        college-level Math was passed on time;
+    placement: the ELM and SAT_Math scores, their score bands, and the placement they imply (see PLACEMENTS_LIST):
+        exempt from remediation with an ELM score of at least ELM_EXEMPT_SCORE or a SAT_Math score of at least
+        SAT_MATH_EXEMPT_SCORE, remediation with a lower ELM score, and untested otherwise.
+
+summarize_trajectories() then gives the rates and medians of every group of students (cohort_year by default),
+and compare_placement() gives them for every placement, ELM band and SAT_Math band within each group, so that how
+students actually fared can be read against how they were placed:
+    trajectories_df = build_math_trajectories(contacts_df, enrollment_df)
+    summary_df = summarize_trajectories(trajectories_df, by=["cohort_year", "category"])
+    placement_df = compare_placement(trajectories_df)
+Completion rates by a given term are computed over the students observed for at least that many terms only.
+
+Functions exported by this module include:
+    placement_bands(): the placement and score bands implied by ELM and SAT_Math scores
+    build_math_trajectories(): per-student Math trajectories for the whole population
+    summarize_trajectories(): rates and medians of the trajectories of each group of students
+    compare_placement(): summarize_trajectories() for each placement measure within each group
+
+"""
+
+import numpy as np
+import pandas as pd
+from analysis.cube import MISSING_LABEL
+from analysis.metrics import DEFAULT_SEASONS, _regular_term_lookup, _check_start_terms
+from analysis.survival import DEFAULT_STRATA_COLUMNS
+from utilities.other_constants import MATH_COURSES_SET, MATH_REMEDIATION_COURSES_SET, PASSING_GRADES
+from utilities.semesters import SEMESTER_CALENDAR
+
+WITHDRAWAL_GRADES_SET = {"W", "WU"}
+ELM_EXEMPT_SCORE = 50
+SAT_MATH_EXEMPT_SCORE = 550
+PLACEMENTS_LIST = ["exempt", "remediation", "untested"]
+ELM_BAND_EDGES_LIST = [0, 34, 42, ELM_EXEMPT_SCORE, 81]
+ELM_BAND_LABELS_LIST = ["0-33", "34-41", "42-49", "50-80"]
+SAT_MATH_BAND_EDGES_LIST = [200, 400, 500, SAT_MATH_EXEMPT_SCORE, 801]
+SAT_MATH_BAND_LABELS_LIST = ["200-399", "400-499", "500-549", "550-800"]
+PLACEMENT_MEASURES_LIST = ["placement", "elm_band", "sat_math_band"]
+COMPLETION_HORIZONS_LIST = [2, 4, 6]
+
+
+def placement_bands(elm_scores, sat_math_scores):
+    """Return the placement and score bands implied by ELM and SAT_Math scores.
+
+    Args:
+        elm_scores (Series): ELM scores; missing if the student did not take the ELM.
+        sat_math_scores (Series): SAT Math scores, with the same index.
+
+    Returns:
+        A DataFrame with the same index and the columns placement (one of PLACEMENTS_LIST), elm_band and
+        sat_math_band (labels of ELM_BAND_LABELS_LIST and SAT_MATH_BAND_LABELS_LIST; missing without a score).
+
+    """
+
+    elm = pd.to_numeric(elm_scores, errors="coerce")
+    sat_math = pd.to_numeric(sat_math_scores, errors="coerce")
+    exempt = ((elm >= ELM_EXEMPT_SCORE) | (sat_math >= SAT_MATH_EXEMPT_SCORE)).values
+    remediation = ~exempt & elm.notnull().values
+    bands_df = pd.DataFrame({"placement": np.where(exempt, "exempt", np.where(remediation, "remediation",
+                                                                               "untested"))},
+                            index=elm.index)
+    bands_df["elm_band"] = pd.cut(elm, ELM_BAND_EDGES_LIST, right=False, labels=ELM_BAND_LABELS_LIST)\
+        .astype(object).values
+    bands_df["sat_math_band"] = pd.cut(sat_math, SAT_MATH_BAND_EDGES_LIST, right=False,
+                                       labels=SAT_MATH_BAND_LABELS_LIST).astype(object).values
+    return bands_df
+
+
+def _first_rows(row_positions, selected):
+    """Return, for the selected rows of a sorted array of student positions, the first row of each student.
+
+    Args:
+        row_positions (ndarray): Student position of each row, sorted with ties in the order of the rows.
+        selected (ndarray): Boolean mask of the rows to consider.
+
+    Returns:
+        A tuple of (student positions, row indexes) of the first selected row of each student that has one.
+
+    """
+
+    selected_rows = np.flatnonzero(selected)
+    positions, first_indexes = np.unique(row_positions[selected_rows], return_index=True)
+    return positions, selected_rows[first_indexes]
+
+
+def _recommended_terms(pathways, start_terms, before_start, regular_counts):
+    """Return the first recommended Math course of each student's Pathway and its regular term (NaN if none)."""
+
+    courses = np.array([getattr(x, "first_math_course", None) for x in pathways], dtype=object)
+    semester_offsets = np.array([getattr(x, "first_math_semester", None) for x in pathways], dtype=float)
+    terms = np.full(len(courses), np.nan)
+    known = ~np.isnan(semester_offsets)
+    # Pathway semesters are offsets from the cohort's first semester: 0 is its Fall, 2 the next Spring, and so on
+    recommended_semesters = start_terms[known] + semester_offsets[known].astype(np.int64)
+    terms[known] = regular_counts[np.minimum(recommended_semesters, len(regular_counts) - 1)] - before_start[known]
+    return courses, terms
+
+
+def build_math_trajectories(contacts_df, enrollment_df, last_semester_number=None, seasons=DEFAULT_SEASONS,
+                            attributes=DEFAULT_STRATA_COLUMNS):
+    """Compute the Math trajectory of every student with a cohort year.
+
+    Args:
+        contacts_df (DataFrame): Student attributes, as returned by preprocessing(); must contain student_id and
+            cohort_year.  ELM, SAT_Math and Pathway are used when present.
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        last_semester_number (int): Last observed semester; defaults to the last semester in enrollment_df.
+        seasons (iterable): Seasons that count as regular terms; must include Fall.
+        attributes (iterable): Columns of contacts_df to keep for grouping; those absent are left out.
+
+    Returns:
+        A DataFrame with one row per student: student_id, cohort_year, the attributes, ELM, SAT_Math, the columns
+        of placement_bands(), observed_terms, and the trajectory columns described in the module docstring.
+        Terms are regular terms from the start of the cohort, and are NaN for events that did not happen.
+        Students whose first term is after the last observed semester are left out.
+
+    """
+
+    if "Fall" not in seasons:
+        raise ValueError("build_math_trajectories() requires the Fall season, in which every cohort starts")
+    if last_semester_number is None:
+        last_semester_number = int(enrollment_df["semester_number"].max())
+    columns_list = ["student_id", "cohort_year"] + [x for x in attributes if x in contacts_df.columns
+                                                    and x not in ("student_id", "cohort_year")]
+    source_df = contacts_df[contacts_df["cohort_year"].notnull()].drop_duplicates(subset="student_id")
+    trajectories_df = source_df[columns_list].reset_index(drop=True)
+    for each_column in ["ELM", "SAT_Math"]:
+        trajectories_df[each_column] = pd.to_numeric(source_df[each_column], errors="coerce").values \
+            if each_column in source_df.columns else np.nan
+    placement_df = placement_bands(trajectories_df["ELM"], trajectories_df["SAT_Math"])
+    for each_column in PLACEMENT_MEASURES_LIST:
+        trajectories_df[each_column] = placement_df[each_column].values
+
+    start_terms = SEMESTER_CALENDAR.cohort_start_numbers(trajectories_df["cohort_year"].values).astype(np.int64)
+    _check_start_terms(start_terms, trajectories_df["cohort_year"].values)
+    last_needed = int(max(last_semester_number, start_terms.max() if len(start_terms) else 0,
+                          enrollment_df["semester_number"].max() if len(enrollment_df) else 0)) + 8
+    is_regular, regular_counts = _regular_term_lookup(seasons, last_needed)
+    before_start = regular_counts[start_terms - 1]
+    trajectories_df["observed_terms"] = regular_counts[last_semester_number] - before_start
+
+    # The Math rows of the population, sorted by student, semester, grade (not passed first) and course
+    courses = enrollment_df["course"]
+    is_remedial = courses.isin(MATH_REMEDIATION_COURSES_SET).values
+    is_college = courses.isin(MATH_COURSES_SET).values
+    student_positions = pd.Series(np.arange(len(trajectories_df)), index=trajectories_df["student_id"].values)
+    row_positions = enrollment_df["student_id"].map(student_positions).values
+    math_rows = np.flatnonzero((is_remedial | is_college) & ~np.isnan(row_positions))
+    row_positions = row_positions[math_rows].astype(np.int64)
+    semesters = enrollment_df["semester_number"].values[math_rows].astype(np.int64)
+    course_names = courses.values[math_rows]
+    grade_letters = enrollment_df["grade_letter"].values[math_rows]
+    passed = pd.Series(grade_letters).isin(PASSING_GRADES).values
+    order = np.lexsort((pd.factorize(course_names, sort=True)[0], passed, semesters, row_positions))
+    row_positions, semesters, course_names = row_positions[order], semesters[order], course_names[order]
+    is_remedial, is_college = is_remedial[math_rows][order], is_college[math_rows][order]
+    grade_letters, passed = grade_letters[order], passed[order]
+    withdrawn = pd.Series(grade_letters).isin(WITHDRAWAL_GRADES_SET).values
+    terms = regular_counts[semesters] - before_start[row_positions]
+    n_students = len(trajectories_df)
+
+    def first_term(selected):
+        """The term of the first selected row of each student, NaN for students without one."""
+        values = np.full(n_students, np.nan)
+        positions, rows = _first_rows(row_positions, selected)
+        values[positions] = terms[rows]
+        return values
+
+    trajectories_df["remediation_attempts"] = np.bincount(row_positions[is_remedial], minlength=n_students)
+    trajectories_df["remediation_withdrawals"] = np.bincount(row_positions[is_remedial & withdrawn],
+                                                             minlength=n_students)
+    trajectories_df["first_remediation_term"] = first_term(is_remedial)
+    trajectories_df["remediation_pass_term"] = first_term(is_remedial & passed)
+    trajectories_df["took_remediation"] = trajectories_df["remediation_attempts"].values > 0
+
+    trajectories_df["attempts"] = np.bincount(row_positions[is_college], minlength=n_students)
+    trajectories_df["withdrawals"] = np.bincount(row_positions[is_college & withdrawn], minlength=n_students)
+    for prefix, selected in [("first_attempt", is_college), ("first_pass", is_college & passed)]:
+        positions, rows = _first_rows(row_positions, selected)
+        course_column = np.full(n_students, np.nan, dtype=object)
+        semester_column = np.full(n_students, np.nan)
+        term_column = np.full(n_students, np.nan)
+        course_column[positions] = course_names[rows]
+        semester_column[positions] = semesters[rows]
+        term_column[positions] = terms[rows]
+        trajectories_df[prefix + "_course"] = course_column
+        trajectories_df[prefix + "_semester"] = semester_column
+        trajectories_df[prefix + "_term"] = term_column
+    trajectories_df["completed"] = trajectories_df["first_pass_term"].notnull().values
+    # Passed on the first attempt: the first college-level row itself, which, since rows not passed sort first,
+    #     is passed only if every college-level course of the first semester with one was passed
+    positions, rows = _first_rows(row_positions, is_college)
+    first_attempt_passed = np.zeros(n_students, dtype=bool)
+    first_attempt_passed[positions] = passed[rows]
+    trajectories_df["first_attempt_passed"] = first_attempt_passed
+    trajectories_df["terms_to_completion"] = trajectories_df["first_pass_term"].values
+    trajectories_df["terms_from_remediation"] = (trajectories_df["first_pass_term"] -
+                                                 trajectories_df["first_remediation_term"]).values
+
+    pathways = source_df["Pathway"].values if "Pathway" in source_df.columns else [None] * n_students
+    recommended_courses, recommended_terms = _recommended_terms(pathways, start_terms, before_start, regular_counts)
+    trajectories_df["recommended_course"] = recommended_courses
+    trajectories_df["recommended_term"] = recommended_terms
+    trajectories_df["attempt_delay"] = trajectories_df["first_attempt_term"].values - recommended_terms
+    on_time = pd.Series(trajectories_df["first_pass_term"].values <= recommended_terms, dtype=object)
+    trajectories_df["on_time"] = on_time.where(~np.isnan(recommended_terms), np.nan).values
+    return trajectories_df[trajectories_df["observed_terms"] >= 1].reset_index(drop=True)
+
+
+def _group_keys(trajectories_df, by):
+    """Return the by columns, with missing values labeled and whole-number floats made integers."""
+
+    keys_df = pd.DataFrame(index=trajectories_df.index)
+    for each_column in by:
+        values = trajectories_df[each_column]
+        if values.dtype.kind == 'f' and np.all(np.mod(values.dropna().values, 1) == 0):
+            values = pd.Series([x if np.isnan(x) else int(x) for x in values.values], index=values.index,
+                               dtype=object)
+        keys_df[each_column] = values.astype(object).where(values.notnull(), MISSING_LABEL)
+    return keys_df
+
+
+def summarize_trajectories(trajectories_df, by=("cohort_year",), horizons=COMPLETION_HORIZONS_LIST):
+    """Compute the rates and medians of the Math trajectories of each group of students.
+
+    Args:
+        trajectories_df (DataFrame): Output of build_math_trajectories().
+        by (iterable): Columns of trajectories_df by which to group the students.
+        horizons (iterable): Terms by which to compute completion rates.
+
+    Returns:
+        A DataFrame with the by columns and, for each group: students; took_remediation_rate, attempted_rate and
+        completion_rate over all students; first_attempt_pass_rate and mean_attempts over the students who
+        attempted college-level Math; withdrawal_rate over all attempts; median_terms_to_completion over the
+        students who completed it, and median_terms_from_remediation over those who also took remediation;
+        on_time_rate over the students with a recommended term; and completed_by_term_<n> over the students
+        observed for at least n terms.
+
+    """
+
+    by = list(by)
+    attempted = trajectories_df["attempts"].values > 0
+    completed = trajectories_df["completed"].values
+    observed_terms = trajectories_df["observed_terms"].values
+    has_recommendation = trajectories_df["recommended_term"].notnull().values
+    first_attempt_passed = trajectories_df["first_attempt_passed"].values
+    values_df = pd.DataFrame({
+        "students": 1,
+        "took_remediation": trajectories_df["took_remediation"].values.astype(float),
+        "attempted": attempted.astype(float),
+        "completed": completed.astype(float),
+        "first_attempt_passed": np.where(attempted, first_attempt_passed, np.nan).astype(float),
+        "attempts_of_attempters": np.where(attempted, trajectories_df["attempts"].values, np.nan),
+        "attempts": trajectories_df["attempts"].values,
+        "withdrawals": trajectories_df["withdrawals"].values,
+        "terms_to_completion": trajectories_df["terms_to_completion"].values,
+        "terms_from_remediation": trajectories_df["terms_from_remediation"].values,
+        "on_time": np.where(has_recommendation, trajectories_df["on_time"].values == True, np.nan).astype(float)},
+        index=trajectories_df.index)
+    for each_horizon in horizons:
+        completed_by = completed & (trajectories_df["terms_to_completion"].values <= each_horizon)
+        values_df["completed_by_term_" + str(each_horizon)] = np.where(observed_terms >= each_horizon,
+                                                                        completed_by, np.nan).astype(float)
+    grouped = pd.concat([_group_keys(trajectories_df, by), values_df], axis=1).groupby(by, sort=True)
+
+    summary_df = grouped["students"].sum().to_frame()
+    summary_df["took_remediation_rate"] = grouped["took_remediation"].mean()
+    summary_df["attempted_rate"] = grouped["attempted"].mean()
+    summary_df["completion_rate"] = grouped["completed"].mean()
+    summary_df["first_attempt_pass_rate"] = grouped["first_attempt_passed"].mean()
+    summary_df["mean_attempts"] = grouped["attempts_of_attempters"].mean()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        summary_df["withdrawal_rate"] = grouped["withdrawals"].sum() / grouped["attempts"].sum().replace(0, np.nan)
+    summary_df["median_terms_to_completion"] = grouped["terms_to_completion"].median()
+    summary_df["median_terms_from_remediation"] = grouped["terms_from_remediation"].median()
+    summary_df["on_time_rate"] = grouped["on_time"].mean()
+    for each_horizon in horizons:
+        column = "completed_by_term_" + str(each_horizon)
+        summary_df[column] = grouped[column].mean()
+    return summary_df.reset_index()
+
+
+def compare_placement(trajectories_df, by=("cohort_year",), measures=PLACEMENT_MEASURES_LIST,
+                      horizons=COMPLETION_HORIZONS_LIST):
+    """Summarize the Math trajectories of each placement group within each group of students.
+
+    Args:
+        trajectories_df (DataFrame): Output of build_math_trajectories().
+        by (iterable): Columns of trajectories_df by which to group the students.
+        measures (iterable): Placement columns of trajectories_df, from PLACEMENT_MEASURES_LIST.
+        horizons (iterable): Terms by which to compute completion rates.
+
+    Returns:
+        A long-format DataFrame with the by columns, placement_measure (the name of the measure),
+        placement_value (the placement or score band, MISSING_LABEL for students without a score) and the
+        columns of summarize_trajectories().
+
+    """
+
+    by = list(by)
+    comparisons = []
+    for each_measure in measures:
+        summary_df = summarize_trajectories(trajectories_df, by=by + [each_measure], horizons=horizons)
+        summary_df = summary_df.rename(columns={each_measure: "placement_value"})
+        summary_df.insert(len(by), "placement_measure", each_measure)
+        comparisons.append(summary_df)
+    return pd.concat(comparisons, ignore_index=True)
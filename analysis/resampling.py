@@ -0,0 +1,284 @@
+"""Compare outcomes of two groups of students with bootstrap confidence intervals and permutation tests.
+
+Studies usually compare an outcome (graduation, persistence, core progress, 4th-term completion) between Metro
+and Comparison students, overall and within levels of attributes such as race, gender or Pell eligibility.
+The function compare_outcomes() runs all of these comparisons in one call.  Each comparison (one outcome, one
+attribute level) is a task; tasks run in a process pool, and within a task every resample is drawn at once
+with NumPy:
+    - For outcomes with few distinct values (0/1 flags, core progress), bootstrap resamples are drawn as
+        multinomial counts of each value, and permutations as chains of hypergeometric counts.  These are exactly
+        the distributions of resampling individual students, at a cost independent of the group sizes.
+    - For other outcomes, resampled indices are drawn in batches as matrices, bounded by MAX_BATCH_ELEMENTS.
+
+Every task seeds its own random number generator from the base seed and the task's position, so results are
+reproducible regardless of the number of processes or the order in which tasks finish.
+
+The returned table has one row per comparison, with the raw p-value of the permutation test; pass it to
+format_p_values() to add the rounded p-values and symbols produced by utilities/helpers.py.
+
+Functions exported by this module include:
+    outcome_to_numeric(): convert an outcome column into 0/1 or numeric values
+    bootstrap_difference(): bootstrap confidence interval of a difference in means
+    permutation_test(): two-sided permutation test of a difference in means
+    compare_outcomes(): run both for many outcomes and attribute splits
+    format_p_values(): add rounded p-values and their symbols to a results table
+
+"""
+
+import multiprocessing
+import numpy as np
+import pandas as pd
+from analysis.metrics import convert_to_flags
+from utilities.helpers import round_pv, get_pv_symbol
+
+DEFAULT_OUTCOME_COLUMNS = ["result", "third_persistence", "fifth_persistence", "seventh_persistence",
+                           "core_progress", "fourth_completion"]
+DEFAULT_SPLIT_COLUMNS = ["race", "gender", "pell_eligible", "first_gen", "household_income", "cohort_year"]
+RESULT_SUCCESS_VALUE = "Graduated"
+MAX_BATCH_ELEMENTS = 10 ** 7
+MAX_DISCRETE_LEVELS = 20
+ALL_STUDENTS_LABEL = "All"
+RESULTS_COLUMNS = ["attribute", "level", "outcome", "n_treated", "n_control", "treated_mean", "control_mean",
+                   "difference", "ci_lower", "ci_upper", "p_value"]
+
+
+def outcome_to_numeric(series):
+    """Convert an outcome column into floating-point values suitable for comparing means.
+
+    The result column becomes 1 for "Graduated" and 0 for any other recorded result.  Numeric and boolean
+    columns are converted directly; yes/no style text columns are converted with convert_to_flags().
+
+    Args:
+        series (Series): The outcome column.
+
+    Returns:
+        A Series of floats, with NaN where the outcome is missing.
+
+    """
+
+    if series.name == "result":
+        return (series == RESULT_SUCCESS_VALUE).astype(float).where(series.notnull())
+    if series.dtype == bool:
+        return series.astype(float)
+    numeric = pd.to_numeric(series, errors="coerce")
+    if numeric.notnull().sum() >= series.notnull().sum():
+        return numeric.astype(float)
+    return convert_to_flags(series).astype(float)
+
+
+def _discrete_levels(values):
+    """Return the distinct values and their counts, or None if there are more than MAX_DISCRETE_LEVELS of them."""
+
+    levels, counts = np.unique(values, return_counts=True)
+    if len(levels) > MAX_DISCRETE_LEVELS:
+        return None
+    return levels, counts
+
+
+def _batch_sizes(resamples, row_length):
+    """Split a number of resamples into batches holding at most MAX_BATCH_ELEMENTS drawn values each."""
+
+    batch = max(1, MAX_BATCH_ELEMENTS // max(row_length, 1))
+    return [min(batch, resamples - start) for start in range(0, resamples, batch)]
+
+
+def _bootstrap_means(values, resamples, random_state):
+    """Draw bootstrap means of one group's values.
+
+    Args:
+        values (ndarray): The group's outcome values.
+        resamples (int): Number of bootstrap resamples.
+        random_state (RandomState): Random number generator.
+
+    Returns:
+        An array of resamples bootstrap means.
+
+    """
+
+    discrete = _discrete_levels(values)
+    if discrete is not None:
+        levels, counts = discrete
+        drawn_counts = random_state.multinomial(len(values), counts / float(len(values)), size=resamples)
+        return drawn_counts.dot(levels) / float(len(values))
+    return np.concatenate([values[random_state.randint(0, len(values), size=(size, len(values)))].mean(axis=1)
+                           for size in _batch_sizes(resamples, len(values))])
+
+
+def _permuted_sums(pooled, n_treated, resamples, random_state):
+    """Draw the sum of the treated group's values under random relabelings of the pooled values.
+
+    For discrete values, the number of treated students drawn at each level follows a chain of hypergeometric
+    distributions, which is drawn for all resamples at once.  Otherwise, each relabeling picks the treated
+    students as the n_treated smallest of a row of random keys.
+
+    Args:
+        pooled (ndarray): Outcome values of both groups.
+        n_treated (int): Size of the treated group.
+        resamples (int): Number of random relabelings.
+        random_state (RandomState): Random number generator.
+
+    Returns:
+        An array of resamples sums.
+
+    """
+
+    discrete = _discrete_levels(pooled)
+    if discrete is None:
+        return np.concatenate([
+            pooled[np.argpartition(random_state.rand(size, len(pooled)), n_treated - 1, axis=1)[:, :n_treated]]
+            .sum(axis=1) for size in _batch_sizes(resamples, len(pooled))])
+    levels, counts = discrete
+    sums = np.zeros(resamples)
+    still_to_draw = np.full(resamples, n_treated, dtype=np.int64)
+    remaining_pool = len(pooled)
+    for level, count in zip(levels[:-1], counts[:-1]):
+        remaining_pool -= count
+        drawn = np.zeros(resamples, dtype=np.int64)
+        drawing = still_to_draw > 0
+        if drawing.any():
+            drawn[drawing] = random_state.hypergeometric(count, remaining_pool, still_to_draw[drawing])
+        sums += drawn * level
+        still_to_draw -= drawn
+    return sums + still_to_draw * levels[-1]
+
+
+def bootstrap_difference(treated_values, control_values, resamples=10000, confidence=0.95, random_state=None):
+    """Compute a percentile bootstrap confidence interval for the difference in means (treated - control).
+
+    Args:
+        treated_values (ndarray): Outcome values of the treated group.
+        control_values (ndarray): Outcome values of the control group.
+        resamples (int): Number of bootstrap resamples.
+        confidence (float): Confidence level of the interval.
+        random_state (RandomState): Random number generator; a new unseeded one if None.
+
+    Returns:
+        A tuple of (lower bound, upper bound).
+
+    """
+
+    random_state = np.random.RandomState() if random_state is None else random_state
+    differences = _bootstrap_means(treated_values, resamples, random_state) \
+        - _bootstrap_means(control_values, resamples, random_state)
+    tail = (1.0 - confidence) / 2.0 * 100
+    return tuple(np.percentile(differences, [tail, 100 - tail]))
+
+
+def permutation_test(treated_values, control_values, resamples=10000, random_state=None):
+    """Run a two-sided permutation test of the difference in means (treated - control).
+
+    Args:
+        treated_values (ndarray): Outcome values of the treated group.
+        control_values (ndarray): Outcome values of the control group.
+        resamples (int): Number of random permutations.
+        random_state (RandomState): Random number generator; a new unseeded one if None.
+
+    Returns:
+        The p-value, computed as (1 + permutations at least as extreme as observed) / (1 + resamples).
+
+    """
+
+    random_state = np.random.RandomState() if random_state is None else random_state
+    n_treated, n_control = len(treated_values), len(control_values)
+    pooled = np.concatenate([treated_values, control_values])
+    total = pooled.sum()
+    observed = abs(treated_values.mean() - control_values.mean())
+    treated_sums = _permuted_sums(pooled, n_treated, resamples, random_state)
+    permuted = np.abs(treated_sums / float(n_treated) - (total - treated_sums) / float(n_control))
+    extreme = np.count_nonzero(permuted >= observed - 1e-12)
+    return (extreme + 1.0) / (resamples + 1.0)
+
+
+def _run_comparison(task):
+    """Run the bootstrap and permutation test of one comparison task (executed in a worker process).
+
+    Args:
+        task (tuple): (labels, treated values, control values, resamples, confidence, seed).
+
+    Returns:
+        A tuple holding one row of the results table.
+
+    """
+
+    labels, treated_values, control_values, resamples, confidence, seed = task
+    treated_mean = treated_values.mean() if len(treated_values) else np.nan
+    control_mean = control_values.mean() if len(control_values) else np.nan
+    if len(treated_values) < 2 or len(control_values) < 2:
+        ci_lower, ci_upper, p_value = np.nan, np.nan, np.nan
+    else:
+        random_state = np.random.RandomState(seed)
+        ci_lower, ci_upper = bootstrap_difference(treated_values, control_values, resamples, confidence,
+                                                  random_state)
+        p_value = permutation_test(treated_values, control_values, resamples, random_state)
+    return labels + (len(treated_values), len(control_values), treated_mean, control_mean,
+                     treated_mean - control_mean, ci_lower, ci_upper, p_value)
+
+
+def compare_outcomes(contacts_df, outcome_columns=DEFAULT_OUTCOME_COLUMNS, split_columns=DEFAULT_SPLIT_COLUMNS,
+                     treated_category="Metro", control_categories=("Comp",), resamples=10000,
+                     confidence=0.95, seed=0, processes=None):
+    """Compare outcomes between treated and control students, overall and within each attribute level.
+
+    Args:
+        contacts_df (DataFrame): Student attributes and outcomes, including student_id and category columns.
+        outcome_columns (list): Outcome columns to compare (see outcome_to_numeric() for their conversion).
+        split_columns (list): Attributes whose levels define the subgroups in which to compare outcomes.
+            The whole population is always compared as well, under the attribute and level "All".
+        treated_category (str): Category of the treated students.
+        control_categories (iterable): Categories of the control students.
+        resamples (int): Number of bootstrap resamples and of permutations per comparison.
+        confidence (float): Confidence level of the bootstrap intervals.
+        seed (int): Base seed; each comparison's generator is seeded with (seed, comparison position).
+        processes (int): Number of worker processes; None uses every CPU, and 1 runs in this process.
+
+    Returns:
+        A DataFrame with the columns listed in RESULTS_COLUMNS, one row per outcome and attribute level.
+
+    """
+
+    selected_df = contacts_df[contacts_df["category"].isin([treated_category] + list(control_categories))]
+    treated = (selected_df["category"] == treated_category).values
+    numeric_outcomes_dict = {each_outcome: outcome_to_numeric(selected_df[each_outcome]).values
+                             for each_outcome in outcome_columns}
+    splits = [(ALL_STUDENTS_LABEL, ALL_STUDENTS_LABEL, np.ones(len(selected_df), dtype=bool))]
+    for each_column in split_columns:
+        column_values = selected_df[each_column]
+        for each_level in sorted(column_values.dropna().unique()):
+            splits.append((each_column, each_level, (column_values == each_level).values))
+
+    tasks = []
+    for attribute, level, in_split in splits:
+        for each_outcome in outcome_columns:
+            values = numeric_outcomes_dict[each_outcome]
+            present = in_split & ~np.isnan(values)
+            tasks.append(((attribute, level, each_outcome), values[present & treated], values[present & ~treated],
+                          resamples, confidence, [seed, len(tasks)]))
+    if processes == 1:
+        rows = [_run_comparison(each_task) for each_task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes=processes)
+        try:
+            rows = pool.map(_run_comparison, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    return pd.DataFrame(rows, columns=RESULTS_COLUMNS)
+
+
+def format_p_values(results_df):
+    """Add the rounded p-values and the symbols used to print them to a results table.
+
+    Args:
+        results_df (DataFrame): Output of compare_outcomes().
+
+    Returns:
+        A copy of results_df with p_value_rounded (see round_pv()) and p_symbol (see get_pv_symbol()) columns,
+        which are NaN for comparisons that were too small to test.
+
+    """
+
+    formatted_df = results_df.copy()
+    tested = formatted_df["p_value"].notnull()
+    formatted_df["p_value_rounded"] = formatted_df.loc[tested, "p_value"].map(round_pv)
+    formatted_df["p_symbol"] = formatted_df.loc[tested, "p_value_rounded"].map(get_pv_symbol)
+    return formatted_df
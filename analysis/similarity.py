@@ -0,0 +1,324 @@
+"""Find students with similar course histories using MinHash signatures and locality-sensitive hashing.
+
+A student's course history is represented as a set of tokens:
+    - "courses": the names of the courses the student took;
+    - "sequence": term-ordered shingles, i.e., a token "A>B" for every course A in one of the student's terms and
+        course B in their next term with courses, plus a token "^A" for every course A of their first term.  The
+        terms are those of the student's StudentSequence (see model/student_sequence.py): only terms with courses
+        count, so a skipped semester does not break a shingle.
+Two histories are compared by the Jaccard similarity of their token sets.
+
+Comparing every pair of students is quadratic, so a MinHashIndex summarizes each token set by a signature of
+num_perm minimum hash values, which agree between two students with probability equal to their Jaccard
+similarity.  The signatures are cut into bands, and students whose signatures agree on a whole band land in the
+same bucket; only students sharing a bucket with a query are considered, and these candidates are re-ranked by
+their exact Jaccard similarity.  With the default 32 bands of 4 rows, pairs with a similarity of 0.5 are found
+with probability above 0.85, and pairs with a similarity of 0.8 almost surely.
+
+Usage:
+    index = build_similarity_index(enrollment_df, kind="sequence")
+    index.query("912345678", k=10)                        # the 10 most similar students found
+    index.near_duplicate_groups(threshold=0.8)            # groups of students with near-identical histories
+
+Functions and classes exported by this module include:
+    history_tokens(): token sets of all students in an enrollment DataFrame
+    sequence_shingles(): "sequence" tokens of one StudentSequence
+    build_similarity_index(): build a MinHashIndex from an enrollment DataFrame
+    MinHashIndex: approximate nearest-neighbor queries and near-duplicate grouping
+
+"""
+
+import zlib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+MERSENNE_PRIME = (1 << 31) - 1
+DEFAULT_NUM_PERM = 128
+DEFAULT_BANDS = 32
+MAX_BUCKET_SIZE = 200     # buckets larger than this (e.g., very common histories) are skipped when grouping
+
+
+def _token_hash(token):
+    """Return a stable 31-bit hash of a token string."""
+
+    return (zlib.crc32(token) & 0xffffffff) % MERSENNE_PRIME
+
+
+def history_tokens(enrollment_df, kind="courses"):
+    """Create the token pairs of every student's course history.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        kind (str): "courses" or "sequence" (see the module docstring).
+
+    Returns:
+        A DataFrame with student_id and token columns, one row per distinct (student, token) pair.
+
+    """
+
+    if kind == "courses":
+        tokens_df = enrollment_df[["student_id", "course"]].rename(columns={"course": "token"})
+    elif kind == "sequence":
+        terms_df = enrollment_df[["student_id", "semester_number", "course"]].copy()
+        terms_df["rank"] = terms_df.groupby("student_id")["semester_number"].rank(method="dense").astype(int)
+        first_df = terms_df[terms_df["rank"] == 1]
+        next_df = terms_df[["student_id", "rank", "course"]].copy()
+        next_df["rank"] -= 1
+        pairs_df = terms_df.merge(next_df, on=["student_id", "rank"], suffixes=("", "_next"))
+        tokens_df = pd.concat([pd.DataFrame({"student_id": first_df["student_id"].values,
+                                             "token": "^" + first_df["course"].values.astype(object)}),
+                               pd.DataFrame({"student_id": pairs_df["student_id"].values,
+                                             "token": pairs_df["course"].values.astype(object) + ">"
+                                             + pairs_df["course_next"].values.astype(object)})],
+                              ignore_index=True)
+    else:
+        raise ValueError("Unknown kind of history tokens: " + str(kind))
+    return tokens_df[["student_id", "token"]].drop_duplicates().reset_index(drop=True)
+
+
+def sequence_shingles(student_sequence):
+    """Create the "sequence" tokens of one StudentSequence, e.g., to query the index with a new student.
+
+    Args:
+        student_sequence (StudentSequence): The student's CourseGroups.
+
+    Returns:
+        The set of tokens.
+
+    """
+
+    ordered_groups = [x for x in sorted(student_sequence.course_sequence, key=lambda y: y.semester_number)
+                      if len(x.course_list)]
+    if not ordered_groups:
+        return set()
+    tokens = set("^" + x.course for x in ordered_groups[0].course_list)
+    for this_group, next_group in zip(ordered_groups[:-1], ordered_groups[1:]):
+        tokens.update(x.course + ">" + y.course for x in this_group.course_list for y in next_group.course_list)
+    return tokens
+
+
+class MinHashIndex:
+    """This class holds MinHash signatures, LSH buckets, and exact token sets of a population of students.
+
+    The exact token sets are kept as a sparse student-by-token matrix, used to re-rank candidates.
+
+    """
+
+    def __init__(self, tokens_df, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS, seed=0):
+        """Instantiate a MinHashIndex object.
+
+        Args:
+            tokens_df (DataFrame): Distinct (student_id, token) pairs, as returned by history_tokens().
+            num_perm (int): Number of hash functions in a signature.
+            bands (int): Number of LSH bands; must divide num_perm.  More bands find less similar pairs.
+            seed (int): Seed of the random hash functions.
+
+        """
+
+        if num_perm % bands:
+            raise ValueError("The number of bands must divide the number of hash functions.")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        random_state = np.random.RandomState(seed)
+        self.hash_a = random_state.randint(1, MERSENNE_PRIME, size=num_perm).astype('uint64')
+        self.hash_b = random_state.randint(0, MERSENNE_PRIME, size=num_perm).astype('uint64')
+        self.band_weights = random_state.randint(1, 1 << 62, size=self.rows_per_band).astype('uint64')
+
+        student_codes, self.student_ids = pd.factorize(tokens_df["student_id"].values, sort=True)
+        token_codes, self.tokens = pd.factorize(tokens_df["token"].values, sort=True)
+        self.token_hashes = np.array([_token_hash(x) for x in self.tokens], dtype='uint64')
+        self.token_matrix = sparse.csr_matrix((np.ones(len(student_codes), dtype='float64'),
+                                               (student_codes, token_codes)),
+                                              shape=(len(self.student_ids), len(self.tokens)))
+        self.set_sizes = np.asarray(self.token_matrix.sum(axis=1)).ravel()
+        self.signatures = self._signatures(self.token_matrix.indptr, self.token_hashes[self.token_matrix.indices])
+        self.band_keys = self._band_keys(self.signatures)
+        # For each band, the students sorted by their key in that band
+        self.band_orders = np.argsort(self.band_keys, axis=0, kind="mergesort")
+        self.sorted_band_keys = np.take_along_axis(self.band_keys, self.band_orders, axis=0)
+
+    def _signatures(self, offsets, hashed_tokens):
+        """Compute the MinHash signatures of token sets stored as consecutive runs of hashed tokens.
+
+        Args:
+            offsets (ndarray): Start of each set's run in hashed_tokens, plus the total length.
+            hashed_tokens (ndarray): Token hashes, as uint64.
+
+        Returns:
+            A uint64 array of shape (number of sets, num_perm); empty sets get MERSENNE_PRIME everywhere.
+
+        """
+
+        signatures = np.full((len(offsets) - 1, self.num_perm), MERSENNE_PRIME, dtype='uint64')
+        nonempty = np.flatnonzero(np.diff(offsets) > 0)
+        if len(hashed_tokens) == 0:
+            return signatures
+        for each_perm in range(self.num_perm):
+            values = (self.hash_a[each_perm] * hashed_tokens + self.hash_b[each_perm]) % MERSENNE_PRIME
+            signatures[nonempty, each_perm] = np.minimum.reduceat(values, offsets[nonempty])
+        return signatures
+
+    def _band_keys(self, signatures):
+        """Combine the rows of each band of the signatures into one 64-bit bucket key per band."""
+
+        banded = signatures.reshape(len(signatures), self.bands, self.rows_per_band)
+        return (banded * self.band_weights).sum(axis=2)
+
+    def _student_position(self, student_id):
+        position = np.searchsorted(self.student_ids, student_id)
+        if position >= len(self.student_ids) or self.student_ids[position] != student_id:
+            raise KeyError(student_id)
+        return position
+
+    def candidates(self, band_keys):
+        """Return the positions of the students sharing a bucket, in any band, with the given band keys."""
+
+        found = []
+        for each_band in range(self.bands):
+            keys = self.sorted_band_keys[:, each_band]
+            start = np.searchsorted(keys, band_keys[each_band], side="left")
+            stop = np.searchsorted(keys, band_keys[each_band], side="right")
+            found.append(self.band_orders[start:stop, each_band])
+        return np.unique(np.concatenate(found)) if found else np.array([], dtype=int)
+
+    def query(self, student_or_tokens, k=10, include_self=False):
+        """Find the students whose histories are most similar to a student's, or to a set of tokens.
+
+        Args:
+            student_or_tokens (str or set): A student id in the index, or a set of tokens (e.g., from
+                sequence_shingles()).
+            k (int): Number of students to return.
+            include_self (bool): Keep the queried student in the results.
+
+        Returns:
+            A DataFrame with student_id and jaccard columns, sorted by decreasing exact Jaccard similarity.  It
+            holds fewer than k rows when fewer candidates shared a bucket with the query.
+
+        """
+
+        if isinstance(student_or_tokens, basestring):
+            position = self._student_position(student_or_tokens)
+            band_keys = self.band_keys[position]
+            query_vector = self.token_matrix.getrow(position)
+            query_size = self.set_sizes[position]
+            exclude = None if include_self else position
+        else:
+            query_tokens = sorted(set(student_or_tokens))
+            hashed = np.array([_token_hash(x) for x in query_tokens], dtype='uint64')
+            band_keys = self._band_keys(self._signatures(np.array([0, len(hashed)]), hashed))[0]
+            positions = np.searchsorted(self.tokens, query_tokens)
+            in_range = positions < len(self.tokens)
+            positions = positions[in_range]
+            known = positions[self.tokens[positions] == np.array(query_tokens, dtype=object)[in_range]]
+            query_vector = sparse.csr_matrix((np.ones(len(known)), (np.zeros(len(known), dtype=int), known)),
+                                             shape=(1, len(self.tokens)))
+            query_size = float(len(query_tokens))
+            exclude = None
+        candidate_positions = self.candidates(band_keys)
+        if exclude is not None:
+            candidate_positions = candidate_positions[candidate_positions != exclude]
+        intersections = np.asarray(self.token_matrix[candidate_positions].dot(query_vector.T).todense()).ravel()
+        unions = self.set_sizes[candidate_positions] + query_size - intersections
+        jaccard = np.where(unions > 0, intersections / np.maximum(unions, 1), 0.0)
+        results_df = pd.DataFrame({"student_id": self.student_ids[candidate_positions], "jaccard": jaccard},
+                                  columns=["student_id", "jaccard"])
+        return results_df.sort_values(["jaccard", "student_id"], ascending=[False, True]).head(k)\
+            .reset_index(drop=True)
+
+    def candidate_pairs(self, max_bucket_size=MAX_BUCKET_SIZE):
+        """Return every pair of students sharing a bucket in some band.
+
+        Args:
+            max_bucket_size (int): Buckets holding more students are skipped.
+
+        Returns:
+            An array of shape (number of pairs, 2) of student positions, with the smaller position first.
+
+        """
+
+        pairs = []
+        for each_band in range(self.bands):
+            keys = self.sorted_band_keys[:, each_band]
+            order = self.band_orders[:, each_band]
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            sizes = np.diff(np.r_[starts, len(keys)])
+            # Buckets of the same size are expanded into pairs together
+            for each_size in np.unique(sizes[(sizes > 1) & (sizes <= max_bucket_size)]):
+                members = order[starts[sizes == each_size][:, None] + np.arange(each_size)]
+                first, second = np.triu_indices(each_size, 1)
+                pairs.append(np.stack([members[:, first].ravel(), members[:, second].ravel()], axis=1))
+        if not pairs:
+            return np.zeros((0, 2), dtype=int)
+        pairs = np.sort(np.concatenate(pairs), axis=1)
+        pair_keys = np.unique(pairs[:, 0].astype('int64') * len(self.student_ids) + pairs[:, 1])
+        return np.stack(np.divmod(pair_keys, len(self.student_ids)), axis=1)
+
+    def jaccard_pairs(self, pairs):
+        """Compute the exact Jaccard similarity of pairs of students.
+
+        Args:
+            pairs (ndarray): Array of shape (number of pairs, 2) of student positions.
+
+        Returns:
+            An array of Jaccard similarities.
+
+        """
+
+        if len(pairs) == 0:
+            return np.zeros(0)
+        intersections = np.asarray(self.token_matrix[pairs[:, 0]].multiply(self.token_matrix[pairs[:, 1]])
+                                   .sum(axis=1)).ravel()
+        unions = self.set_sizes[pairs[:, 0]] + self.set_sizes[pairs[:, 1]] - intersections
+        return np.where(unions > 0, intersections / np.maximum(unions, 1), 0.0)
+
+    def near_duplicate_groups(self, threshold=0.8, max_bucket_size=MAX_BUCKET_SIZE):
+        """Group students whose histories are near-duplicates of one another.
+
+        Candidate pairs sharing a bucket are kept if their exact Jaccard similarity reaches the threshold, and
+        groups are the connected components of the kept pairs.
+
+        Args:
+            threshold (float): Minimum Jaccard similarity of a kept pair.
+            max_bucket_size (int): Buckets holding more students are skipped when generating candidates.
+
+        Returns:
+            A DataFrame with student_id and group columns, for the students in groups of two or more, sorted by
+            group; groups are numbered from 0 in order of decreasing size.
+
+        """
+
+        pairs = self.candidate_pairs(max_bucket_size)
+        pairs = pairs[self.jaccard_pairs(pairs) >= threshold]
+        graph = sparse.csr_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+                                  shape=(len(self.student_ids), len(self.student_ids)))
+        n_components, labels = connected_components(graph, directed=False)
+        sizes = np.bincount(labels)
+        grouped = np.flatnonzero(sizes[labels] > 1)
+        # renumber the groups by decreasing size
+        group_order = np.lexsort((np.arange(n_components), -sizes))
+        group_numbers = np.empty(n_components, dtype=int)
+        group_numbers[group_order] = np.arange(n_components)
+        groups_df = pd.DataFrame({"student_id": self.student_ids[grouped], "group": group_numbers[labels[grouped]]},
+                                 columns=["student_id", "group"])
+        return groups_df.sort_values(["group", "student_id"]).reset_index(drop=True)
+
+
+def build_similarity_index(enrollment_df, kind="courses", num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS, seed=0):
+    """Build a MinHashIndex over the course histories of the students in an enrollment DataFrame.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        kind (str): "courses" or "sequence" (see the module docstring).
+        num_perm (int): Number of hash functions in a signature.
+        bands (int): Number of LSH bands; must divide num_perm.
+        seed (int): Seed of the random hash functions.
+
+    Returns:
+        A MinHashIndex.
+
+    """
+
+    return MinHashIndex(history_tokens(enrollment_df, kind), num_perm, bands, seed)
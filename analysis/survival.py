@@ -0,0 +1,288 @@
+"""Estimate time to degree (and time to departure) with Kaplan-Meier curves and hazard tables.
+
+Time is counted in regular terms from the start of a student's cohort, as in analysis/metrics.py: with the default
+seasons, term 1 of a 2012 cohort student is Fall 2012, term 8 is Spring 2016 and term 12 is Spring 2018.  A
+summer or winter semester counts as the regular term before it.
+
+build_event_times() derives, for every student, the time of two events and whether each was observed:
+    graduation: the regular term of graduation_term, the IR degree term.  When it is missing for a graduate, the
+        4th/5th/6th-year graduation flags give the last term by which the student graduated (8, 10 or 12), which
+        is used instead.  Students who have not graduated are censored at the last observed term, or, with
+        censor_at="last_enrollment", at the last term in which they were enrolled.
+    departure: the term after a student's last enrolled term, for students who have not graduated and have not
+        been enrolled for departure_gap regular terms by the last observed term.  Graduates are censored at
+        graduation, and others at the last observed term.
+The last observed term of a student is the regular term of the last semester in the enrollment data.
+
+kaplan_meier() then builds the event table of every stratum at once: the students of all strata are counted into
+one matrix of (stratum, term) cells with a single np.bincount, and the number at risk, the hazard, the survival
+function and its Greenwood confidence interval are cumulative sums and products along the rows of that matrix.
+Every stratification of a refresh (category, category x cohort_year, category x race, ...) costs about as much as
+grouping the students once:
+    times_df = build_event_times(contacts_df, enrollment_df)
+    curves_df = kaplan_meier(times_df, by=["category", "cohort_year"])
+    tables_dict = stratified_tables(times_df, [["category"], ["category", "cohort_year"], ["category", "race"]])
+
+For graduation, 1 - survival is the cumulative graduation rate; median_times() reads the median time to the event
+of each stratum from the curves.
+
+Functions exported by this module include:
+    graduation_semester_numbers(): convert IR degree terms ("2016S", "Spring 2016", "2163") into semester numbers
+    build_event_times(): per-student event and censoring times for graduation and departure
+    kaplan_meier(): Kaplan-Meier curves and hazard tables for every stratum of a grouping
+    stratified_tables(): kaplan_meier() for several groupings
+    median_times(): median time to the event of each stratum
+
+"""
+
+import numpy as np
+import pandas as pd
+from analysis.cube import MISSING_LABEL
+from analysis.metrics import DEFAULT_SEASONS, _regular_term_lookup, _check_start_terms, convert_to_flags
+from utilities.semesters import SEMESTER_CALENDAR
+
+EVENTS_LIST = ["graduation", "departure"]
+DEFAULT_STRATA_COLUMNS = ["category", "cohort_year", "cohort_name", "race", "gender", "pell_eligible", "first_gen",
+                          "household_income"]
+IR_GRADUATION_TERMS_DICT = {
+    "fourth_year_graduated": 8,
+    "fifth_year_graduated": 10,
+    "sixth_year_graduated": 12
+}
+DEFAULT_DEPARTURE_GAP = 2
+CONFIDENCE_Z = 1.959964
+CURVE_COLUMNS_LIST = ["term", "at_risk", "events", "censored", "hazard", "survival", "std_error", "ci_lower",
+                      "ci_upper", "cumulative_incidence"]
+
+
+def graduation_semester_numbers(terms):
+    """Convert degree terms into semester numbers (1 is Fall 2009), all at once.
+
+    The terms are read by SemesterCalendar.to_numbers() of utilities/semesters.py, in any of its spellings:
+    "2016S", "S2016", "Spring 2016" and the CS term code "2163" are all Spring 2016.
+
+    Args:
+        terms (Series): The degree terms.
+
+    Returns:
+        A float Series with the same index, with NaN where a term is missing or not recognized.
+
+    """
+
+    numbers = SEMESTER_CALENDAR.to_numbers(terms, errors="coerce").astype(float)
+    return numbers.where(numbers >= 1)
+
+
+def _last_enrolled_terms(enrollment_df, student_ids, start_terms, regular_counts):
+    """Find the last regular term (1-based, from the cohort start) in which each student is enrolled; 0 if none."""
+
+    student_positions = pd.Series(np.arange(len(student_ids)), index=student_ids)
+    row_positions = enrollment_df["student_id"].map(student_positions).values
+    in_population = ~np.isnan(row_positions)
+    row_positions = row_positions[in_population].astype(np.int64)
+    semesters = enrollment_df["semester_number"].values[in_population]
+    terms = regular_counts[semesters] - regular_counts[start_terms[row_positions] - 1]
+    last_terms = np.zeros(len(student_ids), dtype=np.int64)
+    np.maximum.at(last_terms, row_positions, terms)
+    return last_terms
+
+
+def build_event_times(contacts_df, enrollment_df, last_semester_number=None, seasons=DEFAULT_SEASONS,
+                      censor_at="observation_end", departure_gap=DEFAULT_DEPARTURE_GAP,
+                      attributes=DEFAULT_STRATA_COLUMNS):
+    """Derive each student's event and censoring times for graduation and departure.
+
+    Args:
+        contacts_df (DataFrame): Student attributes, as returned by preprocessing(); must contain student_id and
+            cohort_year.  The IR columns graduated, graduation_term and fourth/fifth/sixth_year_graduated are used
+            when present; students without a cohort year are left out.
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        last_semester_number (int): Last observed semester; defaults to the last semester in enrollment_df.
+        seasons (iterable): Seasons that count as regular terms; must include Fall.
+        censor_at (str): "observation_end" or "last_enrollment": where students who have not graduated are
+            censored for graduation.
+        departure_gap (int): Number of regular terms without enrollment after which a student has departed.
+        attributes (iterable): Columns of contacts_df to keep as strata; those absent are left out.
+
+    Returns:
+        A DataFrame with one row per student: student_id, cohort_year, the attributes, observed_terms (number of
+        regular terms observed), last_enrolled_term (0 if never enrolled), and, for each event of EVENTS_LIST,
+        <event>_time (in regular terms) and <event>_event (True if observed, False if censored).  Students whose
+        first term is after the last observed semester are left out.
+
+    """
+
+    if "Fall" not in seasons:
+        raise ValueError("build_event_times() requires the Fall season, in which every cohort starts")
+    if censor_at not in ("observation_end", "last_enrollment"):
+        raise ValueError("censor_at must be observation_end or last_enrollment, not " + str(censor_at))
+    if last_semester_number is None:
+        last_semester_number = int(enrollment_df["semester_number"].max())
+    columns_list = ["student_id", "cohort_year"] + [x for x in attributes if x in contacts_df.columns
+                                                    and x not in ("student_id", "cohort_year")]
+    source_df = contacts_df[contacts_df["cohort_year"].notnull()].drop_duplicates(subset="student_id")
+    times_df = source_df[columns_list].reset_index(drop=True)
+    start_terms = SEMESTER_CALENDAR.cohort_start_numbers(times_df["cohort_year"].values).astype(np.int64)
+    _check_start_terms(start_terms, times_df["cohort_year"].values)
+
+    graduation_semesters = graduation_semester_numbers(source_df["graduation_term"]).values \
+        if "graduation_term" in source_df.columns else np.full(len(times_df), np.nan)
+    known_semesters = graduation_semesters[~np.isnan(graduation_semesters)]
+    last_needed = int(max(last_semester_number, start_terms.max() if len(start_terms) else 0,
+                          known_semesters.max() if len(known_semesters) else 0,
+                          enrollment_df["semester_number"].max() if len(enrollment_df) else 0))
+    is_regular, regular_counts = _regular_term_lookup(seasons, last_needed)
+    before_start = regular_counts[start_terms - 1]
+    observed_terms = regular_counts[last_semester_number] - before_start
+    last_enrolled_terms = _last_enrolled_terms(enrollment_df, times_df["student_id"].values, start_terms,
+                                               regular_counts)
+
+    # Graduation terms: from the degree term, or else from the latest-term graduation flag that is set
+    graduation_terms = np.full(len(times_df), np.nan)
+    has_semester = ~np.isnan(graduation_semesters)
+    graduation_terms[has_semester] = regular_counts[graduation_semesters[has_semester].astype(np.int64)] - \
+        before_start[has_semester]
+    for field, term in sorted(IR_GRADUATION_TERMS_DICT.items(), key=lambda x: -x[1]):
+        if field in source_df.columns:
+            flagged = (convert_to_flags(source_df[field]) == True).values
+            graduation_terms = np.where(flagged & has_semester, graduation_terms,
+                                        np.where(flagged, term, graduation_terms))
+    graduated = ~np.isnan(graduation_terms)
+    if "graduated" in source_df.columns:
+        degree_counts = pd.to_numeric(source_df["graduated"], errors="coerce").fillna(0).values
+        graduated |= degree_counts > 0
+    graduation_terms = np.where(graduated & np.isnan(graduation_terms), observed_terms, graduation_terms)
+    graduated &= graduation_terms <= observed_terms
+    graduation_terms = np.maximum(graduation_terms, 1)
+
+    censoring_terms = observed_terms if censor_at == "observation_end" else last_enrolled_terms
+    times_df["observed_terms"] = observed_terms
+    times_df["last_enrolled_term"] = last_enrolled_terms
+    times_df["graduation_time"] = np.where(graduated, graduation_terms, censoring_terms).astype(np.int64)
+    times_df["graduation_event"] = graduated
+    departed = ~graduated & (last_enrolled_terms + departure_gap <= observed_terms)
+    times_df["departure_time"] = np.where(departed, last_enrolled_terms + 1,
+                                          np.where(graduated, graduation_terms, observed_terms)).astype(np.int64)
+    times_df["departure_event"] = departed
+    return times_df[observed_terms >= 1].reset_index(drop=True)
+
+
+def _strata_codes(times_df, by):
+    """Number the strata of the by columns, labeling missing values; return (codes, DataFrame of strata keys)."""
+
+    if not by:
+        return np.zeros(len(times_df), dtype=np.int64), pd.DataFrame(index=[0])
+    keys_df = pd.DataFrame(index=np.arange(len(times_df)))
+    for each_column in by:
+        values = times_df[each_column].values
+        if values.dtype.kind == 'f' and np.all(np.mod(values[~np.isnan(values)], 1) == 0):
+            values = [x if np.isnan(x) else int(x) for x in values]
+        keys_df[each_column] = pd.Series(values, dtype=object).where(pd.notnull(values), MISSING_LABEL).values
+    grouped = keys_df.groupby(by, sort=True)
+    codes = grouped.ngroup().values.astype(np.int64)
+    strata_df = grouped.size().reset_index()[by]
+    return codes, strata_df
+
+
+def kaplan_meier(times_df, by=(), event="graduation", max_terms=None):
+    """Compute Kaplan-Meier curves and hazard tables for every stratum of the by columns at once.
+
+    Args:
+        times_df (DataFrame): Event times from build_event_times().
+        by (iterable): Columns of times_df that define the strata; with none, all students form one stratum.
+        event (str): One of EVENTS_LIST.
+        max_terms (int): Last term of the tables; defaults to the largest event or censoring time.
+
+    Returns:
+        A long-format DataFrame with the by columns and, for each stratum and term with students at risk, the
+        columns of CURVE_COLUMNS_LIST: the number at risk at the start of the term, the events and censored
+        students in the term, the hazard (events / at risk), the survival function after the term, its
+        Greenwood standard error and log-log 95% confidence interval, and the cumulative incidence
+        (1 - survival: for graduation, the cumulative graduation rate).
+
+    """
+
+    if event not in EVENTS_LIST:
+        raise ValueError("Unknown event " + str(event) + "; expected one of " + ", ".join(EVENTS_LIST))
+    by = list(by)
+    codes, strata_df = _strata_codes(times_df, by)
+    times = times_df[event + "_time"].values.astype(np.int64)
+    events = times_df[event + "_event"].values.astype(bool)
+    if max_terms is None:
+        max_terms = int(times.max()) if len(times) else 0
+    times = np.minimum(times, max_terms + 1)
+    width = max_terms + 2       # terms 0..max_terms, and one column for those still at risk after max_terms
+
+    # One cell per (stratum, term): exits are events and censored students, both leaving the risk set
+    cells = codes * width + times
+    size = len(strata_df) * width
+    exits = np.bincount(cells, minlength=size).reshape(-1, width)
+    event_counts = np.bincount(cells[events], minlength=size).reshape(-1, width)
+    event_counts[:, -1] = 0
+    at_risk = exits.sum(axis=1)[:, None] - (np.cumsum(exits, axis=1) - exits)
+    exits, event_counts, at_risk = exits[:, 1:-1], event_counts[:, 1:-1], at_risk[:, 1:-1]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hazard = np.where(at_risk > 0, event_counts / at_risk.astype(float), 0.0)
+        survival = np.cumprod(1 - hazard, axis=1)
+        greenwood = np.cumsum(np.where(at_risk > event_counts,
+                                       event_counts / (at_risk * (at_risk - event_counts).astype(float)), 0.0),
+                              axis=1)
+        std_error = survival * np.sqrt(greenwood)
+        log_survival = np.log(survival)
+        spread = CONFIDENCE_Z * np.sqrt(greenwood) / np.abs(log_survival)
+        ci_lower = np.where(log_survival < 0, survival ** np.exp(spread), np.nan)
+        ci_upper = np.where(log_survival < 0, survival ** np.exp(-spread), np.nan)
+    ci_lower = np.where(survival == 1, 1.0, np.where(survival == 0, 0.0, ci_lower))
+    ci_upper = np.where(survival == 1, 1.0, np.where(survival == 0, 0.0, ci_upper))
+
+    terms = np.arange(1, max_terms + 1)
+    curves_df = strata_df.loc[np.repeat(np.arange(len(strata_df)), max_terms)].reset_index(drop=True)
+    columns_dict = {"term": np.tile(terms, len(strata_df)), "at_risk": at_risk.ravel(),
+                    "events": event_counts.ravel(), "censored": (exits - event_counts).ravel(),
+                    "hazard": hazard.ravel(), "survival": survival.ravel(), "std_error": std_error.ravel(),
+                    "ci_lower": ci_lower.ravel(), "ci_upper": ci_upper.ravel(),
+                    "cumulative_incidence": 1 - survival.ravel()}
+    for each_column in CURVE_COLUMNS_LIST:
+        curves_df[each_column] = columns_dict[each_column]
+    return curves_df[curves_df["at_risk"] > 0].reset_index(drop=True)[by + CURVE_COLUMNS_LIST]
+
+
+def stratified_tables(times_df, groupings, event="graduation", max_terms=None):
+    """Compute kaplan_meier() for each of several groupings, over a common range of terms.
+
+    Args:
+        times_df (DataFrame): Event times from build_event_times().
+        groupings (iterable): Lists of by columns, e.g., [["category"], ["category", "cohort_year"]].
+        event (str): One of EVENTS_LIST.
+        max_terms (int): Last term of the tables; defaults to the largest event or censoring time.
+
+    Returns:
+        A dictionary mapping the tuple of by columns of each grouping to its curves.
+
+    """
+
+    if max_terms is None and len(times_df):
+        max_terms = int(times_df[event + "_time"].max())
+    return {tuple(x): kaplan_meier(times_df, by=x, event=event, max_terms=max_terms) for x in groupings}
+
+
+def median_times(curves_df, by=()):
+    """Find the median time to the event of each stratum: the first term at which survival is 0.5 or less.
+
+    Args:
+        curves_df (DataFrame): Curves from kaplan_meier().
+        by (iterable): The by columns of the curves.
+
+    Returns:
+        A DataFrame with the by columns and median_term, NaN for strata whose survival stays above 0.5.
+
+    """
+
+    by = list(by)
+    reached = curves_df[curves_df["survival"] <= 0.5]
+    if by:
+        medians = reached.groupby(by)["term"].min()
+        strata_df = curves_df[by].drop_duplicates().set_index(by)
+        return strata_df.assign(median_term=medians.reindex(strata_df.index).values).reset_index()
+    return pd.DataFrame({"median_term": [reached["term"].min() if len(reached) else np.nan]})
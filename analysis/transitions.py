@@ -0,0 +1,247 @@
+"""Build course-by-course co-enrollment and transition matrices.
+
+Two questions come up in curriculum design: which courses do students take together in the same term, and which
+courses do students take in the term after a given course.  Both are answered by sparse course-by-course count
+matrices, built from the long-format enrollment DataFrame of utilities/enrollment.py:
+    - co_enrollment_matrix(): entry (a, b) is the number of student-terms with both a and b (the diagonal is
+        the number of student-terms with a);
+    - transition_matrix(): entry (a, b) is the number of times a student took a in one term and b in the next.
+
+Both come from one sparse incidence matrix X, with a row per student-term and a column per course.  The
+co-enrollment matrix is the product X'X, and the transition matrix is the product X[t]'X[t+1] of the rows of
+consecutive terms of the same student, which are paired with one sorted search.  By default consecutive terms
+are consecutive semester numbers; with seasons (as in the seasons argument of create_spmf_input_file() in
+utilities/spmf_tools.py), only terms in those seasons are kept and, e.g., with ["Fall", "Spring"], a spring term
+follows the preceding fall term.
+
+Every builder takes contacts_df and a where dictionary (e.g., {"category": "Metro", "cohort_year": [2012]}) to
+restrict the students; course_matrices_by() builds one matrix per cohort, category or other attribute.  All
+matrices built from the same enrollment DataFrame share its course list, so they can be compared entry by entry.
+
+Functions and classes exported by this module include:
+    CourseMatrix: a sparse course-by-course count matrix with its course names
+    co_enrollment_matrix(): courses taken together in a term
+    transition_matrix(): courses taken in consecutive terms
+    course_matrices_by(): one matrix per level of an attribute
+
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from analysis.metrics import _regular_term_lookup
+from utilities.other_constants import PASSING_GRADES
+
+TERM_KEY_MULTIPLIER = 1 << 20   # larger than any term number; combines (student, term) into one sortable key
+
+
+class CourseMatrix:
+    """This class holds a sparse course-by-course count matrix.
+
+    The base array holds, for each row course, the number of opportunities it had: the number of student-terms
+    with the course (co-enrollment), or the number of those that were followed by a term (transitions).  Dividing
+    a row by its base gives the share of students who also (or next) took each column course.
+
+    """
+
+    def __init__(self, matrix, course_names, base, kind):
+        """Instantiate a CourseMatrix object.
+
+        Args:
+            matrix (csr_matrix): Square matrix of counts, with rows and columns in the order of course_names.
+            course_names (ndarray): Sorted course names.
+            base (ndarray): Number of opportunities of each row course.
+            kind (str): "co_enrollment" or "transition".
+
+        """
+
+        self.matrix = matrix
+        self.course_names = course_names
+        self.base = base
+        self.kind = kind
+
+    def course_index(self, course_name):
+        """Return the row and column position of a course, or raise KeyError if the course is unknown."""
+
+        position = np.searchsorted(self.course_names, course_name)
+        if position >= len(self.course_names) or self.course_names[position] != course_name:
+            raise KeyError(course_name)
+        return position
+
+    def conditional(self):
+        """Return the matrix with each row divided by its base, as a sparse matrix of shares."""
+
+        inverse_base = np.where(self.base > 0, 1.0 / np.maximum(self.base, 1), 0.0)
+        return sparse.diags(inverse_base).dot(self.matrix).tocsr()
+
+    def to_df(self, min_count=1, include_diagonal=False):
+        """Create a long-format DataFrame of the nonzero entries.
+
+        Args:
+            min_count (int): Leave out entries with fewer counts.
+            include_diagonal (bool): Keep the entries of a course with itself.
+
+        Returns:
+            A DataFrame with the columns course_a, course_b, count, base (of course_a) and share, sorted by
+            decreasing count.
+
+        """
+
+        coordinates = self.matrix.tocoo()
+        keep = coordinates.data >= min_count
+        if not include_diagonal:
+            keep &= coordinates.row != coordinates.col
+        rows, columns, counts = coordinates.row[keep], coordinates.col[keep], coordinates.data[keep]
+        entries_df = pd.DataFrame({"course_a": self.course_names[rows],
+                                   "course_b": self.course_names[columns],
+                                   "count": counts,
+                                   "base": self.base[rows]},
+                                  columns=["course_a", "course_b", "count", "base"])
+        entries_df["share"] = entries_df["count"] / entries_df["base"].astype(float)
+        return entries_df.sort_values(["count", "course_a", "course_b"], ascending=[False, True, True])\
+            .reset_index(drop=True)
+
+    def top(self, course_name, n=10):
+        """Return the n courses most often taken with (or after) a course.
+
+        Args:
+            course_name (str): The course, without spaces (e.g., "MATH110").
+            n (int): Number of courses to return.
+
+        Returns:
+            A DataFrame with the columns course, count and share, sorted by decreasing count.
+
+        """
+
+        position = self.course_index(course_name)
+        row = self.matrix.getrow(position).tocoo()
+        keep = row.col != position if self.kind == "co_enrollment" else np.ones(len(row.col), dtype=bool)
+        top_df = pd.DataFrame({"course": self.course_names[row.col[keep]], "count": row.data[keep]},
+                              columns=["course", "count"])
+        top_df["share"] = top_df["count"] / float(max(self.base[position], 1))
+        return top_df.sort_values(["count", "course"], ascending=[False, True]).head(n).reset_index(drop=True)
+
+
+def _select_students(enrollment_df, contacts_df, where):
+    """Return the rows of enrollment_df whose students match the where dictionary of contacts_df columns."""
+
+    if not where:
+        return enrollment_df
+    if contacts_df is None:
+        raise ValueError("Selecting students with where requires contacts_df.")
+    selected_df = contacts_df
+    for each_column, values in where.items():
+        values = list(values) if isinstance(values, (list, tuple, set)) else [values]
+        selected_df = selected_df[selected_df[each_column].isin(values)]
+    return enrollment_df[enrollment_df["student_id"].isin(selected_df["student_id"].values)]
+
+
+def _incidence(enrollment_df, course_names, seasons, passing_only):
+    """Build the student-term by course incidence matrix.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data, already restricted to the selected students.
+        course_names (ndarray): Sorted course names that define the columns.
+        seasons (iterable): If given, keep only terms in these seasons and number them as regular terms.
+        passing_only (bool): Keep only courses with a grade in PASSING_GRADES.
+
+    Returns:
+        A tuple of (csr_matrix with one row per student-term, int64 array of the (student, term) key of each row).
+
+    """
+
+    rows_df = enrollment_df
+    if passing_only:
+        rows_df = rows_df[rows_df["grade_letter"].isin(PASSING_GRADES)]
+    semester_numbers = rows_df["semester_number"].values.astype('int64')
+    terms = semester_numbers
+    keep = np.ones(len(rows_df), dtype=bool)
+    if seasons is not None and len(semester_numbers):
+        is_regular, regular_ordinal = _regular_term_lookup(seasons, int(semester_numbers.max()))
+        keep = is_regular[semester_numbers]
+        terms = regular_ordinal[semester_numbers]
+    student_codes = pd.factorize(rows_df["student_id"].values[keep], sort=True)[0].astype('int64')
+    keys = student_codes * TERM_KEY_MULTIPLIER + terms[keep]
+    row_keys, row_positions = np.unique(keys, return_inverse=True)
+    column_positions = np.searchsorted(course_names, rows_df["course"].values[keep])
+    incidence = sparse.csr_matrix((np.ones(len(row_positions), dtype='int32'), (row_positions, column_positions)),
+                                  shape=(len(row_keys), len(course_names)))
+    # a course listed twice in a student-term counts once
+    incidence.data[:] = 1
+    return incidence, row_keys
+
+
+def co_enrollment_matrix(enrollment_df, contacts_df=None, where=None, seasons=None, passing_only=False):
+    """Count, for every pair of courses, the student-terms in which both were taken.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        contacts_df (DataFrame): Student attributes, required if where is given.
+        where (dict): Mapping of contacts_df columns to a value, or a list of values, that students must have.
+        seasons (iterable): If given, only terms in these seasons are counted.
+        passing_only (bool): Count a course only if the student passed it.
+
+    Returns:
+        A CourseMatrix of kind "co_enrollment".
+
+    """
+
+    course_names = np.unique(enrollment_df["course"].values)
+    incidence, row_keys = _incidence(_select_students(enrollment_df, contacts_df, where), course_names, seasons,
+                                     passing_only)
+    matrix = incidence.T.dot(incidence).tocsr()
+    return CourseMatrix(matrix, course_names, np.asarray(matrix.diagonal()), "co_enrollment")
+
+
+def transition_matrix(enrollment_df, contacts_df=None, where=None, seasons=None, step=1, passing_only=False):
+    """Count, for every pair of courses (a, b), the times a student took a in a term and b step terms later.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        contacts_df (DataFrame): Student attributes, required if where is given.
+        where (dict): Mapping of contacts_df columns to a value, or a list of values, that students must have.
+        seasons (iterable): If given, only terms in these seasons are kept, and terms are consecutive when they
+            are consecutive among those seasons (e.g., Fall 2012 and Spring 2013 for ["Fall", "Spring"]).
+        step (int): Number of terms between the two courses.
+        passing_only (bool): Count a course only if the student passed it.
+
+    Returns:
+        A CourseMatrix of kind "transition"; its base counts the student-terms with course a that were followed,
+        step terms later, by a term with one or more courses.
+
+    """
+
+    course_names = np.unique(enrollment_df["course"].values)
+    incidence, row_keys = _incidence(_select_students(enrollment_df, contacts_df, where), course_names, seasons,
+                                     passing_only)
+    next_positions = np.searchsorted(row_keys, row_keys + step)
+    found = next_positions < len(row_keys)
+    found[found] = row_keys[next_positions[found]] == row_keys[found] + step
+    source = incidence[np.flatnonzero(found)]
+    matrix = source.T.dot(incidence[next_positions[found]]).tocsr()
+    return CourseMatrix(matrix, course_names, np.asarray(source.sum(axis=0)).ravel(), "transition")
+
+
+def course_matrices_by(enrollment_df, contacts_df, by="cohort_year", kind="transition", **kwargs):
+    """Build one matrix for each level of a contacts_df attribute.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data (see utilities/enrollment.py).
+        contacts_df (DataFrame): Student attributes.
+        by (str): The attribute, e.g., "cohort_year" or "category".
+        kind (str): "transition" or "co_enrollment".
+        **kwargs: Other arguments of transition_matrix() or co_enrollment_matrix(), including a where
+            dictionary to restrict the students further.
+
+    Returns:
+        Dictionary mapping each level of the attribute to a CourseMatrix.
+
+    """
+
+    builder = transition_matrix if kind == "transition" else co_enrollment_matrix
+    where = dict(kwargs.pop("where", None) or {})
+    matrices_dict = dict()
+    for each_level in sorted(contacts_df[by].dropna().unique()):
+        where[by] = each_level
+        matrices_dict[each_level] = builder(enrollment_df, contacts_df, where=where, **kwargs)
+    return matrices_dict
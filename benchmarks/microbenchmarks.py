@@ -0,0 +1,476 @@
+"""Time the hot functions of the model and utilities, keep the timings as baselines, and compare runs with them.
+
+run_benchmarks.py measures whole pipeline stages once each, which shows where the time goes but cannot tell
+whether a change to one function made it a few percent faster or slower.  This module times each benchmark many
+times instead, and keeps every sample, so that two runs can be compared with a statistical test:
+    micro benchmarks time one call of a hot function on a small, fixed input built from a seeded random state:
+        course_group_add_course: CourseGroup.add_Course() of a semester's courses, repeated course included
+        course_group_to_spmf_string, course_group_to_spmf_string_passing: CourseGroup.to_spmf_string()
+        pathway_progress, pathway_progress_passing: Pathway.compute_pathway_progress() of an 8-semester record
+        csv_read_csv: Csv.read_csv() of a 2000-row file
+        sequence_semester_lengths: determine_sequence_semester_lengths() over a 2000-line SPMF input file
+    scenario benchmarks time a mid-size step on a synthetic data directory (see synthetic_data.py) of
+    scenario_students students, generated once per run; the preprocessing they need is done once, untimed:
+        scenario_preprocessing_metro_comp: preprocessing(metro_comp=True)
+        scenario_enrollment_df: build_enrollment_df() of the records of every student
+        scenario_spmf_input: create_spmf_input_file() for the Comparison students
+        scenario_sequence_spans: determine_sequence_semester_lengths() over that file
+
+Each sample times enough calls (loops) to last at least MIN_SAMPLE_SECONDS, and is kept as seconds per call.  A
+run is saved as a baseline JSON file with BASELINE_SCHEMA_VERSION, the git commit, the versions of Python,
+NumPy and pandas, and the samples of every benchmark; by default in BASELINES_DIR, named after the commit.
+compare_results() then tests, for each benchmark, whether the current samples are larger than the baseline
+samples with a one-sided Mann-Whitney U test, and flags a regression when the test is significant at alpha and
+the median time grew by more than threshold; improvements are flagged the same way.  Baselines are only
+comparable on the same machine, so the versions and platform of the two runs are printed with the comparison.
+
+The scenario benchmarks point METRO_DATA_DIR at the synthetic data, so, as in run_benchmarks.py, this module
+imports nothing from the project at load time, and run_suite() must run before configuration.py is imported.
+
+Usage:
+    python -m benchmarks.microbenchmarks run --save
+    python -m benchmarks.microbenchmarks run --group micro --compare benchmarks/baselines/1a2b3c4.json
+    python -m benchmarks.microbenchmarks compare benchmarks/baselines/1a2b3c4.json benchmarks/baselines/5d6e7f8.json
+
+Functions exported by this module include:
+    run_suite(): time the benchmarks and return the results with their metadata
+    save_results(), load_results(): write and read a baseline JSON file
+    compare_results(): flag the benchmarks that are significantly slower (or faster) than in a baseline
+    format_comparison(): the comparison as a table
+
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import numpy as np
+from scipy import stats
+
+BASELINE_SCHEMA_VERSION = 1
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+GROUPS_LIST = ["micro", "scenario"]
+MIN_SAMPLE_SECONDS = 0.05
+DEFAULT_REPEATS_DICT = {"micro": 20, "scenario": 5}
+DEFAULT_SCENARIO_STUDENTS = 5000
+DEFAULT_ALPHA = 0.01
+DEFAULT_THRESHOLD = 0.05
+FIXTURE_ROWS = 2000
+FIXTURE_COURSES_LIST = ["MATH110", "MATH125", "MATH150", "ENG114", "BIO100", "PSY200", "HIST120", "SOC110",
+                        "CHEM115", "COMM150", "ECON101", "HED210"]
+FIXTURE_GRADES_LIST = ["A", "A-", "B+", "B", "C", "D", "F", "W", "CR"]
+
+
+def _fixture_courses(random_state, n_courses, semester_number=1):
+    """Create Course objects of distinct courses with random grades."""
+
+    from model.course import Course
+    from utilities.other_constants import GRADE_POINT_DICT
+    names = random_state.choice(FIXTURE_COURSES_LIST, n_courses, replace=False)
+    letters = random_state.choice(FIXTURE_GRADES_LIST, n_courses)
+    return [Course(semester_number, x, GRADE_POINT_DICT.get(y), y, "900000001") for x, y in zip(names, letters)]
+
+
+def _fixture_record(random_state, n_semesters=8, n_courses=4):
+    """Create a term_CourseGroup_dict of the Fall and Spring semesters of a student's first years."""
+
+    from model.course_group import CourseGroup
+    record_dict = dict()
+    for semester_number in [1 + 4 * (x // 2) + 2 * (x % 2) for x in range(n_semesters)]:
+        record_dict[semester_number] = CourseGroup(semester_number=semester_number, student_id="900000001")
+        for each_Course in _fixture_courses(random_state, n_courses, semester_number):
+            record_dict[semester_number].add_Course(each_Course)
+    return record_dict
+
+
+def _write_spmf_fixture(path, random_state, n_lines=FIXTURE_ROWS):
+    """Write an SPMF input file of n_lines random 8-semester sequences."""
+
+    with open(path, "w") as spmf_file:
+        for _ in range(n_lines):
+            record_dict = _fixture_record(random_state)
+            spmf_file.write("".join(record_dict[x].to_spmf_string() for x in sorted(record_dict)) + "-2\n")
+    return path
+
+
+def _setup_add_course(context):
+    from model.course_group import CourseGroup
+    courses_list = _fixture_courses(context["random_state"], 5)
+    courses_list.append(courses_list[2])
+
+    def work():
+        course_group = CourseGroup(semester_number=1, student_id="900000001")
+        for each_Course in courses_list:
+            course_group.add_Course(each_Course)
+    return work
+
+
+def _setup_to_spmf_string(context, passing_only=False):
+    course_group = _fixture_record(context["random_state"], n_semesters=1, n_courses=5)[1]
+    return lambda: course_group.to_spmf_string(passing_only=passing_only)
+
+
+def _setup_pathway_progress(context, passing_only=False):
+    from model.pathway import Pathway
+    pathway = Pathway(name="STEM-2012", first_exp={"ENG114"}, second_exp={"BIO100", "CHEM115"}, cap={"HED210"},
+                      semester_courses_dict={0: ["MATH110"], 2: ["MATH125"], 4: ["MATH150"], 6: [""]})
+    record_dict = _fixture_record(context["random_state"])
+    return lambda: pathway.compute_pathway_progress(record_dict, passing_only=passing_only)
+
+
+def _setup_read_csv(context):
+    from utilities.tables import Csv
+    path = os.path.join(context["work_dir"], "fixture.csv")
+    random_state = context["random_state"]
+    with open(path, "w") as csv_file:
+        csv_file.write(",".join("column_" + str(x) for x in range(10)) + "\n")
+        for _ in range(FIXTURE_ROWS):
+            csv_file.write(",".join(str(x) for x in random_state.randint(0, 100000, 10)) + "\n")
+    csv_object = Csv(path)
+    return csv_object.read_csv
+
+
+def _setup_sequence_lengths(context):
+    from utilities.spmf_tools import determine_sequence_semester_lengths
+    path = _write_spmf_fixture(os.path.join(context["work_dir"], "fixture_spmf.txt"), context["random_state"])
+    return lambda: determine_sequence_semester_lengths(["MATH110", "MATH125", "MATH150"], path)
+
+
+def _preprocessed(context):
+    """Return the outputs of preprocessing(metro_comp=True) on the scenario data, computed once per run."""
+
+    if "preprocessed" not in context:
+        from processing import preprocessing
+        context["preprocessed"] = preprocessing(metro_comp=True)
+    return context["preprocessed"]
+
+
+def _setup_scenario_preprocessing(context):
+    from processing import preprocessing
+    return lambda: preprocessing(metro_comp=True)
+
+
+def _setup_scenario_enrollment_df(context):
+    from utilities.enrollment import build_enrollment_df
+    student_record_dict = _preprocessed(context)[1]
+    return lambda: build_enrollment_df(student_record_dict)
+
+
+def _spmf_scenario_path(context):
+    return os.path.join(context["work_dir"], "scenario_spmf.txt")
+
+
+def _setup_scenario_spmf_input(context):
+    from utilities.spmf_tools import create_spmf_input_file
+    contacts_df, student_record_dict, roster_dict = _preprocessed(context)
+    # An absolute file name makes create_spmf_input_file() write into the work directory, not SPMF_DIR
+    return lambda: create_spmf_input_file(contacts_df=contacts_df, student_records_dict=student_record_dict,
+                                          cohort_years=list(range(2009, 2017)), passing_only=False,
+                                          seasons=["Fall", "Spring", "Summer"],
+                                          spmf_input_file_name=_spmf_scenario_path(context), capture_gaps=True,
+                                          comp_only=True)
+
+
+def _setup_scenario_sequence_spans(context):
+    from utilities.spmf_tools import determine_sequence_semester_lengths
+    if not os.path.exists(_spmf_scenario_path(context)):
+        _setup_scenario_spmf_input(context)()
+    return lambda: determine_sequence_semester_lengths(["MATH110", "MATH125", "MATH150"],
+                                                       _spmf_scenario_path(context))
+
+
+BENCHMARKS_DICT = {
+    "course_group_add_course": ("micro", _setup_add_course),
+    "course_group_to_spmf_string": ("micro", _setup_to_spmf_string),
+    "course_group_to_spmf_string_passing": ("micro", lambda x: _setup_to_spmf_string(x, passing_only=True)),
+    "pathway_progress": ("micro", _setup_pathway_progress),
+    "pathway_progress_passing": ("micro", lambda x: _setup_pathway_progress(x, passing_only=True)),
+    "csv_read_csv": ("micro", _setup_read_csv),
+    "sequence_semester_lengths": ("micro", _setup_sequence_lengths),
+    "scenario_preprocessing_metro_comp": ("scenario", _setup_scenario_preprocessing),
+    "scenario_enrollment_df": ("scenario", _setup_scenario_enrollment_df),
+    "scenario_spmf_input": ("scenario", _setup_scenario_spmf_input),
+    "scenario_sequence_spans": ("scenario", _setup_scenario_sequence_spans)
+}
+
+
+def _calibrate(work):
+    """Return the number of calls of work whose total time is at least MIN_SAMPLE_SECONDS, as timeit does."""
+
+    loops = 1
+    while True:
+        start = timeit.default_timer()
+        for _ in range(loops):
+            work()
+        if timeit.default_timer() - start >= MIN_SAMPLE_SECONDS or loops >= 10 ** 6:
+            return loops
+        loops *= 2
+
+
+def time_benchmark(work, repeats, calibrate=True, disable_gc=True):
+    """Time a function in repeated samples.
+
+    Args:
+        work (callable): Function without arguments to time.
+        repeats (int): Number of samples.
+        calibrate (bool): If true, each sample times as many calls as _calibrate() finds; otherwise one call.
+        disable_gc (bool): If true, the garbage collector is disabled while a sample is timed, as in timeit.
+
+    Returns:
+        A dictionary of the number of loops per sample, the samples in seconds per call, and their summary
+        statistics.
+
+    """
+
+    loops = _calibrate(work) if calibrate else 1
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    try:
+        for _ in range(repeats):
+            if disable_gc:
+                gc.disable()
+            start = timeit.default_timer()
+            for _ in range(loops):
+                work()
+            samples.append((timeit.default_timer() - start) / loops)
+            if gc_was_enabled:
+                gc.enable()
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return {"loops": loops, "samples": samples, "median": float(np.median(samples)), "mean": float(np.mean(samples)),
+            "stdev": float(np.std(samples, ddof=1)) if len(samples) > 1 else 0.0, "min": float(np.min(samples))}
+
+
+def _git_commit():
+    """Return the short hash of the checked-out commit, with "-dirty" if the tree has changes; None outside git."""
+
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        with open(os.devnull, "w") as devnull:
+            commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=root_dir,
+                                             stderr=devnull).strip()
+            changes = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                              cwd=root_dir, stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if changes else "")
+
+
+def _environment():
+    """Describe the interpreter, libraries and machine that produced a run."""
+
+    import pandas as pd
+    return {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "platform": platform.platform(), "machine": platform.machine(), "processor": platform.processor()}
+
+
+def run_suite(names=None, groups=GROUPS_LIST, repeats=None, scenario_students=DEFAULT_SCENARIO_STUDENTS, seed=0,
+              verbose=True):
+    """Time the benchmarks and return the results with their metadata.
+
+    Args:
+        names (list): Names of the benchmarks of BENCHMARKS_DICT to run; all those of groups if None.
+        groups (list): Groups of the benchmarks to run, when names is None.
+        repeats (int): Number of samples per benchmark; DEFAULT_REPEATS_DICT of its group if None.
+        scenario_students (int): Number of students of the synthetic data of the scenario benchmarks.
+        seed (int): Seed of the fixtures and of the synthetic data.
+        verbose (bool): If true, print each benchmark's median time as it finishes.
+
+    Returns:
+        A dictionary with schema_version, created, commit, environment, settings and benchmarks, the last mapping
+        each benchmark name to its group and the dictionary of time_benchmark().
+
+    """
+
+    names = sorted(x for x, y in BENCHMARKS_DICT.items() if y[0] in groups) if names is None else list(names)
+    work_dir = tempfile.mkdtemp(prefix="metro_microbenchmarks_")
+    results_dict = {"schema_version": BASELINE_SCHEMA_VERSION,
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "commit": _git_commit(),
+                    "environment": _environment(),
+                    "settings": {"scenario_students": scenario_students, "seed": seed,
+                                 "min_sample_seconds": MIN_SAMPLE_SECONDS},
+                    "benchmarks": dict()}
+    stdout = sys.stdout
+    devnull = open(os.devnull, "w")
+    try:
+        if any(BENCHMARKS_DICT[x][0] == "scenario" for x in names):
+            data_dir = os.path.join(work_dir, "data")
+            if "configuration" in sys.modules and sys.modules["configuration"].DATA_DIR != data_dir:
+                raise RuntimeError("The scenario benchmarks must run before configuration.py is imported.")
+            os.environ["METRO_DATA_DIR"] = data_dir
+            from benchmarks.synthetic_data import generate_dataset
+            sys.stdout = devnull
+            generate_dataset(data_dir, n_students=scenario_students, seed=seed)
+            sys.stdout = stdout
+        context = {"work_dir": work_dir}
+        for each_name in names:
+            group, setup_function = BENCHMARKS_DICT[each_name]
+            context["random_state"] = np.random.RandomState(seed)
+            # preprocessing() and create_spmf_input_file() print their progress; the timings should not include it
+            sys.stdout = devnull
+            work = setup_function(context)
+            result_dict = time_benchmark(work, DEFAULT_REPEATS_DICT[group] if repeats is None else repeats,
+                                         calibrate=group == "micro", disable_gc=group == "micro")
+            sys.stdout = stdout
+            result_dict["group"] = group
+            results_dict["benchmarks"][each_name] = result_dict
+            if verbose:
+                print("%-40s %12s  (%d x %d)" % (each_name, _format_seconds(result_dict["median"]),
+                                                 len(result_dict["samples"]), result_dict["loops"]))
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results_dict
+
+
+def save_results(results_dict, path=None):
+    """Write the results of run_suite() to a baseline JSON file, atomically.
+
+    Args:
+        results_dict (dict): Results of run_suite().
+        path (str): Path of the file; BASELINES_DIR/<commit>.json if None.
+
+    Returns:
+        The path of the file.
+
+    """
+
+    if path is None:
+        path = os.path.join(BASELINES_DIR, (results_dict["commit"] or results_dict["created"]) + ".json")
+    if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path + ".tmp", "w") as json_file:
+        json.dump(results_dict, json_file, indent=1, sort_keys=True)
+    os.rename(path + ".tmp", path)
+    return path
+
+
+def load_results(path):
+    """Read a baseline JSON file written by save_results(), checking its schema version."""
+
+    with open(path) as json_file:
+        results_dict = json.load(json_file)
+    if results_dict.get("schema_version") != BASELINE_SCHEMA_VERSION:
+        raise ValueError(path + " has baseline schema version " + str(results_dict.get("schema_version")) +
+                         "; expected version " + str(BASELINE_SCHEMA_VERSION) + ".")
+    return results_dict
+
+
+def compare_results(baseline_dict, current_dict, alpha=DEFAULT_ALPHA, threshold=DEFAULT_THRESHOLD):
+    """Compare the samples of each benchmark of two runs.
+
+    Args:
+        baseline_dict (dict): Results of the earlier run, from run_suite() or load_results().
+        current_dict (dict): Results of the run to check.
+        alpha (float): Significance level of the one-sided Mann-Whitney U tests.
+        threshold (float): Smallest relative change of the median time that is flagged, e.g., 0.05 for 5%.
+
+    Returns:
+        A list of dictionaries, one per benchmark of both runs, with the medians, their ratio (current over
+        baseline), the p-values of the tests for slower and faster, and the verdict: "regression",
+        "improvement" or "unchanged".
+
+    """
+
+    comparisons = []
+    for each_name in sorted(set(baseline_dict["benchmarks"]) & set(current_dict["benchmarks"])):
+        baseline_samples = baseline_dict["benchmarks"][each_name]["samples"]
+        current_samples = current_dict["benchmarks"][each_name]["samples"]
+        ratio = np.median(current_samples) / np.median(baseline_samples)
+        p_slower = stats.mannwhitneyu(current_samples, baseline_samples, alternative="greater")[1]
+        p_faster = stats.mannwhitneyu(current_samples, baseline_samples, alternative="less")[1]
+        verdict = "unchanged"
+        if p_slower < alpha and ratio > 1 + threshold:
+            verdict = "regression"
+        elif p_faster < alpha and ratio < 1 - threshold:
+            verdict = "improvement"
+        comparisons.append({"name": each_name, "baseline_median": float(np.median(baseline_samples)),
+                            "current_median": float(np.median(current_samples)), "ratio": float(ratio),
+                            "p_slower": float(p_slower), "p_faster": float(p_faster), "verdict": verdict})
+    return comparisons
+
+
+def _format_seconds(seconds):
+    for unit, scale in [("s", 1.0), ("ms", 1e-3), ("us", 1e-6)]:
+        if seconds >= scale:
+            return "%.3f %s" % (seconds / scale, unit)
+    return "%.1f ns" % (seconds / 1e-9)
+
+
+def format_comparison(comparisons, baseline_dict, current_dict):
+    """Format the result of compare_results() as a table, headed by the commits and environments of both runs."""
+
+    lines = []
+    for label, results_dict in [("baseline", baseline_dict), ("current", current_dict)]:
+        environment = results_dict["environment"]
+        lines.append("%-9s %s  %s  Python %s  NumPy %s  pandas %s  %s" % (
+            label, results_dict["commit"], results_dict["created"], environment["python"], environment["numpy"],
+            environment["pandas"], environment["platform"]))
+    if baseline_dict["settings"] != current_dict["settings"]:
+        lines.append("warning: the runs have different settings; scenario timings are not comparable")
+    lines.append("%-40s %12s %12s %8s %10s  %s" % ("benchmark", "baseline", "current", "ratio", "p", "verdict"))
+    for each in comparisons:
+        p_value = each["p_faster"] if each["ratio"] < 1 else each["p_slower"]
+        lines.append("%-40s %12s %12s %8.3f %10.2g  %s" % (
+            each["name"], _format_seconds(each["baseline_median"]), _format_seconds(each["current_median"]),
+            each["ratio"], p_value, each["verdict"]))
+    return "\n".join(lines)
+
+
+def _compare_and_print(baseline_dict, current_dict, arguments):
+    """Print the comparison of two runs; return 1 if a benchmark regressed, so that scripts can fail on it."""
+
+    comparisons = compare_results(baseline_dict, current_dict, alpha=arguments.alpha, threshold=arguments.threshold)
+    print(format_comparison(comparisons, baseline_dict, current_dict))
+    return 1 if any(x["verdict"] == "regression" for x in comparisons) else 0
+
+
+def main(argv=None):
+    """Run the run or compare subcommand; return the exit status."""
+
+    parser = argparse.ArgumentParser(description="Run the microbenchmarks and compare them with baselines.")
+    subparsers = parser.add_subparsers(dest="command")
+    run = subparsers.add_parser("run", help="Time the benchmarks.")
+    run.add_argument("names", nargs="*", help="benchmarks of BENCHMARKS_DICT to run (default: all of the groups)")
+    run.add_argument("--group", nargs="+", choices=GROUPS_LIST, default=GROUPS_LIST, help="groups to run")
+    run.add_argument("--repeats", type=int, default=None, help="samples per benchmark")
+    run.add_argument("--scenario-students", type=int, default=DEFAULT_SCENARIO_STUDENTS,
+                     help="number of students of the scenario data")
+    run.add_argument("--seed", type=int, default=0, help="seed of the fixtures and the scenario data")
+    run.add_argument("--save", nargs="?", const="", default=None,
+                     help="save the results as a baseline, to this path or to BASELINES_DIR/<commit>.json")
+    run.add_argument("--compare", default=None, help="baseline file with which to compare the results")
+    compare = subparsers.add_parser("compare", help="Compare two saved runs.")
+    compare.add_argument("baseline", help="baseline file")
+    compare.add_argument("current", help="file of the run to check")
+    for each_parser in [run, compare]:
+        each_parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA, help="significance level")
+        each_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                 help="smallest relative change of the median that is flagged")
+    arguments = parser.parse_args(argv)
+
+    if arguments.command == "run" and set(arguments.names) - set(BENCHMARKS_DICT):
+        parser.error("unknown benchmarks: " + ", ".join(sorted(set(arguments.names) - set(BENCHMARKS_DICT))))
+    if arguments.command == "compare":
+        return _compare_and_print(load_results(arguments.baseline), load_results(arguments.current), arguments)
+    results_dict = run_suite(arguments.names or None, arguments.group, arguments.repeats,
+                             arguments.scenario_students, arguments.seed)
+    if arguments.save is not None:
+        print("Saved " + save_results(results_dict, arguments.save or None))
+    if arguments.compare is not None:
+        return _compare_and_print(load_results(arguments.compare), results_dict, arguments)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""Measure the wall time and peak memory of each stage of the data pipeline on synthetic data.
+
+For each requested number of students, a synthetic data directory is generated (see synthetic_data.py) and each
+pipeline stage is run in a fresh child process whose environment points METRO_DATA_DIR at that directory.  Running
+every stage in its own process keeps the stages from sharing caches, and makes the peak resident set size that the
+operating system reports for the child the peak memory of that stage alone.  The exception is spmf_input, whose child
+runs preprocessing first: its peak would be that of preprocessing, so only its rss_growth_mb, how much the stage
+itself raised the peak, is reported, and its peak_rss_mb is None.
+
+The stages are:
+    generate: write the synthetic data directory
+    preprocessing_metro: preprocessing(metro_only=True)
+    preprocessing_metro_comp: preprocessing(metro_comp=True)
+    preprocessing_all: preprocessing() for every student on campus
+    spmf_input: create_spmf_input_file() for Comparison students, after an unmeasured preprocessing(metro_comp=True)
+
+Usage:
+    python -m benchmarks.run_benchmarks --students 1000 10000 --json results.json
+
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from utilities.instrumentation import peak_rss_mb, cpu_seconds
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+STAGES_LIST = ["generate", "preprocessing_metro", "preprocessing_metro_comp", "preprocessing_all", "spmf_input"]
+RESULT_POLL_SECONDS = 5     # how often to check that a child that has not reported yet is still running
+
+
+def _run_stage(stage, data_dir, n_students, seed, results_queue):
+    """Run one stage in the current (child) process and put its measurements on results_queue.
+
+    Args:
+        stage (str): One of STAGES_LIST.
+        data_dir (str): The synthetic data directory.
+        n_students (int): Number of students to generate (for the generate stage).
+        seed (int): Seed for the generate stage.
+        results_queue (Queue): Queue on which to put the dictionary of measurements.
+
+    """
+
+    os.environ["METRO_DATA_DIR"] = data_dir
+    sys.stdout = open(os.devnull, "w")
+    try:
+        if stage == "generate":
+            from benchmarks.synthetic_data import generate_dataset
+            work = lambda: generate_dataset(data_dir, n_students=n_students, seed=seed)
+        else:
+            from processing import preprocessing
+            if stage == "preprocessing_metro":
+                work = lambda: preprocessing(metro_only=True)
+            elif stage == "preprocessing_metro_comp":
+                work = lambda: preprocessing(metro_comp=True)
+            elif stage == "preprocessing_all":
+                work = lambda: preprocessing()
+            else:
+                from utilities.spmf_tools import create_spmf_input_file
+                contacts_df, student_records_dict, roster_dict = preprocessing(metro_comp=True)
+                work = lambda: create_spmf_input_file(contacts_df=contacts_df,
+                                                      student_records_dict=student_records_dict,
+                                                      cohort_years=list(range(2009, 2017)),
+                                                      passing_only=False,
+                                                      seasons=["Fall", "Spring", "Summer"],
+                                                      spmf_input_file_name="benchmark_spmf_input.txt",
+                                                      capture_gaps=True,
+                                                      comp_only=True)
+        rss_before = peak_rss_mb()
+        cpu_before = cpu_seconds()
+        wall_before = time.time()
+        work()
+        results_queue.put({"stage": stage,
+                           "students": n_students,
+                           "wall_seconds": time.time() - wall_before,
+                           "cpu_seconds": cpu_seconds() - cpu_before,
+                           # the child's lifetime peak; for spmf_input, that of the unmeasured preprocessing
+                           "peak_rss_mb": peak_rss_mb() if stage != "spmf_input" else None,
+                           "rss_growth_mb": peak_rss_mb() - rss_before,
+                           "error": None})
+    except Exception as error:
+        results_queue.put({"stage": stage, "students": n_students, "error": repr(error)})
+
+
+def _wait_for_result(child, results_queue, stage, n_students):
+    """Wait for the measurements of a child process, or for the child to die without reporting them.
+
+    A child killed by the operating system (e.g., for running out of memory) or by a crash in a C extension
+    puts nothing on the queue, so the queue is polled and the child checked between polls.
+
+    Returns:
+        The dictionary put on results_queue by the child, or one whose error gives the child's exit code.
+
+    """
+
+    while True:
+        try:
+            return results_queue.get(timeout=RESULT_POLL_SECONDS)
+        except Empty:
+            if not child.is_alive():
+                break
+    # The child may have put its result on the queue just before it exited
+    try:
+        return results_queue.get(timeout=1)
+    except Empty:
+        child.join()
+        return {"stage": stage, "students": n_students, "error": "child exited with code " + str(child.exitcode)}
+
+
+def run_benchmarks(student_counts, stages=STAGES_LIST, seed=0, data_root=None, keep_data=False):
+    """Generate synthetic data at each scale and measure every stage in a child process.
+
+    Args:
+        student_counts (list): Numbers of students for which to generate data and run the stages.
+        stages (list): Stages to run (see STAGES_LIST); the generate stage always runs first.
+        seed (int): Seed of the synthetic data generator.
+        data_root (str): Directory under which to write the synthetic data; a temporary directory if None.
+        keep_data (bool): If true, leave the synthetic data directories in place afterwards.
+
+    Returns:
+        A list of dictionaries, one per scale and stage, with the measurements (or an error message).
+
+    """
+
+    data_root = tempfile.mkdtemp(prefix="metro_benchmarks_") if data_root is None else data_root
+    results = []
+    try:
+        for n_students in student_counts:
+            data_dir = os.path.join(data_root, "students_" + str(n_students))
+            for stage in ["generate"] + [x for x in stages if x != "generate"]:
+                results_queue = multiprocessing.Queue()
+                child = multiprocessing.Process(target=_run_stage,
+                                                args=(stage, data_dir, n_students, seed, results_queue))
+                child.start()
+                result = _wait_for_result(child, results_queue, stage, n_students)
+                child.join()
+                results.append(result)
+                print(format_result(result))
+                if stage == "generate" and result["error"] is not None:
+                    break
+    finally:
+        if not keep_data:
+            shutil.rmtree(data_root, ignore_errors=True)
+    return results
+
+
+def format_result(result):
+    """Format one measurement dictionary as a line of text."""
+
+    if result["error"] is not None:
+        return "%9d students  %-26s FAILED: %s" % (result["students"], result["stage"], result["error"])
+    if result["peak_rss_mb"] is None:
+        return "%9d students  %-26s wall %9.2f s  cpu %9.2f s  peak RSS       n/a     (+%.1f MB)" % (
+            result["students"], result["stage"], result["wall_seconds"], result["cpu_seconds"],
+            result["rss_growth_mb"])
+    return "%9d students  %-26s wall %9.2f s  cpu %9.2f s  peak RSS %9.1f MB  (+%.1f MB)" % (
+        result["students"], result["stage"], result["wall_seconds"], result["cpu_seconds"],
+        result["peak_rss_mb"], result["rss_growth_mb"])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data.")
+    parser.add_argument("--students", type=int, nargs="+", default=[1000, 10000],
+                        help="numbers of students to generate (e.g., 1000 100000 1000000)")
+    parser.add_argument("--stages", nargs="+", default=STAGES_LIST, choices=STAGES_LIST, help="stages to run")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data generator")
+    parser.add_argument("--data-root", default=None, help="directory for the synthetic data (default: temporary)")
+    parser.add_argument("--keep-data", action="store_true", help="keep the synthetic data afterwards")
+    parser.add_argument("--json", default=None, help="also write the measurements to this JSON file")
+    arguments = parser.parse_args()
+    all_results = run_benchmarks(arguments.students, arguments.stages, arguments.seed, arguments.data_root,
+                                 arguments.keep_data)
+    if arguments.json is not None:
+        with open(arguments.json, "w") as json_file:
+            json.dump(all_results, json_file, indent=2)
@@ -0,0 +1,515 @@
+"""Generate a synthetic data directory with the same layout and file formats as the real student data.
+
+The real student data is protected by FERPA and cannot leave the analysis machines, which makes it impossible to
+measure or profile preprocessing() and the SPMF tools anywhere else.  This module writes a complete, realistic
+data directory of invented students:
+    1. Salesforce exports: Contact.csv, Account.csv, Cohorts__c.csv, Term__c.csv, EnrollmentOpportunity__c.csv.
+    2. The Metro pathways file, Pathways.csv.
+    3. IR data: one FTFTF_Fall<year>.csv file per cohort year, plus parent_educ.csv.
+    4. One CS query file per semester in SEMESTERS_LIST, in the query_data directory.
+Every file uses the column headers defined in utilities/file_constants.py, including the repeated column names of
+the query files, so the files exercise exactly the same code paths as the real exports.
+
+The number of students is configurable from a few hundred to millions; all rows are drawn with vectorized NumPy
+operations and written with pandas, so a dataset of a million students is generated in minutes.  To run the
+processing modules on the generated data, point the METRO_DATA_DIR environment variable at the output directory
+(see configuration.py).
+
+Functions exported by this module include:
+    generate_dataset(): write a complete synthetic data directory
+
+"""
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from utilities.file_constants import CONTACTS_FILE, CONTACT_COLUMNS_DICT, ACCOUNTS_FILE, COHORTS_FILE, TERMS_FILE, \
+    ENROLLMENTS_FILE, ENROLLMENT_COLUMNS_DICT, IR_DATA_DICT, IR_PARENT_EDUC_FILE, IR_PARENT_EDUC_DICT, PATHWAYS_FILE, \
+    QUERY_DATA_DIR, QUERY_DATA_COLUMNS_LIST, CONTACT_STUDENT_TYPES_DICT
+from utilities.other_constants import SEMESTERS_LIST, RACE_RENAMING_DICT, INCOME_CATEGORIES_DICT, \
+    EDUCATION_CATEGORIES_DICT, MATH_COURSES_SET, MATH_REMEDIATION_COURSES_SET
+
+FIRST_COHORT_YEAR = 2009
+LAST_COHORT_YEAR = 2017
+ACADEMIES_LIST = ["HLTH", "CCSJ", "STEM", "ESJ", "CAS"]
+COMP_COHORT_NAME = "COMP"
+OTHER_ACCOUNT_NAMES_LIST = ["Partner High School", "Community Organization"]
+DEPARTMENTS_LIST = ["ENG", "BIO", "CHEM", "PSY", "HIST", "SOC", "ECON", "BECA", "HED", "ETHS", "PHYS", "CSC",
+                    "ART", "MUS", "PHIL", "COMM", "ANTH", "GEOG", "PLSI", "KIN"]
+COURSES_PER_DEPARTMENT = 15
+GRADE_WEIGHTS_DICT = {
+    'A': 14, 'A+': 1, 'A-': 9,
+    'B': 12, 'B+': 8, 'B-': 7,
+    'C': 8, 'C+': 5, 'C-': 3,
+    'D': 2, 'D+': 1, 'D-': 1,
+    'F': 4, 'I': 0.5, 'IC': 0.5,
+    'CR': 6, 'NC': 1, 'RD': 0.3,
+    'RP': 0.2, 'W': 4, 'WU': 1.5
+}
+LOW_GRADES_LIST = ["D-", "D", "D+", "F", "NC", "W", "WU"]
+INVALID_GRADES_LIST = ["", "AU"]
+STATUS_WEIGHTS_DICT = {"Enrolled": 0.95, "Dropped": 0.04, "Wait Listed": 0.01}
+SEASON_PREFIXES_DICT = {"Fall": "F", "Winter": "WI", "Spring": "S", "Summer": "SU"}
+SEASON_ENROLLMENT_PROBABILITIES_DICT = {"Fall": 0.93, "Winter": 0.04, "Spring": 0.9, "Summer": 0.15}
+SEASON_MEAN_COURSES_DICT = {"Fall": 4.0, "Winter": 1.0, "Spring": 4.0, "Summer": 1.5}
+OTHER_RACES_LIST = ["Two or More Races - Non-Hispanic", "Native Hawaiian or Other Pacific Islander Only - Non-Hispanic",
+                    "Unknown"]
+
+
+def _salesforce_ids(prefix, count, random_state):
+    """Create unique 18-character Salesforce-style record Id's with a three-character prefix."""
+
+    numbers = random_state.permutation(count) + random_state.randint(10 ** 9, 10 ** 10)
+    return np.array([prefix + "000" + format(each_number, "012d") for each_number in numbers])
+
+
+def _unique_integers(low, high, count, random_state):
+    """Draw count distinct integers from [low, high) without materializing the whole range."""
+
+    values = np.array([], dtype=np.int64)
+    while len(values) < count:
+        values = np.unique(np.r_[values, random_state.randint(low, high, int(count * 1.1) + 10)])
+    return random_state.permutation(values)[:count]
+
+
+def _choice(options, size, random_state, weights=None):
+    """Draw size values from options, with optional (unnormalized) weights."""
+
+    options = np.asarray(options, dtype=object)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float) / np.sum(weights)
+    return options[random_state.choice(len(options), size=size, p=weights)]
+
+
+def _blank_out(values, proportion, random_state):
+    """Replace a random proportion of an object array's values with empty strings, as in the exports."""
+
+    values = np.asarray(values, dtype=object).copy()
+    values[random_state.rand(len(values)) < proportion] = ""
+    return values
+
+
+def _write_csv(data_frame, path, header=None):
+    """Write a DataFrame as csv; header, if given, is written verbatim (it may repeat column names)."""
+
+    if header is None:
+        data_frame.to_csv(path, index=False)
+    else:
+        with open(path, "w") as output_file:
+            output_file.write(",".join(header) + "\n")
+        data_frame.to_csv(path, mode="a", header=False, index=False, chunksize=500000)
+
+
+def _make_students(n_students, metro_share, comp_share, random_state):
+    """Draw the population of first-time freshmen, with their cohort years, categories and attributes.
+
+    Returns:
+        A DataFrame with one row per student.
+
+    """
+
+    students_df = pd.DataFrame({
+        "student_id": np.array([format(each_number, "09d") for each_number in
+                                _unique_integers(9 * 10 ** 8, 10 ** 9, n_students, random_state)]),
+        "cohort_year": random_state.randint(FIRST_COHORT_YEAR, LAST_COHORT_YEAR + 1, n_students)
+    })
+    draws = random_state.rand(n_students)
+    students_df["category"] = np.where(draws < metro_share, "Metro",
+                                       np.where(draws < metro_share + comp_share, "Comp", "Other"))
+    students_df["academy"] = np.where(students_df["category"] == "Metro",
+                                      _choice(ACADEMIES_LIST, n_students, random_state), COMP_COHORT_NAME)
+    metro = (students_df["category"] == "Metro").values
+    students_df["pell"] = random_state.rand(n_students) < np.where(metro, 0.7, 0.45)
+    students_df["first_gen"] = random_state.rand(n_students) < np.where(metro, 0.6, 0.35)
+    students_df["race"] = _choice(sorted(RACE_RENAMING_DICT) + OTHER_RACES_LIST, n_students, random_state,
+                                  weights=[30, 28, 8, 18, 6, 1, 9])
+    students_df["gender"] = _choice(["Female", "Male"], n_students, random_state, weights=[57, 43])
+    # Students' propensity to keep enrolling term after term, and to do well, vary together
+    students_df["ability"] = random_state.normal(0.0, 1.0, n_students) + 0.15 * metro
+    students_df["regular_terms"] = np.clip(np.round(random_state.normal(9, 3, n_students)
+                                                    + 1.5 * students_df["ability"].values), 1, 16).astype(int)
+    students_df["needs_remediation"] = random_state.rand(n_students) < 0.3 - 0.1 * np.tanh(students_df["ability"])
+    return students_df
+
+
+def _write_salesforce_files(students_df, output_dir, random_state):
+    """Write the Account, Cohorts__c, Term__c, Contact and EnrollmentOpportunity__c exports.
+
+    Returns:
+        A dictionary mapping each file name to its number of rows.
+
+    """
+
+    # Accounts: the two student types that preprocessing() keeps, plus unrelated accounts
+    account_names = sorted(CONTACT_STUDENT_TYPES_DICT) + OTHER_ACCOUNT_NAMES_LIST
+    accounts_df = pd.DataFrame({"Id": _salesforce_ids("001", len(account_names), random_state),
+                                "Name": account_names,
+                                "Type": "Organization"})
+    account_ids_dict = dict(zip(accounts_df["Name"], accounts_df["Id"]))
+    _write_csv(accounts_df, os.path.join(output_dir, ACCOUNTS_FILE))
+
+    # Cohorts: one per academy (and the comparison group) and year, named like HLTH-2014
+    cohort_names = [academy + "-" + str(year) for academy in ACADEMIES_LIST + [COMP_COHORT_NAME]
+                    for year in range(FIRST_COHORT_YEAR, LAST_COHORT_YEAR + 1)]
+    cohorts_df = pd.DataFrame({"Id": _salesforce_ids("a0C", len(cohort_names), random_state),
+                               "Name": cohort_names})
+    cohort_ids_dict = dict(zip(cohorts_df["Name"], cohorts_df["Id"]))
+    _write_csv(cohorts_df, os.path.join(output_dir, COHORTS_FILE))
+
+    # Terms: SFSU terms (named like "SFSU Fall 2012") and the comparison terms that preprocessing() drops
+    term_names = ["SFSU " + x for x in SEMESTERS_LIST] + ["SFSU COMP " + x for x in SEMESTERS_LIST]
+    terms_df = pd.DataFrame({"Id": _salesforce_ids("a0T", len(term_names), random_state),
+                             "Name": term_names,
+                             "TermCode__c": [SEASON_PREFIXES_DICT[x.split()[-2]] + x[-4:] for x in term_names]})
+    _write_csv(terms_df, os.path.join(output_dir, TERMS_FILE))
+
+    # Contacts: Metro and Comparison students, plus a few contacts that are not students
+    contacts_df = students_df[students_df["category"] != "Other"].reset_index(drop=True)
+    n_contacts, n_extra = len(contacts_df), max(1, len(contacts_df) // 50)
+    all_contacts = n_contacts + n_extra
+    contact_ids = _salesforce_ids("003", all_contacts, random_state)
+    years = np.concatenate([contacts_df["cohort_year"].values,
+                            random_state.randint(FIRST_COHORT_YEAR, LAST_COHORT_YEAR + 1, n_extra)])
+    academies = np.concatenate([contacts_df["academy"].values, _choice(ACADEMIES_LIST, n_extra, random_state)])
+    categories = np.concatenate([contacts_df["category"].values, _choice(OTHER_ACCOUNT_NAMES_LIST, n_extra,
+                                                                         random_state)])
+    account_names_by_category = {"Metro": "SFSU Students", "Comp": "SFSU Comparison Students"}
+    income_labels = sorted(INCOME_CATEGORIES_DICT)
+    education_labels = sorted(EDUCATION_CATEGORIES_DICT)
+    values_dict = {
+        "SFSU_student_ID__c": np.concatenate([contacts_df["student_id"].values,
+                                              [format(x, "09d") for x in random_state.randint(10 ** 8, 9 * 10 ** 8,
+                                                                                              n_extra)]]),
+        "CurrentCohort__c": [cohort_ids_dict[a + "-" + str(y)] for a, y in zip(academies, years)],
+        "Race_or_ethnicity_iped_ir__c": _blank_out(np.concatenate([contacts_df["race"].values,
+                                                                   _choice(OTHER_RACES_LIST, n_extra, random_state)]),
+                                                   0.05, random_state),
+        "AccountId": [account_ids_dict[account_names_by_category.get(x, x)] for x in categories],
+        "Applicant_pool_year__c": _blank_out([str(y) + "-" + str(y + 1) for y in years], 0.01, random_state),
+        "First_Generation__c": _blank_out(np.where(np.concatenate([contacts_df["first_gen"].values,
+                                                                   np.zeros(n_extra, bool)]), "Yes", "No"),
+                                          0.1, random_state),
+        "Household_income__c": _blank_out(_choice(income_labels, all_contacts, random_state), 0.15, random_state),
+        "What_language_at_home__c": _blank_out(_choice(["English", "Spanish", "Cantonese", "Tagalog", "Vietnamese"],
+                                                       all_contacts, random_state, [50, 25, 12, 8, 5]),
+                                               0.2, random_state),
+        "Language_other_than_English_at_home__c": _choice(["true", "false"], all_contacts, random_state),
+        "Sex_Gender__c": _blank_out(np.concatenate([contacts_df["gender"].values,
+                                                    _choice(["Female", "Male"], n_extra, random_state)]),
+                                    0.02, random_state),
+        "Country_of_Origin__c": _blank_out(_choice(["United States", "Mexico", "China", "Philippines", "El Salvador"],
+                                                   all_contacts, random_state, [80, 7, 5, 5, 3]), 0.3, random_state),
+        "Third_term_persistence__c": _blank_out(_choice(["Yes", "No"], all_contacts, random_state, [8, 2]),
+                                                0.3, random_state),
+        "Fifth_term_persistence__c": _blank_out(_choice(["Yes", "No"], all_contacts, random_state, [7, 3]),
+                                                0.4, random_state),
+        "Seventh_term_persistence__c": _blank_out(_choice(["Yes", "No"], all_contacts, random_state, [6, 4]),
+                                                  0.5, random_state),
+        "Pell_eligible__c": _blank_out(np.where(np.concatenate([contacts_df["pell"].values, np.zeros(n_extra, bool)]),
+                                                "Yes", "No"), 0.05, random_state),
+        "Student_Origin__c": _choice(["Bay Area", "Southern California", "Central Valley", "Out of State"],
+                                     all_contacts, random_state, [60, 20, 15, 5]),
+        "Education_level_mother_or_guardian1_IR__c": _blank_out(_choice(education_labels, all_contacts,
+                                                                        random_state), 0.2, random_state),
+        "Education_level_father_or_guardian2_IR__c": _blank_out(_choice(education_labels, all_contacts,
+                                                                        random_state), 0.25, random_state),
+        "Current_Metro_Enrollment__c": _choice(["Enrolled", "Not Enrolled", "Graduated"], all_contacts, random_state),
+        "Current_Institution_Enrollment__c": _choice(["Enrolled", "Not Enrolled", "Graduated"], all_contacts,
+                                                     random_state),
+        "Id": contact_ids,
+        "ACT_English_score__c": _blank_out(np.clip(random_state.normal(20, 5, all_contacts), 1, 36).astype(int),
+                                           0.8, random_state),
+        "ACT_Math_score__c": _blank_out(np.clip(random_state.normal(20, 5, all_contacts), 1, 36).astype(int),
+                                        0.8, random_state),
+        "EPT_score_SFSU_numeric__c": _blank_out(np.clip(random_state.normal(145, 10, all_contacts), 120, 180)
+                                                .astype(int), 0.4, random_state),
+        "ELM_score_SFSU_numeric__c": _blank_out(np.clip(random_state.normal(45, 10, all_contacts), 0, 70)
+                                                .astype(int), 0.4, random_state),
+        "SAT_EB_Reading_Writing_score__c": _blank_out((np.clip(random_state.normal(480, 90, all_contacts), 200, 800)
+                                                       // 10 * 10).astype(int), 0.3, random_state),
+        "SAT_Math_score__c": _blank_out((np.clip(random_state.normal(470, 90, all_contacts), 200, 800)
+                                         // 10 * 10).astype(int), 0.3, random_state),
+        "EOP_Status__c": _choice(["EOP", "Not EOP"], all_contacts, random_state, [3, 7])
+    }
+    contact_columns = sorted(CONTACT_COLUMNS_DICT) + ["FirstName", "LastName", "Phone"]
+    values_dict["FirstName"] = _choice(["Alex", "Sam", "Jordan", "Taylor", "Casey", "Riley"], all_contacts,
+                                       random_state)
+    values_dict["LastName"] = _choice(["Nguyen", "Garcia", "Smith", "Lee", "Lopez", "Chen"], all_contacts,
+                                      random_state)
+    values_dict["Phone"] = ["(415) 555-" + format(x, "04d") for x in random_state.randint(0, 10000, all_contacts)]
+    order = random_state.permutation(all_contacts)
+    _write_csv(pd.DataFrame(values_dict, columns=contact_columns).iloc[order],
+               os.path.join(output_dir, CONTACTS_FILE))
+
+    # Enrollment opportunities: one per contact and regular term, the last of which records the outcome
+    sfsu_term_ids = terms_df["Id"].values[:len(SEMESTERS_LIST)]
+    terms_count = np.minimum(contacts_df["regular_terms"].values, 12)
+    contact_positions = np.repeat(np.arange(n_contacts), terms_count)
+    term_offsets = np.arange(len(contact_positions)) - np.repeat(np.cumsum(terms_count) - terms_count, terms_count)
+    semester_positions = (contacts_df["cohort_year"].values[contact_positions] - FIRST_COHORT_YEAR) * 4 \
+        + 2 * term_offsets
+    within_terms = semester_positions < len(SEMESTERS_LIST)
+    contact_positions, term_offsets, semester_positions = contact_positions[within_terms], \
+        term_offsets[within_terms], semester_positions[within_terms]
+    is_last = np.r_[contact_positions[1:] != contact_positions[:-1], True]
+    graduated = contacts_df["regular_terms"].values[contact_positions] >= 8
+    stages = np.where(is_last, np.where(graduated, "Graduated",
+                                        np.where(semester_positions >= len(SEMESTERS_LIST) - 2, "Enrolled",
+                                                 "Left Institution")), "Enrolled")
+    n_enrollments = len(contact_positions)
+    gpas = np.round(np.clip(random_state.normal(2.9, 0.6, n_enrollments)
+                            + 0.2 * contacts_df["ability"].values[contact_positions], 0, 4), 2)
+    enrollments_df = pd.DataFrame({
+        "Id": _salesforce_ids("a0E", n_enrollments, random_state),
+        "MetroPersistence__c": _choice(["true", "false"], n_enrollments, random_state, [8, 2]),
+        "Stage__c": stages,
+        "Contact__c": contact_ids[contact_positions],
+        "TermNumber__c": term_offsets + 1,
+        "Term__c": sfsu_term_ids[semester_positions],
+        "NumberOfUnits__c": random_state.choice([9, 12, 13, 15, 16], n_enrollments),
+        "GPA__c": gpas,
+        "CumulativeGPA__c": gpas,
+        "SFSU_Campus_UE__c": (term_offsets + 1) * 13
+    }, columns=sorted(ENROLLMENT_COLUMNS_DICT))
+    _write_csv(enrollments_df, os.path.join(output_dir, ENROLLMENTS_FILE))
+    return {ACCOUNTS_FILE: len(accounts_df), COHORTS_FILE: len(cohorts_df), TERMS_FILE: len(terms_df),
+            CONTACTS_FILE: all_contacts, ENROLLMENTS_FILE: n_enrollments}
+
+
+def _course_catalog():
+    """Return the names of the general-education and major courses, as the CS query files spell them (e.g., "BIO 120")."""
+
+    return [department + " " + str(100 + 10 * number) for department in DEPARTMENTS_LIST
+            for number in range(COURSES_PER_DEPARTMENT)]
+
+
+def _split_course_name(course):
+    """Insert the space between department and number that the CS query files use (MATH110 -> MATH 110)."""
+
+    department = course.rstrip("0123456789")
+    return department + " " + course[len(department):]
+
+
+def _write_pathways_file(output_dir, random_state):
+    """Write Pathways.csv, with one pathway per Metro academy and cohort year.
+
+    Returns:
+        A dictionary mapping cohort names (e.g., HLTH-2012) to (first_exp, second_exp, cap) course names.
+
+    """
+
+    rows = []
+    pathway_courses_dict = dict()
+    math_courses = sorted(MATH_COURSES_SET)
+    for academy in ACADEMIES_LIST:
+        for year in range(FIRST_COHORT_YEAR, LAST_COHORT_YEAR + 1):
+            first_exp = [academy + "110", academy + "111"]
+            second_exp = [academy + "210"]
+            cap = [academy + "310"]
+            pathway_courses_dict[academy + "-" + str(year)] = (first_exp[0], second_exp[0], cap[0])
+            rows.append({"cohort": academy,
+                         "year": str(year),
+                         "first_exp": ";".join(first_exp),
+                         "second_exp": ";".join(second_exp),
+                         "cap": ";".join(cap),
+                         "semester_1": ";".join([first_exp[0], math_courses[random_state.randint(len(math_courses))]]),
+                         "semester_2": ";".join([first_exp[1], "ENG114"]),
+                         "semester_3": ";".join([second_exp[0],
+                                                 math_courses[random_state.randint(len(math_courses))]]),
+                         "semester_4": cap[0]})
+    _write_csv(pd.DataFrame(rows, columns=["cohort", "year", "first_exp", "second_exp", "cap", "semester_1",
+                                           "semester_2", "semester_3", "semester_4"]),
+               os.path.join(output_dir, PATHWAYS_FILE))
+    return pathway_courses_dict
+
+
+def _write_ir_files(students_df, ir_dir, random_state):
+    """Write one FTFTF_Fall<year>.csv file per cohort year, and parent_educ.csv.
+
+    About one percent of the students left and started over in a later cohort, so they appear in two IR files,
+    as they do in the real IR data.
+
+    Returns:
+        A dictionary mapping each file name to its number of rows.
+
+    """
+
+    rows_dict = dict()
+    n_students = len(students_df)
+    repeaters = random_state.rand(n_students) < 0.01
+    ir_df = pd.concat([students_df, students_df[repeaters].assign(cohort_year=lambda x: x["cohort_year"] + 1)],
+                      ignore_index=True)
+    ir_df = ir_df[ir_df["cohort_year"] <= LAST_COHORT_YEAR]
+    regular_terms = ir_df["regular_terms"].values
+    graduation_years = ir_df["cohort_year"].values + (regular_terms + 1) // 2
+    graduated = regular_terms >= 8
+    values_dict = {
+        "cohort_sid": ir_df["student_id"].values,
+        "cohort_year_term": [str(x) + "F" for x in ir_df["cohort_year"].values],
+        "sex": np.where(ir_df["gender"].values == "Female", "F", "M"),
+        "pell_eligible": np.where(ir_df["pell"].values, "Y", "N"),
+        "lst_dept_long": _choice(DEPARTMENTS_LIST, len(ir_df), random_state),
+        "cohort_acad_plan_desc1": _choice(["Biology BS", "Psychology BA", "Business BS", "Undeclared"],
+                                          len(ir_df), random_state),
+        "ethnic_desc1": ir_df["race"].values,
+        "rtn_yr1": (regular_terms >= 3).astype(int),
+        "rtn_yr2": (regular_terms >= 5).astype(int),
+        "rtn_yr3": (regular_terms >= 7).astype(int),
+        "deg_yr4": (graduated & (regular_terms <= 8)).astype(int),
+        "deg_yr5": (graduated & (regular_terms <= 10)).astype(int),
+        "deg_yr6": (graduated & (regular_terms <= 12)).astype(int),
+        "deg_cnt": graduated.astype(int),
+        "deg_year_term": np.where(graduated, [str(x) + "S" for x in graduation_years], ""),
+        "admit_type": "FTF"
+    }
+    ir_columns = sorted(IR_DATA_DICT) + ["admit_type"]
+    full_df = pd.DataFrame(values_dict, columns=ir_columns)
+    for year in range(FIRST_COHORT_YEAR, LAST_COHORT_YEAR + 1):
+        file_name = "FTFTF_Fall" + str(year) + ".csv"
+        year_df = full_df[ir_df["cohort_year"].values == year]
+        _write_csv(year_df, os.path.join(ir_dir, file_name))
+        rows_dict[file_name] = len(year_df)
+
+    # parent_educ: one row per student, keyed by the CS start term (e.g., 2127 for Fall 2012), plus a few
+    #     students from cohorts before 2009, which preprocessing() drops
+    education_labels = sorted(EDUCATION_CATEGORIES_DICT)
+    n_early = max(1, n_students // 100)
+    parents_df = pd.DataFrame({
+        "student_id": np.concatenate([students_df["student_id"].values,
+                                      [format(x, "09d") for x in random_state.randint(10 ** 8, 9 * 10 ** 8,
+                                                                                      n_early)]]),
+        "mother_edu": _blank_out(_choice(education_labels, n_students + n_early, random_state), 0.1, random_state),
+        "father_edu": _blank_out(_choice(education_labels, n_students + n_early, random_state), 0.15, random_state),
+        "strm": np.concatenate([2000 + (students_df["cohort_year"].values - 2000) * 10 + 7,
+                                random_state.choice([2067, 2077, 2087], n_early)])
+    }, columns=sorted(IR_PARENT_EDUC_DICT)).drop_duplicates(subset="student_id")
+    _write_csv(parents_df, os.path.join(ir_dir, IR_PARENT_EDUC_FILE))
+    rows_dict[IR_PARENT_EDUC_FILE] = len(parents_df)
+    return rows_dict
+
+
+def _write_query_files(students_df, pathway_courses_dict, query_dir, random_state):
+    """Write one CS query file per semester, with one row per student and course.
+
+    Students enroll in regular (fall and spring) terms from their cohort year until they leave or graduate, and
+    occasionally in winter and summer terms.  Metro students take their pathway's core courses in their first
+    two years; students who need remediation take remedial Math in their first terms.
+
+    Returns:
+        A dictionary mapping each file name to its number of rows.
+
+    """
+
+    rows_dict = dict()
+    general_courses = _course_catalog()
+    popularity = 1.0 / np.arange(1, len(general_courses) + 1) ** 0.8
+    college_math_courses = [_split_course_name(x) for x in sorted(MATH_COURSES_SET) if x.startswith("MATH")]
+    remedial_math_courses = [_split_course_name(x) for x in sorted(MATH_REMEDIATION_COURSES_SET)]
+    grades = sorted(GRADE_WEIGHTS_DICT)
+    grade_weights = np.array([GRADE_WEIGHTS_DICT[x] for x in grades], dtype=float)
+    statuses = sorted(STATUS_WEIGHTS_DICT)
+    start_terms = (students_df["cohort_year"].values - FIRST_COHORT_YEAR) * 4 + 1
+    last_terms = start_terms + 2 * (students_df["regular_terms"].values - 1)
+    metro = (students_df["category"] == "Metro").values
+    pathway_courses = students_df["academy"].str.cat(students_df["cohort_year"].astype(str), sep="-")\
+        .map(pathway_courses_dict).values
+
+    for semester_number, semester_name in enumerate(SEMESTERS_LIST, start=1):
+        season, year = semester_name.split()
+        active = np.flatnonzero((start_terms <= semester_number) & (last_terms >= semester_number))
+        enrolled = active[random_state.rand(len(active)) < SEASON_ENROLLMENT_PROBABILITIES_DICT[season]]
+        course_counts = np.clip(random_state.poisson(SEASON_MEAN_COURSES_DICT[season], len(enrolled)), 1, 6)
+        positions = np.repeat(enrolled, course_counts)
+        courses = np.asarray(general_courses, dtype=object)[random_state.choice(len(general_courses), len(positions),
+                                                                                p=popularity / popularity.sum())]
+
+        # First-year Math: remedial courses for students who need them, college-level courses otherwise
+        relative_terms = semester_number - start_terms[positions]
+        first_of_term = np.r_[True, positions[1:] != positions[:-1]]
+        takes_math = first_of_term & (relative_terms <= 6) & (random_state.rand(len(positions)) < 0.5)
+        remedial = takes_math & students_df["needs_remediation"].values[positions] & (relative_terms <= 2)
+        courses[takes_math] = _choice(college_math_courses, takes_math.sum(), random_state)
+        courses[remedial] = _choice(remedial_math_courses, remedial.sum(), random_state)
+
+        # Metro core pathway: first-year experience in the first regular term, second-year experience in the
+        #     third, and the capstone in the fourth
+        second_of_term = np.r_[False, first_of_term[:-1]] & ~first_of_term
+        metro_rows = np.flatnonzero(second_of_term & metro[positions])
+        for relative_term, course_index in [(0, 0), (4, 1), (6, 2)]:
+            pathway_rows = metro_rows[(relative_terms[metro_rows] == relative_term)
+                                      & (random_state.rand(len(metro_rows)) < 0.85)]
+            courses[pathway_rows] = [_split_course_name(pathway_courses[x][course_index])
+                                     for x in positions[pathway_rows]]
+
+        # Better students get better grades: half of their low grades are redrawn from the A and B grades
+        grade_letters = _choice(grades, len(positions), random_state, grade_weights)
+        redrawn = (students_df["ability"].values[positions] > 0.5) & np.in1d(grade_letters, LOW_GRADES_LIST) \
+            & (random_state.rand(len(positions)) < 0.5)
+        grade_letters[redrawn] = _choice(["A", "A-", "B+", "B"], redrawn.sum(), random_state)
+        invalid = random_state.rand(len(positions)) < 0.005
+        grade_letters[invalid] = _choice(INVALID_GRADES_LIST, invalid.sum(), random_state)
+        units = random_state.choice([1, 3, 3, 3, 4, 4], len(positions))
+        query_df = pd.DataFrame({
+            "id": students_df["student_id"].values[positions],
+            "admit": [SEASON_PREFIXES_DICT["Fall"] + str(x) for x in students_df["cohort_year"].values[positions]],
+            "class": courses,
+            "units": units,
+            "status": _choice(statuses, len(positions), random_state,
+                              [STATUS_WEIGHTS_DICT[x] for x in statuses]),
+            "grade": grade_letters,
+            "units_taken": np.where(grade_letters == "W", 0, units)
+        }, columns=["id", "admit", "class", "units", "status", "grade", "units_taken"])
+        # A few rows are repeated, as happens when a student is listed twice for the same class
+        repeated = query_df[random_state.rand(len(query_df)) < 0.003]
+        query_df = pd.concat([query_df, repeated]).sort_values(["id", "class"], kind="mergesort")
+
+        file_name = SEASON_PREFIXES_DICT[season] + year + "_enrollment.csv"
+        _write_csv(query_df, os.path.join(query_dir, file_name), header=QUERY_DATA_COLUMNS_LIST)
+        rows_dict[file_name] = len(query_df)
+    return rows_dict
+
+
+def generate_dataset(output_dir, n_students=10000, seed=0, metro_share=0.05, comp_share=0.1):
+    """Write a complete synthetic data directory.
+
+    Args:
+        output_dir (str): Directory to write the files to; it is created if it does not exist.  Files that
+            already exist in it are overwritten.
+        n_students (int): Number of first-time freshmen across all cohort years.
+        seed (int): Seed of the random number generator, so that datasets can be regenerated exactly.
+        metro_share (float): Proportion of the students who are Metro students.
+        comp_share (float): Proportion of the students who are Comparison students.
+
+    Returns:
+        A dictionary mapping the relative path of each written file to its number of data rows.
+
+    """
+
+    random_state = np.random.RandomState(seed)
+    ir_dir = os.path.join(output_dir, "IR_data")
+    query_dir = os.path.join(output_dir, QUERY_DATA_DIR)
+    for each_dir in [output_dir, ir_dir, query_dir, os.path.join(output_dir, "spmf")]:
+        if not os.path.isdir(each_dir):
+            os.makedirs(each_dir)
+
+    students_df = _make_students(n_students, metro_share, comp_share, random_state)
+    rows_dict = _write_salesforce_files(students_df, output_dir, random_state)
+    pathway_courses_dict = _write_pathways_file(output_dir, random_state)
+    rows_dict[PATHWAYS_FILE] = len(pathway_courses_dict)
+    rows_dict.update({os.path.join("IR_data", x): y
+                      for x, y in _write_ir_files(students_df, ir_dir, random_state).items()})
+    rows_dict.update({os.path.join(QUERY_DATA_DIR, x): y
+                      for x, y in _write_query_files(students_df, pathway_courses_dict, query_dir,
+                                                     random_state).items()})
+    return rows_dict
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic student data directory.")
+    parser.add_argument("output_dir", help="directory to write the data files to")
+    parser.add_argument("--students", type=int, default=10000, help="number of first-time freshmen")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random number generator")
+    arguments = parser.parse_args()
+    written_dict = generate_dataset(arguments.output_dir, n_students=arguments.students, seed=arguments.seed)
+    print("Wrote %d files, %d rows" % (len(written_dict), sum(written_dict.values())))
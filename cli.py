@@ -0,0 +1,350 @@
+"""Run the preprocessing, SPMF and reporting steps of the project from the command line.
+
+Each step is a subcommand:
+    - preprocess: run preprocessing() and optionally save its outputs and its stage report;
+    - export-spmf: run preprocessing() and write a SPMF input file with create_spmf_input_file();
+    - export: run preprocessing() and write the partitioned enrollment, panel and summary extracts with
+        export_tables() (see utilities/export.py);
+    - mine: run an SPMF algorithm on an input file with run_spmf();
+    - spans: count the semesters spanned by a three-course sequence with determine_sequence_semester_lengths();
+    - report: print the stage table of a report or trace written by preprocess;
+    - serve: keep the preprocessed data warm in a daemon that answers queries over a Unix domain socket (see
+        utilities/warm_data.py).
+
+The preprocessing steps need pandas, numpy and the whole of processing.py, which take most of a second to
+import, while mine, spans and report need none of them.  So this module imports nothing but the standard library
+at load time, and each subcommand imports what it needs inside its own function; the light subcommands start in a
+few tens of milliseconds.  To see where the import time of a subcommand goes, put --profile-import before it:
+the time spent importing each module, with and without the modules it imports in turn, is printed to stderr
+when the subcommand ends.
+
+Usage:
+    python cli.py preprocess --metro-comp --report output/preprocessing_report.json
+    python cli.py export-spmf spmfinput_metro_2009_16.txt --metro-comp --seasons Fall Spring
+    python cli.py export --metro-comp --formats csv parquet --chunk-students 10000
+    python cli.py mine spmfinput_metro_2009_16.txt spmfoutput_metro_2009_16.txt 0.4
+    python cli.py spans spmfinput_metro_2009_16.txt MATH110 MATH125 MATH150
+    python cli.py --profile-import report output/preprocessing_report.json
+
+Functions and classes exported by this module include:
+    ImportProfiler: times every import made while it is installed
+    build_parser(): create the argument parser of the subcommands
+    main(): parse the arguments and run a subcommand
+
+"""
+
+import argparse
+import sys
+import time
+
+SEASONS_LIST = ["Fall", "Winter", "Spring", "Summer"]
+PROFILE_IMPORT_ROWS = 30
+
+
+class ImportProfiler:
+    """This class times every import made while it is installed in place of the built-in __import__.
+
+    Only imports of modules that are not loaded yet are timed.  For each module, the cumulative time includes
+    the modules it imports in turn, and the self time does not.
+
+    """
+
+    def __init__(self):
+        """Instantiate an ImportProfiler object, which does nothing until install() is called."""
+
+        self.cumulative_dict = dict()
+        self.self_dict = dict()
+        self.children_stack = []
+        self.original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=None, level=-1):
+        if name in sys.modules:
+            return self.original_import(name, globals, locals, fromlist, level)
+        self.children_stack.append(0.0)
+        start = time.time()
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - start
+            children = self.children_stack.pop()
+            if self.children_stack:
+                self.children_stack[-1] += elapsed
+            self.cumulative_dict[name] = self.cumulative_dict.get(name, 0.0) + elapsed
+            self.self_dict[name] = self.self_dict.get(name, 0.0) + elapsed - children
+
+    def install(self):
+        """Start timing imports."""
+
+        import __builtin__
+        self.original_import = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+    def uninstall(self):
+        """Stop timing imports."""
+
+        import __builtin__
+        __builtin__.__import__ = self.original_import
+
+    def summary(self, rows=PROFILE_IMPORT_ROWS):
+        """Create a table of the slowest imports, by cumulative time, for printing.
+
+        Args:
+            rows (int): Number of modules to list.
+
+        Returns:
+            String representation of the import times, in milliseconds.
+
+        """
+
+        total = sum(self.self_dict.values())
+        lines = ["%-40s %12s %12s" % ("module", "self ms", "cumulative ms")]
+        for each_name in sorted(self.cumulative_dict, key=lambda x: -self.cumulative_dict[x])[:rows]:
+            lines.append("%-40s %12.1f %12.1f" % (each_name, 1000 * self.self_dict[each_name],
+                                                  1000 * self.cumulative_dict[each_name]))
+        lines.append("%-40s %12.1f" % ("total (%d modules)" % len(self.self_dict), 1000 * total))
+        return "\n".join(lines)
+
+
+def _preprocess(arguments):
+    """Run preprocessing() with the arguments' options, and save and summarize what was asked for.
+
+    Args:
+        arguments (Namespace): Parsed arguments of the preprocess or export-spmf subcommand.
+
+    Returns:
+        The tuple (contacts_df, student_record_dict, roster_dict) returned by preprocessing().
+
+    """
+
+    from processing import preprocessing
+    from utilities.instrumentation import PipelineReport, RowCounters
+
+    report = PipelineReport(trace_file=arguments.trace)
+    row_counters = RowCounters()
+    contacts_df, student_record_dict, roster_dict = preprocessing(metro_only=arguments.metro_only,
+                                                                  metro_comp=arguments.metro_comp,
+                                                                  contacts_through_2016=not arguments.all_years,
+                                                                  attributes_only=arguments.attributes_only,
+                                                                  report=report,
+                                                                  row_counters=row_counters,
+                                                                  out_of_core=arguments.out_of_core)
+    print(report.summary())
+    if arguments.report is not None:
+        report.write_json(arguments.report)
+    if arguments.row_counts is not None:
+        row_counters.to_df().to_csv(arguments.row_counts, index=False)
+    return contacts_df, student_record_dict, roster_dict
+
+
+def command_preprocess(arguments):
+    """Run the preprocess subcommand."""
+
+    contacts_df, student_record_dict, roster_dict = _preprocess(arguments)
+    if arguments.contacts_csv is not None:
+        contacts_df.to_csv(arguments.contacts_csv, index=False)
+    if arguments.record_store is not None and student_record_dict is not None:
+        from utilities.record_store import write_record_store
+        write_record_store(student_record_dict, arguments.record_store)
+    return 0
+
+
+def command_export_spmf(arguments):
+    """Run the export-spmf subcommand."""
+
+    contacts_df, student_record_dict, roster_dict = _preprocess(arguments)
+    from utilities.spmf_tools import create_spmf_input_file
+    create_spmf_input_file(contacts_df=contacts_df,
+                           student_records_dict=student_record_dict,
+                           cohort_years=list(range(arguments.first_cohort, arguments.last_cohort + 1)),
+                           passing_only=arguments.passing_only,
+                           seasons=arguments.seasons,
+                           spmf_input_file_name=arguments.spmf_input_file_name,
+                           capture_gaps=arguments.capture_gaps,
+                           comp_only=arguments.comp_only)
+    return 0
+
+
+def command_export(arguments):
+    """Run the export subcommand."""
+
+    contacts_df, student_record_dict, roster_dict = _preprocess(arguments)
+    from utilities.export import EXPORT_DIR, export_tables
+    manifest_dict = export_tables(contacts_df, student_record_dict,
+                                  output_dir=EXPORT_DIR if arguments.output_dir is None else arguments.output_dir,
+                                  tables=arguments.tables,
+                                  formats=arguments.formats,
+                                  chunk_students=arguments.chunk_students)
+    print("%-12s %-10s %12s %12s" % ("table", "format", "partitions", "rows"))
+    for each_table in arguments.tables:
+        for each_format, rows_dict in sorted(manifest_dict[each_table]["rows"].items()):
+            print("%-12s %-10s %12d %12d" % (each_table, each_format, len(rows_dict), sum(rows_dict.values())))
+    return 0
+
+
+def command_mine(arguments):
+    """Run the mine subcommand."""
+
+    from utilities.spmf_tools import run_spmf
+    run_spmf(arguments.input_file_name, arguments.output_file_name, arguments.min_support, arguments.algorithm,
+             *arguments.algorithm_arguments)
+    return 0
+
+
+def command_spans(arguments):
+    """Run the spans subcommand: print how many students' sequences spanned each number of semesters."""
+
+    from collections import Counter
+    from utilities.spmf_tools import determine_sequence_semester_lengths
+    lengths_list = determine_sequence_semester_lengths(arguments.courses, arguments.spmf_file_name)
+    print("%-10s %10s" % ("semesters", "students"))
+    for each_length, students in sorted(Counter(lengths_list).items()):
+        print("%-10d %10d" % (each_length, students))
+    print("%-10s %10d" % ("total", len(lengths_list)))
+    return 0
+
+
+def command_report(arguments):
+    """Run the report subcommand."""
+
+    from utilities.instrumentation import read_report
+    report = read_report(arguments.report_file)
+    print(report.summary())
+    for each_record in report.records:
+        if "rows_by_reason" in each_record.extra:
+            for each_reason, rows in sorted(each_record.extra["rows_by_reason"].items()):
+                print("%-24s %-24s %12d" % (each_record.name, each_reason, rows))
+    return 0
+
+
+def command_serve(arguments):
+    """Run the serve subcommand, until it is interrupted."""
+
+    from utilities.warm_data import WarmDataServer, DEFAULT_SOCKET_PATH
+    socket_path = DEFAULT_SOCKET_PATH if arguments.socket_path is None else arguments.socket_path
+    server = WarmDataServer(socket_path=socket_path,
+                            poll_seconds=None if arguments.poll_seconds <= 0 else arguments.poll_seconds,
+                            metro_only=arguments.metro_only,
+                            metro_comp=arguments.metro_comp,
+                            contacts_through_2016=not arguments.all_years)
+    print("Serving on " + socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _add_preprocessing_arguments(parser):
+    """Add the options of preprocessing() to the parser of a subcommand that runs it."""
+
+    students = parser.add_mutually_exclusive_group()
+    students.add_argument("--metro-only", action="store_true", help="Metro students only.")
+    students.add_argument("--metro-comp", action="store_true", help="Metro and Comparison students only.")
+    parser.add_argument("--all-years", action="store_true",
+                        help="Keep the students of cohort years after 2016.")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="Keep the enrollment records in record store shards instead of in memory.")
+    parser.add_argument("--report", help="Path of a JSON file to which to write the stage report.")
+    parser.add_argument("--trace", help="Path of a file to which to append one JSON line per finished stage.")
+    parser.add_argument("--row-counts", help="Path of a csv file to which to write the kept and dropped rows.")
+
+
+def build_parser():
+    """Create the argument parser of the subcommands.
+
+    Returns:
+        An ArgumentParser whose parsed arguments hold, in function, the function that runs the subcommand.
+
+    """
+
+    parser = argparse.ArgumentParser(description="Process and analyze the Metro student data.")
+    parser.add_argument("--profile-import", action="store_true",
+                        help="Print to stderr the time spent importing each module.")
+    subparsers = parser.add_subparsers(title="subcommands")
+
+    preprocess = subparsers.add_parser("preprocess", help="Run preprocessing() and save its outputs.")
+    _add_preprocessing_arguments(preprocess)
+    preprocess.add_argument("--attributes-only", action="store_true",
+                            help="Compute the student attributes only, not the enrollment records.")
+    preprocess.add_argument("--contacts-csv", help="Path of a csv file to which to write contacts_df.")
+    preprocess.add_argument("--record-store", help="Path of a record store file for the enrollment records.")
+    preprocess.set_defaults(function=command_preprocess)
+
+    export_spmf = subparsers.add_parser("export-spmf", help="Write a SPMF input file of course sequences.")
+    export_spmf.add_argument("spmf_input_file_name", help="Name of the input file to create in SPMF_DIR.")
+    _add_preprocessing_arguments(export_spmf)
+    export_spmf.add_argument("--first-cohort", type=int, default=2009, help="First cohort year to include.")
+    export_spmf.add_argument("--last-cohort", type=int, default=2016, help="Last cohort year to include.")
+    export_spmf.add_argument("--seasons", nargs="+", choices=SEASONS_LIST, default=["Fall", "Spring", "Summer"],
+                             help="Seasons of the semesters to include.")
+    export_spmf.add_argument("--passing-only", action="store_true", help="Include passed courses only.")
+    export_spmf.add_argument("--capture-gaps", action="store_true", help="Mark semesters with no courses.")
+    export_spmf.add_argument("--comp-only", action="store_true", help="Comparison students only.")
+    export_spmf.set_defaults(function=command_export_spmf, attributes_only=False)
+
+    export = subparsers.add_parser("export", help="Write the partitioned extracts of the enrollment data.")
+    _add_preprocessing_arguments(export)
+    export.add_argument("--tables", nargs="+", choices=["enrollment", "panel", "summary"],
+                        default=["enrollment", "panel", "summary"], help="Tables to export.")
+    export.add_argument("--formats", nargs="+", choices=["csv", "parquet", "feather"], default=["csv"],
+                        help="File formats to write; parquet and feather need pyarrow.")
+    export.add_argument("--chunk-students", type=int, default=20000,
+                        help="Number of students whose tables are built and written at a time.")
+    export.add_argument("--output-dir", help="Directory of the extracts; EXPORT_DIR if not given.")
+    export.set_defaults(function=command_export, attributes_only=False)
+
+    mine = subparsers.add_parser("mine", help="Run an SPMF algorithm on an input file.")
+    mine.add_argument("input_file_name", help="Name of the input file in SPMF_DIR.")
+    mine.add_argument("output_file_name", help="Name of the output file to create in SPMF_DIR.")
+    mine.add_argument("min_support", help="Minimum support, as a percentage or a proportion.")
+    mine.add_argument("--algorithm", default="CM-SPADE", help="Name of the SPMF algorithm.")
+    mine.add_argument("algorithm_arguments", nargs="*", help="Further arguments of the algorithm.")
+    mine.set_defaults(function=command_mine)
+
+    spans = subparsers.add_parser("spans", help="Count the semesters spanned by a three-course sequence.")
+    spans.add_argument("spmf_file_name", help="Name of the SPMF input file in SPMF_DIR.")
+    spans.add_argument("courses", nargs=3, help="The three courses of the sequence, e.g., MATH110.")
+    spans.set_defaults(function=command_spans)
+
+    report = subparsers.add_parser("report", help="Print the stage table of a preprocessing report or trace.")
+    report.add_argument("report_file", help="Path of a file written by preprocess --report or --trace.")
+    report.set_defaults(function=command_report)
+
+    serve = subparsers.add_parser("serve", help="Serve the preprocessed data over a Unix domain socket.")
+    students = serve.add_mutually_exclusive_group()
+    students.add_argument("--metro-only", action="store_true", help="Metro students only.")
+    students.add_argument("--metro-comp", action="store_true", help="Metro and Comparison students only.")
+    serve.add_argument("--all-years", action="store_true", help="Keep the students of cohort years after 2016.")
+    serve.add_argument("--socket-path", help="Path of the Unix domain socket; DEFAULT_SOCKET_PATH if not given.")
+    serve.add_argument("--poll-seconds", type=float, default=30,
+                       help="Interval between checks for changed data files; 0 to never reload.")
+    serve.set_defaults(function=command_serve)
+
+    return parser
+
+
+def main(argv=None):
+    """Parse the arguments and run a subcommand.
+
+    Args:
+        argv (list): The arguments; sys.argv[1:] if None.
+
+    Returns:
+        The exit status of the subcommand.
+
+    """
+
+    arguments = build_parser().parse_args(argv)
+    if not arguments.profile_import:
+        return arguments.function(arguments)
+    profiler = ImportProfiler()
+    profiler.install()
+    try:
+        return arguments.function(arguments)
+    finally:
+        profiler.uninstall()
+        sys.stderr.write(profiler.summary() + "\n")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,15 +7,19 @@ and csv files exported by San Francisco State University's Campus Solutions (CS)
 
 When any new data directories are created or the paths to existing ones are modified, those changes should be made
 in this file.
+
+The data directory can be moved elsewhere (for example, to a directory of synthetic data generated by
+benchmarks/synthetic_data.py) by setting the METRO_DATA_DIR environment variable before these modules are imported.
 """
 
 import os
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(ROOT_DIR, "data")
+DATA_DIR = os.environ.get("METRO_DATA_DIR", os.path.join(ROOT_DIR, "data"))
 HOME_DIR = os.path.expanduser("~")
 SPMF_DIR = os.path.join(DATA_DIR, "spmf")
 BIN_DIR = os.path.join(ROOT_DIR, "bin")
 OUTPUT_DIR = os.path.join(ROOT_DIR, "output")
+CACHE_DIR = os.path.join(OUTPUT_DIR, "cache")
 RSTCMP2_QUERY_DIR = os.path.join(DATA_DIR, "Rstcmp2_queries")
 NSSE_DIR = os.path.join(DATA_DIR, "nsse")
\ No newline at end of file
@@ -5,27 +5,55 @@ and some feature engineering, and populates certain data structures.  These
 structures are made available to other modules and can be used for
 analysis of student performance and demographics data.
 
+The work is organized in named stages, each in its own function: reading the Salesforce exports,
+resolving Salesforce identifiers, attaching pathways, deriving outcomes, merging IR data, ingesting the
+term-by-term enrollment data, and computing progress metrics.  Passing a PipelineReport (see
+utilities/instrumentation.py) to preprocessing() records the time, memory and row counts of each stage.
+For studies of all students, the out_of_core option keeps the enrollment records on disk, in shards of students,
+instead of in memory.  Studies that compare rosters (Metro only, Metro and Comparison, all students) can get all
+of them from preprocessing_variants(), which reads the data once.  When only a few Salesforce records changed,
+refresh_attributes() recomputes the attributes of their students alone.
+
 Functions exported by this module include:
     preprocessing(): collect, transform, and return structures for student data
+    preprocessing_variants(): the results of preprocessing() for several rosters, from one pass over the data
+    refresh_attributes(): recompute the attributes of some students, e.g., those whose Salesforce records changed
 
 """
 
+import csv
 import os, sys
+from collections import Counter
 import pandas as pd
 import numpy as np
 import time
-from configuration import DATA_DIR, HOME_DIR
+from configuration import DATA_DIR, HOME_DIR, CACHE_DIR
 from model import course, course_group, pathway
-from utilities.helpers import parse_term_from_filename
+from utilities.helpers import parse_term_from_filename, convert_semester_name_to_semester_number
 from utilities.tables import Csv
+from utilities.enrollment import build_enrollment_df
+from utilities.record_store import write_record_store, student_shard, ShardedRecordStore, RECORD_STORE_SUFFIX
+from utilities.instrumentation import NullReport, RowCounters, ROW_KEPT, ROW_DROPPED_STATUS, \
+    ROW_DROPPED_GRADE, ROW_DROPPED_ROSTER, ROW_DROPPED_DUPLICATE
+from analysis.metrics import compute_term_metrics
 from utilities.file_constants import *
 from utilities.other_constants import GRADE_POINT_DICT, GRADE_OUTCOME_DICT, NUMBERS_TO_SEMESTERS_DICT, \
     SEMESTERS_TO_NUMBERS_DICT, VALID_GRADES, SEMESTERS_LIST, RACE_RENAMING_DICT, INCOME_CATEGORIES_DICT,\
     INCOMPLETE_GRADES
 
 
+DEFAULT_SHARD_DIR = os.path.join(CACHE_DIR, "enrollment_shards")
+DEFAULT_SHARDS = 16
+# maps each roster variant to the metro_only and metro_comp arguments of preprocessing(), from narrowest to widest
+ROSTER_VARIANTS_DICT = {"metro_only": (True, False), "metro_comp": (False, True), "all": (False, False)}
+ROSTER_VARIANTS_LIST = ["metro_only", "metro_comp", "all"]
+PREPROCESSING_STAGES_LIST = ["salesforce_load", "id_resolution", "pathways", "outcomes", "ir_merge",
+                             "enrollment_ingestion", "progress_metrics"]
+
+
 def preprocessing(metro_only=False, metro_comp=False, contacts_through_2016=True,
-                  attributes_only=False):
+                  attributes_only=False, report=None, row_counters=None, out_of_core=False, shard_dir=None,
+                  n_shards=DEFAULT_SHARDS, return_row_counters=False):
     """Collect, transform, feature-engineer, and return student data for analysis by callers.
 
     The student data exists as a collection of csv files, which are stored in the /data directory.
@@ -49,16 +77,238 @@ def preprocessing(metro_only=False, metro_comp=False, contacts_through_2016=True
         attributes_only (bool): If true, consider and return only the demographic and personal attributes of
         students.  If false, the semester-by-semester academic performance of the students is also
         collected, engineered, and returned.
-
-    Returns: The tuple (contacts_df, student_record_dict, roster_dict).
+        report (PipelineReport): If given, the time, memory and row counts of each stage (see
+            PREPROCESSING_STAGES_LIST) are recorded in it.  See utilities/instrumentation.py.
+        row_counters (RowCounters): If given, the numbers of rows of the enrollment files that were kept and
+            dropped, by file, student category and reason, are added to it.  See utilities/instrumentation.py.
+        out_of_core (bool): If true, the enrollment records are partitioned by student into n_shards record store
+            files in shard_dir, processed one shard at a time, and returned as a ShardedRecordStore (see
+            utilities/record_store.py), which opens the shards with memory mapping and builds CourseGroup objects
+            only on access.  Use it for studies of all students, whose records may not fit in memory.
+        shard_dir (str): Directory of the shards; DEFAULT_SHARD_DIR if None.
+        n_shards (int): Number of shards.
+        return_row_counters (bool): If true, also return the RowCounters of the enrollment files (row_counters, if
+            given, or a new one), as a fourth element.
+
+    Returns: The tuple (contacts_df, student_record_dict, roster_dict), or, if return_row_counters, the tuple
+            (contacts_df, student_record_dict, roster_dict, row_counters).
         contacts_df is a pandas dataframe containing student demographic and personal attributes.
         student_record_dict is a Python dictionary whose keys are student id's and whose values are
             Python dictionaries, which in turn map semester numbers (i.e., Fall 2009 is 1, Winter 2009
                 is 2, etc.) to CourseGroup objects (see the model/course_group.py file).
                 If attributes_only, the student_record_dict is None.
+                If out_of_core, it is a ShardedRecordStore holding the same records.
         roster_dict is a Python dictionary that maps the strings "metro", "comp", and "combined" to
             Python sets containing the student id's for Metro, Comparison and Metro plus Comparison students
             respectively.
+        row_counters is the RowCounters of the enrollment files; None if attributes_only.
+
+    """
+
+    report = NullReport() if report is None else report
+    contacts_df, roster_dict = _preprocess_attributes(contacts_through_2016, report)
+
+    if attributes_only:
+        results = (_filter_to_roster(contacts_df, metro_only, metro_comp), None, roster_dict)
+        return results + (None,) if return_row_counters else results
+
+    #################################
+    ##### Enrollment Processing #####
+    #################################
+
+    with report.stage("enrollment_ingestion") as stage:
+        row_counters = RowCounters() if row_counters is None else row_counters
+        if out_of_core:
+            student_record_dict, total_rows_read = _ingest_enrollments_out_of_core(
+                roster_dict, metro_only, metro_comp, row_counters,
+                DEFAULT_SHARD_DIR if shard_dir is None else shard_dir, n_shards)
+        else:
+            student_record_dict, total_rows_read = _ingest_enrollments(roster_dict, metro_only, metro_comp,
+                                                                       row_counters)
+        stage.rows_in = total_rows_read
+        stage.rows_out = row_counters.total(ROW_KEPT)
+        stage.extra["students"] = len(student_record_dict)
+        stage.extra["rows_by_reason"] = {x: row_counters.total(x) for x in set(y[2] for y in row_counters.counts)}
+
+    with report.stage("progress_metrics") as stage:
+        stage.rows_in = len(contacts_df)
+        contacts_df = _compute_progress_metrics(contacts_df, student_record_dict, metro_only, metro_comp)
+        contacts_df = _filter_to_roster(contacts_df, metro_only, metro_comp)
+        stage.rows_out = len(contacts_df)
+    print "total rows read: ", total_rows_read
+
+    if return_row_counters:
+        return contacts_df, student_record_dict, roster_dict, row_counters
+    return contacts_df, student_record_dict, roster_dict
+
+
+def preprocessing_variants(variants=ROSTER_VARIANTS_LIST, contacts_through_2016=True, report=None,
+                           row_counters_dict=None):
+    """Return the results of preprocessing() for several rosters of students, reading the data only once.
+
+    A study often needs preprocessing(metro_only=True), preprocessing(metro_comp=True) and preprocessing() alike.
+    The three differ only in which students are kept, so this function reads and processes every file once, for
+    the widest roster requested, and computes the progress metrics once, for the widest of the Metro-only and
+    Metro-and-Comparison rosters requested.  Each variant is then a filtered view: its student_record_dict is a
+    new dictionary holding the same CourseGroup objects as the others, and its contacts_df a filter of a shared
+    DataFrame.  Each variant is equal to what preprocessing() returns with the variant's arguments.
+
+    Args:
+        variants (iterable): Names of the variants, in ROSTER_VARIANTS_DICT: "metro_only", "metro_comp" and "all".
+        contacts_through_2016 (bool): If true, only students in 2009-2016 cohort years are considered.
+        report (PipelineReport): If given, the time, memory and row counts of each stage are recorded in it.
+        row_counters_dict (dict): If given, maps variant names to RowCounters objects, to which the numbers of rows
+            kept and dropped are added as preprocessing() would add them for that variant.
+
+    Returns:
+        Dictionary mapping each variant name to its tuple (contacts_df, student_record_dict, roster_dict); the
+        roster_dict is shared.
+
+    """
+
+    variants = list(variants)
+    unknown_variants = [x for x in variants if x not in ROSTER_VARIANTS_DICT]
+    if unknown_variants or not variants:
+        raise ValueError("Unknown roster variants: " + ", ".join(unknown_variants) if unknown_variants
+                         else "No roster variant was requested.")
+    report = NullReport() if report is None else report
+    contacts_df, roster_dict = _preprocess_attributes(contacts_through_2016, report)
+
+    # the widest roster requested decides which records are read
+    widest_variant = [x for x in ROSTER_VARIANTS_LIST[::-1] if x in variants][0]
+    with report.stage("enrollment_ingestion") as stage:
+        row_counters = RowCounters()
+        student_record_dict, total_rows_read = _ingest_enrollments(roster_dict,
+                                                                   *ROSTER_VARIANTS_DICT[widest_variant],
+                                                                   row_counters=row_counters)
+        stage.rows_in = total_rows_read
+        stage.rows_out = row_counters.total(ROW_KEPT)
+        stage.extra["students"] = len(student_record_dict)
+        stage.extra["rows_by_reason"] = {x: row_counters.total(x) for x in set(y[2] for y in row_counters.counts)}
+
+    variants_dict = dict()
+    with report.stage("progress_metrics") as stage:
+        stage.rows_in = len(contacts_df)
+        metrics_variants = [x for x in ("metro_comp", "metro_only") if x in variants]
+        if metrics_variants:
+            metrics_roster = _variant_roster(roster_dict, metrics_variants[0])
+            metrics_contacts_df = _compute_progress_metrics(
+                contacts_df, _records_view(student_record_dict, metrics_roster),
+                *ROSTER_VARIANTS_DICT[metrics_variants[0]])
+        for each_variant in variants:
+            metro_only, metro_comp = ROSTER_VARIANTS_DICT[each_variant]
+            variant_record_dict = _records_view(student_record_dict, _variant_roster(roster_dict, each_variant))
+            if each_variant == "all":
+                variant_contacts_df = _compute_progress_metrics(contacts_df, variant_record_dict, False, False)
+            else:
+                variant_contacts_df = _filter_to_roster(metrics_contacts_df, metro_only, metro_comp)
+                if len(variant_contacts_df) < len(metrics_contacts_df):
+                    # preprocessing() numbers the rows of a variant of its own from 0
+                    variant_contacts_df = variant_contacts_df.reset_index(drop=True)
+            variants_dict[each_variant] = (variant_contacts_df, variant_record_dict, roster_dict)
+            if row_counters_dict is not None and each_variant in row_counters_dict:
+                row_counters_dict[each_variant].merge(_variant_row_counters(row_counters, metro_only, metro_comp))
+        stage.rows_out = sum(len(x[0]) for x in variants_dict.values())
+        stage.extra["students"] = {x: len(y[0]) for x, y in variants_dict.items()}
+    print "total rows read: ", total_rows_read
+
+    return variants_dict
+
+
+def refresh_attributes(contacts_df, student_ids, metro_only=False, metro_comp=False, contacts_through_2016=True,
+                       report=None):
+    """Recompute the attributes of some students, e.g., those whose Salesforce records changed.
+
+    Only the Contacts, EnrollmentOpportunities and IR records of the given students go through the stages of
+    the attributes (see PREPROCESSING_STAGES_LIST), and their rows replace those of contacts_df.  Students who
+    are no longer in the exports, or no longer in the roster, are removed.  See utilities/change_capture.py for
+    finding the students whose records changed.
+
+    Args:
+        contacts_df (DataFrame): Student attributes, as returned by preprocessing() with attributes_only and the
+            same metro_only, metro_comp and contacts_through_2016 arguments.
+        student_ids (iterable): Ids of the students to recompute.
+        metro_only (bool): The metro_only argument of preprocessing().
+        metro_comp (bool): The metro_comp argument of preprocessing().
+        contacts_through_2016 (bool): The contacts_through_2016 argument of preprocessing().
+        report (PipelineReport): If given, the stages are recorded in it.
+
+    Returns:
+        A new contacts_df, with the rows of the students recomputed.
+
+    """
+
+    report = NullReport() if report is None else report
+    student_ids = set(student_ids)
+    refreshed_df, roster_dict = _preprocess_attributes(contacts_through_2016, report, student_ids)
+    refreshed_df = _filter_to_roster(refreshed_df, metro_only, metro_comp)
+    refreshed_df = refreshed_df[refreshed_df["student_id"].isin(student_ids)]
+    kept_df = contacts_df[~contacts_df["student_id"].isin(student_ids)]
+    return pd.concat([kept_df, refreshed_df]).sort_index()[contacts_df.columns]
+
+
+def _variant_roster(roster_dict, variant):
+    """Return the set of students of a roster variant, or None for "all"."""
+
+    return {"metro_only": roster_dict["metro"], "metro_comp": roster_dict["combined"], "all": None}[variant]
+
+
+def _records_view(student_record_dict, students_set):
+    """Return the records of the students in students_set, sharing their CourseGroup objects.
+
+    Args:
+        student_record_dict (dict): Mapping of student id's to dictionaries of semester number->CourseGroup pairs.
+        students_set (set): The students to keep; None to keep all of them.
+
+    Returns:
+        student_record_dict itself if no student is left out, else a new dictionary with the same values.
+
+    """
+
+    if students_set is None or students_set.issuperset(student_record_dict):
+        return student_record_dict
+    return {x: y for x, y in student_record_dict.items() if x in students_set}
+
+
+def _variant_row_counters(row_counters, metro_only, metro_comp):
+    """Recount the rows kept and dropped by a wider roster as a narrower roster would have counted them.
+
+    The roster is checked after the status and the grade of a row, and duplicate courses are only found among
+    the rows that pass all three checks, so the rows of the left-out categories that the wider roster counted as
+    kept or duplicate are exactly those the narrower roster drops as not in the roster.
+
+    Args:
+        row_counters (RowCounters): Counts of the wider roster.
+        metro_only (bool): The narrower roster keeps Metro students only.
+        metro_comp (bool): The narrower roster keeps Metro and Comparison students only.
+
+    Returns:
+        A new RowCounters object.
+
+    """
+
+    kept_categories = {"Metro"} if metro_only else {"Metro", "Comp"} if metro_comp else None
+    variant_row_counters = RowCounters()
+    for (term_file, category, reason), rows in row_counters.counts.items():
+        if kept_categories is not None and category not in kept_categories \
+                and reason in (ROW_KEPT, ROW_DROPPED_DUPLICATE):
+            reason = ROW_DROPPED_ROSTER
+        variant_row_counters.counts[(term_file, category, reason)] += rows
+    return variant_row_counters
+
+
+def _preprocess_attributes(contacts_through_2016, report, student_ids=None):
+    """Run the stages that read the Salesforce and IR data into the students' attributes.
+
+    Args:
+        contacts_through_2016 (bool): The contacts_through_2016 argument of preprocessing().
+        report (PipelineReport): Report in which to record the stages.
+        student_ids (set): If given, only the Contacts, EnrollmentOpportunities and IR records of these students
+            are processed; see refresh_attributes().
+
+    Returns:
+        A tuple of (contacts_df, roster_dict), before the enrollment records are read and before contacts_df is
+        limited to any roster; see preprocessing().
 
     """
 
@@ -66,6 +316,55 @@ def preprocessing(metro_only=False, metro_comp=False, contacts_through_2016=True
     ##### Information Specific to Metro ######
     ##########################################
 
+    with report.stage("salesforce_load") as stage:
+        salesforce_dict = _load_salesforce_exports(contacts_through_2016, student_ids)
+        stage.rows_out = len(salesforce_dict["contacts"])
+        stage.extra["files"] = {x: len(y) for x, y in salesforce_dict.items()}
+
+    with report.stage("id_resolution") as stage:
+        stage.rows_in = len(salesforce_dict["contacts"])
+        contacts_df, enrollments_df, roster_dict = _resolve_salesforce_ids(salesforce_dict, contacts_through_2016)
+        stage.rows_out = len(contacts_df)
+
+    #################################
+    #####  Pathways Processing  #####
+    #################################
+    # Each Metro student is assigned to a cohort, which in turn follows a specific pathway, or sequence,
+    #   of 3 foundational Metro courses.  See the model/pathway.py file for more information.
+
+    with report.stage("pathways") as stage:
+        stage.rows_in = len(contacts_df)
+        contacts_df = _attach_pathways(contacts_df)
+        stage.rows_out = len(contacts_df)
+
+    with report.stage("outcomes") as stage:
+        stage.rows_in = len(enrollments_df)
+        contacts_df = _derive_outcomes(contacts_df, enrollments_df)
+        stage.rows_out = len(contacts_df)
+
+    ##########################################
+    #####   Information for all FTFTF   ######
+    ##########################################
+
+    with report.stage("ir_merge") as stage:
+        stage.rows_in = len(contacts_df)
+        contacts_df = _merge_ir_data(contacts_df, student_ids)
+        stage.rows_out = len(contacts_df)
+    return contacts_df, roster_dict
+
+
+def _load_salesforce_exports(contacts_through_2016, student_ids=None):
+    """Read the Salesforce Data Export files and rename their columns.
+
+    Args:
+        contacts_through_2016 (bool): If true, drop Contacts whose applicant pool year is after 2015-2016.
+        student_ids (set): If given, keep only the Contacts of these students, and their EnrollmentOpportunities.
+
+    Returns:
+        A dictionary mapping "contacts", "accounts", "cohorts", "terms" and "enrollments" to DataFrames.
+
+    """
+
     # Read Contacts file
     contact_data_file = os.path.join(DATA_DIR, CONTACTS_FILE)
     contacts_df = pd.read_csv(contact_data_file,
@@ -79,7 +378,6 @@ def preprocessing(metro_only=False, metro_comp=False, contacts_through_2016=True
         contacts_df = contacts_df[~contacts_df['applicant_pool_year'].isin(['2017-2018', '2016-2017', np.nan])]
     contacts_df = contacts_df[~contacts_df['applicant_pool_year'].isnull()]
 
-
     # Read Accounts file
     account_data_file = os.path.join(DATA_DIR, ACCOUNTS_FILE)
     accounts_df = pd.read_csv(account_data_file,
@@ -87,6 +385,54 @@ def preprocessing(metro_only=False, metro_comp=False, contacts_through_2016=True
                               usecols=ACCOUNT_COLUMNS_DICT.keys())
     accounts_df.rename(columns=ACCOUNT_COLUMNS_DICT, inplace=True)
 
+    # Read Cohorts file
+    cohort_data_file = os.path.join(DATA_DIR, COHORTS_FILE)
+    cohorts_df = pd.read_csv(cohort_data_file,
+                             low_memory=False,
+                             usecols=COHORT_COLUMNS_DICT.keys())
+    cohorts_df.rename(columns=COHORT_COLUMNS_DICT, inplace=True)
+
+    # Read the Terms csv so that EnrollmentOpportunity terms can be determined
+    terms_data_file = os.path.join(DATA_DIR, TERMS_FILE)
+    terms_df = pd.read_csv(terms_data_file,
+                           low_memory=False,
+                           usecols=TERM_COLUMNS_DICT.keys())
+    terms_df.rename(columns=TERM_COLUMNS_DICT, inplace=True)
+
+    # Read the EnrollmentOpportunity csv
+    enrollments_data_file = os.path.join(DATA_DIR, ENROLLMENTS_FILE)
+    enrollments_df = pd.read_csv(enrollments_data_file,
+                                 low_memory=False,
+                                 usecols=ENROLLMENT_COLUMNS_DICT.keys())
+    enrollments_df.rename(columns=ENROLLMENT_COLUMNS_DICT, inplace=True)
+    if student_ids is not None:
+        contacts_df = contacts_df[contacts_df["student_id"].isin(student_ids)]
+        enrollments_df = enrollments_df[enrollments_df["student_id"].isin(contacts_df["contact_id"])]
+    return {"contacts": contacts_df,
+            "accounts": accounts_df,
+            "cohorts": cohorts_df,
+            "terms": terms_df,
+            "enrollments": enrollments_df}
+
+
+def _resolve_salesforce_ids(salesforce_dict, contacts_through_2016):
+    """Replace Salesforce record identifiers with names, and build the rosters of Metro and Comparison students.
+
+    Args:
+        salesforce_dict (dict): The DataFrames returned by _load_salesforce_exports().
+        contacts_through_2016 (bool): If true, drop Contacts in the 2017 and 2018 cohorts.
+
+    Returns:
+        A tuple of (contacts_df, enrollments_df, roster_dict); see preprocessing() for roster_dict.
+
+    """
+
+    contacts_df = salesforce_dict["contacts"]
+    accounts_df = salesforce_dict["accounts"]
+    cohorts_df = salesforce_dict["cohorts"]
+    terms_df = salesforce_dict["terms"]
+    enrollments_df = salesforce_dict["enrollments"]
+
     # In Contacts df, replace Account Id with Account name
     contacts_df['category'].replace(accounts_df
                         .set_index("account_id", verify_integrity=True)
@@ -97,12 +443,6 @@ def preprocessing(metro_only=False, metro_comp=False, contacts_through_2016=True
     contacts_df = contacts_df[contacts_df["category"].isin(CONTACT_STUDENT_TYPES_DICT.values())]
 
     # Add the students' cohorts
-
-    cohort_data_file = os.path.join(DATA_DIR, COHORTS_FILE)
-    cohorts_df = pd.read_csv(cohort_data_file,
-                             low_memory=False,
-                             usecols=COHORT_COLUMNS_DICT.keys())
-    cohorts_df.rename(columns=COHORT_COLUMNS_DICT, inplace=True)
     # In contacts_df, replace Cohort identifier with Cohort name
     contacts_df.replace(cohorts_df
                         .set_index("cohort_id", verify_integrity=True)
@@ -122,45 +462,52 @@ def preprocessing(metro_only=False, metro_comp=False, contacts_through_2016=True
     comp_students_set = set(contacts_df.loc[contacts_df["category"]
                              .isin(["Comp"]), "student_id"]
                              .values)
+    roster_dict = {"metro": metro_students_set,
+                   "comp": comp_students_set,
+                   "combined": combined_students_set}
 
-    #################################
-    #####  Pathways Processing  #####
-    #################################
-    # Each Metro student is assigned to a cohort, which in turn follows a specific pathway, or sequence,
-    #   of 3 foundational Metro courses.  See the model/pathway.py file for more information.
-
-    # Read pathway information associated with each Metro cohort
-    #   Return a dictionary that maps cohort names to Pathway objects
-    cohort_pathway_dict = pathway.Pathway.make_cohort_pathway_dict()
-    contacts_df['Pathway'] = contacts_df['cohort'].map(cohort_pathway_dict)
-
-    # Read the Terms csv so that EnrollmentOpportunity terms can be determined
-    terms_data_file = os.path.join(DATA_DIR, TERMS_FILE)
-    terms_df = pd.read_csv(terms_data_file,
-                           low_memory=False,
-                           usecols=TERM_COLUMNS_DICT.keys())
-    terms_df.rename(columns=TERM_COLUMNS_DICT, inplace=True)
     # remove unneeded term objects
     terms_df = terms_df[(terms_df["term_name"].str.contains("SFSU")) \
         & (~terms_df["term_name"].str.contains("COMP"))]
     # remove leading unwanted characters in the term names
     terms_df["term_name"] = terms_df["term_name"].map(lambda x : x[5:])
     terms_df.set_index("term_id", verify_integrity=True, inplace=True)
-
-
-    # Read the EnrollmentOpportunity csv
-    enrollments_data_file = os.path.join(DATA_DIR, ENROLLMENTS_FILE)
-    enrollments_df = pd.read_csv(enrollments_data_file,
-                                 low_memory=False,
-                                 usecols=ENROLLMENT_COLUMNS_DICT.keys())
-    enrollments_df.rename(columns=ENROLLMENT_COLUMNS_DICT, inplace=True)
     # replace the Term ID with the term number from the Terms csv
-    contacts_df.replace(cohorts_df
-                        .set_index("cohort_id", verify_integrity=True)
-                        .to_dict()["cohort_name"],
-                        inplace=True)
     enrollments_df.replace(terms_df.to_dict()["term_name"], inplace=True)
     enrollments_df.set_index("enrollment_id", verify_integrity=True, inplace=True)
+    return contacts_df, enrollments_df, roster_dict
+
+
+def _attach_pathways(contacts_df):
+    """Map each student's cohort to its Pathway object, in a new Pathway column.
+
+    Args:
+        contacts_df (DataFrame): Student attributes, with a cohort column.
+
+    Returns:
+        contacts_df, with the Pathway column added.
+
+    """
+
+    # Read pathway information associated with each Metro cohort
+    #   Return a dictionary that maps cohort names to Pathway objects
+    cohort_pathway_dict = pathway.Pathway.make_cohort_pathway_dict()
+    contacts_df['Pathway'] = contacts_df['cohort'].map(cohort_pathway_dict)
+    return contacts_df
+
+
+def _derive_outcomes(contacts_df, enrollments_df):
+    """Derive each student's result (Graduated, Left or Open) from the stages of their EnrollmentOpportunities.
+
+    Args:
+        contacts_df (DataFrame): Student attributes.
+        enrollments_df (DataFrame): EnrollmentOpportunity records, with term names resolved.
+
+    Returns:
+        contacts_df, with the result column added.
+
+    """
+
     graduates_df = enrollments_df.drop_duplicates(subset=["student_id", "stage"], keep="first")[['student_id', "stage"]]
     graduates_df["student_id"].replace(contacts_df
                            .set_index("contact_id", verify_integrity=True)
@@ -178,10 +525,21 @@ def preprocessing(metro_only=False, metro_comp=False, contacts_through_2016=True
                 return "Open"
     aggregated = grouped.apply(get_result)
     contacts_df['result'] = contacts_df['student_id'].map(aggregated.to_dict())
+    return contacts_df
 
-    ##########################################
-    #####   Information for all FTFTF   ######
-    ##########################################
+
+def _merge_ir_data(contacts_df, student_ids=None):
+    """Combine the IR data for all first-time freshmen with the Salesforce attributes of the students.
+
+    Args:
+        contacts_df (DataFrame): Student attributes from Salesforce.
+        student_ids (set): If given, only the IR data of these students is combined.
+
+    Returns:
+        A DataFrame of attributes for all first-time freshmen, indexed by student id, in which students
+        who are neither Metro nor Comparison students have the category "Other".
+
+    """
 
     # Read and create a data frame for IR data
     ir_df = pd.DataFrame()
@@ -217,6 +575,8 @@ def preprocessing(metro_only=False, metro_comp=False, contacts_through_2016=True
     ir_df.set_index(keys="student_id", inplace=True, verify_integrity=True, drop=False)
     if len(ir_df.index.get_duplicates())>0:
         raise ValueError("The IR dataframe has duplicated indexes before merging with contacts.")
+    if student_ids is not None:
+        ir_df = ir_df[ir_df["student_id"].isin(student_ids)]
     # Now combine the attributes data contained in ir_df into contacts_df
     contacts_df.set_index(keys='student_id', inplace=True, verify_integrity=True, drop=False)
     contacts_df = contacts_df.combine_first(ir_df)
@@ -230,85 +590,196 @@ def preprocessing(metro_only=False, metro_comp=False, contacts_through_2016=True
 
     # Label all non-Metro and non-Comparison students as being in "other" category
     contacts_df.loc[~contacts_df["category"].isin(["Metro", "Comp"]), "category"] = "Other"
+    return contacts_df
 
-    if attributes_only:
-        if metro_only:
-            contacts_df = contacts_df[contacts_df["category"] == "Metro"]
-        else:
-            if metro_comp:
-                contacts_df = contacts_df[contacts_df["category"].isin(["Metro", "Comp"])]
-        roster_dict = {"metro": metro_students_set,
-                       "comp": comp_students_set,
-                       "combined": combined_students_set}
-        return contacts_df, None, roster_dict
-    
-    #################################
-    ##### Enrollment Processing #####
-    #################################
 
-    semesters_to_numbers_dict = dict()  # maps semester names ("Fall 2009") to semester numbers (1)
-    numbers_to_semesters_dict = dict()  # maps semester numbers (1) to semester names ("Fall 2009")
+def _filtered_query_files(roster_dict, metro_only, metro_comp):
+    """Read the term-by-term CS query files, one at a time, and filter their rows.
 
-    semester_no = 1
-    for each_semester in SEMESTERS_LIST:
-        semesters_to_numbers_dict[each_semester] = semester_no
-        numbers_to_semesters_dict[semester_no] = each_semester
-        semester_no += 1
+    Rows are dropped, and counted by student category and reason, when their status is not Enrolled, their
+    grade is not in VALID_GRADES, or their student is outside the requested roster.
 
-    student_record_dict = dict()   # map each student id to a dictionary of term->CourseGroup key-value pairs
-    # Incorporate term-by-term enrollment data in a dict
+    Args:
+        roster_dict (dict): Rosters of Metro and Comparison students; see preprocessing().
+        metro_only (bool): Keep the rows of Metro students only.
+        metro_comp (bool): Keep the rows of Metro and Comparison students only.
+
+    Yields:
+        For each file, in order of file name, a tuple of (file name, number of rows read, Counter of dropped rows
+        keyed by (category, reason), list of (category, student id, semester number, course name, grade letter)
+        tuples for the rows kept, in file order).
+
+    """
+
+    metro_students_set = roster_dict["metro"]
+    comp_students_set = roster_dict["comp"]
     query_files = sorted(os.listdir(os.path.join(DATA_DIR, QUERY_DATA_DIR)))
-    total_rows_read = 0
     for idx, each_file in enumerate(query_files):
         header_row, rows = Csv(csv_file=os.path.join(os.path.join(DATA_DIR, QUERY_DATA_DIR), each_file),
                                has_duplicate_column_names=True
                                ).read_csv()
         print "Reading file", idx+1, "of", len(query_files), "...", each_file, "# rows:", len(rows)
-        for idx, row in enumerate(rows):
-            total_rows_read+=1
+        semester_number = convert_semester_name_to_semester_number(parse_term_from_filename(each_file))
+        file_counts = Counter()     # maps (category, reason) to the number of rows of this file
+        kept_rows = []
+        for row in rows:
             student_id = row["SF State ID"]
-            status = row["Status"]
             grade_letter = row["Grade"]
-            # Skip this row of the csv file if conditions warrant
-            if status != "Enrolled" or grade_letter not in VALID_GRADES: continue
-            if metro_only and student_id not in metro_students_set : continue
+            if student_id in metro_students_set:
+                category = "Metro"
+            elif student_id in comp_students_set:
+                category = "Comp"
             else:
-                if metro_comp and student_id not in combined_students_set: continue
-            grade = GRADE_POINT_DICT[grade_letter]
+                category = "Other"
+            # Skip this row of the csv file if conditions warrant
+            if row["Status"] != "Enrolled":
+                file_counts[(category, ROW_DROPPED_STATUS)] += 1
+                continue
+            if grade_letter not in VALID_GRADES:
+                file_counts[(category, ROW_DROPPED_GRADE)] += 1
+                continue
+            if (metro_only and category != "Metro") or (metro_comp and category == "Other"):
+                file_counts[(category, ROW_DROPPED_ROSTER)] += 1
+                continue
             #admit_term = row["Admit Term"]
-            semester = SEMESTERS_TO_NUMBERS_DICT[parse_term_from_filename(each_file)]
-            semester_number = semester
-            course_name = row["Class"].replace(" ", "")
-            this_course_object = course.Course(semester_number=semester_number,
-                                               course=course_name,
-                                               grade=grade,
-                                               grade_letter=grade_letter,
-                                               student_id=student_id)
-            # Add it to this student's CourseGroup for that term
-            #     First check if student exists in the outer dict yet:
-            try:
-                term_CourseGroup_dict = student_record_dict[student_id]
-                # If student has a CourseGroup for this semester, add this Course to it
-                try:
-                    current_CourseGroup = term_CourseGroup_dict[semester_number]
-                    current_CourseGroup.add_Course(this_course_object)
-                    term_CourseGroup_dict[semester_number] = current_CourseGroup
-                # if a student has no CourseGroup yet for this semester, create it
-                except:
-                    new_CourseGroup = course_group.CourseGroup(semester_number=semester_number,
-                                                               student_id=student_id)
-                    new_CourseGroup.add_Course(this_course_object)
-                    term_CourseGroup_dict[semester_number] = new_CourseGroup
-                student_record_dict[student_id] = term_CourseGroup_dict
-            # If a student doesn't exist in the outer dict yet, create a dictionary
-            #     and add the first term->CourseGroup key-value pair to it
-            except KeyError:
-                term_CourseGroup_dict = dict()
-                new_CourseGroup = course_group.CourseGroup(semester_number=semester_number,
-                                                           student_id=student_id)
-                new_CourseGroup.add_Course(this_course_object)
-                term_CourseGroup_dict[semester_number] = new_CourseGroup
-                student_record_dict[student_id] = term_CourseGroup_dict
+            kept_rows.append((category, student_id, semester_number, row["Class"].replace(" ", ""), grade_letter))
+        yield each_file, len(rows), file_counts, kept_rows
+
+
+def _add_course_to_records(student_record_dict, student_id, semester_number, course_name, grade_letter):
+    """Add one course to a student_record_dict, unless the student already has it in that semester.
+
+    Args:
+        student_record_dict (dict): Mapping of student id's to dictionaries of semester number->CourseGroup pairs.
+        student_id (str): The student's identifier.
+        semester_number (int): The semester of the course.
+        course_name (str): The name of the course, without spaces.
+        grade_letter (str): The letter grade, one of VALID_GRADES.
+
+    Returns:
+        True if the course was added, False if it was a duplicate course.
+
+    """
+
+    # Add it to this student's CourseGroup for that term
+    #     creating the student's dictionary and the CourseGroup if they do not exist yet
+    term_CourseGroup_dict = student_record_dict.setdefault(student_id, dict())
+    current_CourseGroup = term_CourseGroup_dict.get(semester_number)
+    if current_CourseGroup is None:
+        current_CourseGroup = course_group.CourseGroup(semester_number=semester_number,
+                                                       student_id=student_id)
+        term_CourseGroup_dict[semester_number] = current_CourseGroup
+    # add_Course() is called for duplicates too, so that it can track those with differing grades
+    courses_before = len(current_CourseGroup.course_list)
+    current_CourseGroup.add_Course(course.Course(semester_number=semester_number,
+                                                 course=course_name,
+                                                 grade=GRADE_POINT_DICT[grade_letter],
+                                                 grade_letter=grade_letter,
+                                                 student_id=student_id))
+    return len(current_CourseGroup.course_list) > courses_before
+
+
+def _ingest_enrollments(roster_dict, metro_only, metro_comp, row_counters):
+    """Read the term-by-term CS query files into a student_record_dict.
+
+    Args:
+        roster_dict (dict): Rosters of Metro and Comparison students; see preprocessing().
+        metro_only (bool): Keep the records of Metro students only.
+        metro_comp (bool): Keep the records of Metro and Comparison students only.
+        row_counters (RowCounters): Counts of the rows kept and dropped, to which the counts of each file are added.
+
+    Returns:
+        A tuple of (student_record_dict, total number of rows read); see preprocessing() for student_record_dict.
+
+    """
+
+    student_record_dict = dict()   # map each student id to a dictionary of term->CourseGroup key-value pairs
+    total_rows_read = 0
+    # Incorporate term-by-term enrollment data in a dict
+    for each_file, rows_read, file_counts, kept_rows in _filtered_query_files(roster_dict, metro_only, metro_comp):
+        total_rows_read += rows_read
+        for category, student_id, semester_number, course_name, grade_letter in kept_rows:
+            if _add_course_to_records(student_record_dict, student_id, semester_number, course_name, grade_letter):
+                file_counts[(category, ROW_KEPT)] += 1
+            else:
+                file_counts[(category, ROW_DROPPED_DUPLICATE)] += 1
+        row_counters.add_file(each_file, file_counts)
+    return student_record_dict, total_rows_read
+
+
+def _ingest_enrollments_out_of_core(roster_dict, metro_only, metro_comp, row_counters, shard_dir, n_shards):
+    """Read the term-by-term CS query files into record store shards on disk, one shard at a time.
+
+    In the first pass, the kept rows of each query file are appended to n_shards csv files, chosen by a hash of the
+    student id, so that all rows of a student end up in one shard, in the order in which they were read.  In the
+    second pass, each shard is loaded into a student_record_dict, written as a record store file (see
+    utilities/record_store.py), and released.  Only one query file, or one shard, is held in memory at a time.
+
+    Args:
+        roster_dict (dict): Rosters of Metro and Comparison students; see preprocessing().
+        metro_only (bool): Keep the records of Metro students only.
+        metro_comp (bool): Keep the records of Metro and Comparison students only.
+        row_counters (RowCounters): Counts of the rows kept and dropped, to which the counts of each file are added.
+        shard_dir (str): Directory in which to write the shards; its previous shards are replaced.
+        n_shards (int): Number of shards.
+
+    Returns:
+        A tuple of (ShardedRecordStore over the shards, total number of rows read).
+
+    """
+
+    if not os.path.isdir(shard_dir):
+        os.makedirs(shard_dir)
+    rows_paths = [os.path.join(shard_dir, "shard_" + str(x) + ".csv") for x in range(n_shards)]
+    store_paths = [os.path.join(shard_dir, "shard_" + str(x) + RECORD_STORE_SUFFIX) for x in range(n_shards)]
+    total_rows_read = 0
+    query_files = []
+    rows_files = [open(x, "wb") for x in rows_paths]
+    try:
+        writers = [csv.writer(x) for x in rows_files]
+        for each_file, rows_read, file_counts, kept_rows in _filtered_query_files(roster_dict, metro_only,
+                                                                                   metro_comp):
+            total_rows_read += rows_read
+            row_counters.add_file(each_file, file_counts)
+            for each_row in kept_rows:
+                writers[student_shard(each_row[1], n_shards)].writerow((len(query_files),) + each_row)
+            query_files.append(each_file)
+    finally:
+        for each_rows_file in rows_files:
+            each_rows_file.close()
+
+    for rows_path, store_path in zip(rows_paths, store_paths):
+        shard_record_dict = dict()
+        shard_counts = Counter()    # maps (file index, category, reason) to the number of rows
+        with open(rows_path, "rb") as rows_file:
+            for file_index, category, student_id, semester_number, course_name, grade_letter in csv.reader(rows_file):
+                if _add_course_to_records(shard_record_dict, student_id, int(semester_number), course_name,
+                                          grade_letter):
+                    shard_counts[(int(file_index), category, ROW_KEPT)] += 1
+                else:
+                    shard_counts[(int(file_index), category, ROW_DROPPED_DUPLICATE)] += 1
+        write_record_store(shard_record_dict, store_path)
+        os.remove(rows_path)
+        for file_index in sorted(set(x[0] for x in shard_counts)):
+            row_counters.add_file(query_files[file_index], Counter({(x[1], x[2]): y for x, y in shard_counts.items()
+                                                                     if x[0] == file_index}))
+    return ShardedRecordStore(store_paths), total_rows_read
+
+
+def _compute_progress_metrics(contacts_df, student_record_dict, metro_only, metro_comp):
+    """Limit contacts_df to students with enrollment records and add their progress metrics.
+
+    Args:
+        contacts_df (DataFrame): Student attributes.
+        student_record_dict (dict): The records returned by _ingest_enrollments(), or a ShardedRecordStore of them.
+        metro_only (bool): The metro_only argument of preprocessing().
+        metro_comp (bool): The metro_comp argument of preprocessing().
+
+    Returns:
+        contacts_df, limited to students who registered at some point, with the core_progress and
+        fourth_completion columns added for Metro-only or Metro-and-Comparison studies.
+
+    """
 
     # need the student_records_dict to be limited only to students who registered at some point
     students_full_set = set(contacts_df["student_id"].values).intersection(student_record_dict)
@@ -316,42 +787,26 @@ def preprocessing(metro_only=False, metro_comp=False, contacts_through_2016=True
 
     # Use this student_records_dict to compute
     #     (1) core-pathway progress (0 for Comp students) and
-    #     (2) 4th-term completion
+    #     (2) 4th-term completion (see analysis/metrics.py for other terms and for persistence)
     # Add these fields to each student record
-
     if not(metro_only==False and metro_comp==False):
+        if isinstance(student_record_dict, ShardedRecordStore):
+            # Out-of-core: compute the metrics shard by shard, never holding all enrollments in one frame
+            fourth_term_metrics_df = student_record_dict.map_shards(
+                lambda x: compute_term_metrics(
+                    x, contacts_df[contacts_df["student_id"].isin(x["student_id"].unique())], terms=[4]))
+        else:
+            fourth_term_metrics_df = compute_term_metrics(build_enrollment_df(student_record_dict), contacts_df,
+                                                          terms=[4])
+        fourth_term_completion_df = fourth_term_metrics_df\
+            .rename(columns={"completion_4": "fourth_completion"})[["student_id", "fourth_completion"]]
         progress_df = pd.DataFrame(columns=["student_id", "core_progress"])
-        fourth_term_completion_df = pd.DataFrame(columns=["student_id", "fourth_completion"])
         for idx, student_id in enumerate(student_record_dict):
             this_student_records_dict = student_record_dict[student_id]
             try:
                 cohort_year = str(int(contacts_df.loc[contacts_df["student_id"] == student_id, "cohort_year"].item()))
             except ValueError:
                 continue
-            first_term_numeric = SEMESTERS_TO_NUMBERS_DICT["Fall "+cohort_year]
-            first_4_terms_set = set(range(first_term_numeric, first_term_numeric+7, 2))
-            if first_term_numeric+6 not in this_student_records_dict.keys()\
-                    or len(first_4_terms_set.intersection(this_student_records_dict.keys()))<3:
-                fourth_completion = False
-            else:
-                try:
-                    fourthcoursegroup = this_student_records_dict[first_term_numeric+6]
-                    incomplete = True
-                    courses = []
-                    for this_course in fourthcoursegroup.course_list:
-                        courses.append( (this_course.course, this_course.grade_letter))
-                        if this_course.grade_letter not in INCOMPLETE_GRADES:
-                            incomplete = False
-                            fourth_completion = True
-                            break
-                    if incomplete:
-                        fourth_completion = False
-                except KeyError:
-                    fourth_completion = False
-            fourth_term_completion_df = fourth_term_completion_df\
-                .append(pd.DataFrame({"student_id":[student_id],
-                                      "fourth_completion": [fourth_completion]}),
-                        ignore_index=True)
             # Now populate the progress data frame
             # Metro students have a Pathway - compute how many courses from it were taken
             # Comp students do not have a Pathway: core progress is 0
@@ -371,21 +826,28 @@ def preprocessing(metro_only=False, metro_comp=False, contacts_through_2016=True
         progress_df["core_progress"] = progress_df["core_progress"].astype('int8')
         contacts_df = contacts_df.merge(progress_df, how="outer", on="student_id") \
             .merge(fourth_term_completion_df, how = "outer", on="student_id")
+    return contacts_df
 
-    # Prepare the data structures to be returned to the caller
 
-    roster_dict = {"metro": metro_students_set,
-                   "comp": comp_students_set,
-                   "combined": combined_students_set}
+def _filter_to_roster(contacts_df, metro_only, metro_comp):
+    """Keep only the students that the study asked for.
+
+    Args:
+        contacts_df (DataFrame): Student attributes.
+        metro_only (bool): Keep Metro students only.
+        metro_comp (bool): Keep Metro and Comparison students only.
+
+    Returns:
+        The filtered contacts_df.
+
+    """
 
     if metro_only:
         contacts_df = contacts_df[contacts_df["category"]=="Metro"]
     else:
         if metro_comp:
             contacts_df = contacts_df[contacts_df["category"].isin(["Metro", "Comp"])]
-    print "total rows read: ", total_rows_read
-
-    return contacts_df, student_record_dict, roster_dict
+    return contacts_df
 
 
 if __name__ == '__main__':
@@ -0,0 +1,44 @@
+"""Tests of utilities/instrumentation.py."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from utilities.instrumentation import PipelineReport, read_report
+
+
+class ReadReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _run(self, report, stage_names):
+        for each_name in stage_names:
+            with report.stage(each_name) as record:
+                record.rows_in, record.rows_out = 10, 8
+
+    def test_trace_with_one_stage(self):
+        trace_path = os.path.join(self.directory, "trace.jsonl")
+        self._run(PipelineReport(trace_file=trace_path), ["read_salesforce"])
+        report = read_report(trace_path)
+        self.assertEqual([x.name for x in report.records], ["read_salesforce"])
+        self.assertEqual(report.records[0].rows_out, 8)
+
+    def test_trace_with_several_stages(self):
+        trace_path = os.path.join(self.directory, "trace.jsonl")
+        self._run(PipelineReport(trace_file=trace_path), ["read_salesforce", "merge_ir"])
+        self.assertEqual([x.name for x in read_report(trace_path).records], ["read_salesforce", "merge_ir"])
+
+    def test_json_report(self):
+        report_path = os.path.join(self.directory, "report.json")
+        report = PipelineReport()
+        self._run(report, ["read_salesforce", "merge_ir"])
+        report.write_json(report_path)
+        self.assertEqual([x.name for x in read_report(report_path).records], ["read_salesforce", "merge_ir"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""Tests of analysis/metrics.py."""
+
+import unittest
+import numpy as np
+import pandas as pd
+from analysis.metrics import compute_term_metrics, compare_with_ir_persistence
+from utilities.other_constants import GRADE_POINT_DICT
+
+
+def _enrollment_df(courses_list):
+    """Build an enrollment frame from (student id, semester number, course, grade letter) tuples."""
+
+    return pd.DataFrame({"student_id": [x[0] for x in courses_list],
+                         "semester_number": [x[1] for x in courses_list],
+                         "course": [x[2] for x in courses_list],
+                         "grade": [GRADE_POINT_DICT.get(x[3]) for x in courses_list],
+                         "grade_letter": [x[3] for x in courses_list]},
+                        columns=["student_id", "semester_number", "course", "grade", "grade_letter"])
+
+
+class TermMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        # Cohort 2012 starts in semester 13 (Fall 2012): regular terms 1-5 are semesters 13, 15, 17, 19 and 21.
+        # Cohort 2011 starts in semester 9.
+        self.enrollment_df = _enrollment_df([
+            ("001", 13, "MATH110", "A"), ("001", 15, "ENGL114", "B"), ("001", 17, "BIOL100", "W"),
+            ("001", 19, "PSY200", "C"),
+            ("002", 13, "MATH110", "B"), ("002", 14, "ENGL114", "A"), ("002", 19, "PSY200", "B"),
+            ("003", 9, "MATH110", "A"), ("003", 11, "ENGL114", "A"), ("003", 13, "BIOL100", "A"),
+            ("003", 15, "PSY200", "A"), ("003", 17, "HIST120", "A")])
+        self.contacts_df = pd.DataFrame({"student_id": ["001", "002", "003"], "cohort_year": [2012, 2012, 2011],
+                                         "third_persistence": ["Y", "1", "Y"],
+                                         "fifth_persistence": ["Y", "0", "N"],
+                                         "seventh_persistence": [np.nan, np.nan, "Y"]})
+
+    def test_persistence_completion_and_terms_enrolled(self):
+        metrics_df = compute_term_metrics(self.enrollment_df, self.contacts_df).set_index("student_id")
+        # A withdrawal still counts as enrolled, but not as completed
+        self.assertEqual(list(metrics_df["persistence_3"]), [True, False, True])
+        self.assertEqual(list(metrics_df["completion_3"]), [False, False, True])
+        # The winter semester 14 is not a regular term
+        self.assertEqual(list(metrics_df["terms_enrolled_4"]), [4, 2, 4])
+        self.assertEqual(list(metrics_df["completion_4"]), [True, False, True])
+        self.assertEqual(list(metrics_df["persistence_5"]), [False, False, True])
+
+    def test_ir_persistence_compared_only_through_the_last_semester(self):
+        metrics_df = compute_term_metrics(self.enrollment_df, self.contacts_df)
+        comparison_df = compare_with_ir_persistence(metrics_df, self.contacts_df, last_semester_number=17)\
+            .set_index("field")
+        # Third terms end by semester 17 for both cohorts; fifth terms only for the 2011 cohort; seventh for none
+        self.assertEqual(list(comparison_df["compared"]), [3, 1, 0])
+        self.assertEqual(comparison_df.loc["third_persistence", "agree"], 2)
+        self.assertEqual(comparison_df.loc["third_persistence", "reported_only"], 1)
+        self.assertEqual(comparison_df.loc["fifth_persistence", "computed_only"], 1)
+        self.assertTrue(np.isnan(comparison_df.loc["seventh_persistence", "agreement_rate"]))
+
+    def test_cohort_before_the_first_semester_is_rejected(self):
+        contacts_df = pd.DataFrame({"student_id": ["004"], "cohort_year": [2007]})
+        with self.assertRaises(ValueError):
+            compute_term_metrics(_enrollment_df([("004", 1, "MATH110", "A")]), contacts_df)
+
+
+if __name__ == "__main__":
+    unittest.main()
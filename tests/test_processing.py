@@ -0,0 +1,84 @@
+"""Tests of processing.py."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+import processing
+from benchmarks.synthetic_data import generate_dataset
+from model import course_group
+from utilities.enrollment import build_enrollment_df
+from utilities.instrumentation import RowCounters, ROW_DROPPED_DUPLICATE
+
+
+class AddCourseToRecordsTest(unittest.TestCase):
+
+    def setUp(self):
+        course_group.duplicate_courses_set.clear()
+        course_group.students_with_duplicate_courses_set.clear()
+
+    def test_duplicate_course_with_different_grade_is_tracked(self):
+        student_record_dict = dict()
+        self.assertTrue(processing._add_course_to_records(student_record_dict, "001", 20, "MATH110", "B"))
+        self.assertFalse(processing._add_course_to_records(student_record_dict, "001", 20, "MATH110", "A"))
+        self.assertEqual(len(student_record_dict["001"][20].course_list), 1)
+        self.assertEqual(course_group.duplicate_courses_set, {"MATH110"})
+        self.assertEqual(course_group.students_with_duplicate_courses_set, {"001"})
+
+    def test_duplicate_course_with_same_grade_is_not_tracked(self):
+        student_record_dict = dict()
+        processing._add_course_to_records(student_record_dict, "001", 20, "MATH110", "B")
+        self.assertFalse(processing._add_course_to_records(student_record_dict, "001", 20, "MATH110", "B"))
+        self.assertEqual(course_group.duplicate_courses_set, set())
+
+
+class OutOfCoreIngestionTest(unittest.TestCase):
+    """The out-of-core path of preprocessing() must give the same results as the in-memory path."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        generate_dataset(cls.directory, n_students=300, seed=1)
+        cls.saved_data_dir = processing.DATA_DIR
+        processing.DATA_DIR = cls.directory
+        student_ids = sorted(set(x[1] for each_file in processing._filtered_query_files(
+            {"metro": set(), "comp": set()}, False, False) for x in each_file[3]))
+        cls.roster_dict = {"metro": set(student_ids[:40]), "comp": set(student_ids[40:120])}
+
+    @classmethod
+    def tearDownClass(cls):
+        processing.DATA_DIR = cls.saved_data_dir
+        shutil.rmtree(cls.directory)
+
+    def _contacts_df(self, student_record_dict):
+        student_ids = sorted(self.roster_dict["metro"] | self.roster_dict["comp"])
+        first_semesters = [min(student_record_dict[x]) if x in student_record_dict else 1 for x in student_ids]
+        return pd.DataFrame({"student_id": student_ids,
+                             "cohort_year": [2009 + (x - 1) // 4 for x in first_semesters],
+                             "Pathway": [None] * len(student_ids),
+                             "category": ["Metro" if x in self.roster_dict["metro"] else "Comp"
+                                          for x in student_ids]})
+
+    def test_same_records_counters_and_metrics(self):
+        memory_counters, shard_counters = RowCounters(), RowCounters()
+        memory_records, memory_rows = processing._ingest_enrollments(self.roster_dict, False, True,
+                                                                     memory_counters)
+        shard_records, shard_rows = processing._ingest_enrollments_out_of_core(
+            self.roster_dict, False, True, shard_counters, os.path.join(self.directory, "shards"), 4)
+
+        self.assertEqual(shard_rows, memory_rows)
+        self.assertEqual(shard_counters.counts, memory_counters.counts)
+        self.assertGreater(memory_counters.total(ROW_DROPPED_DUPLICATE), 0)
+        self.assertEqual(sorted(shard_records.keys()), sorted(memory_records))
+        pd.testing.assert_frame_equal(shard_records.to_enrollment_df(), build_enrollment_df(memory_records))
+
+        contacts_df = self._contacts_df(memory_records)
+        memory_df = processing._compute_progress_metrics(contacts_df, memory_records, False, True)
+        shard_df = processing._compute_progress_metrics(contacts_df, shard_records, False, True)
+        pd.testing.assert_frame_equal(shard_df.sort_values("student_id").reset_index(drop=True),
+                                      memory_df.sort_values("student_id").reset_index(drop=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Tests of utilities/record_store.py."""
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+from model import course, course_group
+from utilities.enrollment import build_enrollment_df
+from utilities.other_constants import GRADE_POINT_DICT
+from utilities.record_store import write_record_store, student_shard, RecordStore, ShardedRecordStore
+
+
+def _record_dict(courses_list):
+    """Build a student_record_dict from (student id, semester number, course, grade letter) tuples."""
+
+    student_record_dict = dict()
+    for student_id, semester_number, course_name, grade_letter in courses_list:
+        term_CourseGroup_dict = student_record_dict.setdefault(student_id, dict())
+        if semester_number not in term_CourseGroup_dict:
+            term_CourseGroup_dict[semester_number] = course_group.CourseGroup(semester_number=semester_number,
+                                                                              student_id=student_id)
+        term_CourseGroup_dict[semester_number].add_Course(course.Course(semester_number, course_name,
+                                                                        GRADE_POINT_DICT.get(grade_letter),
+                                                                        grade_letter, student_id))
+    return student_record_dict
+
+
+def _summary(student_record_dict):
+    """Describe the records as plain values that can be compared."""
+
+    return {student_id: {semester_number: ([(x.course, x.grade, x.grade_letter) for x in each_CourseGroup.course_list],
+                                           each_CourseGroup.term_gpa, each_CourseGroup.major)
+                         for semester_number, each_CourseGroup in term_CourseGroup_dict.items()}
+            for student_id, term_CourseGroup_dict in student_record_dict.items()}
+
+
+class RecordStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.student_record_dict = _record_dict([
+            ("912345678", 13, "MATH110", "B+"), ("912345678", 13, "ENGL114", "W"),
+            ("912345678", 15, "MATH124", "A"),
+            ("900000001", 9, "BIOL100", "CR"), ("900000002", 17, "PSY200", "C-")])
+        self.student_record_dict["912345678"][15].term_gpa = 4.0
+        self.student_record_dict["912345678"][15].major = "Biology"
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_records_read_back_equal(self):
+        path = os.path.join(self.directory, "records.bin")
+        write_record_store(self.student_record_dict, path)
+        records = RecordStore(path)
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records.keys(), ["900000001", "900000002", "912345678"])
+        self.assertTrue("912345678" in records)
+        self.assertFalse("999999999" in records)
+        self.assertIsNone(records.get("999999999"))
+        self.assertEqual(_summary(records.to_dict()), _summary(self.student_record_dict))
+        # A grade without grade points (W, CR) stays None, and CourseGroup fields that were not set stay None
+        self.assertIsNone(records["912345678"][13].course_list[1].grade)
+        self.assertIsNone(records["912345678"][13].term_gpa)
+        pd.testing.assert_frame_equal(records.to_enrollment_df(), build_enrollment_df(self.student_record_dict))
+        unpickled = pickle.loads(pickle.dumps(records))
+        self.assertEqual(_summary(unpickled.to_dict()), _summary(self.student_record_dict))
+
+    def test_sharded_records_read_back_equal(self):
+        n_shards = 2
+        paths = [os.path.join(self.directory, "shard_" + str(x) + ".bin") for x in range(n_shards)]
+        for shard, path in enumerate(paths):
+            write_record_store({x: y for x, y in self.student_record_dict.items()
+                                if student_shard(x, n_shards) == shard}, path)
+        records = ShardedRecordStore(paths)
+        self.assertEqual(len(records), 3)
+        self.assertEqual(_summary(records.to_dict()), _summary(self.student_record_dict))
+        self.assertEqual(_summary({"900000002": records["900000002"]}),
+                         _summary({"900000002": self.student_record_dict["900000002"]}))
+        pd.testing.assert_frame_equal(records.to_enrollment_df(), build_enrollment_df(self.student_record_dict))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Tests of analysis/remediation.py."""
+
+import unittest
+import pandas as pd
+from analysis.remediation import build_math_trajectories
+from utilities.other_constants import GRADE_POINT_DICT
+
+
+def _frames(courses_list):
+    """Build contacts and enrollment frames of 2012-cohort students (first semester 13).
+
+    Args:
+        courses_list (list): (student id, semester number, course, grade letter) tuples.
+
+    """
+
+    student_ids = sorted(set(x[0] for x in courses_list))
+    contacts_df = pd.DataFrame({"student_id": student_ids, "cohort_year": [2012] * len(student_ids)})
+    enrollment_df = pd.DataFrame({"student_id": [x[0] for x in courses_list],
+                                  "semester_number": [x[1] for x in courses_list],
+                                  "course": [x[2] for x in courses_list],
+                                  "grade": [GRADE_POINT_DICT.get(x[3]) for x in courses_list],
+                                  "grade_letter": [x[3] for x in courses_list]},
+                                 columns=["student_id", "semester_number", "course", "grade", "grade_letter"])
+    return contacts_df, enrollment_df
+
+
+class FirstAttemptTest(unittest.TestCase):
+
+    def _trajectories(self, courses_list):
+        contacts_df, enrollment_df = _frames(courses_list)
+        trajectories_df = build_math_trajectories(contacts_df, enrollment_df, last_semester_number=21)
+        return trajectories_df.set_index("student_id")
+
+    def test_courses_of_the_first_semester_do_not_depend_on_course_names(self):
+        trajectories_df = self._trajectories([
+            ("001", 13, "MATH110", "F"), ("001", 13, "MATH124", "A"),
+            ("002", 13, "MATH110", "A"), ("002", 13, "MATH124", "F"),
+            ("003", 13, "MATH110", "B"), ("003", 13, "MATH124", "A")])
+        self.assertEqual(list(trajectories_df["first_attempt_passed"]), [False, False, True])
+        self.assertEqual(list(trajectories_df["first_attempt_course"]), ["MATH110", "MATH124", "MATH110"])
+        self.assertEqual(list(trajectories_df["terms_to_completion"]), [1, 1, 1])
+
+
+    def test_retake_remediation_and_withdrawal(self):
+        trajectories_df = self._trajectories([
+            ("004", 13, "MATH110", "F"), ("004", 15, "MATH110", "B"),
+            ("005", 13, "MATH60", "C"), ("005", 15, "MATH110", "A"),
+            ("006", 13, "MATH110", "W")])
+        self.assertEqual(list(trajectories_df["first_attempt_passed"]), [False, True, False])
+        self.assertEqual(list(trajectories_df["attempts"]), [2, 1, 1])
+        self.assertEqual(list(trajectories_df["withdrawals"]), [0, 0, 1])
+        self.assertEqual(list(trajectories_df["completed"]), [True, True, False])
+        self.assertEqual(trajectories_df.loc["004", "terms_to_completion"], 2)
+        self.assertTrue(pd.isnull(trajectories_df.loc["006", "terms_to_completion"]))
+        self.assertEqual(list(trajectories_df["took_remediation"]), [False, True, False])
+        self.assertEqual(trajectories_df.loc["005", "terms_from_remediation"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
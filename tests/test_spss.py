@@ -0,0 +1,70 @@
+"""Tests of utilities/spss.py."""
+
+import datetime
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import numpy as np
+from utilities.spss import read_sav
+
+SPSS_EPOCH = datetime.datetime(1582, 10, 14)
+
+
+def _seconds(moment):
+    """Seconds from the SPSS epoch to a datetime."""
+
+    delta = moment - SPSS_EPOCH
+    return delta.days * 86400.0 + delta.seconds
+
+
+def _write_sav(path, variables_list, cases_list):
+    """Write an uncompressed little-endian system file of numeric variables.
+
+    Args:
+        path (str): Path of the file to write.
+        variables_list (list): (name, format type, width, decimals) of each variable.
+        cases_list (list): Lists of float values, one per case.
+
+    """
+
+    chunks = ["$FL2", "@(#) SPSS DATA FILE test".ljust(60)]
+    chunks.append(struct.pack("<4i", 2, len(variables_list), 0, 0) + struct.pack("<i", len(cases_list)))
+    chunks.append(struct.pack("<d", 100.0) + "01 Sep 17" + "00:00:00" + " " * 64 + "\x00" * 3)
+    for name, format_type, width, decimals in variables_list:
+        print_format = (format_type << 16) | (width << 8) | decimals
+        chunks.append(struct.pack("<6i", 2, 0, 0, 0, print_format, print_format) + name.ljust(8))
+    chunks.append(struct.pack("<2i", 999, 0))
+    for each_case in cases_list:
+        chunks.append(struct.pack("<" + str(len(each_case)) + "d", *each_case))
+    with open(path, "wb") as output_file:
+        output_file.write("".join(chunks))
+
+
+class ReadSavFormatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_date_time_datetime_and_percent_variables(self):
+        path = os.path.join(self.directory, "formats.sav")
+        _write_sav(path, [("ENTRY", 20, 11, 0), ("START", 21, 8, 0), ("STAMP", 22, 20, 0), ("SHARE", 31, 8, 1)],
+                   [[_seconds(datetime.datetime(2017, 9, 1)), 9.5 * 3600,
+                     _seconds(datetime.datetime(2017, 9, 1, 13, 45)), 42.5]])
+        data_frame, metadata_dict = read_sav(path)
+
+        self.assertEqual(data_frame["ENTRY"][0], np.datetime64("2017-09-01T00:00:00"))
+        self.assertEqual(data_frame["START"][0], np.timedelta64(9 * 3600 + 1800, "s"))
+        self.assertEqual(data_frame["STAMP"][0], np.datetime64("2017-09-01T13:45:00"))
+        self.assertEqual(data_frame["SHARE"].dtype, np.dtype('float64'))
+        self.assertEqual(data_frame["SHARE"][0], 42.5)
+        self.assertEqual(metadata_dict["formats"],
+                         {"ENTRY": "DATE11", "START": "TIME8", "STAMP": "DATETIME20", "SHARE": "PCT8.1"})
+
+
+if __name__ == "__main__":
+    unittest.main()
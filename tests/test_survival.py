@@ -0,0 +1,56 @@
+"""Tests of analysis/survival.py."""
+
+import math
+import unittest
+import pandas as pd
+from analysis.survival import kaplan_meier, median_times, CONFIDENCE_Z
+
+
+class KaplanMeierTest(unittest.TestCase):
+
+    def setUp(self):
+        # Two graduate in term 8, one is censored in term 9, one graduates in term 10, one is censored in term 12
+        self.times_df = pd.DataFrame({"category": ["Metro"] * 5,
+                                      "graduation_time": [8, 8, 9, 10, 12],
+                                      "graduation_event": [True, True, False, True, False]})
+
+    def test_survival_and_greenwood_bounds(self):
+        curves_df = kaplan_meier(self.times_df).set_index("term")
+        self.assertEqual(list(curves_df.index), list(range(1, 13)))
+        self.assertEqual(list(curves_df.loc[[7, 8, 9, 10, 11, 12], "at_risk"]), [5, 5, 3, 2, 1, 1])
+        self.assertEqual(list(curves_df.loc[[8, 9, 10, 12], "censored"]), [0, 1, 0, 1])
+        self.assertEqual(curves_df.loc[7, "survival"], 1.0)
+        self.assertEqual(curves_df.loc[7, "ci_lower"], 1.0)
+
+        # Term 8: S = 1 - 2/5; Greenwood sum 2 / (5 * 3)
+        greenwood = 2.0 / 15
+        self.assertAlmostEqual(curves_df.loc[8, "hazard"], 0.4)
+        self.assertAlmostEqual(curves_df.loc[8, "survival"], 0.6)
+        self.assertAlmostEqual(curves_df.loc[8, "std_error"], 0.6 * math.sqrt(greenwood))
+        spread = CONFIDENCE_Z * math.sqrt(greenwood) / abs(math.log(0.6))
+        self.assertAlmostEqual(curves_df.loc[8, "ci_lower"], 0.6 ** math.exp(spread))
+        self.assertAlmostEqual(curves_df.loc[8, "ci_upper"], 0.6 ** math.exp(-spread))
+
+        # Term 10: S = 0.6 * (1 - 1/2); Greenwood sum adds 1 / (2 * 1)
+        greenwood += 0.5
+        self.assertAlmostEqual(curves_df.loc[9, "survival"], 0.6)
+        self.assertAlmostEqual(curves_df.loc[10, "survival"], 0.3)
+        self.assertAlmostEqual(curves_df.loc[10, "std_error"], 0.3 * math.sqrt(greenwood))
+        spread = CONFIDENCE_Z * math.sqrt(greenwood) / abs(math.log(0.3))
+        self.assertAlmostEqual(curves_df.loc[10, "ci_lower"], 0.3 ** math.exp(spread))
+        self.assertAlmostEqual(curves_df.loc[12, "cumulative_incidence"], 0.7)
+
+    def test_strata_and_median(self):
+        times_df = pd.concat([self.times_df,
+                              pd.DataFrame({"category": ["Comp"], "graduation_time": [12],
+                                            "graduation_event": [False]})], ignore_index=True)
+        curves_df = kaplan_meier(times_df, by=["category"])
+        self.assertEqual(sorted(set(curves_df["category"])), ["Comp", "Metro"])
+        self.assertEqual(curves_df[curves_df["category"] == "Comp"]["survival"].min(), 1.0)
+        medians_df = median_times(curves_df, by=["category"]).set_index("category")
+        self.assertEqual(medians_df.loc["Metro", "median_term"], 10)
+        self.assertTrue(math.isnan(medians_df.loc["Comp", "median_term"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
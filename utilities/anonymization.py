@@ -0,0 +1,220 @@
+"""Strip personally-identifying information from the data files, one row at a time.
+
+Before a drop of data files is shared or analyzed, the columns of PERSONAL_INFO_COLUMN_NAMES_LIST (names,
+addresses, phone numbers) are removed, and the student ids of STUDENT_ID_COLUMN_NAMES_LIST are replaced with
+pseudonyms.  A pseudonym is derived from the student id with a keyed hash (HMAC-SHA256), so that:
+    - the same student gets the same pseudonym in every file, and the files can still be joined on student id;
+    - without the key, a pseudonym cannot be traced back to a student id, even by hashing every possible id.
+Pseudonyms are strings of PSEUDONYM_DIGITS digits that do not start with 0, so they are read like student ids.
+The key is passed as an argument, or read from the environment variable named by ANONYMIZATION_KEY_VARIABLE;
+keep it out of the data directory.
+
+Files are read and written row by row with the csv module, so memory use does not grow with the size of a file.
+Each file is written to a temporary file in its own directory, which then replaces it with a single rename, so a
+file is never seen half-anonymized.  The files of a directory are processed in parallel, one per process.
+
+Usage:
+    python -m utilities.anonymization data/ --key-file ~/metro_anonymization.key
+
+Functions exported by this module include:
+    load_key(): find the anonymization key
+    pseudonymize(): the pseudonym of a student id
+    anonymize_file(): anonymize one csv or tsv file in place
+    anonymize_path(): anonymize a file, or all csv and tsv files of a directory in parallel
+
+"""
+
+import argparse
+import csv
+import hashlib
+import hmac
+import multiprocessing
+import os
+import shutil
+import tempfile
+from utilities.other_constants import PERSONAL_INFO_COLUMN_NAMES_LIST, STUDENT_ID_COLUMN_NAMES_LIST
+
+ANONYMIZATION_KEY_VARIABLE = "METRO_ANONYMIZATION_KEY"
+PSEUDONYM_DIGITS = 18
+BACKUP_PREFIX = "_original_file_"
+TEMPORARY_PREFIX = ".anonymizing_"
+TABLE_EXTENSIONS_DELIMITERS_DICT = {".csv": ",", ".tsv": "\t"}
+
+
+def load_key(key=None):
+    """Find the anonymization key.
+
+    Args:
+        key (str): The key; if None, the value of the ANONYMIZATION_KEY_VARIABLE environment variable.
+
+    Returns:
+        The key.
+
+    """
+
+    key = os.environ.get(ANONYMIZATION_KEY_VARIABLE) if key is None else key
+    if not key:
+        raise ValueError("Pseudonyms require a key: pass one, or set the " + ANONYMIZATION_KEY_VARIABLE +
+                         " environment variable.")
+    return key
+
+
+def pseudonymize(student_id, key):
+    """Return the pseudonym of a student id; empty ids stay empty.
+
+    Args:
+        student_id (str): The student id.
+        key (str): The anonymization key.
+
+    Returns:
+        A string of PSEUDONYM_DIGITS digits, the first of which is not 0.
+
+    """
+
+    if student_id == "":
+        return student_id
+    digest = int(hmac.new(key, student_id.strip(), hashlib.sha256).hexdigest(), 16)
+    smallest = 10 ** (PSEUDONYM_DIGITS - 1)
+    return str(smallest + digest % (9 * smallest))
+
+
+def _delimiter(path):
+    return TABLE_EXTENSIONS_DELIMITERS_DICT.get(os.path.splitext(path)[1].lower(), ",")
+
+
+def anonymize_file(path, drop_columns=PERSONAL_INFO_COLUMN_NAMES_LIST, hash_columns=STUDENT_ID_COLUMN_NAMES_LIST,
+                   key=None, make_backup=False):
+    """Anonymize one csv or tsv file in place.
+
+    Every column whose header is in drop_columns is removed, and every value of a column whose header is in
+    hash_columns is replaced with its pseudonym.  Repeated headers are all handled.  A file with none of the
+    columns is left as it is, without being read through.
+
+    Args:
+        path (str): Path to the file; a .tsv file is tab-separated, any other file comma-separated.
+        drop_columns (iterable): Headers of the columns to remove.
+        hash_columns (iterable): Headers of the columns whose values to replace with pseudonyms.
+        key (str): The anonymization key; see load_key().  Only needed if the file has a column to hash.
+        make_backup (bool): Keep the original file, as BACKUP_PREFIX followed by its name, in its directory.
+
+    Returns:
+        Dictionary with the path, the number of data rows (None if the file was left as it is), and the sorted lists
+        of dropped and hashed headers.
+
+    """
+
+    drop_columns, hash_columns = set(drop_columns), set(hash_columns)
+    delimiter = _delimiter(path)
+    directory, file_name = os.path.split(os.path.abspath(path))
+    with open(path, 'rU') as input_file:
+        reader = csv.reader(input_file, delimiter=delimiter)
+        header_row = next(reader, None) or []
+        kept_positions = [x for x, y in enumerate(header_row) if y not in drop_columns]
+        hashed_positions = [x for x, y in enumerate(header_row) if y in hash_columns and y not in drop_columns]
+        summary_dict = {"path": path, "rows": 0,
+                        "dropped": sorted(set(header_row) & drop_columns),
+                        "hashed": sorted(set(header_row[x] for x in hashed_positions))}
+        if not summary_dict["dropped"] and not summary_dict["hashed"]:
+            summary_dict["rows"] = None
+            return summary_dict
+        if hashed_positions:
+            key = load_key(key)
+        descriptor, temporary_path = tempfile.mkstemp(prefix=TEMPORARY_PREFIX + file_name, dir=directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as output_file:
+                writer = csv.writer(output_file, delimiter=delimiter, lineterminator="\n")
+                writer.writerow([header_row[x] for x in kept_positions])
+                for row in reader:
+                    for position in hashed_positions:
+                        if position < len(row):
+                            row[position] = pseudonymize(row[position], key)
+                    writer.writerow([row[x] for x in kept_positions if x < len(row)])
+                    summary_dict["rows"] += 1
+            shutil.copymode(path, temporary_path)
+            if make_backup:
+                backup_path = os.path.join(directory, BACKUP_PREFIX + file_name)
+                if os.path.exists(backup_path):
+                    os.remove(backup_path)
+                os.link(path, backup_path)
+            os.rename(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+    return summary_dict
+
+
+def _table_files(directory):
+    """List the csv and tsv files in a directory and its subdirectories, leaving out backups and temporary files."""
+
+    paths_list = []
+    for each_directory, subdirectories, file_names in os.walk(directory):
+        subdirectories.sort()
+        for each_name in sorted(file_names):
+            if os.path.splitext(each_name)[1].lower() in TABLE_EXTENSIONS_DELIMITERS_DICT \
+                    and not each_name.startswith((BACKUP_PREFIX, TEMPORARY_PREFIX, "~")):
+                paths_list.append(os.path.join(each_directory, each_name))
+    return paths_list
+
+
+def _anonymize_file_job(arguments):
+    """Call anonymize_file() with a tuple of its arguments, in a worker process."""
+
+    return anonymize_file(*arguments)
+
+
+def anonymize_path(path, drop_columns=PERSONAL_INFO_COLUMN_NAMES_LIST, hash_columns=STUDENT_ID_COLUMN_NAMES_LIST,
+                   key=None, make_backups=False, processes=None):
+    """Anonymize a file, or every csv and tsv file of a directory and its subdirectories.
+
+    Args:
+        path (str): Path to a file or a directory.
+        drop_columns (iterable): Headers of the columns to remove.
+        hash_columns (iterable): Headers of the columns whose values to replace with pseudonyms.
+        key (str): The anonymization key; see load_key().  Required if hash_columns is not empty.
+        make_backups (bool): Keep each original file; see anonymize_file().
+        processes (int): Number of worker processes for a directory; the number of CPUs if None.
+
+    Returns:
+        List of the dictionaries returned by anonymize_file(), one per file, in order of path.
+
+    """
+
+    if os.path.isfile(path):
+        paths_list = [path]
+    elif os.path.isdir(path):
+        paths_list = _table_files(path)
+    else:
+        raise IOError("No such file or directory: " + path)
+    # Check the key once, before any worker starts
+    key = load_key(key) if hash_columns else key
+    jobs_list = [(x, sorted(drop_columns), sorted(hash_columns), key, make_backups) for x in paths_list]
+    if len(jobs_list) <= 1 or processes == 1:
+        return [_anonymize_file_job(x) for x in jobs_list]
+    pool = multiprocessing.Pool(processes=processes)
+    try:
+        return pool.map(_anonymize_file_job, jobs_list, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Remove personal information from csv and tsv data files.")
+    parser.add_argument("path", help="A file, or a directory whose files (and subdirectories' files) to anonymize.")
+    parser.add_argument("--key-file", help="File holding the anonymization key; otherwise the key is read from "
+                                           "the " + ANONYMIZATION_KEY_VARIABLE + " environment variable.")
+    parser.add_argument("--no-hash", action="store_true", help="Only remove columns; keep the student ids.")
+    parser.add_argument("--backups", action="store_true", help="Keep a copy of each original file.")
+    parser.add_argument("--processes", type=int, help="Number of worker processes.")
+    arguments = parser.parse_args()
+    key = None
+    if arguments.key_file is not None:
+        with open(arguments.key_file, 'rb') as key_file:
+            key = key_file.read().strip()
+    for each_summary in anonymize_path(arguments.path,
+                                       hash_columns=() if arguments.no_hash else STUDENT_ID_COLUMN_NAMES_LIST,
+                                       key=key, make_backups=arguments.backups, processes=arguments.processes):
+        print("%-60s %10s rows  dropped: %s  hashed: %s" % (each_summary["path"], each_summary["rows"],
+                                                           ", ".join(each_summary["dropped"]) or "-",
+                                                           ", ".join(each_summary["hashed"]) or "-"))
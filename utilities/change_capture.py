@@ -0,0 +1,222 @@
+"""Detect the records that changed between two Salesforce Data Exports.
+
+Each Salesforce Data Export holds every Contact and EnrollmentOpportunity, although only a few hundred of them
+usually change from one export to the next.  This module keeps a snapshot of each export in CHANGE_CAPTURE_DIR:
+for every record, its Salesforce Id, a 64-bit hash of the columns that preprocessing() reads, and the student id
+of the student it belongs to.  Comparing a new export with the snapshot gives the Ids of the records that were
+inserted, updated and deleted, and the student ids of all the students they belong to, before and after the
+change.  A change to a column that preprocessing() does not read (e.g., LastModifiedDate) is not a change.
+
+Rows are hashed all at once with pandas, and snapshots are compared with a single merge on Id.
+
+The students whose records changed are the only ones whose attributes need recomputing:
+    changes_dict = capture_changes()
+    student_ids = affected_student_ids(changes_dict)
+    new_contacts_df = refresh_attributes(contacts_df, student_ids)     # see processing.py
+    cube.refresh_students(new_contacts_df, contacts_df, student_ids)   # see analysis/cube.py
+The first time changes are captured there is no snapshot to compare with: every record is inserted, and the
+changes are marked as initial, so a full preprocessing() is needed instead.
+
+Functions and classes exported by this module include:
+    ExportChanges: the Ids of inserted, updated and deleted records of one export file, and their students
+    hash_export(): hash the rows of an export file
+    diff_snapshots(): compare two hashed exports
+    capture_changes(): compare the current exports with their snapshots, and replace the snapshots
+    affected_student_ids(): the students whose records changed
+
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from configuration import DATA_DIR, CACHE_DIR
+from utilities.file_constants import CONTACTS_FILE, CONTACT_COLUMNS_DICT, ENROLLMENTS_FILE, ENROLLMENT_COLUMNS_DICT
+
+CHANGE_CAPTURE_DIR = os.path.join(CACHE_DIR, "change_capture")
+RECORD_ID_COLUMN = "Id"
+CONTACT_STUDENT_COLUMN = "SFSU_student_ID__c"
+ENROLLMENT_CONTACT_COLUMN = "Contact__c"
+CAPTURED_EXPORTS_DICT = {
+    CONTACTS_FILE: sorted(CONTACT_COLUMNS_DICT),
+    ENROLLMENTS_FILE: sorted(ENROLLMENT_COLUMNS_DICT)
+}
+SNAPSHOT_SUFFIX = ".snapshot.npz"
+
+
+class ExportChanges:
+    """This class holds the changes of one export file between its snapshot and its current version.
+
+    Attributes:
+        file_name (str): Name of the export file.
+        inserted, updated, deleted (set): Salesforce Ids of the records in each state.
+        student_ids (set): Student ids of the changed records, before and after the change.
+        initial (bool): True if there was no snapshot, so that every record counts as inserted.
+
+    """
+
+    def __init__(self, file_name, inserted=(), updated=(), deleted=(), student_ids=(), initial=False):
+        self.file_name = file_name
+        self.inserted = set(inserted)
+        self.updated = set(updated)
+        self.deleted = set(deleted)
+        self.student_ids = set(student_ids)
+        self.initial = initial
+
+    def __len__(self):
+        return len(self.inserted) + len(self.updated) + len(self.deleted)
+
+    def __repr__(self):
+        return "ExportChanges(" + self.file_name + ": " + str(len(self.inserted)) + " inserted, " + \
+            str(len(self.updated)) + " updated, " + str(len(self.deleted)) + " deleted, " + \
+            str(len(self.student_ids)) + " students" + (", initial" if self.initial else "") + ")"
+
+    def summary(self):
+        """Return the numbers of changed records and students, as a dictionary."""
+
+        return {"file": self.file_name, "inserted": len(self.inserted), "updated": len(self.updated),
+                "deleted": len(self.deleted), "students": len(self.student_ids), "initial": self.initial}
+
+
+def hash_export(path, columns, student_ids=None):
+    """Hash the rows of an export file.
+
+    Args:
+        path (str): Path to the csv file.
+        columns (iterable): Columns to hash; those absent from the file are left out, so the hashes depend only on
+            the columns the pipeline reads.
+        student_ids (Series): If given, maps Contact Ids to student ids, and each row belongs to the student of
+            its ENROLLMENT_CONTACT_COLUMN; otherwise it belongs to the student of its CONTACT_STUDENT_COLUMN.
+
+    Returns:
+        A DataFrame indexed by Id, with a uint64 hash column and a student_id column.
+
+    """
+
+    header = pd.read_csv(path, nrows=0).columns
+    owner_column = CONTACT_STUDENT_COLUMN if student_ids is None else ENROLLMENT_CONTACT_COLUMN
+    hashed_columns = sorted(set(columns) & set(header) - {RECORD_ID_COLUMN})
+    export_df = pd.read_csv(path, usecols=sorted(set(hashed_columns) | {RECORD_ID_COLUMN, owner_column}),
+                            dtype=str, keep_default_na=False, low_memory=False)
+    if export_df[RECORD_ID_COLUMN].duplicated().any():
+        raise ValueError("The Ids of " + path + " are not unique.")
+    hashed_df = pd.DataFrame({"hash": pd.util.hash_pandas_object(export_df[hashed_columns], index=False).values},
+                             index=export_df[RECORD_ID_COLUMN].values)
+    owners = export_df[owner_column]
+    if student_ids is not None:
+        owners = owners.map(student_ids).fillna("")
+    hashed_df["student_id"] = owners.values
+    hashed_df.index.name = RECORD_ID_COLUMN
+    return hashed_df
+
+
+def diff_snapshots(previous_df, current_df, file_name=""):
+    """Compare two hashed exports.
+
+    Args:
+        previous_df (DataFrame): The hashed rows of the earlier export, from hash_export(); None if there is none.
+        current_df (DataFrame): The hashed rows of the current export.
+        file_name (str): Name of the export file, for the result.
+
+    Returns:
+        An ExportChanges object.
+
+    """
+
+    if previous_df is None:
+        return ExportChanges(file_name, inserted=current_df.index, student_ids=current_df["student_id"],
+                             initial=True)
+    merged_df = previous_df.join(current_df, how="outer", lsuffix="_previous", rsuffix="_current")
+    in_previous = merged_df["hash_previous"].notnull().values
+    in_current = merged_df["hash_current"].notnull().values
+    updated = in_previous & in_current & \
+        ((merged_df["hash_previous"].values != merged_df["hash_current"].values) |
+         (merged_df["student_id_previous"].values != merged_df["student_id_current"].values))
+    changed_df = merged_df[updated | (in_previous != in_current)]
+    student_ids = set(changed_df["student_id_previous"].dropna()) | set(changed_df["student_id_current"].dropna())
+    student_ids.discard("")
+    return ExportChanges(file_name,
+                         inserted=merged_df.index[in_current & ~in_previous],
+                         updated=merged_df.index[updated],
+                         deleted=merged_df.index[in_previous & ~in_current],
+                         student_ids=student_ids)
+
+
+def _snapshot_path(store_dir, file_name):
+    return os.path.join(store_dir, file_name + SNAPSHOT_SUFFIX)
+
+
+def _read_snapshot(path):
+    """Read a snapshot written by _write_snapshot(); None if there is none."""
+
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as arrays:
+        snapshot_df = pd.DataFrame({"hash": arrays["hashes"], "student_id": arrays["student_ids"].astype(str)},
+                                   index=arrays["ids"].astype(str))
+    snapshot_df.index.name = RECORD_ID_COLUMN
+    return snapshot_df
+
+
+def _write_snapshot(hashed_df, path):
+    """Write the hashed rows of an export, atomically."""
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as snapshot_file:
+        np.savez(snapshot_file, ids=np.array(hashed_df.index.values.tolist(), dtype='S'),
+                 hashes=hashed_df["hash"].values.astype('uint64'),
+                 student_ids=np.array(hashed_df["student_id"].values.tolist(), dtype='S'))
+    os.rename(temporary_path, path)
+
+
+def capture_changes(data_dir=DATA_DIR, store_dir=CHANGE_CAPTURE_DIR, commit=True):
+    """Compare the current Contacts and EnrollmentOpportunity exports with their snapshots.
+
+    Args:
+        data_dir (str): Directory of the export files.
+        store_dir (str): Directory of the snapshots.
+        commit (bool): If true, the current exports replace the snapshots, so that the next call reports the
+            changes made after this one.  Pass False to look at the changes without accepting them.
+
+    Returns:
+        A dictionary mapping the name of each export file of CAPTURED_EXPORTS_DICT to its ExportChanges.
+
+    """
+
+    contacts_df = hash_export(os.path.join(data_dir, CONTACTS_FILE), CAPTURED_EXPORTS_DICT[CONTACTS_FILE])
+    # Enrollment records belong to students through their Contact
+    contact_students = pd.read_csv(os.path.join(data_dir, CONTACTS_FILE),
+                                   usecols=[RECORD_ID_COLUMN, CONTACT_STUDENT_COLUMN], dtype=str,
+                                   keep_default_na=False).set_index(RECORD_ID_COLUMN)[CONTACT_STUDENT_COLUMN]
+    hashed_dict = {
+        CONTACTS_FILE: contacts_df,
+        ENROLLMENTS_FILE: hash_export(os.path.join(data_dir, ENROLLMENTS_FILE),
+                                      CAPTURED_EXPORTS_DICT[ENROLLMENTS_FILE], student_ids=contact_students)
+    }
+    changes_dict = {x: diff_snapshots(_read_snapshot(_snapshot_path(store_dir, x)), y, x)
+                    for x, y in hashed_dict.items()}
+    if commit:
+        if not os.path.isdir(store_dir):
+            os.makedirs(store_dir)
+        for file_name, hashed_df in hashed_dict.items():
+            _write_snapshot(hashed_df, _snapshot_path(store_dir, file_name))
+        with open(os.path.join(store_dir, "last_changes.json"), "w") as summary_file:
+            json.dump([changes_dict[x].summary() for x in sorted(changes_dict)], summary_file, indent=1)
+    return changes_dict
+
+
+def affected_student_ids(changes_dict):
+    """Return the set of student ids of the records that changed in any export.
+
+    Args:
+        changes_dict (dict): ExportChanges objects, as returned by capture_changes().
+
+    Returns:
+        A set of student ids.
+
+    """
+
+    student_ids = set()
+    for each_changes in changes_dict.values():
+        student_ids |= each_changes.student_ids
+    return student_ids
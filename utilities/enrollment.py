@@ -0,0 +1,53 @@
+"""Provide a flat, columnar view of the term-by-term enrollment records.
+
+The preprocessing() function of processing.py stores each student's academic record as a dictionary
+that maps semester numbers to CourseGroup objects, which in turn hold Course objects.  That structure is
+convenient for walking through the record of one student, but questions asked of the whole population
+(persistence rates, grade distributions, course sequences, and so on) are answered much faster when the
+same information is held in one long-format pandas DataFrame, with one row per student, semester and course.
+
+Functions exported by this module include:
+    build_enrollment_df(): flatten a student_record_dict into an enrollment DataFrame
+
+"""
+
+import numpy as np
+import pandas as pd
+
+ENROLLMENT_FRAME_COLUMNS = ["student_id", "semester_number", "course", "grade", "grade_letter"]
+
+
+def build_enrollment_df(student_record_dict):
+    """Flatten a student_record_dict into a long-format enrollment DataFrame.
+
+    Each Course object in the record becomes one row of the DataFrame.  Since CourseGroup.add_Course()
+    already discards repeated courses within a semester, the rows are unique by student, semester and course.
+
+    Args:
+        student_record_dict (dict): Mapping of student id's to dictionaries of semester number->CourseGroup
+            pairs, as returned by preprocessing().
+
+    Returns:
+        A DataFrame with the columns listed in ENROLLMENT_FRAME_COLUMNS, sorted by student and semester.
+        Grades without a grade-point value (e.g., W or CR) are NaN in the grade column.
+
+    """
+
+    student_ids, semester_numbers, courses, grades, grade_letters = [], [], [], [], []
+    for student_id, term_CourseGroup_dict in student_record_dict.items():
+        for semester_number, each_CourseGroup in term_CourseGroup_dict.items():
+            for each_Course in each_CourseGroup.course_list:
+                student_ids.append(student_id)
+                semester_numbers.append(semester_number)
+                courses.append(each_Course.course)
+                grades.append(np.nan if each_Course.grade is None else each_Course.grade)
+                grade_letters.append(each_Course.grade_letter)
+    enrollment_df = pd.DataFrame({"student_id": student_ids,
+                                  "semester_number": np.array(semester_numbers, dtype='int32'),
+                                  "course": courses,
+                                  "grade": np.array(grades, dtype='float64'),
+                                  "grade_letter": grade_letters},
+                                 columns=ENROLLMENT_FRAME_COLUMNS)
+    enrollment_df.sort_values(["student_id", "semester_number", "course"], inplace=True)
+    enrollment_df.reset_index(drop=True, inplace=True)
+    return enrollment_df
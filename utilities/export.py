@@ -0,0 +1,445 @@
+"""Write the enrollment data as partitioned, columnar extracts for Tableau and other BI tools.
+
+Three tables are exported, all computed from the long-format enrollment DataFrame of utilities/enrollment.py with
+column operations, without creating a Course object or a dictionary per row:
+    enrollment: one row per student, semester and course, with the student's cohort_year, the semester name and
+        academic year, the regular term from the start of the cohort (see analysis/metrics.py), and passed,
+        completed and Math course flags;
+    panel: one row per student of a cohort and regular term, from term 1 to the last observed term (at most
+        max_terms), with the numbers of courses taken, completed and passed, the mean grade points of the term,
+        and running totals; terms without courses are kept, with enrolled False;
+    summary: one row per student, with the attributes of SUMMARY_ATTRIBUTES_LIST and totals over the record.
+
+The students are exported in chunks of chunk_students (one shard at a time, for a ShardedRecordStore), and each
+chunk is written as soon as its tables are built, so that memory is bounded by the size of a chunk rather than of
+the population.  Each table is partitioned by cohort_year, Hive style, under OUTPUT_DIR/extracts:
+    extracts/<table>/csv/cohort_year=2012/<table>.csv                 one csv file per partition, appended to
+    extracts/<table>/parquet/cohort_year=2012/part-00000.parquet     one file per chunk and partition
+    extracts/<table>/feather/cohort_year=2012/part-00000.feather
+Students without a cohort_year are in the partition cohort_year=MISSING_PARTITION.  The cohort_year column stays
+in the csv files, which most BI tools read without their directory names, and is left out of the Parquet and
+Feather files, whose readers take it from the directory names.  The tables are written to a staging directory and
+moved into place when all chunks are written, so a reader never sees half an extract; manifest.json then lists
+the columns and the number of rows of every partition.
+
+Parquet and Feather files are written by pandas, which needs pyarrow (or fastparquet, for Parquet, or
+feather-format, for Feather); csv needs nothing more.
+
+Usage:
+    manifest_dict = export_tables(contacts_df, student_record_dict, formats=("csv", "parquet"))
+    python cli.py export --metro-comp --formats csv parquet
+
+Functions exported by this module include:
+    iter_enrollment_chunks(): the enrollment DataFrames of successive chunks of students
+    enrollment_table(), panel_table(), summary_table(): the rows of each table for a chunk of students
+    partition_labels(): the cohort_year partition of each row
+    export_tables(): write the partitioned tables of all students
+
+"""
+
+import json
+import os
+import pkgutil
+import shutil
+import numpy as np
+import pandas as pd
+from configuration import OUTPUT_DIR
+from analysis.metrics import DEFAULT_SEASONS, _regular_term_lookup, _check_start_terms
+from utilities.enrollment import build_enrollment_df
+from utilities.other_constants import PASSING_GRADES, INCOMPLETE_GRADES, MATH_COURSES_SET, \
+    MATH_REMEDIATION_COURSES_SET
+from utilities.semesters import SEMESTER_CALENDAR
+
+EXPORT_DIR = os.path.join(OUTPUT_DIR, "extracts")
+EXPORT_TABLES_LIST = ["enrollment", "panel", "summary"]
+EXPORT_FORMATS_LIST = ["csv", "parquet", "feather"]
+FORMAT_ENGINES_DICT = {
+    "csv": [],
+    "parquet": ["pyarrow", "fastparquet"],
+    "feather": ["pyarrow", "feather"]
+}
+PARTITION_COLUMN = "cohort_year"
+MISSING_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+DEFAULT_CHUNK_STUDENTS = 20000
+DEFAULT_MAX_TERMS = 12
+SUMMARY_ATTRIBUTES_LIST = ["category", "cohort_year", "cohort_name", "race", "gender", "pell_eligible", "first_gen",
+                           "household_income", "EOP", "major", "ELM", "EPT", "SAT_Math", "SAT_Verbal", "ACT_Math",
+                           "ACT_English", "result", "third_persistence", "fifth_persistence", "seventh_persistence",
+                           "graduated", "graduation_term", "fourth_year_graduated", "fifth_year_graduated",
+                           "sixth_year_graduated"]
+MANIFEST_FILE = "manifest.json"
+
+
+def _check_formats(formats):
+    """Raise an error before anything is written if a format is unknown or has no engine installed."""
+
+    for each_format in formats:
+        if each_format not in FORMAT_ENGINES_DICT:
+            raise ValueError("Unknown export format " + repr(each_format) + "; expected one of " +
+                             ", ".join(EXPORT_FORMATS_LIST) + ".")
+        engines = FORMAT_ENGINES_DICT[each_format]
+        if engines and not any(pkgutil.find_loader(x) is not None for x in engines):
+            raise ImportError("Writing " + each_format + " files needs one of these packages: " +
+                              ", ".join(engines) + ".")
+
+
+def _split_students(enrollment_df, chunk_students):
+    """Split an enrollment DataFrame into DataFrames holding all rows of at most chunk_students students each."""
+
+    student_codes = pd.factorize(enrollment_df["student_id"], sort=True)[0]
+    chunk_numbers = student_codes // chunk_students
+    order = np.argsort(chunk_numbers, kind="mergesort")
+    bounds = np.searchsorted(chunk_numbers[order], np.arange(chunk_numbers.max() + 2 if len(order) else 1))
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        yield enrollment_df.iloc[order[start:stop]].reset_index(drop=True)
+
+
+def iter_enrollment_chunks(records, chunk_students=DEFAULT_CHUNK_STUDENTS):
+    """Generate the long-format enrollment DataFrames of successive chunks of students.
+
+    Every row of a student is in the same chunk, so tables with one or more rows per student can be computed
+    chunk by chunk.
+
+    Args:
+        records: An enrollment DataFrame (see utilities/enrollment.py), a RecordStore or ShardedRecordStore (see
+            utilities/record_store.py), or a student_record_dict.
+        chunk_students (int): Largest number of students in a chunk.  The shards of a ShardedRecordStore are read
+            one at a time, and split if they are larger.
+
+    Yields:
+        Enrollment DataFrames with the columns listed in ENROLLMENT_FRAME_COLUMNS.
+
+    """
+
+    if isinstance(records, pd.DataFrame):
+        for each_chunk_df in _split_students(records, chunk_students):
+            yield each_chunk_df
+    elif hasattr(records, "shards"):
+        for each_shard in records.shards:
+            for each_chunk_df in _split_students(each_shard.to_enrollment_df(), chunk_students):
+                yield each_chunk_df
+    elif hasattr(records, "to_enrollment_df"):
+        for each_chunk_df in _split_students(records.to_enrollment_df(), chunk_students):
+            yield each_chunk_df
+    else:
+        student_ids = sorted(records.keys())
+        for start in range(0, len(student_ids), chunk_students):
+            yield build_enrollment_df({x: records[x] for x in student_ids[start:start + chunk_students]})
+
+
+def _last_semester_number(records):
+    """Return the last semester number of the records, without building their enrollment DataFrame."""
+
+    if isinstance(records, pd.DataFrame):
+        return int(records["semester_number"].max()) if len(records) else 0
+    if hasattr(records, "shards"):
+        return max([_last_semester_number(x) for x in records.shards] + [0])
+    if hasattr(records, "arrays"):
+        return int(np.max(records.arrays["term_semesters"])) if len(records.arrays["term_semesters"]) else 0
+    return max([max(x) for x in records.values() if x] + [0])
+
+
+def _students_frame(contacts_df):
+    """Index the attributes of the students by student id, one row per student, with their start semesters."""
+
+    students_df = contacts_df.drop_duplicates(subset="student_id").set_index("student_id")
+    students_df = students_df[[x for x in SUMMARY_ATTRIBUTES_LIST if x in students_df.columns]].copy()
+    students_df["cohort_year"] = pd.to_numeric(students_df["cohort_year"], errors="coerce")
+    students_df["start_term"] = SEMESTER_CALENDAR.cohort_start_numbers(students_df["cohort_year"])
+    _check_start_terms(students_df["start_term"].values, students_df["cohort_year"].values)
+    return students_df
+
+
+def partition_labels(cohort_years):
+    """Return the cohort_year partition of each row: the year as a string, or MISSING_PARTITION.
+
+    Args:
+        cohort_years: Cohort years, as a list, array or Series of numbers or numeric strings.
+
+    Returns:
+        An array of strings.
+
+    """
+
+    years = pd.to_numeric(pd.Series(cohort_years), errors="coerce").values
+    known = ~np.isnan(years)
+    return np.where(known, np.where(known, years, 0).astype(np.int64).astype(str), MISSING_PARTITION)
+
+
+def enrollment_table(enrollment_df, students_df, seasons=DEFAULT_SEASONS):
+    """Build the enrollment table of a chunk of students.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data of the students.
+        students_df (DataFrame): Attributes indexed by student id, as built by export_tables(); must contain
+            cohort_year and start_term.
+        seasons (iterable): Seasons that count as regular terms.
+
+    Returns:
+        A DataFrame with one row per row of enrollment_df.  term is the regular term from the start of the
+        student's cohort (a summer or winter semester counts as the regular term before it), and is missing for
+        students without a cohort_year.
+
+    """
+
+    attributes_df = students_df.reindex(enrollment_df["student_id"].values)
+    semesters = enrollment_df["semester_number"]
+    start_terms = attributes_df["start_term"].values
+    has_start = ~np.isnan(start_terms)
+    terms = np.full(len(enrollment_df), np.nan)
+    terms[has_start] = SEMESTER_CALENDAR.relative_terms(semesters.values[has_start], start_terms[has_start],
+                                                        seasons=seasons)
+    table_df = pd.DataFrame({
+        "student_id": enrollment_df["student_id"].values,
+        "cohort_year": attributes_df["cohort_year"].values,
+        "semester_number": semesters.values,
+        "semester_name": SEMESTER_CALENDAR.to_names(semesters.values),
+        "academic_year": SEMESTER_CALENDAR.to_academic_years(semesters.values),
+        "term": terms,
+        "course": enrollment_df["course"].values,
+        "grade": enrollment_df["grade"].values,
+        "grade_letter": enrollment_df["grade_letter"].values,
+        "passed": enrollment_df["grade_letter"].isin(PASSING_GRADES).values,
+        "completed": ~enrollment_df["grade_letter"].isin(INCOMPLETE_GRADES).values,
+        "is_math_course": enrollment_df["course"].isin(MATH_COURSES_SET).values,
+        "is_remediation_math_course": enrollment_df["course"].isin(MATH_REMEDIATION_COURSES_SET).values},
+        columns=["student_id", "cohort_year", "semester_number", "semester_name", "academic_year", "term", "course",
+                 "grade", "grade_letter", "passed", "completed", "is_math_course", "is_remediation_math_course"])
+    return table_df
+
+
+def _course_counts(enrollment_df, cell_indexes, n_cells):
+    """Count the courses, completed, passed and Math courses, and sum the grade points, of every cell at once.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data.
+        cell_indexes (ndarray): The cell of each row of enrollment_df, or -1 for rows outside every cell.
+        n_cells (int): Number of cells.
+
+    Returns:
+        A dictionary mapping courses, courses_completed, courses_passed, math_courses, grade_points and
+        graded_courses to arrays of n_cells values.
+
+    """
+
+    keep = cell_indexes >= 0
+    cells = cell_indexes[keep]
+    grades = enrollment_df["grade"].values[keep]
+    graded = ~np.isnan(grades)
+    weights_dict = {
+        "courses": None,
+        "courses_completed": ~enrollment_df["grade_letter"].isin(INCOMPLETE_GRADES).values[keep],
+        "courses_passed": enrollment_df["grade_letter"].isin(PASSING_GRADES).values[keep],
+        "math_courses": enrollment_df["course"].isin(MATH_COURSES_SET).values[keep],
+        "grade_points": np.where(graded, grades, 0.0),
+        "graded_courses": graded
+    }
+    return {x: np.bincount(cells, weights=None if y is None else y.astype(float), minlength=n_cells)
+            for x, y in weights_dict.items()}
+
+
+def _mean_grade_points(counts_dict):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts_dict["graded_courses"] > 0,
+                        counts_dict["grade_points"] / counts_dict["graded_courses"], np.nan)
+
+
+def panel_table(enrollment_df, students_df, last_semester_number, seasons=DEFAULT_SEASONS,
+                max_terms=DEFAULT_MAX_TERMS):
+    """Build the panel table of a chunk of students.
+
+    Only the courses of regular semesters are counted, as in analysis/metrics.py.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data of the students.
+        students_df (DataFrame): Attributes indexed by student id, as built by export_tables(); must contain
+            cohort_year and start_term.
+        last_semester_number (int): Last semester of the data; later terms are not in the panel.
+        seasons (iterable): Seasons that count as regular terms.
+        max_terms (int): Largest number of terms per student.
+
+    Returns:
+        A DataFrame with one row per student with a cohort_year (and courses in enrollment_df) and term.
+
+    """
+
+    student_ids = pd.unique(enrollment_df["student_id"].values)
+    chunk_students_df = students_df.reindex(student_ids)
+    chunk_students_df = chunk_students_df[chunk_students_df["start_term"].notnull()]
+    start_terms = chunk_students_df["start_term"].values.astype(np.int64)
+    last_number = max(last_semester_number, int(enrollment_df["semester_number"].max()) if len(enrollment_df) else 0,
+                      int(start_terms.max()) if len(start_terms) else 0) + 4 * max_terms
+    is_regular, regular_counts = _regular_term_lookup(seasons, last_number)
+    regular_semesters = np.flatnonzero(is_regular)
+    term_semesters = regular_semesters[regular_counts[start_terms - 1][:, None] + np.arange(max_terms)[None, :]]
+
+    # One cell per student and term; each enrollment row falls in the cell of its student and regular term
+    student_positions = pd.Series(np.arange(len(chunk_students_df)), index=chunk_students_df.index)
+    row_positions = enrollment_df["student_id"].map(student_positions).values
+    semesters = enrollment_df["semester_number"].values
+    in_panel = ~np.isnan(row_positions)
+    row_positions = np.where(in_panel, row_positions, 0).astype(np.int64)
+    row_starts = np.append(start_terms, 1)[np.where(in_panel, row_positions, len(start_terms))]
+    term_positions = regular_counts[semesters] - regular_counts[row_starts - 1] - 1
+    keep = in_panel & is_regular[semesters] & (term_positions >= 0) & (term_positions < max_terms)
+    cell_indexes = np.where(keep, row_positions * max_terms + term_positions, -1)
+    counts_dict = _course_counts(enrollment_df, cell_indexes, len(chunk_students_df) * max_terms)
+
+    observed = (term_semesters <= last_semester_number).ravel()
+    panel_df = pd.DataFrame({
+        "student_id": np.repeat(chunk_students_df.index.values, max_terms),
+        "cohort_year": np.repeat(chunk_students_df["cohort_year"].values, max_terms),
+        "term": np.tile(np.arange(1, max_terms + 1), len(chunk_students_df)),
+        "semester_number": term_semesters.ravel(),
+        "enrolled": counts_dict["courses"] > 0,
+        "courses": counts_dict["courses"].astype(np.int64),
+        "courses_completed": counts_dict["courses_completed"].astype(np.int64),
+        "courses_passed": counts_dict["courses_passed"].astype(np.int64),
+        "math_courses": counts_dict["math_courses"].astype(np.int64),
+        "mean_grade_points": _mean_grade_points(counts_dict)},
+        columns=["student_id", "cohort_year", "term", "semester_number", "enrolled", "courses", "courses_completed",
+                 "courses_passed", "math_courses", "mean_grade_points"])
+    cells_shape = (len(chunk_students_df), max_terms)
+    panel_df["terms_enrolled"] = np.cumsum(panel_df["enrolled"].values.reshape(cells_shape), axis=1).ravel()
+    panel_df["cumulative_courses_passed"] = np.cumsum(panel_df["courses_passed"].values.reshape(cells_shape),
+                                                      axis=1).ravel()
+    panel_df.insert(4, "semester_name", SEMESTER_CALENDAR.to_names(panel_df["semester_number"].values))
+    return panel_df[observed].reset_index(drop=True)
+
+
+def summary_table(enrollment_df, students_df):
+    """Build the summary table of a chunk of students.
+
+    Args:
+        enrollment_df (DataFrame): Long-format enrollment data of the students.
+        students_df (DataFrame): Attributes indexed by student id, as built by export_tables().
+
+    Returns:
+        A DataFrame with one row per student of enrollment_df: the attributes of SUMMARY_ATTRIBUTES_LIST found in
+        students_df (missing for students without attributes), then totals over all semesters.
+
+    """
+
+    student_codes, student_ids = pd.factorize(enrollment_df["student_id"], sort=True)
+    counts_dict = _course_counts(enrollment_df, student_codes, len(student_ids))
+    semesters = enrollment_df["semester_number"].values
+    first_semesters = np.full(len(student_ids), np.iinfo(np.int64).max, dtype=np.int64)
+    last_semesters = np.zeros(len(student_ids), dtype=np.int64)
+    np.minimum.at(first_semesters, student_codes, semesters)
+    np.maximum.at(last_semesters, student_codes, semesters)
+    distinct_semesters = ~pd.DataFrame({"student": student_codes, "semester": semesters}).duplicated().values
+    semester_counts = np.bincount(student_codes[distinct_semesters], minlength=len(student_ids))
+
+    summary_df = students_df.reindex(student_ids).drop("start_term", axis=1)
+    summary_df.index.name = "student_id"
+    summary_df = summary_df.reset_index()
+    summary_df["first_semester_number"] = first_semesters
+    summary_df["first_semester_name"] = SEMESTER_CALENDAR.to_names(first_semesters)
+    summary_df["last_semester_number"] = last_semesters
+    summary_df["last_semester_name"] = SEMESTER_CALENDAR.to_names(last_semesters)
+    summary_df["semesters_enrolled"] = semester_counts
+    for each_column in ["courses", "courses_completed", "courses_passed", "math_courses"]:
+        summary_df[each_column] = counts_dict[each_column].astype(np.int64)
+    summary_df["mean_grade_points"] = _mean_grade_points(counts_dict)
+    return summary_df
+
+
+def _columnar_types(table_df):
+    """Make the object columns hold strings or missing values only, as Parquet and Feather columns need one type."""
+
+    table_df = table_df.reset_index(drop=True)
+    for each_column in table_df.columns[table_df.dtypes == object]:
+        values = table_df[each_column]
+        table_df[each_column] = values.where(values.isnull(), values.astype(str))
+    return table_df
+
+
+def _write_partitions(table_df, table_name, format_dir, file_format, chunk_number, rows_dict):
+    """Write the rows of a chunk of a table to the partition of each row, and count them into rows_dict."""
+
+    labels = partition_labels(table_df[PARTITION_COLUMN])
+    for each_label, partition_df in table_df.groupby(labels, sort=True):
+        partition_dir = os.path.join(format_dir, PARTITION_COLUMN + "=" + each_label)
+        if not os.path.isdir(partition_dir):
+            os.makedirs(partition_dir)
+        if file_format == "csv":
+            path = os.path.join(partition_dir, table_name + ".csv")
+            partition_df.to_csv(path, mode="a", header=not os.path.exists(path), index=False)
+        else:
+            path = os.path.join(partition_dir, "part-%05d.%s" % (chunk_number, file_format))
+            partition_df = _columnar_types(partition_df.drop(PARTITION_COLUMN, axis=1))
+            if file_format == "parquet":
+                partition_df.to_parquet(path)
+            else:
+                partition_df.to_feather(path)
+        rows_dict[each_label] = rows_dict.get(each_label, 0) + len(partition_df)
+
+
+def export_tables(contacts_df, records, output_dir=EXPORT_DIR, tables=EXPORT_TABLES_LIST, formats=("csv",),
+                  chunk_students=DEFAULT_CHUNK_STUDENTS, seasons=DEFAULT_SEASONS, max_terms=DEFAULT_MAX_TERMS,
+                  last_semester_number=None):
+    """Write the partitioned tables of all students, chunk by chunk.
+
+    Args:
+        contacts_df (DataFrame): Student attributes, as returned by preprocessing(); must contain student_id and
+            cohort_year.
+        records: The enrollment records: an enrollment DataFrame, a RecordStore, a ShardedRecordStore or a
+            student_record_dict (see iter_enrollment_chunks()).
+        output_dir (str): Directory of the extracts.  The directories of the exported tables are replaced.
+        tables (iterable): Names of the tables to export, from EXPORT_TABLES_LIST.
+        formats (iterable): File formats to write, from EXPORT_FORMATS_LIST.
+        chunk_students (int): Largest number of students in a chunk.
+        seasons (iterable): Seasons that count as regular terms.
+        max_terms (int): Largest number of terms per student in the panel.
+        last_semester_number (int): Last observed semester; the last semester of the records if None.
+
+    Returns:
+        The manifest written to output_dir: a dictionary mapping each table to its columns and, for each format,
+        the number of rows of each partition.
+
+    """
+
+    for each_table in tables:
+        if each_table not in EXPORT_TABLES_LIST:
+            raise ValueError("Unknown table " + repr(each_table) + "; expected one of " +
+                             ", ".join(EXPORT_TABLES_LIST) + ".")
+    _check_formats(formats)
+    if last_semester_number is None:
+        last_semester_number = _last_semester_number(records)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    students_df = _students_frame(contacts_df)
+    table_functions_dict = {
+        "enrollment": lambda x: enrollment_table(x, students_df, seasons),
+        "panel": lambda x: panel_table(x, students_df, last_semester_number, seasons, max_terms),
+        "summary": lambda x: summary_table(x, students_df)
+    }
+
+    staging_dir = os.path.join(output_dir, ".staging-" + str(os.getpid()))
+    manifest_dict = {x: {"columns": None, "rows": {y: dict() for y in formats}} for x in tables}
+    try:
+        for chunk_number, each_chunk_df in enumerate(iter_enrollment_chunks(records, chunk_students)):
+            for each_table in tables:
+                table_df = table_functions_dict[each_table](each_chunk_df)
+                manifest_dict[each_table]["columns"] = list(table_df.columns)
+                for each_format in formats:
+                    _write_partitions(table_df, each_table, os.path.join(staging_dir, each_table, each_format),
+                                      each_format, chunk_number, manifest_dict[each_table]["rows"][each_format])
+        for each_table in tables:
+            table_dir = os.path.join(output_dir, each_table)
+            if os.path.isdir(table_dir):
+                shutil.rmtree(table_dir)
+            if os.path.isdir(os.path.join(staging_dir, each_table)):
+                os.rename(os.path.join(staging_dir, each_table), table_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    # Tables exported earlier and not replaced now stay in the manifest
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            manifest_dict = dict(json.load(manifest_file), **manifest_dict)
+    with open(manifest_path + ".tmp", "w") as manifest_file:
+        json.dump(manifest_dict, manifest_file, indent=1, sort_keys=True)
+    os.rename(manifest_path + ".tmp", manifest_path)
+    return manifest_dict
@@ -111,10 +111,13 @@ IR_PARENT_EDUC_DTYPE_CONVERSIONS_DICT = {
 }
 PATHWAYS_FILE = "Pathways.csv"
 QUERY_DATA_DIR = "query_data"
+# Columns of the per-term CS query files in QUERY_DATA_DIR.  The export repeats some column names (e.g., Units),
+#   which is why preprocessing() reads these files with Csv(has_duplicate_column_names=True).
+QUERY_DATA_COLUMNS_LIST = ["SF State ID", "Admit Term", "Class", "Units", "Status", "Grade", "Units"]
 SPMF_EXECUTABLE = "spmf.jar"
 RSTCMP2_COLUMNS_DICT = {
-    "Term": "Term",
-    "ID": "Id",
+    "Term": "term",
+    "ID": "student_id",
     "Grd Points": "grade_points",
     "Admit Term": "admit_term_rstcmp",
     "Current Total Units Taken": "current_units",
@@ -2,13 +2,29 @@
 
 This module contains functions relating to frequently-conducted manipulations,
     transformations, and conversions of academic data.
+
+The semester conversions below compute single values with plain arithmetic and dictionary lookups, since they are
+called once per row in loops.  Given a list, array or Series, they hand the whole column to the SemesterCalendar of
+utilities/semesters.py, which is imported only then, so that importing this module does not import pandas.
 """
 
 from other_constants import *
-import sys
 import collections
 
 
+def _is_scalar(value):
+    """Tell whether a value is a single value, rather than a list, array or Series of values."""
+
+    return isinstance(value, (basestring, int, long, float)) or not hasattr(value, "__len__")
+
+
+def _semester_calendar():
+    """Return the SEMESTER_CALENDAR of utilities/semesters.py, importing it on first use."""
+
+    from utilities.semesters import SEMESTER_CALENDAR
+    return SEMESTER_CALENDAR
+
+
 # convenience function to convert a semester code like "F2010" to its corresponding academic year
 def convert_term_code_to_academic_year(term_code, as_string=False):
     """Given a term code, such F2012, return the year in which the academic year
@@ -30,6 +46,9 @@ def convert_term_code_to_academic_year(term_code, as_string=False):
         The year in which the academic year containing term_code started, as a string.
 
     """
+    if not _is_scalar(term_code):
+        calendar = _semester_calendar()
+        return calendar.to_academic_years(calendar.to_numbers(term_code), as_string=as_string)
     year = int(term_code[-4:])
     if as_string == False:
         if term_code[0] == 'F':
@@ -61,22 +80,20 @@ def parse_term_from_filename(filename):
     Returns:
         A string representation of the semester and year, such as "Fall 2013".
 
+    Raises:
+        ValueError: if the file name does not start with one of these abbreviations and a year.
+
     """
 
-    if filename[0] == 'F':
+    if filename[:1] == 'F':
         return "Fall " + filename[1:5]
-    else:
-        if filename[0] == 'W':
-            return "Winter " + filename[2:6]
-        else:
-            if filename[0] == 'S' and filename[1] == '2':
-                return "Spring " + filename[1:5]
-            else:
-                if filename[0] == 'S' and filename[1] == 'U':
-                    return "Summer " + filename[2:6]
-                else:
-                    print "ERROR: invalid filename prefix: ", filename
-                    sys.exit(1)
+    if filename[:2] == 'WI':
+        return "Winter " + filename[2:6]
+    if filename[:2] == 'S2':
+        return "Spring " + filename[1:5]
+    if filename[:2] == 'SU':
+        return "Summer " + filename[2:6]
+    raise ValueError("Invalid file name prefix; expected a term code such as F2013 or SU2014: " + str(filename))
 
 
 def convert_semester_name_to_academic_year(semester_name):
@@ -90,6 +107,9 @@ def convert_semester_name_to_academic_year(semester_name):
 
     """
 
+    if not _is_scalar(semester_name):
+        calendar = _semester_calendar()
+        return calendar.to_academic_years(calendar.to_numbers(semester_name)).astype(str)
     return semester_name[-4:] if semester_name[:2] in {"Fa"} \
         else str(int(semester_name[-4:]) - 1)
 
@@ -130,7 +150,9 @@ def convert_semester_number_to_academic_year(semester_number):
 
     """
 
-    return convert_semester_name_to_academic_year(NUMBERS_TO_SEMESTERS_DICT[semester_number])
+    if not _is_scalar(semester_number):
+        return _semester_calendar().to_academic_years(semester_number).astype(str)
+    return str(FIRST_SEMESTER_YEAR + (int(semester_number) - 1) // 4)
 
 
 def show_counter_percentages(input_list, digits=3, print_output=False):
@@ -169,7 +191,13 @@ def convert_semester_name_to_semester_number(semester_name):
 
     """
 
-    return SEMESTERS_TO_NUMBERS_DICT[semester_name]
+    if not _is_scalar(semester_name):
+        return _semester_calendar().to_numbers(semester_name)
+    semester_number = SEMESTERS_TO_NUMBERS_DICT.get(semester_name)
+    if semester_number is None:
+        # A semester outside SEMESTERS_LIST
+        return _semester_calendar().to_numbers(semester_name)
+    return semester_number
 
 def convert_cohort_year_to_start_term(year):
     """Convert a cohort year ("2011") into its corresponding semester number (9).
@@ -183,7 +211,9 @@ def convert_cohort_year_to_start_term(year):
         An integer identifier for that semester as used in this project.
 
     """
-    return (int(year) - 2009) * 4 + 1
+    if not _is_scalar(year):
+        return _semester_calendar().cohort_start_numbers(year)
+    return (int(year) - FIRST_SEMESTER_YEAR) * 4 + 1
 
 
 def round_pv(p_value):
@@ -0,0 +1,385 @@
+"""Record the time, memory and row counts of each stage of a data pipeline.
+
+The preprocessing() function of processing.py runs as a series of named stages (reading the Salesforce exports,
+resolving identifiers, merging IR data, and so on).  When a PipelineReport is passed to it, each stage is timed
+and measured:
+    - wall_seconds and cpu_seconds: elapsed real time and user plus system CPU time;
+    - peak_rss_mb: the process's peak resident set size at the end of the stage, and peak_rss_growth_mb,
+        how much the stage raised it;
+    - rows_in and rows_out: the number of rows the stage started and ended with, as reported by the stage.
+When no report is passed, a NullReport takes its place and the stages pay nothing for the instrumentation.
+
+A PipelineReport can also write a JSON trace, one JSON object per line and per stage, as each stage ends, so a
+run that fails part of the way still leaves a record of where its time went.  Callers that need more can add hook
+functions, which are called with each StageRecord as its stage ends.
+
+The ingestion of the term-by-term enrollment files also keeps RowCounters: how many rows of each file were kept
+and how many were dropped, by reason and by student category.  The counts are kept per file in plain Counters
+and are added together when a file is done, so workers that read different files can each keep their own
+RowCounters and merge them at the end.
+
+Classes exported by this module include:
+    StageRecord: the measurements of one stage
+    PipelineReport: collects StageRecords, writes the optional trace, and summarizes the run
+    NullReport: a report that records nothing
+    RowCounters: counts of rows kept and dropped, by file, student category and reason
+    read_report(): rebuild a PipelineReport from a JSON report or trace file
+
+"""
+
+import json
+import os
+import resource
+import sys
+import time
+from collections import Counter
+
+ROW_KEPT = "kept"
+ROW_DROPPED_STATUS = "status_not_enrolled"
+ROW_DROPPED_GRADE = "grade_not_valid"
+ROW_DROPPED_ROSTER = "not_in_roster"
+ROW_DROPPED_DUPLICATE = "duplicate_course"
+ROW_REASONS_LIST = [ROW_KEPT, ROW_DROPPED_STATUS, ROW_DROPPED_GRADE, ROW_DROPPED_ROSTER, ROW_DROPPED_DUPLICATE]
+ROW_COUNTERS_COLUMNS = ["term_file", "category", "reason", "rows"]
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of the current process, in megabytes."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def cpu_seconds():
+    """Return the user plus system CPU time used by the current process, in seconds."""
+
+    times = os.times()
+    return times[0] + times[1]
+
+
+class StageRecord:
+    """This class holds the measurements of one stage of a pipeline run.
+
+    The rows_in, rows_out and extra attributes are set by the stage itself, while the stage runs; the timing
+    and memory attributes are set when the stage ends.
+
+    """
+
+    def __init__(self, name):
+        """Instantiate a StageRecord object.
+
+        Args:
+            name (str): Name of the stage.
+
+        """
+
+        self.name = name
+        self.rows_in = None
+        self.rows_out = None
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_mb = None
+        self.peak_rss_growth_mb = None
+        self.extra = dict()
+
+    def to_dict(self):
+        """Create a dictionary of the fields of this class instance.
+
+        Returns:
+            Dictionary mapping field names to values, suitable for JSON serialization.
+
+        """
+
+        return {
+            "stage": self.name,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "peak_rss_mb": self.peak_rss_mb,
+            "peak_rss_growth_mb": self.peak_rss_growth_mb,
+            "extra": self.extra
+        }
+
+
+class _StageContext:
+    """Context manager that measures one stage and hands its StageRecord to the report when the stage ends."""
+
+    def __init__(self, report, record):
+        self.report = report
+        self.record = record
+
+    def __enter__(self):
+        self.wall_start = time.time()
+        self.cpu_start = cpu_seconds()
+        self.rss_start = peak_rss_mb()
+        return self.record
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.record.wall_seconds = time.time() - self.wall_start
+        self.record.cpu_seconds = cpu_seconds() - self.cpu_start
+        self.record.peak_rss_mb = peak_rss_mb()
+        self.record.peak_rss_growth_mb = self.record.peak_rss_mb - self.rss_start
+        if exc_type is not None:
+            self.record.extra["error"] = repr(exc_value)
+        self.report.add_record(self.record)
+        return False
+
+
+class PipelineReport:
+    """This class collects the StageRecords of a pipeline run.
+
+    Use it by passing an instance to preprocessing(report=...), and reading its records afterwards:
+        report = PipelineReport(trace_file="preprocessing_trace.jsonl")
+        contacts_df, student_record_dict, roster_dict = preprocessing(metro_comp=True, report=report)
+        print report.summary()
+
+    """
+
+    def __init__(self, trace_file=None, hooks=None):
+        """Instantiate a PipelineReport object.
+
+        Args:
+            trace_file (str): If given, path of a file to which one JSON line is appended per finished stage.
+            hooks (list): Functions to call with each StageRecord when its stage ends.
+
+        """
+
+        self.records = []
+        self.trace_file = trace_file
+        self.hooks = [] if hooks is None else list(hooks)
+
+    def stage(self, name):
+        """Start measuring a stage.
+
+        Args:
+            name (str): Name of the stage.
+
+        Returns:
+            A context manager whose value is the stage's StageRecord, on which the stage can set rows_in,
+            rows_out and extra entries.
+
+        """
+
+        return _StageContext(self, StageRecord(name))
+
+    def add_record(self, record):
+        """Store a finished StageRecord, append it to the trace file, and call the hooks.
+
+        Args:
+            record (StageRecord): The record of the stage that just ended.
+
+        Returns:
+            None
+
+        """
+
+        self.records.append(record)
+        if self.trace_file is not None:
+            with open(self.trace_file, "a") as trace:
+                trace.write(json.dumps(record.to_dict(), sort_keys=True) + "\n")
+        for each_hook in self.hooks:
+            each_hook(record)
+
+    def to_dict(self):
+        """Create a dictionary holding the records of all finished stages and the totals of the run.
+
+        Returns:
+            Dictionary with "stages" (list of record dictionaries), "total_wall_seconds", "total_cpu_seconds"
+            and "peak_rss_mb".
+
+        """
+
+        return {
+            "stages": [x.to_dict() for x in self.records],
+            "total_wall_seconds": sum(x.wall_seconds for x in self.records),
+            "total_cpu_seconds": sum(x.cpu_seconds for x in self.records),
+            "peak_rss_mb": max([x.peak_rss_mb for x in self.records] or [None])
+        }
+
+    def write_json(self, path):
+        """Write the whole report, as returned by to_dict(), to a JSON file.
+
+        Args:
+            path (str): Path of the JSON file.
+
+        Returns:
+            None
+
+        """
+
+        with open(path, "w") as json_file:
+            json.dump(self.to_dict(), json_file, indent=2, sort_keys=True)
+
+    def summary(self):
+        """Create a table of the finished stages, one line per stage, for printing.
+
+        Returns:
+            String representation of the report.
+
+        """
+
+        lines = ["%-24s %10s %10s %10s %10s %12s" % ("stage", "wall s", "cpu s", "peak MB", "rows in", "rows out")]
+        for each_record in self.records:
+            lines.append("%-24s %10.2f %10.2f %10.1f %10s %12s" % (each_record.name, each_record.wall_seconds,
+                                                                   each_record.cpu_seconds, each_record.peak_rss_mb,
+                                                                   each_record.rows_in, each_record.rows_out))
+        return "\n".join(lines)
+
+
+class _NullStageContext:
+    """Context manager standing in for _StageContext when nothing is measured."""
+
+    def __enter__(self):
+        return StageRecord(None)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class NullReport:
+    """This class stands in for a PipelineReport when the caller did not ask for one; it records nothing."""
+
+    def stage(self, name):
+        """Return a context manager that measures nothing.
+
+        Args:
+            name (str): Name of the stage (ignored).
+
+        Returns:
+            A context manager whose value is a throwaway StageRecord.
+
+        """
+
+        return _NullStageContext()
+
+
+class RowCounters:
+    """This class counts the rows of the enrollment files that were kept and dropped.
+
+    Counts are keyed by (term file, student category, reason), where reason is one of ROW_REASONS_LIST.  Inside
+    the per-row loop, callers count into a plain Counter keyed by (category, reason) and pass it to add_file()
+    once the file is done, which keeps the cost per row to a single dictionary update.
+
+    """
+
+    def __init__(self):
+        """Instantiate an empty RowCounters object."""
+
+        self.counts = Counter()
+
+    def add_file(self, term_file, file_counts):
+        """Add the counts of one file.
+
+        Args:
+            term_file (str): Name of the enrollment file.
+            file_counts (Counter): Numbers of rows, keyed by (category, reason).
+
+        Returns:
+            None
+
+        """
+
+        for (category, reason), rows in file_counts.items():
+            self.counts[(term_file, category, reason)] += rows
+
+    def merge(self, other):
+        """Add the counts of another RowCounters object, e.g., one kept by a worker process, to this one.
+
+        Args:
+            other (RowCounters): The counts to add.
+
+        Returns:
+            This RowCounters object.
+
+        """
+
+        self.counts.update(other.counts)
+        return self
+
+    def total(self, reason=None):
+        """Return the number of rows counted, for one reason or for all of them.
+
+        Args:
+            reason (str): One of ROW_REASONS_LIST; None for every reason.
+
+        Returns:
+            The number of rows.
+
+        """
+
+        return sum(rows for (term_file, category, each_reason), rows in self.counts.items()
+                   if reason is None or each_reason == reason)
+
+    def to_df(self):
+        """Create a DataFrame of the counts, one row per term file, category and reason.
+
+        Returns:
+            A DataFrame with the columns listed in ROW_COUNTERS_COLUMNS, sorted by term file, category and reason.
+
+        """
+
+        # pandas is imported here, so that reading a report (see read_report()) does not pay for importing it
+        import pandas as pd
+        counts_df = pd.DataFrame([key + (rows,) for key, rows in self.counts.items()], columns=ROW_COUNTERS_COLUMNS)
+        return counts_df.sort_values(ROW_COUNTERS_COLUMNS[:3]).reset_index(drop=True)
+
+    def by_reason(self, by=("category",)):
+        """Tabulate the counts with one column per reason.
+
+        Args:
+            by (iterable): Columns ("term_file" and/or "category") by which to break the counts down.
+
+        Returns:
+            A DataFrame indexed by the by columns, with one integer column per reason in ROW_REASONS_LIST.
+
+        """
+
+        return self.to_df().pivot_table(index=list(by), columns="reason", values="rows", aggfunc="sum", fill_value=0)\
+            .reindex(columns=ROW_REASONS_LIST, fill_value=0)
+
+    def to_dict(self):
+        """Create a nested dictionary of the counts, suitable for JSON serialization.
+
+        Returns:
+            Dictionary mapping term file to category to reason to number of rows.
+
+        """
+
+        nested = dict()
+        for (term_file, category, reason), rows in self.counts.items():
+            nested.setdefault(term_file, dict()).setdefault(category, dict())[reason] = rows
+        return nested
+
+
+def read_report(path):
+    """Rebuild a PipelineReport from a file written by PipelineReport.write_json() or by its trace.
+
+    Args:
+        path (str): Path of a JSON report, or of a JSON trace with one line per stage.
+
+    Returns:
+        A PipelineReport holding the StageRecords of the file, which can be summarized but not traced further.
+
+    """
+
+    with open(path, "r") as report_file:
+        text = report_file.read()
+    try:
+        parsed = json.loads(text)
+    except ValueError:
+        parsed = None
+    if isinstance(parsed, dict) and "stages" in parsed:
+        stage_dicts = parsed["stages"]
+    else:
+        # A trace, possibly of a partial run with a single stage line
+        stage_dicts = [json.loads(x) for x in text.splitlines() if x.strip()]
+    report = PipelineReport()
+    for each_stage in stage_dicts:
+        record = StageRecord(each_stage["stage"])
+        for each_field in ("rows_in", "rows_out", "wall_seconds", "cpu_seconds", "peak_rss_mb",
+                           "peak_rss_growth_mb"):
+            setattr(record, each_field, each_stage.get(each_field))
+        record.extra = each_stage.get("extra", dict())
+        report.records.append(record)
+    return report
@@ -21,6 +21,7 @@ SEMESTERS_LIST = [
     "Fall 2017"
 ]
 
+FIRST_SEMESTER_YEAR = 2009     # year of "Fall 2009", semester number 1
 SEMESTERS_TO_NUMBERS_DICT = {x: SEMESTERS_LIST.index(x) + 1 for x in SEMESTERS_LIST}
 NUMBERS_TO_SEMESTERS_DICT = {SEMESTERS_LIST.index(x) + 1: x for x in SEMESTERS_LIST}
 SEASON_MODULO = {
@@ -92,6 +93,9 @@ GRADE_OUTCOME_DICT = {
 }
 VALID_LEVELS_SET = {"Freshman", "Sophomore", "Junior", "Senior"}
 PERSONAL_INFO_COLUMN_NAMES_LIST = {"First Name", "Last Name", "Address", "Phone Number"}
+# Headers of the student id columns of the data files, which anonymization replaces with keyed pseudonyms
+STUDENT_ID_COLUMN_NAMES_LIST = {"SFSU_student_ID__c", "UD_Student_ID__c", "cohort_sid", "student_id", "SF State ID",
+                                "ID"}
 RACE_RENAMING_DICT = {
     "Hispanic/Latino (any race)": "Hispanic/Latino",
     "Asian Only (Asian) - Non-Hispanic": "Asian",
@@ -0,0 +1,434 @@
+"""Store a student_record_dict in a compact binary file, and open it again without reading it into memory.
+
+Pickling a student_record_dict writes every CourseGroup and Course object separately, which makes the file
+large and slow both to write and to load.  This module writes the same records as a handful of columnar arrays
+in a single file instead:
+    - the sorted student id's, and for each student the offset of their first semester (student_offsets);
+    - for each semester of each student, its semester number, the GPA and units fields of its CourseGroup, and
+        the offset of its first course (term_offsets);
+    - for each course, the index of its name in the course-name vocabulary, the index of its letter grade in the
+        grade vocabulary, and its grade points.
+The file starts with a short header that lists the position, type and shape of every array.  Each array starts
+on a 64-byte boundary, so that a RecordStore can memory-map the file and use every array in place: opening even
+a full-campus record set takes milliseconds, and worker processes that open the same file share its pages
+through the operating system's cache.  CourseGroup and Course objects are only created when a student's record
+is looked up, and whole-population questions can skip them altogether via RecordStore.to_enrollment_df().
+
+Usage:
+    write_record_store(student_record_dict, "records.bin")
+    records = RecordStore("records.bin")
+    records["912345678"]     # a dictionary of semester number->CourseGroup, just like student_record_dict
+
+Records too large to build in memory at once can be written in shards, each holding the students whose id hashes
+to it (see student_shard()); a ShardedRecordStore then presents the shards as a single dictionary, and runs
+per-student computations one shard at a time with map_shards().
+
+Functions and classes exported by this module include:
+    write_record_store(): write a student_record_dict to a record store file
+    student_shard(): the shard of a student id
+    RecordStore: a read-only, memory-mapped, dictionary-like view of a record store file
+    ShardedRecordStore: a dictionary-like view of several record store files, one per shard of students
+
+"""
+
+import json
+import os
+import struct
+import zlib
+import numpy as np
+import pandas as pd
+from model import course, course_group
+from utilities.enrollment import ENROLLMENT_FRAME_COLUMNS
+
+RECORD_STORE_MAGIC = "METROREC"
+RECORD_STORE_VERSION = 1
+RECORD_STORE_ALIGNMENT = 64
+RECORD_STORE_SUFFIX = ".records"
+COURSE_GROUP_FLOAT_FIELDS_LIST = ["term_gpa", "term_units", "cumulative_gpa", "cumulative_units"]
+COURSE_GROUP_TEXT_FIELDS_LIST = ["major", "major_second"]
+
+
+def _to_float(value):
+    """Convert an optional number to a float, with NaN standing for None."""
+
+    return np.nan if value is None else float(value)
+
+
+def _from_float(value):
+    """Convert a stored float back to an optional number, with None standing for NaN."""
+
+    return None if np.isnan(value) else float(value)
+
+
+def _vocabulary_ids(values):
+    """Encode a list of strings (or None) as indexes into a sorted vocabulary, with -1 standing for None.
+
+    Returns:
+        A tuple of (vocabulary as a fixed-width byte-string array, int32 array of indexes).
+
+    """
+
+    vocabulary = sorted(set(x for x in values if x is not None))
+    index_dict = {x: idx for idx, x in enumerate(vocabulary)}
+    ids = np.array([-1 if x is None else index_dict[x] for x in values], dtype='int32')
+    return np.array(vocabulary if vocabulary else [""], dtype='S'), ids
+
+
+def write_record_store(student_record_dict, path):
+    """Write a student_record_dict to a record store file.
+
+    The file is written next to its final location and then renamed into place, so readers never see a
+    partly-written file.
+
+    Args:
+        student_record_dict (dict): Mapping of student id's to dictionaries of semester number->CourseGroup
+            pairs, as returned by preprocessing().
+        path (str): Path of the file to write.
+
+    Returns:
+        None
+
+    """
+
+    student_ids = sorted(student_record_dict)
+    student_offsets = [0]
+    term_semesters, term_offsets = [], [0]
+    term_floats_dict = {x: [] for x in COURSE_GROUP_FLOAT_FIELDS_LIST}
+    term_texts_dict = {x: [] for x in COURSE_GROUP_TEXT_FIELDS_LIST}
+    course_names, grade_letters, grades = [], [], []
+    for student_id in student_ids:
+        term_CourseGroup_dict = student_record_dict[student_id]
+        for semester_number in sorted(term_CourseGroup_dict):
+            each_CourseGroup = term_CourseGroup_dict[semester_number]
+            term_semesters.append(semester_number)
+            for each_field in COURSE_GROUP_FLOAT_FIELDS_LIST:
+                term_floats_dict[each_field].append(_to_float(getattr(each_CourseGroup, each_field)))
+            for each_field in COURSE_GROUP_TEXT_FIELDS_LIST:
+                term_texts_dict[each_field].append(getattr(each_CourseGroup, each_field))
+            for each_Course in each_CourseGroup.course_list:
+                course_names.append(each_Course.course)
+                grade_letters.append(each_Course.grade_letter)
+                grades.append(_to_float(each_Course.grade))
+            term_offsets.append(len(course_names))
+        student_offsets.append(len(term_semesters))
+
+    course_vocabulary, course_ids = _vocabulary_ids(course_names)
+    grade_vocabulary, grade_ids = _vocabulary_ids(grade_letters)
+    arrays_dict = {
+        "student_ids": np.array(student_ids if student_ids else [""], dtype='S')[:len(student_ids)],
+        "student_offsets": np.array(student_offsets, dtype='int64'),
+        "term_semesters": np.array(term_semesters, dtype='int32'),
+        "term_offsets": np.array(term_offsets, dtype='int64'),
+        "course_ids": course_ids,
+        "grade_ids": grade_ids.astype('int8'),
+        "grades": np.array(grades, dtype='float64'),
+        "course_vocabulary": course_vocabulary,
+        "grade_vocabulary": grade_vocabulary
+    }
+    for each_field in COURSE_GROUP_FLOAT_FIELDS_LIST:
+        arrays_dict[each_field] = np.array(term_floats_dict[each_field], dtype='float64')
+    for each_field in COURSE_GROUP_TEXT_FIELDS_LIST:
+        arrays_dict[each_field + "_vocabulary"], arrays_dict[each_field + "_ids"] = \
+            _vocabulary_ids(term_texts_dict[each_field])
+
+    # Lay out the arrays after the header, each on an aligned offset relative to the start of the data
+    directory_dict, position = dict(), 0
+    for name in sorted(arrays_dict):
+        array = arrays_dict[name]
+        directory_dict[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": position}
+        position += -(-array.nbytes // RECORD_STORE_ALIGNMENT) * RECORD_STORE_ALIGNMENT
+    header = json.dumps({"version": RECORD_STORE_VERSION, "arrays": directory_dict}, sort_keys=True)
+    prefix_length = len(RECORD_STORE_MAGIC) + 8
+    data_start = -(-(prefix_length + len(header)) // RECORD_STORE_ALIGNMENT) * RECORD_STORE_ALIGNMENT
+    header = header.ljust(data_start - prefix_length)
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as store_file:
+        store_file.write(RECORD_STORE_MAGIC + struct.pack("<Q", len(header)) + header)
+        for name in sorted(arrays_dict):
+            store_file.seek(data_start + directory_dict[name]["offset"])
+            store_file.write(np.ascontiguousarray(arrays_dict[name]).tobytes())
+        store_file.truncate(data_start + position)
+    os.rename(temporary_path, path)
+
+
+def student_shard(student_id, n_shards):
+    """Return the shard, from 0 to n_shards - 1, of a student id; the same in every run and process.
+
+    Args:
+        student_id (str): The student's identifier.
+        n_shards (int): Number of shards.
+
+    Returns:
+        The shard number.
+
+    """
+
+    return (zlib.crc32(student_id) & 0xffffffff) % n_shards
+
+
+class RecordStore:
+    """This class is a read-only view of a record store file that behaves like a student_record_dict.
+
+    Looking a student up returns a new dictionary of semester number->CourseGroup, built from the memory-mapped
+    arrays; the objects are not cached, so changes made to them are not kept.  Pickling a RecordStore (e.g., to
+    send it to a worker process) pickles only its path, and the worker maps the file again.
+
+    """
+
+    def __init__(self, path):
+        """Instantiate a RecordStore object by memory-mapping a record store file.
+
+        Args:
+            path (str): Path of a file written by write_record_store().
+
+        """
+
+        self.path = path
+        self._open()
+
+    def _open(self):
+        """Memory-map the file and create a view of each of its arrays."""
+
+        with open(self.path, "rb") as store_file:
+            magic = store_file.read(len(RECORD_STORE_MAGIC))
+            if magic != RECORD_STORE_MAGIC:
+                raise ValueError(self.path + " is not a record store file.")
+            header_length = struct.unpack("<Q", store_file.read(8))[0]
+            header_dict = json.loads(store_file.read(header_length))
+        if header_dict["version"] != RECORD_STORE_VERSION:
+            raise ValueError(self.path + " has record store version " + str(header_dict["version"]) +
+                             "; expected version " + str(RECORD_STORE_VERSION) + ".")
+        data_start = len(RECORD_STORE_MAGIC) + 8 + header_length
+        self._buffer = np.memmap(self.path, dtype='uint8', mode='r')
+        self.arrays = dict()
+        for name, entry in header_dict["arrays"].items():
+            dtype = np.dtype(str(entry["dtype"]))
+            count = int(np.prod(entry["shape"]))
+            start = data_start + entry["offset"]
+            self.arrays[str(name)] = self._buffer[start:start + count * dtype.itemsize].view(dtype)\
+                .reshape(entry["shape"])
+        self.student_ids = self.arrays["student_ids"]
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._open()
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, student_id):
+        return self._student_index(student_id) is not None
+
+    def __getitem__(self, student_id):
+        student_index = self._student_index(student_id)
+        if student_index is None:
+            raise KeyError(student_id)
+        return self._build_term_CourseGroup_dict(student_index)
+
+    def _student_index(self, student_id):
+        """Return the position of a student id in the sorted student_ids array, or None if it is absent."""
+
+        if not isinstance(student_id, basestring):
+            return None
+        student_index = int(np.searchsorted(self.student_ids, student_id))
+        if student_index < len(self.student_ids) and self.student_ids[student_index] == student_id:
+            return student_index
+        return None
+
+    def _build_term_CourseGroup_dict(self, student_index):
+        """Create the CourseGroup and Course objects of one student.
+
+        Args:
+            student_index (int): Position of the student in the student_ids array.
+
+        Returns:
+            Dictionary mapping semester numbers to CourseGroup objects.
+
+        """
+
+        arrays = self.arrays
+        student_id = str(self.student_ids[student_index])
+        term_CourseGroup_dict = dict()
+        for term_index in range(arrays["student_offsets"][student_index], arrays["student_offsets"][student_index + 1]):
+            semester_number = int(arrays["term_semesters"][term_index])
+            texts_dict = dict()
+            for each_field in COURSE_GROUP_TEXT_FIELDS_LIST:
+                text_id = arrays[each_field + "_ids"][term_index]
+                texts_dict[each_field] = None if text_id < 0 else str(arrays[each_field + "_vocabulary"][text_id])
+            new_CourseGroup = course_group.CourseGroup(semester_number=semester_number,
+                                                       student_id=student_id,
+                                                       term_gpa=_from_float(arrays["term_gpa"][term_index]),
+                                                       term_units=_from_float(arrays["term_units"][term_index]),
+                                                       cumulative_gpa=_from_float(arrays["cumulative_gpa"][term_index]),
+                                                       cumulative_units=_from_float(
+                                                           arrays["cumulative_units"][term_index]),
+                                                       **texts_dict)
+            for course_index in range(arrays["term_offsets"][term_index], arrays["term_offsets"][term_index + 1]):
+                new_CourseGroup.add_Course(course.Course(
+                    semester_number=semester_number,
+                    course=str(arrays["course_vocabulary"][arrays["course_ids"][course_index]]),
+                    grade=_from_float(arrays["grades"][course_index]),
+                    grade_letter=str(arrays["grade_vocabulary"][arrays["grade_ids"][course_index]]),
+                    student_id=student_id))
+            term_CourseGroup_dict[semester_number] = new_CourseGroup
+        return term_CourseGroup_dict
+
+    def keys(self):
+        """Return the list of student id's, in sorted order."""
+
+        return [str(x) for x in self.student_ids]
+
+    def get(self, student_id, default=None):
+        """Return the record of a student, or default if the student is absent."""
+
+        student_index = self._student_index(student_id)
+        return default if student_index is None else self._build_term_CourseGroup_dict(student_index)
+
+    def items(self):
+        """Return a list of (student id, record) pairs, building the record of every student."""
+
+        return [(x, self[x]) for x in self.keys()]
+
+    def values(self):
+        """Return the list of records, building the record of every student."""
+
+        return [self._build_term_CourseGroup_dict(idx) for idx in range(len(self))]
+
+    def to_dict(self):
+        """Build a complete student_record_dict in memory.
+
+        Returns:
+            Dictionary mapping student id's to dictionaries of semester number->CourseGroup pairs.
+
+        """
+
+        return dict(self.items())
+
+    def to_enrollment_df(self):
+        """Create the long-format enrollment DataFrame of utilities/enrollment.py directly from the arrays.
+
+        No CourseGroup or Course objects are created.
+
+        Returns:
+            A DataFrame with the columns listed in ENROLLMENT_FRAME_COLUMNS, equal to build_enrollment_df() of
+            the stored student_record_dict.
+
+        """
+
+        arrays = self.arrays
+        terms_per_student = np.diff(arrays["student_offsets"])
+        courses_per_term = np.diff(arrays["term_offsets"])
+        term_student_index = np.repeat(np.arange(len(self.student_ids)), terms_per_student)
+        course_term_index = np.repeat(np.arange(len(arrays["term_semesters"])), courses_per_term)
+        enrollment_df = pd.DataFrame({
+            "student_id": self.student_ids.astype(str)[term_student_index[course_term_index]],
+            "semester_number": np.asarray(arrays["term_semesters"])[course_term_index],
+            "course": arrays["course_vocabulary"].astype(str)[arrays["course_ids"]],
+            "grade": np.array(arrays["grades"]),
+            "grade_letter": arrays["grade_vocabulary"].astype(str)[arrays["grade_ids"]]},
+            columns=ENROLLMENT_FRAME_COLUMNS)
+        enrollment_df.sort_values(["student_id", "semester_number", "course"], inplace=True)
+        enrollment_df.reset_index(drop=True, inplace=True)
+        return enrollment_df
+
+
+class ShardedRecordStore:
+    """This class is a read-only, dictionary-like view of record store files that each hold one shard of students.
+
+    Shard i holds the students for which student_shard(student_id, number of shards) is i, so a lookup opens
+    only one shard.  Pickling a ShardedRecordStore pickles only the paths of its shards.
+
+    """
+
+    def __init__(self, paths):
+        """Instantiate a ShardedRecordStore object.
+
+        Args:
+            paths (list): Paths of the shard files, in shard order.
+
+        """
+
+        self.paths = list(paths)
+        self.shards = [RecordStore(x) for x in self.paths]
+
+    def __getstate__(self):
+        return {"paths": self.paths}
+
+    def __setstate__(self, state):
+        self.__init__(state["paths"])
+
+    def __len__(self):
+        return sum(len(x) for x in self.shards)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, student_id):
+        return isinstance(student_id, basestring) and student_id in self._shard(student_id)
+
+    def __getitem__(self, student_id):
+        if not isinstance(student_id, basestring):
+            raise KeyError(student_id)
+        return self._shard(student_id)[student_id]
+
+    def _shard(self, student_id):
+        return self.shards[student_shard(student_id, len(self.shards))]
+
+    def keys(self):
+        """Return the list of student id's, shard by shard."""
+
+        return [x for each_shard in self.shards for x in each_shard.keys()]
+
+    def get(self, student_id, default=None):
+        """Return the record of a student, or default if the student is absent."""
+
+        return self[student_id] if student_id in self else default
+
+    def items(self):
+        """Return a list of (student id, record) pairs, building the record of every student."""
+
+        return [x for each_shard in self.shards for x in each_shard.items()]
+
+    def values(self):
+        """Return the list of records, building the record of every student."""
+
+        return [x for each_shard in self.shards for x in each_shard.values()]
+
+    def to_dict(self):
+        """Build a complete student_record_dict in memory."""
+
+        return dict(self.items())
+
+    def to_enrollment_df(self):
+        """Create the long-format enrollment DataFrame of all shards; see RecordStore.to_enrollment_df()."""
+
+        return self.map_shards(lambda x: x)
+
+    def map_shards(self, function):
+        """Apply a function to the enrollment DataFrame of each shard, one shard at a time, and combine the results.
+
+        Since every student is in exactly one shard, functions computing one or more rows per student give the
+        same rows as when applied to all students at once.  Functions that also take contacts_df should be given
+        the shard's students only, e.g.:
+            records.map_shards(lambda x: compute_term_metrics(x, contacts_df[contacts_df["student_id"]
+                                                                             .isin(x["student_id"].unique())]))
+
+        Args:
+            function (callable): Function taking a long-format enrollment DataFrame and returning a DataFrame.
+
+        Returns:
+            The concatenated results, sorted by student_id if the results have that column.
+
+        """
+
+        results_df = pd.concat([function(x.to_enrollment_df()) for x in self.shards], ignore_index=True)
+        if "student_id" in results_df.columns:
+            results_df = results_df.sort_values("student_id", kind="mergesort").reset_index(drop=True)
+        return results_df
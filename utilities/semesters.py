@@ -0,0 +1,268 @@
+"""Number, name and convert semesters for any range of years, on whole columns at once.
+
+Semesters are numbered from 1, the Fall semester of FIRST_SEMESTER_YEAR, with four semesters per academic year:
+Fall 2009 is 1, Winter 2010 is 2, Spring 2010 is 3, Summer 2010 is 4, Fall 2010 is 5, and so on, as in
+SEMESTERS_LIST of utilities/other_constants.py.  Since the numbering is arithmetic, a SemesterCalendar converts
+semesters of any year, before or after the years of SEMESTERS_LIST, without a lookup table.
+
+The conversions take a single value, a list, a NumPy array or a pandas Series, and return a value of the same
+kind (a Series keeps its index), so that a whole column is converted in one call:
+    contacts_df["start_term"] = SEMESTER_CALENDAR.cohort_start_numbers(contacts_df["cohort_year"])
+    enrollment_df["semester_name"] = SEMESTER_CALENDAR.to_names(enrollment_df["semester_number"])
+Text is read in any of the spellings found in the data files: semester names ("Fall 2012"), the term codes of the
+CS query file names ("F2012", "WI2013", "S2013", "SU2013"), IR terms ("2012F", "2016S") and four-digit CS term
+codes ("2127" is Fall 2012: century digit, two-digit year, and 1, 3, 5 or 7 for winter, spring, summer or fall).
+Values that cannot be read raise a ValueError, unless errors="coerce" is passed, in which case they become NaN.
+
+Functions and classes exported by this module include:
+    SemesterCalendar: vectorized conversions between semester numbers, names, term codes and academic years
+    SEMESTER_CALENDAR: the calendar of the project, starting in Fall 2009
+
+"""
+
+import numpy as np
+import pandas as pd
+from utilities.other_constants import FIRST_SEMESTER_YEAR
+
+SEASONS_LIST = ["Fall", "Winter", "Spring", "Summer"]     # in the order of an academic year
+SEASON_TERM_CODES_DICT = {"Fall": "F", "Winter": "WI", "Spring": "S", "Summer": "SU"}
+SEASON_ALIASES_DICT = {
+    "F": "Fall", "FA": "Fall", "FALL": "Fall",
+    "W": "Winter", "WI": "Winter", "WINTER": "Winter",
+    "S": "Spring", "SP": "Spring", "SPRING": "Spring",
+    "SU": "Summer", "SUMMER": "Summer"
+}
+CS_TERM_CODE_SEASONS_DICT = {"1": "Winter", "3": "Spring", "5": "Summer", "7": "Fall"}
+FILENAME_TERM_PATTERN = r"^(SU|WI|F|S)(\d{4})"
+
+
+def _as_array(values):
+    """Return the values as a one-dimensional array, and whether they were a single value."""
+
+    if isinstance(values, pd.Series):
+        return values.values, False
+    if np.ndim(values) == 0:
+        return np.array([values]), True
+    return np.asarray(values), False
+
+
+def _like(result, values):
+    """Return an array of results in the same kind of container as the values it was computed from."""
+
+    if isinstance(values, pd.Series):
+        return pd.Series(result, index=values.index, name=values.name)
+    if np.ndim(values) == 0:
+        return result[0].item() if isinstance(result[0], np.generic) else result[0]
+    return result
+
+
+def _integers_if_whole(numbers):
+    """Convert a float array without NaN into int64."""
+
+    return numbers.astype(np.int64) if not np.isnan(numbers).any() else numbers
+
+
+class SemesterCalendar:
+    """This class converts semester numbers, names, term codes and academic years, on whole arrays at once.
+
+    Semester 1 is the Fall semester of first_year; see the module docstring.
+
+    """
+
+    def __init__(self, first_year=FIRST_SEMESTER_YEAR):
+        """Instantiate a SemesterCalendar object.
+
+        Args:
+            first_year (int): Year of the Fall semester numbered 1.
+
+        """
+
+        self.first_year = first_year
+
+    def __repr__(self):
+        return "SemesterCalendar(first_year=" + str(self.first_year) + ")"
+
+    def _numbers_from_parts(self, years, seasons):
+        """Number the semesters of calendar years (float array) and season names (object array, None if unknown)."""
+
+        season_indexes = pd.Series(seasons).map({x: y for y, x in enumerate(SEASONS_LIST)}).values.astype(float)
+        # Fall opens an academic year; the other seasons belong to the academic year that started the year before
+        with np.errstate(invalid="ignore"):
+            academic_years = years - (season_indexes > 0)
+        return 4 * (academic_years - self.first_year) + season_indexes + 1
+
+    def to_numbers(self, terms, errors="raise"):
+        """Convert semester names, term codes or file names into semester numbers.
+
+        Args:
+            terms: A term, or a list, array or Series of terms, in any spelling of the module docstring.  A file
+                name is read from the term code at its start (e.g., "F2012_enrollment.csv").  Missing values stay
+                missing.
+            errors (str): "raise" to raise a ValueError for terms that cannot be read, or "coerce" to make them NaN.
+
+        Returns:
+            The semester numbers: int64 if none is missing, float otherwise.
+
+        """
+
+        values, single = _as_array(terms)
+        text = pd.Series(values, dtype=object)
+        missing = text.isnull().values | (text.astype(str).str.strip() == "").values
+        text = text.astype(str).str.strip().str.upper()
+        name_like = text.str.extract(r"^([A-Z]+)\s*(\d{4})$", expand=True)
+        year_first = text.str.extract(r"^(\d{4})\s*([A-Z]+)$", expand=True)
+        file_name = text.str.extract(FILENAME_TERM_PATTERN, expand=True)
+        cs_code = text.str.extract(r"^(\d)(\d\d)([1357])$", expand=True)
+
+        years = pd.to_numeric(name_like[1], errors="coerce").values.astype(float)
+        seasons = name_like[0].map(SEASON_ALIASES_DICT).values
+        for season_column, year_column, parts_df in [(1, 0, year_first), (0, 1, file_name)]:
+            unread = pd.isnull(seasons)
+            seasons[unread] = parts_df[season_column].map(SEASON_ALIASES_DICT).values[unread]
+            years[unread] = pd.to_numeric(parts_df[year_column], errors="coerce").values[unread]
+        unread = pd.isnull(seasons) & cs_code[0].notnull().values
+        years[unread] = 1800 + 100 * pd.to_numeric(cs_code[0]).values[unread] + \
+            pd.to_numeric(cs_code[1]).values[unread]
+        seasons[unread] = cs_code[2].map(CS_TERM_CODE_SEASONS_DICT).values[unread]
+
+        numbers = self._numbers_from_parts(years, seasons)
+        invalid = ~missing & np.isnan(numbers)
+        if invalid.any() and errors == "raise":
+            raise ValueError("Cannot read the term " + repr(values[np.flatnonzero(invalid)[0]]) + ".")
+        numbers[missing] = np.nan
+        return _like(_integers_if_whole(numbers), terms)
+
+    def to_name_parts(self, numbers):
+        """Split semester numbers into (season names, calendar years); NaN numbers give None and NaN."""
+
+        values, single = _as_array(numbers)
+        values = values.astype(float)
+        known = ~np.isnan(values)
+        offsets = np.where(known, values, 1).astype(np.int64) - 1
+        season_indexes = offsets % 4
+        years = (self.first_year + offsets // 4 + (season_indexes > 0)).astype(float)
+        seasons = np.array(SEASONS_LIST, dtype=object)[season_indexes]
+        seasons[~known] = None
+        years[~known] = np.nan
+        return seasons, years
+
+    def to_names(self, numbers):
+        """Convert semester numbers into names such as "Fall 2012"; missing numbers give NaN."""
+
+        seasons, years = self.to_name_parts(numbers)
+        names = np.array([x + " " + str(int(y)) if x is not None else np.nan for x, y in zip(seasons, years)],
+                         dtype=object)
+        return _like(names, numbers)
+
+    def to_term_codes(self, numbers):
+        """Convert semester numbers into the term codes of the CS query file names, such as "F2012" or "SU2013"."""
+
+        seasons, years = self.to_name_parts(numbers)
+        codes = np.array([SEASON_TERM_CODES_DICT[x] + str(int(y)) if x is not None else np.nan
+                          for x, y in zip(seasons, years)], dtype=object)
+        return _like(codes, numbers)
+
+    def to_academic_years(self, numbers, as_string=False):
+        """Convert semester numbers into the years in which their academic years started.
+
+        Args:
+            numbers: Semester numbers.
+            as_string (bool): If true, return academic years as strings such as "2012-2013".
+
+        Returns:
+            The starting years (int64, or float if any number is missing), or the strings.
+
+        """
+
+        values, single = _as_array(numbers)
+        values = values.astype(float)
+        years = self.first_year + np.floor((values - 1) / 4)
+        if as_string:
+            years = np.array([str(int(x)) + "-" + str(int(x) + 1) if not np.isnan(x) else np.nan for x in years],
+                             dtype=object)
+            return _like(years, numbers)
+        return _like(_integers_if_whole(years), numbers)
+
+    def cohort_start_numbers(self, cohort_years):
+        """Convert cohort years into the numbers of their first semesters, the Fall of each year.
+
+        Args:
+            cohort_years: Cohort years, as numbers or numeric strings; missing years give NaN.
+
+        Returns:
+            The semester numbers: int64 if none is missing, float otherwise.
+
+        """
+
+        values, single = _as_array(cohort_years)
+        years = np.floor(pd.to_numeric(pd.Series(values), errors="raise").values.astype(float))
+        return _like(_integers_if_whole(4 * (years - self.first_year) + 1), cohort_years)
+
+    def relative_terms(self, numbers, start_numbers, seasons=None):
+        """Count the terms from a start semester (term 1) to each semester.
+
+        Args:
+            numbers: Semester numbers.
+            start_numbers: Semester numbers of the first terms, e.g., from cohort_start_numbers(); a single value
+                or one per number.
+            seasons (iterable): If given, only semesters of these seasons are counted, and a semester of another
+                season counts as the term before it; e.g., ("Fall", "Spring") gives the regular terms of
+                analysis/metrics.py.
+
+        Returns:
+            The term numbers (1 for the start semester, 0 or less before it).
+
+        """
+
+        values, single = _as_array(numbers)
+        starts = _as_array(start_numbers)[0].astype(np.int64)
+        values = values.astype(np.int64)
+        if seasons is None:
+            return _like(values - starts + 1, numbers)
+        # Number of counted semesters from semester 1 to semester n, for each position of n in an academic year
+        counted = np.array([x in seasons for x in SEASONS_LIST], dtype=np.int64)
+        within_year = np.concatenate([[0], np.cumsum(counted)])
+
+        def counts(semester_numbers):
+            return (semester_numbers // 4) * counted.sum() + within_year[semester_numbers % 4]
+
+        return _like(counts(values) - counts(starts - 1), numbers)
+
+    def semester_names(self, first_number=1, last_number=None, last_year=None):
+        """List the names of a range of semesters, e.g., to extend SEMESTERS_LIST past Fall 2017.
+
+        Args:
+            first_number (int): Number of the first semester.
+            last_number (int): Number of the last semester.
+            last_year (int): If last_number is None, the list ends with the Fall semester of this year.
+
+        Returns:
+            A list of names, in order.
+
+        """
+
+        if last_number is None:
+            if last_year is None:
+                raise ValueError("semester_names() needs a last_number or a last_year.")
+            last_number = self.cohort_start_numbers(last_year)
+        return list(self.to_names(np.arange(first_number, last_number + 1)))
+
+    def parse_filename(self, filename):
+        """Return the name of the semester of a CS query file, from the term code at the start of its name.
+
+        Args:
+            filename (str): File name such as "F2013_enrollment.csv", "WI2014_..." or "SU2014_...".
+
+        Returns:
+            The semester name, such as "Fall 2013".
+
+        """
+
+        parts = pd.Series([filename], dtype=object).astype(str).str.extract(FILENAME_TERM_PATTERN, expand=True)
+        if parts[0].isnull().iloc[0]:
+            raise ValueError("Invalid file name prefix; expected a term code such as F2013 or SU2014: " +
+                             str(filename))
+        return SEASON_ALIASES_DICT[parts[0].iloc[0]] + " " + parts[1].iloc[0]
+
+
+SEMESTER_CALENDAR = SemesterCalendar()
@@ -15,7 +15,6 @@ import os
 from configuration import SPMF_DIR, BIN_DIR
 from other_constants import SEASON_MODULO
 from file_constants import SPMF_EXECUTABLE
-from processing import preprocessing
 import subprocess
 
 
@@ -160,11 +159,12 @@ def determine_sequence_semester_lengths(sequence_list, spmf_file_name):
 
 
 if __name__=='__main__':
+    # processing imports pandas and numpy, so it is imported only when this module is run as a script
+    from processing import preprocessing
 
     contacts_df, student_records_dict, roster_dict = preprocessing(metro_comp=True)
     create_spmf_input_file(contacts_df=contacts_df,
                            student_records_dict=student_records_dict,
-                           roster_dict=roster_dict,
                            cohort_years=list(range(2009, 2017)),
                            passing_only=False,
                            seasons = ["Fall", "Spring", "Summer"],
@@ -0,0 +1,575 @@
+"""Read SPSS system files (.sav) into typed DataFrames, and cache them as columnar files.
+
+Some of the IR and NSSE data is delivered as SPSS system files.  This module reads them directly, in Python and
+numpy, following the layout of the format documented by GNU PSPP:
+    - numeric variables become float64 columns, or int64 columns when their format has no decimals and every
+        value is a whole number; variables with date formats (DATE, ADATE, DATETIME, ...) become datetime64
+        columns, and those with time formats (TIME, DTIME) timedelta64 columns;
+    - string variables, including very long strings, become columns of str, with blank values as NaN;
+    - values declared missing, and the system-missing value, become NaN, as with R's read.spss();
+    - variables whose every value has a value label become pandas Categoricals of the labels, with the categories
+        in the order of their values; the labels of other variables are kept in the metadata.
+Uncompressed, bytecode-compressed and zlib-compressed (.zsav) files can be read.
+
+Reading the data of a large file still takes a while, so load_spss() keeps what it reads in a columnar cache
+file, one numpy array per column, named after the SHA-1 hash of the source file: as long as the source file is
+unchanged, loading it again only reads the arrays back.
+
+Usage:
+    ir_df, metadata = load_spss(os.path.join(DATA_DIR, "IR_data", "FTFTF_Fall2017.sav"))
+    metadata["variable_labels"]["cohort_sid"]
+
+Functions exported by this module include:
+    read_sav(): read an SPSS system file into a DataFrame and its metadata
+    load_spss(): read_sav(), through the columnar cache
+
+"""
+
+import hashlib
+import json
+import os
+import struct
+import zlib
+import numpy as np
+import pandas as pd
+from configuration import CACHE_DIR
+
+SPSS_CACHE_DIR = os.path.join(CACHE_DIR, "spss")
+SPSS_READER_VERSION = 2     # part of the cache key; increase it when the DataFrames read from a file change
+SPSS_EPOCH_OFFSET_SECONDS = 12219379200     # seconds from 14 October 1582, the SPSS epoch, to 1 January 1970
+SPSS_DATE_FORMATS_SET = {20, 22, 23, 24, 28, 29, 30, 38, 39, 41}
+SPSS_TIME_FORMATS_SET = {21, 25, 40}
+SPSS_FORMAT_NAMES_DICT = {
+    1: "A", 2: "AHEX", 3: "COMMA", 4: "DOLLAR", 5: "F", 6: "IB", 7: "PIBHEX", 8: "P", 9: "PIB", 10: "PK", 11: "RB",
+    12: "RBHEX", 15: "Z", 16: "N", 17: "E", 20: "DATE", 21: "TIME", 22: "DATETIME", 23: "ADATE", 24: "JDATE",
+    25: "DTIME", 26: "WKDAY", 27: "MONTH", 28: "MOYR", 29: "QYR", 30: "WKYR", 31: "PCT", 32: "DOT", 33: "CCA",
+    34: "CCB", 35: "CCC", 36: "CCD", 37: "CCE", 38: "EDATE", 39: "SDATE", 40: "MTIME", 41: "YMDHMS"
+}
+SPSS_CODE_PAGES_DICT = {2: "cp1252", 1252: "cp1252", 65001: "utf-8", 28591: "latin-1", 20127: "ascii"}
+VERY_LONG_STRING_SEGMENT = 252      # bytes of a very long string stored in each of its 255-byte segments
+BYTECODE_END, BYTECODE_RAW, BYTECODE_SPACES, BYTECODE_MISSING = 252, 253, 254, 255
+
+
+class _SavFile:
+    """Read the records of an SPSS system file in its byte order."""
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+        self.byte_order = "<"
+
+    def read(self, size):
+        chunk = self.data[self.position:self.position + size]
+        if len(chunk) < size:
+            raise ValueError("The SPSS file ends in the middle of a record.")
+        self.position += size
+        return chunk
+
+    def integers(self, count=1):
+        values = struct.unpack(self.byte_order + str(count) + "i", self.read(4 * count))
+        return values[0] if count == 1 else values
+
+    def doubles(self, count=1):
+        values = struct.unpack(self.byte_order + str(count) + "d", self.read(8 * count))
+        return values[0] if count == 1 else values
+
+
+def _format_name(code):
+    """Describe a packed SPSS print format, e.g., F8.2."""
+
+    format_type, width, decimals = (code >> 16) & 0xff, (code >> 8) & 0xff, code & 0xff
+    return SPSS_FORMAT_NAMES_DICT.get(format_type, str(format_type)) + str(width) + \
+        ("." + str(decimals) if decimals else "")
+
+
+def _read_dictionary(sav_file):
+    """Read the header and dictionary records of a system file.
+
+    Args:
+        sav_file (_SavFile): The file, positioned at its start.
+
+    Returns:
+        A dictionary describing the file: its header fields, its variable records (one per 8-byte element of a
+        case, continuation records included), value labels, documents and extension records by subtype.
+
+    """
+
+    record_type = sav_file.read(4)
+    if record_type not in ("$FL2", "$FL3"):
+        raise ValueError("Not an SPSS system file: it starts with " + repr(record_type) + ".")
+    product = sav_file.read(60)
+    layout_code = struct.unpack("<i", sav_file.data[64:68])[0]
+    sav_file.byte_order = "<" if layout_code in (2, 3) else ">"
+    sav_file.read(4)
+    header_dict = {"product": product.rstrip(), "zlib": record_type == "$FL3"}
+    header_dict["case_size"], header_dict["compression"], header_dict["weight_index"], header_dict["cases"] = \
+        sav_file.integers(4)
+    header_dict["bias"] = sav_file.doubles()
+    header_dict["created"] = sav_file.read(9) + " " + sav_file.read(8)
+    header_dict["file_label"] = sav_file.read(64).rstrip()
+    sav_file.read(3)
+
+    variables_list, value_labels_list, extensions_dict, documents_list = [], [], dict(), []
+    while True:
+        record_type = sav_file.integers()
+        if record_type == 2:
+            variable_type, has_label, missing_count, print_format, write_format = sav_file.integers(5)
+            variable_dict = {"type": variable_type, "name": sav_file.read(8).rstrip(), "print_format": print_format,
+                             "label": None, "missing": [], "missing_range": None}
+            if has_label:
+                label_length = sav_file.integers()
+                variable_dict["label"] = sav_file.read(-(-label_length // 4) * 4)[:label_length]
+            if missing_count:
+                missing_raw = [sav_file.read(8) for x in range(abs(missing_count))]
+                if variable_type == 0:
+                    missing_values = [struct.unpack(sav_file.byte_order + "d", x)[0] for x in missing_raw]
+                    if missing_count < 0:
+                        variable_dict["missing_range"] = tuple(missing_values[:2])
+                        missing_values = missing_values[2:]
+                    variable_dict["missing"] = missing_values
+                else:
+                    variable_dict["missing"] = missing_raw
+            variables_list.append(variable_dict)
+        elif record_type == 3:
+            label_count = sav_file.integers()
+            labels_list = []
+            for each_label in range(label_count):
+                value = sav_file.read(8)
+                label_length = ord(sav_file.read(1))
+                labels_list.append((value, sav_file.read(-(-(label_length + 1) // 8) * 8 - 1)[:label_length]))
+            if sav_file.integers() != 4:
+                raise ValueError("A value label record is not followed by its variables.")
+            variable_count = sav_file.integers()
+            indexes = sav_file.integers(variable_count)
+            value_labels_list.append((labels_list, [indexes] if variable_count == 1 else list(indexes)))
+        elif record_type == 6:
+            line_count = sav_file.integers()
+            documents_list.extend(sav_file.read(80).rstrip() for x in range(line_count))
+        elif record_type == 7:
+            subtype, size, count = sav_file.integers(3)
+            extensions_dict[subtype] = sav_file.read(size * count)
+        elif record_type == 999:
+            sav_file.integers()
+            break
+        else:
+            raise ValueError("Unknown SPSS record type " + str(record_type) + ".")
+    return {"header": header_dict, "variables": variables_list, "value_labels": value_labels_list,
+            "extensions": extensions_dict, "documents": documents_list}
+
+
+def _encoding(dictionary_dict, byte_order):
+    """Find the character encoding of the file's text, from its extension records; latin-1 if unknown."""
+
+    extensions_dict = dictionary_dict["extensions"]
+    if 20 in extensions_dict:
+        return extensions_dict[20].strip().lower()
+    if 3 in extensions_dict and len(extensions_dict[3]) >= 32:
+        code_page = struct.unpack(byte_order + "8i", extensions_dict[3][:32])[7]
+        return SPSS_CODE_PAGES_DICT.get(code_page, "latin-1")
+    return "latin-1"
+
+
+def _decompress_zlib(sav_file):
+    """Concatenate the zlib blocks of a .zsav file into its bytecode-compressed data."""
+
+    zheader_offset, ztrailer_offset, ztrailer_length = struct.unpack(sav_file.byte_order + "3q", sav_file.read(24))
+    chunks, position = [], sav_file.position
+    while position < ztrailer_offset:
+        decompressor = zlib.decompressobj()
+        chunks.append(decompressor.decompress(sav_file.data[position:ztrailer_offset]))
+        position = ztrailer_offset - len(decompressor.unused_data)
+    return b"".join(chunks)
+
+
+def _decode_bytecode(data, bias, system_missing, element_count, byte_order):
+    """Expand bytecode-compressed case data into 8-byte elements.
+
+    The data is a series of blocks: 8 one-byte codes, followed by 8 bytes of raw data for each code of
+    BYTECODE_RAW in the block.  Finding where each block starts takes a loop over the blocks; everything else is
+    done on whole arrays.
+
+    Args:
+        data (str): The compressed data.
+        bias (float): The compression bias of the file header (usually 100).
+        system_missing (float): The system-missing value.
+        element_count (int): Number of elements expected, or None if unknown.
+        byte_order (str): "<" or ">", the byte order of the numbers of the file.
+
+    Returns:
+        A uint64 array with the bytes of each 8-byte element, numbers in the file's byte order.
+
+    """
+
+    block_starts, position, length = [], 0, len(data)
+    raw_code = chr(BYTECODE_RAW)
+    while position + 8 <= length:
+        codes = data[position:position + 8]
+        block_starts.append(position)
+        if chr(BYTECODE_END) in codes:
+            break
+        position += 8 + 8 * codes.count(raw_code)
+    buffer = np.frombuffer(data, dtype='uint8')
+    block_starts = np.array(block_starts, dtype='int64')
+    codes = buffer[block_starts[:, None] + np.arange(8)]
+    is_raw = codes == BYTECODE_RAW
+    raw_offsets = block_starts[:, None] + 8 * np.cumsum(is_raw, axis=1)
+    codes, raw_offsets = codes.ravel(), raw_offsets.ravel()
+    end = np.flatnonzero(codes == BYTECODE_END)
+    keep = codes != 0
+    if len(end):
+        keep[end[0]:] = False
+    codes, raw_offsets = codes[keep], raw_offsets[keep]
+    if element_count is not None:
+        codes, raw_offsets = codes[:element_count], raw_offsets[:element_count]
+
+    elements = np.empty(len(codes), dtype=byte_order + 'f8')
+    is_number = codes < BYTECODE_END
+    elements[is_number] = codes[is_number] - bias
+    elements[codes == BYTECODE_MISSING] = system_missing
+    elements = elements.view('uint64')
+    elements[codes == BYTECODE_SPACES] = np.frombuffer(b" " * 8, dtype='uint64')[0]
+    is_raw = codes == BYTECODE_RAW
+    if is_raw.any():
+        raw_bytes = buffer[raw_offsets[is_raw][:, None] + np.arange(8)]
+        elements[is_raw] = np.ascontiguousarray(raw_bytes).view('uint64').ravel()
+    return elements
+
+
+def _variables(dictionary_dict, encoding):
+    """Combine the variable records into variables, with long names and very long strings resolved.
+
+    Returns:
+        A list of dictionaries, one per variable in file order, with its name, type (0 for numeric, else the
+        string width), print format, label, missing values, first element index and, for strings, the
+        (element index, bytes used) of each segment.
+
+    """
+
+    extensions_dict = dictionary_dict["extensions"]
+    long_names_dict = dict()
+    if 13 in extensions_dict:
+        for each_pair in extensions_dict[13].split("\t"):
+            if "=" in each_pair:
+                short_name, long_name = each_pair.split("=", 1)
+                long_names_dict[short_name] = long_name
+    very_long_dict = dict()
+    if 14 in extensions_dict:
+        for each_pair in extensions_dict[14].split("\x00\t"):
+            if "=" in each_pair:
+                short_name, width = each_pair.split("=", 1)
+                very_long_dict[short_name] = int(width.strip("\x00"))
+
+    records_list = dictionary_dict["variables"]
+    variables_list, index = [], 0
+    while index < len(records_list):
+        record = records_list[index]
+        if record["type"] == -1:
+            index += 1
+            continue
+        variable_dict = dict(record)
+        variable_dict["element"] = index
+        variable_dict["record_index"] = index + 1
+        if record["type"] > 0:
+            width = very_long_dict.get(record["name"], record["type"])
+            segment_count = -(-width // VERY_LONG_STRING_SEGMENT) if width > 255 else 1
+            segments, element = [], index
+            for each_segment in range(segment_count):
+                if segment_count == 1:
+                    used = width
+                else:
+                    used = VERY_LONG_STRING_SEGMENT if each_segment < segment_count - 1 \
+                        else width - VERY_LONG_STRING_SEGMENT * (segment_count - 1)
+                segment_width = records_list[element]["type"]
+                segments.append((element, used))
+                element += -(-segment_width // 8)
+            variable_dict["type"] = width
+            variable_dict["segments"] = segments
+            index = element
+        else:
+            index += 1
+        name = long_names_dict.get(record["name"], record["name"])
+        variable_dict["name"] = name.decode(encoding).encode("utf-8")
+        if variable_dict["label"] is not None:
+            variable_dict["label"] = variable_dict["label"].decode(encoding).encode("utf-8")
+        variables_list.append(variable_dict)
+    return variables_list
+
+
+def _value_labels(dictionary_dict, variables_list, encoding, byte_order):
+    """Collect the value labels of each variable.
+
+    Returns:
+        Dictionary mapping variable names to dictionaries of value->label, where values are floats for numeric
+        variables and right-stripped str for string variables.
+
+    """
+
+    by_record_dict = {x["record_index"]: x for x in variables_list}
+    names_set = set(x["name"] for x in variables_list)
+    labels_dict = dict()
+    for labels_list, record_indexes in dictionary_dict["value_labels"]:
+        for each_index in record_indexes:
+            variable_dict = by_record_dict.get(each_index)
+            if variable_dict is None:
+                continue
+            variable_labels_dict = labels_dict.setdefault(variable_dict["name"], dict())
+            for raw_value, label in labels_list:
+                if variable_dict["type"] == 0:
+                    value = struct.unpack(byte_order + "d", raw_value)[0]
+                else:
+                    value = raw_value.rstrip(" ").decode(encoding).encode("utf-8")
+                variable_labels_dict[value] = label.decode(encoding).encode("utf-8")
+    # Labels of long string variables are kept in an extension record
+    data = dictionary_dict["extensions"].get(21, "")
+    position = 0
+    while position + 4 <= len(data):
+        name_length = struct.unpack(byte_order + "i", data[position:position + 4])[0]
+        name = data[position + 4:position + 4 + name_length].decode(encoding).encode("utf-8")
+        position += 4 + name_length
+        width, label_count = struct.unpack(byte_order + "2i", data[position:position + 8])
+        position += 8
+        variable_labels_dict = labels_dict.setdefault(name, dict())
+        for each_label in range(label_count):
+            value_length = struct.unpack(byte_order + "i", data[position:position + 4])[0]
+            value = data[position + 4:position + 4 + value_length].rstrip(" ")
+            position += 4 + value_length
+            label_length = struct.unpack(byte_order + "i", data[position:position + 4])[0]
+            label = data[position + 4:position + 4 + label_length]
+            position += 4 + label_length
+            variable_labels_dict[value.decode(encoding).encode("utf-8")] = label.decode(encoding).encode("utf-8")
+    return {x: y for x, y in labels_dict.items() if x in names_set}
+
+
+def _numeric_column(values, variable_dict, system_missing, high, low):
+    """Convert the float64 values of a numeric variable into a typed column, with missing values as NaN."""
+
+    values = values.copy()
+    missing = values == system_missing
+    for each_missing in variable_dict["missing"]:
+        missing |= values == each_missing
+    if variable_dict["missing_range"] is not None:
+        low_end, high_end = variable_dict["missing_range"]
+        low_end, high_end = (-np.inf if low_end == low else low_end), (np.inf if high_end == high else high_end)
+        missing |= (values >= low_end) & (values <= high_end)
+    values[missing] = np.nan
+    format_code = variable_dict["print_format"]
+    format_type, decimals = (format_code >> 16) & 0xff, format_code & 0xff
+    if format_type in SPSS_DATE_FORMATS_SET:
+        return pd.to_datetime(values - SPSS_EPOCH_OFFSET_SECONDS, unit='s').values
+    if format_type in SPSS_TIME_FORMATS_SET:
+        return pd.to_timedelta(values, unit='s').values
+    if decimals == 0 and not missing.any() and np.all(np.mod(values, 1) == 0) \
+            and (not len(values) or np.abs(values).max() < 2 ** 53):
+        return values.astype('int64')
+    return values
+
+
+def _string_column(case_bytes, variable_dict, encoding):
+    """Extract the values of a string variable, with blank values as NaN."""
+
+    pieces = [case_bytes[:, 8 * element:8 * element + used] for element, used in variable_dict["segments"]]
+    joined = np.ascontiguousarray(np.hstack(pieces))
+    values = joined.view('S' + str(max(joined.shape[1], 1))).ravel() if joined.shape[1] \
+        else np.zeros(len(case_bytes), dtype='S1')
+    stripped = [x.rstrip(" ") for x in values]
+    missing_set = set(x.rstrip(" ") for x in variable_dict["missing"])
+    if encoding not in ("utf-8", "utf8", "ascii"):
+        stripped = [x.decode(encoding).encode("utf-8") for x in stripped]
+    column = np.array(stripped, dtype=object)
+    column[[x == "" or x in missing_set for x in stripped]] = np.nan
+    return column
+
+
+def read_sav(path, convert_categoricals=True):
+    """Read an SPSS system file into a DataFrame and its metadata.
+
+    Args:
+        path (str): Path of the .sav (or .zsav) file.
+        convert_categoricals (bool): Turn the variables whose every value is labeled into Categoricals of labels.
+
+    Returns:
+        A tuple of (DataFrame with one column per variable, metadata dictionary with the file_label, documents,
+        variable_labels, value_labels and formats of the variables).
+
+    """
+
+    with open(path, "rb") as input_file:
+        sav_file = _SavFile(input_file.read())
+    dictionary_dict = _read_dictionary(sav_file)
+    header_dict = dictionary_dict["header"]
+    byte_order = sav_file.byte_order
+    encoding = _encoding(dictionary_dict, byte_order)
+    system_missing, high, low = -np.finfo('float64').max, np.finfo('float64').max, -np.finfo('float64').max
+    if 4 in dictionary_dict["extensions"]:
+        system_missing, high, low = struct.unpack(byte_order + "3d", dictionary_dict["extensions"][4][:24])
+    variables_list = _variables(dictionary_dict, encoding)
+    case_size = len(dictionary_dict["variables"])
+    cases = header_dict["cases"] if header_dict["cases"] >= 0 else None
+
+    if header_dict["compression"] == 0:
+        data = sav_file.data[sav_file.position:]
+        element_count = len(data) // 8 if cases is None else cases * case_size
+        elements = np.frombuffer(data[:8 * element_count], dtype='uint64')
+    else:
+        data = _decompress_zlib(sav_file) if header_dict["compression"] == 2 else sav_file.data[sav_file.position:]
+        elements = _decode_bytecode(data, header_dict["bias"], system_missing,
+                                    None if cases is None else cases * case_size, byte_order)
+    # Numbers are converted to the machine's byte order; strings are kept as they are
+    numbers = elements.view(byte_order + 'f8').astype('float64')
+    cases = len(elements) // case_size if case_size else 0
+    elements = elements[:cases * case_size].reshape(cases, case_size)
+    numbers = numbers[:cases * case_size].reshape(cases, case_size)
+    case_bytes = elements.view('uint8').reshape(cases, 8 * case_size)
+
+    value_labels_dict = _value_labels(dictionary_dict, variables_list, encoding, byte_order)
+    columns_dict, names_list = dict(), []
+    for variable_dict in variables_list:
+        name = variable_dict["name"]
+        if variable_dict["type"] == 0:
+            column = _numeric_column(numbers[:, variable_dict["element"]], variable_dict, system_missing, high, low)
+        else:
+            column = _string_column(case_bytes, variable_dict, encoding)
+        labels_dict = value_labels_dict.get(name)
+        if convert_categoricals and labels_dict:
+            column = _labeled_column(column, labels_dict)
+        columns_dict[name] = column
+        names_list.append(name)
+    data_frame = pd.DataFrame(columns_dict, columns=names_list, index=np.arange(cases))
+    metadata_dict = {
+        "file_label": header_dict["file_label"].decode(encoding).encode("utf-8"),
+        "documents": [x.decode(encoding).encode("utf-8") for x in dictionary_dict["documents"]],
+        "variable_labels": {x["name"]: x["label"] for x in variables_list if x["label"] is not None},
+        "value_labels": value_labels_dict,
+        "formats": {x["name"]: _format_name(x["print_format"]) if x["type"] <= 255 else "A" + str(x["type"])
+                    for x in variables_list}
+    }
+    return data_frame, metadata_dict
+
+
+def _labeled_column(column, labels_dict):
+    """Turn a column whose every non-missing value has a label into a Categorical of labels; else return it."""
+
+    values = pd.Series(column)
+    known = values.notnull()
+    if not values[known].isin(list(labels_dict)).all():
+        return column
+    categories = []
+    for each_value in sorted(labels_dict):
+        if labels_dict[each_value] not in categories:
+            categories.append(labels_dict[each_value])
+    return pd.Categorical(values.map(labels_dict), categories=categories)
+
+
+def _file_hash(path):
+    """Return the SHA-1 hex digest of a file's contents, read in chunks."""
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as input_file:
+        for chunk in iter(lambda: input_file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_cache(data_frame, metadata_dict, cache_path):
+    """Write a DataFrame and its metadata to a columnar cache file, one array per column, atomically."""
+
+    arrays_dict, columns_list = dict(), []
+    for position, name in enumerate(data_frame.columns):
+        series = data_frame[name]
+        key = "column_" + str(position)
+        column_dict = {"name": name}
+        if str(series.dtype) == "category":
+            column_dict["kind"] = "categorical"
+            column_dict["categories"] = list(series.cat.categories)
+            arrays_dict[key] = series.cat.codes.values
+        elif series.dtype == object:
+            column_dict["kind"] = "text"
+            arrays_dict[key] = np.array(series.fillna("").values.tolist() or [""], dtype='S')[:len(series)]
+            arrays_dict[key + "_missing"] = series.isnull().values
+        else:
+            column_dict["kind"] = "array"
+            arrays_dict[key] = series.values
+        columns_list.append(column_dict)
+    header = json.dumps({"version": SPSS_READER_VERSION, "rows": len(data_frame), "columns": columns_list,
+                         "metadata": _metadata_to_json(metadata_dict)})
+    arrays_dict["header"] = np.array(header)
+    temporary_path = cache_path + ".tmp"
+    with open(temporary_path, "wb") as cache_file:
+        np.savez(cache_file, **arrays_dict)
+    os.rename(temporary_path, cache_path)
+
+
+def _metadata_to_json(metadata_dict):
+    """Convert the value labels, whose keys may be floats, into lists of pairs that survive JSON."""
+
+    json_dict = dict(metadata_dict)
+    json_dict["value_labels"] = {x: sorted(y.items()) for x, y in metadata_dict["value_labels"].items()}
+    return json_dict
+
+
+def _text(value):
+    """Turn the unicode strings of decoded JSON back into utf-8 str."""
+
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, list):
+        return [_text(x) for x in value]
+    if isinstance(value, dict):
+        return {_text(x): _text(y) for x, y in value.items()}
+    return value
+
+
+def _read_cache(cache_path):
+    """Read a DataFrame and its metadata back from a columnar cache file."""
+
+    with np.load(cache_path) as arrays:
+        header_dict = _text(json.loads(str(arrays["header"])))
+        columns_dict, names_list = dict(), []
+        for position, column_dict in enumerate(header_dict["columns"]):
+            key = "column_" + str(position)
+            values = arrays[key]
+            if column_dict["kind"] == "categorical":
+                values = pd.Categorical.from_codes(values, categories=column_dict["categories"])
+            elif column_dict["kind"] == "text":
+                values = values.astype(object)
+                values[arrays[key + "_missing"]] = np.nan
+            columns_dict[column_dict["name"]] = values
+            names_list.append(column_dict["name"])
+    metadata_dict = header_dict["metadata"]
+    metadata_dict["value_labels"] = {x: dict((y[0], y[1]) for y in labels_list)
+                                     for x, labels_list in metadata_dict["value_labels"].items()}
+    return pd.DataFrame(columns_dict, columns=names_list, index=np.arange(header_dict["rows"])), metadata_dict
+
+
+def load_spss(path, cache_dir=SPSS_CACHE_DIR, use_cache=True, convert_categoricals=True):
+    """Read an SPSS system file with read_sav(), reusing the cached result if the file has not changed.
+
+    The cache file is named after the source file and the SHA-1 hash of its contents (and of the reader
+    version), so a changed file is read again, and the cache files of its earlier contents are removed.
+
+    Args:
+        path (str): Path of the .sav file.
+        cache_dir (str): Directory of the cache files.
+        use_cache (bool): If false, read the file and leave the cache alone.
+        convert_categoricals (bool): See read_sav().
+
+    Returns:
+        The tuple (DataFrame, metadata dictionary) of read_sav().
+
+    """
+
+    if not use_cache:
+        return read_sav(path, convert_categoricals)
+    key = hashlib.sha1(_file_hash(path) + str(SPSS_READER_VERSION) + str(convert_categoricals)).hexdigest()[:20]
+    prefix = os.path.basename(path) + "_"
+    cache_path = os.path.join(cache_dir, prefix + key + ".npz")
+    if os.path.exists(cache_path):
+        return _read_cache(cache_path)
+    data_frame, metadata_dict = read_sav(path, convert_categoricals)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    for each_name in os.listdir(cache_dir):
+        if each_name.startswith(prefix) and each_name.endswith(".npz"):
+            os.remove(os.path.join(cache_dir, each_name))
+    _write_cache(data_frame, metadata_dict, cache_path)
+    return data_frame, metadata_dict
@@ -10,12 +10,10 @@ However, if it is desired to use native Python to read through files for any rea
 offer (or be expanded to offer) useful services.
 """
 import csv
-import subprocess
-import pandas as pd
 import os
-import shutil
 
 from other_constants import PERSONAL_INFO_COLUMN_NAMES_LIST
+from utilities.anonymization import anonymize_path
 
 
 class Csv:
@@ -23,7 +21,7 @@ class Csv:
 
     Public functions of this class include:
         read_csv: A modified version of Python's csv file reading functionality
-        convert_spss: Calls an R script for converting an spss file into a separated-values (e.g, csv) file
+        convert_spss: Converts an spss file into a separated-values (e.g, csv) file, through the spss cache
         remove_columns: Convenience function for removing named columns
 
     """
@@ -39,9 +37,9 @@ class Csv:
         self.provided_headers_list = provided_headers_list
         self.delimiter = delimiter
         self.has_duplicate_column_names = has_duplicate_column_names
-        self.rows = self.read_csv()
         if is_spss:
-            self.csv_file = self.convert_spss(csv_file, csv_file+".csv")
+            self.csv_file = self.convert_spss(csv_file, csv_file+".csv", separator=delimiter)
+        self.rows = self.read_csv()
 
     def read_csv(self):
         """Read a csv file and return its column headers and data.
@@ -84,7 +82,10 @@ class Csv:
         """Convert an spss file to a separated-values file (e.g., tsv, csv).
 
         Note that the default separator is a tab rather than a comma, since in the spss files that this
-        function has been used on, the columns of data frequently contain commas.
+        function has been used on, the columns of data frequently contain commas.  The file is read in process by
+        load_spss() of utilities/spss.py, so converting it again is fast as long as it is unchanged; labeled values
+        are written as their labels, and missing values as empty fields.  To work with the typed data, call
+        load_spss() directly instead.
 
         Args:
             spss_file_path (str): Path to the spss file.
@@ -95,57 +96,38 @@ class Csv:
             Path to the output file if conversion was successful.
 
         """
-        conversion_script = "spss_to_table.R"
-        cmd = ['Rscript', conversion_script] + [spss_file_path, output_file_path, separator]
-        x = subprocess.check_output(cmd, universal_newlines= True)
-        if x is not None:
-            print x
-            return output_file_path
+        # utilities/spss.py is imported here, so that reading csv files with this module does not import pandas
+        from utilities.spss import load_spss
+        converted_df, metadata_dict = load_spss(spss_file_path)
+        converted_df.to_csv(output_file_path, sep=separator, index=False)
+        return output_file_path
 
     @staticmethod
     def remove_columns(path, columns=None, anonymize = True, make_backups = True):
-        """Remove specified columns from a csv/tsv file.
+        """Remove specified columns from a csv/tsv file, or from all such files of a directory.
 
         This function can be used to remove personally-identifying information.  See
-        PERSONAL_INFO_COLUMN_NAMES_LIST in other_constants.py.
+        PERSONAL_INFO_COLUMN_NAMES_LIST in other_constants.py.  The files are streamed row by row and replaced
+        atomically by anonymize_path() of utilities/anonymization.py, which can also replace student ids with
+        pseudonyms.
 
         Args:
-            path (str): Path to the file from which columns should be removed.
+            path (str): Path to the file, or directory, from which columns should be removed.
             columns (list): List of column headers corresponding to columns to be removed.
             anonymize (bool): If true, remove personally-identifying information.
             make_backups (bool): Back up the file before removing the columns.
 
         Returns:
-            Path(s) to the files from which the columns have been removed.
+            Paths to the files from which the columns have been removed.
 
         """
 
         if columns is None: columns = []
-        if anonymize: columns.extend(PERSONAL_INFO_COLUMN_NAMES_LIST)
-        files = []
-        if os.path.isfile(path):
-            files.extend(path)
-        elif os.path.isdir(path):
-            files.extend([f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))])
-        else:
+        if isinstance(columns, basestring):
+            columns = [columns]
+        columns = set(columns)
+        if anonymize: columns.update(PERSONAL_INFO_COLUMN_NAMES_LIST)
+        if not (os.path.isfile(path) or os.path.isdir(path)):
             raise TypeError("remove_columns() requires a file name or directory name")
-        for file_name in files:
-            if make_backups:
-                shutil.copyfile(file_name, "_original_file_" + file_name)
-            table_df = pd.read_csv(file_name)
-            if isinstance(columns, basestring):
-                columns = [columns]
-            table_df.drop(labels=columns, axis=1, inplace=True)
-            table_df.to_csv(file_name, index=False)
-        return files
-
-
-
-
-
-
-
-
-
-
-
+        return [x["path"] for x in anonymize_path(path, drop_columns=columns, hash_columns=(),
+                                                  make_backups=make_backups)]
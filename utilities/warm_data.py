@@ -0,0 +1,431 @@
+"""Keep the preprocessed student data warm in a local daemon, and query it from other processes.
+
+Every analysis script and notebook that calls preprocessing() pays for reading and processing all of the data
+files, and holds its own copy of contacts_df and student_record_dict.  A WarmDataServer runs preprocessing()
+once, keeps the results in memory, and answers requests over a Unix domain socket, so any number of clients can
+query the same data in milliseconds:
+    - roster: the student ids of roster_dict["metro"], ["comp"] or ["combined"];
+    - contacts: the contacts_df rows (optionally, some columns only) of a list of students;
+    - student: the term-by-term course records of one student, in the long format of utilities/enrollment.py;
+    - aggregate: outcome counts and rates by any cohort dimensions, from an OutcomeCube (see analysis/cube.py);
+    - spmf: write a SPMF input file with create_spmf_input_file() (see utilities/spmf_tools.py).
+
+Requests and replies are frames: an unsigned 64-bit little-endian length followed by the body.  A request body is
+a small JSON object, such as {"op": "student", "student_id": "912345678"}.  A reply body starts with one byte
+giving its kind: REPLY_JSON, REPLY_TABLE, or REPLY_ERROR followed by the error message.  Tables are encoded by
+encode_table() as a JSON header describing the columns, followed by the raw bytes of the numeric columns; only
+columns of Python objects (strings with missing values, mostly) are carried in the header itself.
+
+The server checks the files of DATA_DIR every poll_seconds.  When they change, it runs preprocessing() again in a
+background thread and then swaps in the new data; requests keep being answered from the old data meanwhile, and
+each request is answered entirely from one of them.
+
+Usage:
+    python cli.py serve --metro-comp
+    client = WarmDataClient()
+    client.student("912345678")
+    client.aggregate(by=["cohort_year"], where={"category": "Metro"})
+
+Functions and classes exported by this module include:
+    encode_table(): encode a DataFrame as a compact binary payload
+    decode_table(): decode a payload of encode_table() into a DataFrame
+    data_signature(): summarize the sizes and modification times of the data files
+    WarmData: one preprocessed copy of the data and the answers to requests about it
+    WarmDataServer: the daemon, serving a WarmData and reloading it when the data files change
+    WarmDataClient: a connection to the daemon
+    WarmDataError: error raised by the client when the daemon could not answer a request
+
+"""
+
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import SocketServer
+import numpy as np
+import pandas as pd
+from configuration import CACHE_DIR, DATA_DIR, SPMF_DIR
+
+DEFAULT_SOCKET_PATH = os.path.join(CACHE_DIR, "warm_data.sock")
+DEFAULT_POLL_SECONDS = 30
+FRAME_HEADER = struct.Struct("<Q")
+TABLE_HEADER = struct.Struct("<I")
+REPLY_JSON = b"J"
+REPLY_TABLE = b"T"
+REPLY_ERROR = b"E"
+ROSTER_NAMES_LIST = ["metro", "comp", "combined"]
+
+
+class WarmDataError(Exception):
+    """Error raised by WarmDataClient when the daemon replies with an error."""
+
+
+def _json_default(value):
+    """Convert values that json cannot serialize: numpy scalars into Python numbers, anything else into text."""
+
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def _byte_strings(value):
+    """Convert the unicode strings of decoded JSON into byte strings, as used by the data."""
+
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, list):
+        return [_byte_strings(x) for x in value]
+    if isinstance(value, dict):
+        return {_byte_strings(x): _byte_strings(y) for x, y in value.items()}
+    return value
+
+
+def encode_table(data_frame):
+    """Encode a DataFrame as a compact binary payload.
+
+    Numeric, boolean and datetime columns are stored as their raw bytes.  Object columns are stored as JSON lists
+    in the header, with missing values as null and values that are not strings or numbers (e.g., the Pathway
+    objects of contacts_df) as their text.  The index is not kept.
+
+    Args:
+        data_frame (DataFrame): The table to encode.
+
+    Returns:
+        A byte string: the header length, the JSON header, then the column bytes.
+
+    """
+
+    columns_list, buffers_list, offset = [], [], 0
+    for each_column in data_frame.columns:
+        values = data_frame[each_column].values
+        column_dict = {"name": each_column}
+        if values.dtype.kind == 'O':
+            column_dict["values"] = [None if not isinstance(x, basestring) and pd.isnull(x) else x for x in values]
+        else:
+            values = np.ascontiguousarray(values)
+            column_dict.update({"dtype": values.dtype.str, "offset": offset, "nbytes": values.nbytes})
+            buffers_list.append(values.tostring())
+            offset += values.nbytes
+        columns_list.append(column_dict)
+    header = json.dumps({"rows": len(data_frame), "columns": columns_list}, separators=(",", ":"),
+                        default=_json_default)
+    return TABLE_HEADER.pack(len(header)) + header + b"".join(buffers_list)
+
+
+def decode_table(payload):
+    """Decode a payload of encode_table() into a DataFrame.
+
+    Args:
+        payload (str): The bytes returned by encode_table().
+
+    Returns:
+        A DataFrame with the columns, in order, of the encoded one.
+
+    """
+
+    header_length = TABLE_HEADER.unpack_from(payload)[0]
+    header = _byte_strings(json.loads(payload[TABLE_HEADER.size:TABLE_HEADER.size + header_length]))
+    start = TABLE_HEADER.size + header_length
+    columns_dict, names_list = dict(), []
+    for each_column in header["columns"]:
+        name = each_column["name"]
+        names_list.append(name)
+        if "values" in each_column:
+            columns_dict[name] = np.array([np.nan if x is None else x for x in each_column["values"]], dtype=object)
+        else:
+            dtype = np.dtype(str(each_column["dtype"]))
+            columns_dict[name] = np.frombuffer(payload, dtype=dtype, count=each_column["nbytes"] // dtype.itemsize,
+                                               offset=start + each_column["offset"])
+    return pd.DataFrame(columns_dict, columns=names_list, index=np.arange(header["rows"]))
+
+
+def data_signature(data_dir=DATA_DIR, exclude_dirs=(SPMF_DIR,)):
+    """Summarize the sizes and modification times of the files in the data directory.
+
+    Args:
+        data_dir (str): The data directory.
+        exclude_dirs (iterable): Directories whose files are left out, e.g., SPMF_DIR, to which the server itself
+            writes.
+
+    Returns:
+        A sorted tuple of (relative path, size, modification time), which changes when any data file does.
+
+    """
+
+    excluded = set(os.path.abspath(x) for x in exclude_dirs)
+    signature = []
+    for directory, subdirectories, file_names in os.walk(data_dir):
+        subdirectories[:] = [x for x in subdirectories if os.path.abspath(os.path.join(directory, x)) not in excluded]
+        for each_name in file_names:
+            path = os.path.join(directory, each_name)
+            status = os.stat(path)
+            signature.append((os.path.relpath(path, data_dir), status.st_size, status.st_mtime))
+    return tuple(sorted(signature))
+
+
+def _receive_exactly(connection, size):
+    """Read size bytes from a socket, or return None if it is closed first."""
+
+    chunks, remaining = [], size
+    while remaining:
+        chunk = connection.recv(min(remaining, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def _receive_frame(connection):
+    """Read one frame from a socket, or return None if it is closed."""
+
+    header = _receive_exactly(connection, FRAME_HEADER.size)
+    if header is None:
+        return None
+    return _receive_exactly(connection, FRAME_HEADER.unpack(header)[0])
+
+
+def _send_frame(connection, body):
+    connection.sendall(FRAME_HEADER.pack(len(body)) + body)
+
+
+class WarmData:
+    """This class holds one preprocessed copy of the data and answers requests about it.
+
+    The enrollment records are flattened once into a long-format DataFrame sorted by student, so the records of
+    a student are found with a binary search, and the outcome cube is built once, so aggregates are sums over its
+    cells.  A WarmData object is never modified after it is built, so any number of threads can read it.
+
+    """
+
+    def __init__(self, metro_only=False, metro_comp=True, contacts_through_2016=True):
+        """Instantiate a WarmData object by running preprocessing().
+
+        Args:
+            metro_only (bool): Passed to preprocessing().
+            metro_comp (bool): Passed to preprocessing().
+            contacts_through_2016 (bool): Passed to preprocessing().
+
+        """
+
+        from processing import preprocessing
+        from utilities.enrollment import build_enrollment_df
+        from analysis.cube import OutcomeCube
+
+        self.signature = data_signature()
+        self.options_dict = {"metro_only": metro_only, "metro_comp": metro_comp,
+                             "contacts_through_2016": contacts_through_2016}
+        self.contacts_df, self.student_record_dict, self.roster_dict = preprocessing(**self.options_dict)
+        self.loaded_at = time.time()
+        self.contacts_df = self.contacts_df.reset_index(drop=True)
+        self.contacts_positions = pd.Series(np.arange(len(self.contacts_df)),
+                                            index=self.contacts_df["student_id"].values)
+        self.enrollment_df = build_enrollment_df(self.student_record_dict)
+        self.enrollment_students = self.enrollment_df["student_id"].values.astype(str)
+        self.rosters_dict = {x: np.array(sorted(self.roster_dict[x]), dtype=str) for x in ROSTER_NAMES_LIST}
+        self.cube = OutcomeCube(self.contacts_df)
+        self.spmf_lock = threading.Lock()
+
+    def status(self):
+        """Return a dictionary describing the data: its options, load time and sizes."""
+
+        return {"options": self.options_dict, "loaded_at": self.loaded_at, "students": len(self.contacts_df),
+                "enrollments": len(self.enrollment_df), "data_dir": DATA_DIR}
+
+    def roster(self, name):
+        """Return a table of the sorted student ids of a roster: "metro", "comp" or "combined"."""
+
+        if name not in self.rosters_dict:
+            raise ValueError("Unknown roster " + repr(name) + "; use one of " + ", ".join(ROSTER_NAMES_LIST) + ".")
+        return pd.DataFrame({"student_id": self.rosters_dict[name]})
+
+    def contacts(self, student_ids, columns=None):
+        """Return the contacts_df rows of some students, in the given order; unknown students are left out.
+
+        Args:
+            student_ids (list): Student ids.
+            columns (list): Columns to return; all of them if None.
+
+        Returns:
+            A DataFrame of the students' attributes.
+
+        """
+
+        positions = self.contacts_positions.reindex(student_ids).dropna().values.astype(int)
+        rows_df = self.contacts_df.iloc[positions]
+        return (rows_df if columns is None else rows_df[["student_id"] + [x for x in columns if x != "student_id"]])\
+            .reset_index(drop=True)
+
+    def student(self, student_id):
+        """Return the long-format enrollment rows of one student, sorted by semester and course."""
+
+        start = np.searchsorted(self.enrollment_students, student_id, side="left")
+        end = np.searchsorted(self.enrollment_students, student_id, side="right")
+        return self.enrollment_df.iloc[start:end].reset_index(drop=True)
+
+    def aggregate(self, by=(), where=None):
+        """Return OutcomeCube.rollup(by, where), with the by dimensions as columns."""
+
+        return self.cube.rollup(by=by, where=where).reset_index(drop=not len(by))
+
+    def spmf(self, spmf_input_file_name, cohort_years, passing_only=False, seasons=("Fall", "Spring", "Summer"),
+             capture_gaps=False, comp_only=False):
+        """Write a SPMF input file from the warm data; see create_spmf_input_file() for the arguments.
+
+        Returns:
+            Dictionary with the paths of the input file and of its labels file, and the number of sequences.
+
+        """
+
+        from utilities.spmf_tools import create_spmf_input_file
+        spmf_input_file_name = os.path.basename(spmf_input_file_name)
+        with self.spmf_lock:
+            if not os.path.isdir(SPMF_DIR):
+                os.makedirs(SPMF_DIR)
+            create_spmf_input_file(self.contacts_df, self.student_record_dict, cohort_years, passing_only,
+                                   list(seasons), spmf_input_file_name, capture_gaps, comp_only)
+            path = os.path.join(SPMF_DIR, spmf_input_file_name)
+            with open(path, "r") as input_file:
+                sequences = sum(1 for x in input_file)
+        return {"spmf_input_file": path, "labels_file": path.replace(".txt", "_labels.txt"), "sequences": sequences}
+
+    def answer(self, request_dict):
+        """Answer a decoded request.
+
+        Args:
+            request_dict (dict): The request, whose "op" entry names the method to call with its other entries.
+
+        Returns:
+            The reply body: REPLY_JSON or REPLY_TABLE followed by the payload.
+
+        """
+
+        operation = request_dict.pop("op", None)
+        if operation in ("status", "spmf"):
+            return REPLY_JSON + json.dumps(getattr(self, operation)(**request_dict), default=_json_default)
+        if operation in ("roster", "contacts", "student", "aggregate"):
+            return REPLY_TABLE + encode_table(getattr(self, operation)(**request_dict))
+        raise ValueError("Unknown operation " + repr(operation) + ".")
+
+
+class _RequestHandler(SocketServer.BaseRequestHandler):
+    """Answer the frames of one client connection until the client closes it."""
+
+    def handle(self):
+        while True:
+            body = _receive_frame(self.request)
+            if body is None:
+                return
+            try:
+                reply = self.server.warm_data.answer(_byte_strings(json.loads(body)))
+            except Exception as error:
+                reply = REPLY_ERROR + repr(error)
+            _send_frame(self.request, reply)
+
+
+class WarmDataServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """This class is the daemon: a threaded Unix domain socket server of a WarmData object."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, poll_seconds=DEFAULT_POLL_SECONDS, **options):
+        """Instantiate a WarmDataServer object, which loads the data before it starts listening.
+
+        Args:
+            socket_path (str): Path of the Unix domain socket; a stale socket file there is replaced.
+            poll_seconds (float): Interval between checks for changed data files; None to never reload.
+            **options: Arguments of WarmData, i.e., of preprocessing().
+
+        """
+
+        self.options = options
+        self.poll_seconds = poll_seconds
+        self.warm_data = WarmData(**options)
+        if not os.path.isdir(os.path.dirname(os.path.abspath(socket_path))):
+            os.makedirs(os.path.dirname(os.path.abspath(socket_path)))
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        SocketServer.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+
+    def _watch(self):
+        """Reload the data in the background whenever the data files change."""
+
+        while True:
+            time.sleep(self.poll_seconds)
+            if data_signature() != self.warm_data.signature:
+                # Requests are answered from the old data until the new data is ready
+                try:
+                    self.warm_data = WarmData(**self.options)
+                except Exception as error:
+                    # e.g., files still being copied; keep the old data and try again at the next check
+                    print("Reloading the data failed: " + repr(error))
+
+    def serve_forever(self, poll_interval=0.5):
+        """Start the reloading thread, then answer requests until shutdown() is called."""
+
+        if self.poll_seconds is not None:
+            watcher = threading.Thread(target=self._watch)
+            watcher.daemon = True
+            watcher.start()
+        try:
+            SocketServer.UnixStreamServer.serve_forever(self, poll_interval)
+        finally:
+            if os.path.exists(self.server_address):
+                os.remove(self.server_address)
+
+
+class WarmDataClient:
+    """This class is a connection to a WarmDataServer, with one method per kind of request."""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH):
+        """Instantiate a WarmDataClient object connected to the daemon listening on socket_path."""
+
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(socket_path)
+
+    def request(self, operation, **arguments):
+        """Send a request and return the decoded reply.
+
+        Args:
+            operation (str): The operation: "status", "roster", "contacts", "student", "aggregate" or "spmf".
+            **arguments: The arguments of the operation.
+
+        Returns:
+            A DataFrame for tables, and a dictionary for JSON replies.
+
+        """
+
+        arguments["op"] = operation
+        _send_frame(self.connection, json.dumps(arguments))
+        reply = _receive_frame(self.connection)
+        if reply is None:
+            raise WarmDataError("The warm data daemon closed the connection.")
+        if reply[:1] == REPLY_ERROR:
+            raise WarmDataError(reply[1:])
+        if reply[:1] == REPLY_TABLE:
+            return decode_table(reply[1:])
+        return _byte_strings(json.loads(reply[1:]))
+
+    def status(self):
+        return self.request("status")
+
+    def roster(self, name="combined"):
+        return self.request("roster", name=name)["student_id"].values
+
+    def contacts(self, student_ids, columns=None):
+        return self.request("contacts", student_ids=list(student_ids), columns=columns)
+
+    def student(self, student_id):
+        return self.request("student", student_id=student_id)
+
+    def aggregate(self, by=(), where=None):
+        return self.request("aggregate", by=list(by), where=where)
+
+    def spmf(self, spmf_input_file_name, cohort_years, **options):
+        return self.request("spmf", spmf_input_file_name=spmf_input_file_name, cohort_years=list(cohort_years),
+                            **options)
+
+    def close(self):
+        self.connection.close()